@@ -1,29 +1,72 @@
 ﻿import os
 import uuid
 import io
+import hashlib
+import asyncio
 import logging
+import time
+import statistics
+from collections import deque
+from contextlib import asynccontextmanager
 from typing import Optional
-from datetime import datetime
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.staticfiles import StaticFiles
+from datetime import date, datetime
+from fastapi import FastAPI, UploadFile, File, Body, Header, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 import json
 import sys
+import httpx
 # -*- coding: utf-8 -*-
 import os
 
 # 将项目根目录加入 Python 路径，便于导入数据库配置
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# 数据库后端：postgres（默认）或 sqlite（单机部署，WAL + 单写线程）
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres").lower()
+
 try:
-    from db.database_config import get_db, save_mistake_record, MistakeRecord, MistakeAnalysis, MistakePractice
+    if DB_BACKEND == "sqlite":
+        from db.sqlite_config import get_db, save_mistake_record, MistakeRecord, MistakeAnalysis, MistakePractice, SessionLocal, get_mistake_stats, build_mistakes_query, router, get_writer, close_writer
+        from db.sqlite_config import parse_mistake_list_fields, count_mistakes, select_mistakes_page, MISTAKE_LIST_PREVIEW_CHARS, iter_mistake_export_batches, MISTAKE_EXPORT_COLUMNS
+        from db.sqlite_config import claim_idempotency_key, complete_idempotency_key, release_idempotency_key, purge_expired_idempotency_keys
+        from db.sqlite_config import enqueue_pending_analysis, claim_pending_analysis, complete_pending_analysis, retry_pending_analysis, get_pending_analysis, get_learning_sheet_items
+        from db.sqlite_config import add_mistake_record, add_mistake_analyses, add_mistake_practices, replace_mistake_analyses
+    else:
+        from db.database_config import get_db, save_mistake_record, MistakeRecord, MistakeAnalysis, MistakePractice, SessionLocal, get_mistake_stats, build_mistakes_query, router, engine
+        from db.database_config import parse_mistake_list_fields, count_mistakes, select_mistakes_page, MISTAKE_LIST_PREVIEW_CHARS, iter_mistake_export_batches, MISTAKE_EXPORT_COLUMNS
+        from db.database_config import claim_idempotency_key, complete_idempotency_key, release_idempotency_key, purge_expired_idempotency_keys
+        from db.database_config import enqueue_pending_analysis, claim_pending_analysis, complete_pending_analysis, retry_pending_analysis, get_pending_analysis, get_learning_sheet_items
+        from db.database_config import add_mistake_record, add_mistake_analyses, add_mistake_practices, replace_mistake_analyses
+    from db.partitions import ensure_partitions_once, PARTITION_MAINTENANCE_SECONDS
+    from db.routing import set_route_key, reset_route_key
+    from db.tenancy import USER_ID_HEADER, resolve_user_id, set_current_user_id, reset_current_user_id, current_user_id
+    from core.practice_pool import get_recommendations, rebuild_practice_pools, PRACTICE_POOL_REFRESH_SECONDS
+    from core.review_scheduler import (
+        schedule_reviews, get_due_reviews, count_due_review_cards, grade_review_card, REVIEW_SCHEDULE_SECONDS,
+    )
     DATABASE_AVAILABLE = True
 except ImportError as e:
     logger = logging.getLogger('coze_api')
     logger.warning(f"数据库配置导入失败: {e}，将不会保存数据到数据库")
     DATABASE_AVAILABLE = False
 
+from core.vision.dedup import compute_phash, get_phash_index, to_signed, to_unsigned, PHASH_DUP_MODE
+from core.vision.preprocess import preprocess_for_upload
+from core.vision.pdf import PDF_PAGE_CONCURRENCY, InvalidPDFError, rasterize_pdf, is_available as pdf_split_available
+from storage.media.derivatives import MediaStaticFiles, derivative_urls, generate_derivatives
+from core.exporter.stream import EXPORT_FORMATS, iter_export, is_parquet_available
+from core.exporter.sheet import SHEET_MAX_ITEMS, SheetCache, build_sheet_markdown, sheet_digest, is_available as sheet_export_available
+from integration.singleflight import SingleFlight
+from integration.circuit_breaker import CircuitBreaker, CircuitOpenError
+from integration.coze_capture import CozeCapture
+from integration.baidu import OCR_KINDS, TTS_FORMATS, BaiduAPIError, BaiduServices
+from integration.coze_payload import (
+    CozePayloadError, CozeQuestionStream, normalize_coze_payload, parse_coze_output, transform_coze_result,
+)
+
 
 
 # 配置日志
@@ -52,7 +95,29 @@ load_dotenv()
 
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    """应用生命周期：启动/停止后台任务"""
+    tasks = []
+    if DATABASE_AVAILABLE and PRACTICE_POOL_REFRESH_SECONDS > 0:
+        tasks.append(asyncio.create_task(refresh_practice_pools_periodically()))
+    if DATABASE_AVAILABLE and DB_BACKEND != "sqlite" and PARTITION_MAINTENANCE_SECONDS > 0:
+        tasks.append(asyncio.create_task(ensure_partitions_periodically()))
+    if DATABASE_AVAILABLE and IDEMPOTENCY_PURGE_SECONDS > 0:
+        tasks.append(asyncio.create_task(purge_idempotency_keys_periodically()))
+    if DATABASE_AVAILABLE and COZE_REPLAY_INTERVAL_SECONDS > 0:
+        tasks.append(asyncio.create_task(replay_pending_analyses_periodically()))
+    if DATABASE_AVAILABLE and REVIEW_SCHEDULE_SECONDS > 0:
+        tasks.append(asyncio.create_task(schedule_reviews_periodically()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await baidu.close()
+    if DATABASE_AVAILABLE and DB_BACKEND == "sqlite":
+        close_writer()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 
@@ -73,128 +138,108 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def bind_db_route_key(request: Request, call_next):
+    """按客户端标识（X-Client-Id 请求头，缺省为客户端 IP）路由读请求，保证读己之写"""
+    if not DATABASE_AVAILABLE:
+        return await call_next(request)
+    key = request.headers.get("X-Client-Id") or (request.client.host if request.client else None)
+    token = set_route_key(key)
+    try:
+        return await call_next(request)
+    finally:
+        reset_route_key(token)
+
+
+@app.middleware("http")
+async def bind_current_user(request: Request, call_next):
+    """从 X-User-Id 请求头解析当前用户，列表、详情、统计等查询只返回该用户的数据（见 db/tenancy.py）
+
+    该请求头不是访问控制边界：只接受来自可信代理（USER_ID_TRUSTED_PROXIES）的请求头，由网关负责认证用户。
+    """
+    if not DATABASE_AVAILABLE:
+        return await call_next(request)
+    try:
+        user_id = resolve_user_id(request.headers.get(USER_ID_HEADER), request.client.host if request.client else None)
+    except PermissionError as e:
+        logger.warning(str(e))
+        return JSONResponse({"detail": f"{USER_ID_HEADER} 请求头只接受来自可信代理的请求"}, status_code=403)
+    except ValueError:
+        return JSONResponse({"detail": f"{USER_ID_HEADER} 请求头无效"}, status_code=400)
+    token = set_current_user_id(user_id)
+    try:
+        return await call_next(request)
+    finally:
+        reset_current_user_id(token)
+
+
 
 # 挂载媒体目录为静态文件
 import os
 media_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "media")
-app.mount("/media", StaticFiles(directory=media_dir), name="media")
-
-
-
-def transform_coze_result(coze_data):
-    """将 Coze API 返回的题目列表标准化为前端需要的结构"""
-    if not isinstance(coze_data, list):
-        return []
-
-    normalized = []
-    for item in coze_data:
-        # 处理嵌套结构：如果 item 包含 output 字段，则提取其中的 questions
-        if isinstance(item, dict) and "output" in item and isinstance(item["output"], list):
-            for output_item in item["output"]:
-                if isinstance(output_item, dict) and "questions" in output_item and isinstance(output_item["questions"], list):
-                    for question in output_item["questions"]:
-                        normalized_item = {
-                            "id": output_item.get("id", ""),
-                            "subject": output_item.get("subject") or "",  # 学科
-                            "section": output_item.get("section") or "",
-                            "question": question.get("question") or "",
-                            "answer": question.get("answer") or "",
-                            "is_question": bool(question.get("is_question", True)),
-                            "is_correct": bool(question.get("is_correct", False)),
-                            "correct_answer": question.get("correct_answer") or "",
-                            "comment": question.get("comment") or "",
-                            "error_type": None,
-                            "knowledge_point": ", ".join(output_item.get("knowledge_points", [])) if output_item.get("knowledge_points") else None
-                        }
-                        normalized.append(normalized_item)
-        else:
-            # 处理普通结构
-            normalized_item = {
-                "id": str(item.get("id", "")),
-                "subject": item.get("subject") or "",  # 学科
-                "section": item.get("section") or "",
-                "question": item.get("question") or "",
-                "answer": item.get("answer") or "",
-                "is_question": bool(item.get("is_question", True)),
-                "is_correct": bool(item.get("is_correct", False)),
-                "correct_answer": item.get("correct_answer") or "",
-                "comment": item.get("comment") or "",
-            }
+# 衍生图（media/derived）缺失时惰性生成，并带长期缓存头
+app.mount("/media", MediaStaticFiles(directory=media_dir), name="media")
 
-            for key, value in item.items():
-                if key not in normalized_item:
-                    normalized_item[key] = value
 
-            normalized.append(normalized_item)
 
-    return normalized
+# Coze 各阶段超时（秒）：文件上传通常很快，工作流运行需要数十秒
+COZE_UPLOAD_TIMEOUT_SECONDS = float(os.getenv("COZE_UPLOAD_TIMEOUT_SECONDS", "30"))
+COZE_RUN_TIMEOUT_SECONDS = float(os.getenv("COZE_RUN_TIMEOUT_SECONDS", "180"))
 
+# Coze 熔断：连续失败 COZE_BREAKER_FAILURE_THRESHOLD 次后 COZE_BREAKER_RECOVERY_SECONDS 内直接失败，
+# 到期后放行 COZE_BREAKER_HALF_OPEN_MAX_CALLS 个探测调用
+coze_breaker = CircuitBreaker(
+    "coze",
+    failure_threshold=int(os.getenv("COZE_BREAKER_FAILURE_THRESHOLD", "5")),
+    recovery_seconds=float(os.getenv("COZE_BREAKER_RECOVERY_SECONDS", "30")),
+    half_open_max_calls=int(os.getenv("COZE_BREAKER_HALF_OPEN_MAX_CALLS", "1")),
+)
 
+# 设置 COZE_CAPTURE_DIR 时把 Coze 原始输出脱敏后存为离线回放语料（scripts/replay_coze_corpus.py）
+coze_capture = CozeCapture(
+    os.getenv("COZE_CAPTURE_DIR"),
+    max_files=int(os.getenv("COZE_CAPTURE_MAX_FILES", "10000")),
+)
 
-def extract_practices_from_payload(data):
-    """从 Coze 返回中提取 practices 列表。
-    兼容顶层/嵌套 output 节点两种结构。
-    """
-    practices = []
 
-    def normalize(p):
-        return {
-            "question": (p or {}).get("question") or "",
-            "correct_answer": (p or {}).get("correct_answer") or "",
-            "comment": (p or {}).get("comment") or "",
-        }
+class CozeUnavailableError(HTTPException):
+    """Coze 熔断中，未发起调用直接失败（503）"""
 
-    def collect_from_obj(obj):
-        if not isinstance(obj, dict):
-            return
-        if isinstance(obj.get("practices"), list):
-            for p in obj["practices"]:
-                if isinstance(p, dict):
-                    practices.append(normalize(p))
-        # 遍历 output 节点
-        outs = obj.get("output")
-        if isinstance(outs, list):
-            for out in outs:
-                if isinstance(out, dict) and isinstance(out.get("practices"), list):
-                    for p in out["practices"]:
-                        if isinstance(p, dict):
-                            practices.append(normalize(p))
-                # 同时检查每个 output 下的 questions 中是否内嵌 practices
-                if isinstance(out, dict) and isinstance(out.get("questions"), list):
-                    for q in out["questions"]:
-                        if isinstance(q, dict) and isinstance(q.get("practices"), list):
-                            for p in q["practices"]:
-                                if isinstance(p, dict):
-                                    practices.append(normalize(p))
-
-    if isinstance(data, list):
-        for item in data:
-            if isinstance(item, dict):
-                collect_from_obj(item)
-    elif isinstance(data, dict):
-        collect_from_obj(data)
-        # 常见嵌套载荷 data/items/records 等
-        for key in ("data", "items", "records", "result", "payload"):
-            v = data.get(key)
-            if isinstance(v, (list, dict)):
-                practices.extend(extract_practices_from_payload(v))
-
-    return practices
-
-
-async def call_coze_workflow(image_data: bytes, filename: Optional[str] = None) -> dict:
-    """调用 Coze 工作流进行图像分析（非流式 /v1/workflow/run)
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail="Coze 分析服务暂不可用，请稍后重试",
+            headers={"Retry-After": str(max(1, round(retry_after)))},
+        )
+        self.retry_after = retry_after
+
+
+# Coze 未配置时返回的模拟数据（便于前端联调）
+MOCK_COZE_DATA = [
+    {
+        "id": "1.1",
+        "subject": "数学",  # 学科
+        "section": "计算题",
+        "question": "计算：1/2 + 1/3 = ?",
+        "answer": "",
+        "is_question": True,
+        "is_correct": False,
+        "correct_answer": "5/6",
+        "comment": "需要先找到公分母：2 和 3 的最小公倍数是 6，将分数转换为同分母：1/2 = 3/6，1/3 = 2/6，然后相加：3/6 + 2/6 = 5/6",
+    }
+]
+
+
+async def _prepare_coze_run(image_data: bytes, filename: Optional[str] = None, timings: Optional[dict] = None):
+    """读取 Coze 配置并上传图片，返回 (coze_client, 工作流运行参数)；未配置时返回 None（使用模拟数据）
     依赖环境变量：
       - COZE_API_HOST          （可选，默认 api.coze.cn；若 token 来自 coze.com，请设为 api.coze.com）
       - COZE_ACCESS_TOKEN 或 COZE_API_KEY  （二选一，建议前者；必需）
       - COZE_WORKFLOW_ID       （必需；工作流已发布）
       - COZE_BOT_ID            （可选；某些工作流需要）
       - COZE_APP_ID            （可选；与 BOT_ID 二选一传，不要都传）
+    传入 timings 字典时，会写入上传耗时（upload_ms）。
     """
-    import json
-
-    from fastapi import HTTPException
-
     try:
         from cozepy import AsyncCoze
         from cozepy.auth import AsyncTokenAuth
@@ -214,20 +259,7 @@ async def call_coze_workflow(image_data: bytes, filename: Optional[str] = None)
     # === 配置校验/回退 ===
     if not coze_token or not coze_workflow_id:
         logger.info("Coze 配置缺失（token 或 workflow_id），返回模拟数据以便前端联调。")
-        mock_coze_data = [
-            {
-                "id": "1.1",
-                "subject": "数学",  # 学科
-                "section": "计算题",
-                "question": "计算：1/2 + 1/3 = ?",
-                "answer": "",
-                "is_question": True,
-                "is_correct": False,
-                "correct_answer": "5/6",
-                "comment": "需要先找到公分母：2 和 3 的最小公倍数是 6，将分数转换为同分母：1/2 = 3/6，1/3 = 2/6，然后相加：3/6 + 2/6 = 5/6",
-            }
-        ]
-        return {"analysis": transform_coze_result(mock_coze_data), "practices": []}
+        return None
 
     coze_workflow_id = coze_workflow_id.strip()
     masked_token = coze_token[:6] + "****" if len(coze_token) >= 10 else "****"
@@ -259,8 +291,19 @@ async def call_coze_workflow(image_data: bytes, filename: Optional[str] = None)
     coze_client = AsyncCoze(auth=AsyncTokenAuth(token=coze_token), base_url=base_url)
 
     try:
-        uploaded_file = await coze_client.files.upload(file=upload_buffer)
+        upload_started = time.perf_counter()
+        with coze_breaker.guard():
+            uploaded_file = await asyncio.wait_for(coze_client.files.upload(file=upload_buffer),
+                                                   COZE_UPLOAD_TIMEOUT_SECONDS)
+        if timings is not None:
+            timings["upload_ms"] = round((time.perf_counter() - upload_started) * 1000, 1)
         logger.info("[Coze] 文件上传成功，file_id=%s, size=%d", uploaded_file.id, len(image_data))
+    except CircuitOpenError as exc:
+        logger.warning("[Coze] %s，跳过调用", exc)
+        raise CozeUnavailableError(exc.retry_after) from exc
+    except asyncio.TimeoutError as exc:
+        logger.error("[Coze] 文件上传超时（%ss）", COZE_UPLOAD_TIMEOUT_SECONDS)
+        raise HTTPException(status_code=504, detail=f"Coze 文件上传超时（{COZE_UPLOAD_TIMEOUT_SECONDS:g}s）") from exc
     except CozeAPIError as exc:
         error_message = f"Coze 文件上传失败：code={exc.code}, msg={exc.msg}, logid={exc.logid}"
         logger.error("[Coze] %s", error_message)
@@ -297,13 +340,40 @@ async def call_coze_workflow(image_data: bytes, filename: Optional[str] = None)
     }
     logger.info("[Coze] 请求摘要: %s", json.dumps(safe_dbg, ensure_ascii=False))
 
+    return coze_client, {
+        "workflow_id": coze_workflow_id,
+        "parameters": parameters,
+        "bot_id": coze_bot_id or None,
+        "app_id": coze_app_id or None,
+    }
+
+
+async def call_coze_workflow(image_data: bytes, filename: Optional[str] = None, timings: Optional[dict] = None) -> dict:
+    """调用 Coze 工作流进行图像分析（非流式 /v1/workflow/run)
+    配置见 _prepare_coze_run；传入 timings 字典时，会写入各阶段耗时（upload_ms / run_ms）。
+    文件上传与工作流运行分别受 COZE_UPLOAD_TIMEOUT_SECONDS / COZE_RUN_TIMEOUT_SECONDS 限制，
+    两次网络调用都经过熔断器 coze_breaker，熔断期间直接抛出 CozeUnavailableError。
+    """
+    from cozepy.exception import CozeAPIError
+
+    prepared = await _prepare_coze_run(image_data, filename, timings)
+    if prepared is None:
+        return {"analysis": transform_coze_result(MOCK_COZE_DATA), "practices": []}
+    coze_client, run_kwargs = prepared
+
     try:
-        result = await coze_client.workflows.runs.create(
-            workflow_id=coze_workflow_id,
-            parameters=parameters,
-            bot_id=coze_bot_id or None,
-            app_id=coze_app_id or None,
-        )
+        run_started = time.perf_counter()
+        with coze_breaker.guard():
+            result = await asyncio.wait_for(coze_client.workflows.runs.create(**run_kwargs),
+                                            COZE_RUN_TIMEOUT_SECONDS)
+        if timings is not None:
+            timings["run_ms"] = round((time.perf_counter() - run_started) * 1000, 1)
+    except CircuitOpenError as exc:
+        logger.warning("[Coze] %s，跳过调用", exc)
+        raise CozeUnavailableError(exc.retry_after) from exc
+    except asyncio.TimeoutError as exc:
+        logger.error("[Coze] 工作流运行超时（%ss）", COZE_RUN_TIMEOUT_SECONDS)
+        raise HTTPException(status_code=504, detail=f"Coze 工作流运行超时（{COZE_RUN_TIMEOUT_SECONDS:g}s）") from exc
     except CozeAPIError as exc:
         error_message = f"Coze SDK 调用失败：code={exc.code}, msg={exc.msg}, logid={exc.logid}"
         logger.error("[Coze] %s", error_message)
@@ -317,109 +387,601 @@ async def call_coze_workflow(image_data: bytes, filename: Optional[str] = None)
 
     raw_payload = result.data or ""
     logger.info("[Coze] 完整响应: %s", raw_payload)
-    if not raw_payload.strip():
-        logger.error("[Coze] 工作流返回为空。")
-        raise HTTPException(status_code=502, detail="Coze 未返回任何数据，请检查工作流输出。")
-
+    if coze_capture.enabled:
+        await asyncio.to_thread(coze_capture.write, raw_payload, "run")
     try:
-        parsed_payload = json.loads(raw_payload)
+        coze_payload = parse_coze_output(raw_payload)
         logger.info("[Coze] 成功解析工作流返回，长度=%d", len(raw_payload))
-    except json.JSONDecodeError:
-        logger.error("[Coze] 工作流返回非 JSON，示例=%s", raw_payload[:200])
-        raise HTTPException(status_code=502, detail="Coze 返回内容无法解析，请检查工作流输出。")
+        return normalize_coze_payload(coze_payload)
+    except CozePayloadError as exc:
+        logger.error("[Coze] %s", exc)
+        raise HTTPException(status_code=502, detail=str(exc)) from exc
+
+
+def _coze_stream_error(exc):
+    """把流式调用中的异常转换为 HTTPException（HTTPException 原样返回）"""
+    from cozepy.exception import CozeAPIError
+
+    if isinstance(exc, HTTPException):
+        logger.error("[Coze] %s", exc.detail)
+        return exc
+    if isinstance(exc, asyncio.TimeoutError):
+        logger.error("[Coze] 流式工作流运行超时（%ss）", COZE_RUN_TIMEOUT_SECONDS)
+        return HTTPException(status_code=504, detail=f"Coze 工作流运行超时（{COZE_RUN_TIMEOUT_SECONDS:g}s）")
+    if isinstance(exc, CozeAPIError):
+        error_message = f"Coze SDK 流式调用失败：code={exc.code}, msg={exc.msg}, logid={exc.logid}"
+        logger.error("[Coze] %s", error_message)
+        return HTTPException(status_code=502, detail=error_message)
+    logger.error("[Coze] 调用 /workflow/stream_run 失败: %s", exc)
+    return HTTPException(status_code=500, detail=f"无法调用 Coze 流式工作流：{exc}")
 
-    if isinstance(parsed_payload, dict) and "data" in parsed_payload:
-        coze_payload = parsed_payload.get("data")
-    else:
-        coze_payload = parsed_payload
 
-    logger.info("[Coze] 转换前数据类型: %s", type(coze_payload).__name__)
+async def _next_coze_event(events, budget):
+    """等待 Coze 流的下一个事件，最多等待 budget 秒；返回 (事件, 剩余秒数)，流结束时事件为 None"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        event = await asyncio.wait_for(anext(events), max(budget, 0))
+    except StopAsyncIteration:
+        event = None
+    return event, budget - (loop.time() - started)
 
 
+async def stream_coze_workflow(image_data: bytes, filename: Optional[str] = None, timings: Optional[dict] = None):
+    """流式调用 Coze 工作流（/v1/workflow/stream_run），逐段产出 (节点名称, 输出文本)
+
+    等待 Coze 事件的累计时间受 COZE_RUN_TIMEOUT_SECONDS 限制并经过熔断器；工作流报错或中断时抛出
+    HTTPException。调用方在两次产出之间的处理（入库、推送给慢客户端）不计入超时，也不会被记为
+    Coze 失败；调用方中途关闭时只归还熔断探测名额。
+    未配置 Coze 时分段产出模拟数据。
+    """
+    from cozepy import WorkflowEventType
+
+    prepared = await _prepare_coze_run(image_data, filename, timings)
+    if prepared is None:
+        mock = json.dumps(MOCK_COZE_DATA, ensure_ascii=False)
+        for start in range(0, len(mock), 64):
+            yield "mock", mock[start:start + 64]
+        return
+    coze_client, run_kwargs = prepared
+    chunks = [] if coze_capture.enabled else None
 
-    practices = extract_practices_from_payload(coze_payload)
     try:
-        logger.info("[Coze] 提取到类练习条目数: %d", len(practices))
-    except Exception:
-        pass
+        probe = coze_breaker.acquire()
+    except CircuitOpenError as exc:
+        logger.warning("[Coze] %s，跳过调用", exc)
+        raise CozeUnavailableError(exc.retry_after) from exc
+
+    budget = COZE_RUN_TIMEOUT_SECONDS
+    events = coze_client.workflows.runs.stream(**run_kwargs)
+    settled = False
+    try:
+        while True:
+            try:
+                event, budget = await _next_coze_event(events, budget)
+                if event is not None and event.event == WorkflowEventType.ERROR and event.error:
+                    raise HTTPException(status_code=502, detail=(
+                        f"Coze 工作流出错：code={event.error.error_code}, msg={event.error.error_message}"))
+                if event is not None and event.event == WorkflowEventType.INTERRUPT:
+                    raise HTTPException(status_code=502, detail="Coze 工作流中断（等待人工输入），流式分析不支持")
+            except Exception as exc:
+                settled = True
+                coze_breaker.record_failure(probe)
+                error = _coze_stream_error(exc)
+                if error is exc:
+                    raise
+                raise error from exc
+            if event is None:
+                break
+            if event.event == WorkflowEventType.MESSAGE and event.message:
+                if chunks is not None:
+                    chunks.append((event.message.node_title, event.message.content))
+                yield event.message.node_title, event.message.content
+        settled = True
+        coze_breaker.record_success(probe)
+    finally:
+        if not settled:  # 调用方中途关闭或被取消，没有结论
+            coze_breaker.release(probe)
+        await events.aclose()
 
-    if isinstance(coze_payload, list):
+    if chunks:
+        # 与 CozeQuestionStream 一致，完整输出取最后输出的节点的全部内容
+        last_node = chunks[-1][0]
+        raw_payload = "".join(text for node, text in chunks if node == last_node)
+        await asyncio.to_thread(coze_capture.write, raw_payload, "stream", chunks)
 
-        transformed = transform_coze_result(coze_payload)
 
-        logger.info("[Coze] 转换后数据: %s", json.dumps(transformed, ensure_ascii=False))
 
-        return {"analysis": transformed, "practices": practices}
+@app.get("/")
 
+def read_root():
 
+    missing_keys = []
 
-    if isinstance(coze_payload, dict):
+    for key in ["BAIDU_OCR_API_KEY", "BAIDU_ASR_API_KEY", "BAIDU_TTS_API_KEY", "LLM_API_KEY", "COZE_API_KEY", "COZE_WORKFLOW_ID"]:
 
-        logger.info("[Coze] 返回 dict 数据: %s", json.dumps(coze_payload, ensure_ascii=False))
+        if not os.getenv(key):
 
-        nested_candidates = []
+            missing_keys.append(key)
 
-        for key in ("data", "items", "records", "questions"):
+    if missing_keys:
 
-            value = coze_payload.get(key) if isinstance(coze_payload, dict) else None
+        return {"status": "warning", "missing_keys": missing_keys}
 
-            if isinstance(value, list):
+    return {"status": "ok", "message": "mistake_note API is running."}
 
-                nested_candidates = value
 
-                break
 
+async def find_duplicate_upload(content: bytes):
+    """计算上传图片的感知哈希，并在已有错题记录中查找近重复
+    返回 (image_phash, duplicate_of)，image_phash 为可直接入库的有符号整数
+    """
+    if not DATABASE_AVAILABLE:
+        return None, None
 
+    phash = await asyncio.to_thread(compute_phash, content)
+    if phash is None:
+        return None, None
 
-        if nested_candidates:
+    try:
+        db = next(get_db())
+        index = await asyncio.to_thread(get_phash_index, db, current_user_id())
+        match = index.search(phash)
+    except Exception as e:
+        logger.error(f"近重复检测失败: {e}")
+        return to_signed(phash), None
 
-            transformed = transform_coze_result(nested_candidates)
+    if match is None:
+        return to_signed(phash), None
 
-            logger.info("[Coze] 嵌套列表转换后数据: %s", json.dumps(transformed, ensure_ascii=False))
+    record_id, distance = match
+    logger.info(f"检测到近重复上传：与错题记录 {record_id} 的汉明距离为 {distance}")
+    return to_signed(phash), {"mistake_record_id": record_id, "distance": distance}
 
-            return {"analysis": transformed, "practices": practices}
 
+# 相同图片的并发分析只调用一次 Coze（按原图内容摘要合并）
+COZE_SINGLEFLIGHT_ENABLED = os.getenv("COZE_SINGLEFLIGHT_ENABLED", "1") == "1"
+coze_flight = SingleFlight("coze")
 
 
-        transformed = transform_coze_result([coze_payload])
+async def call_coze_with_preprocess(content: bytes, filename: Optional[str]):
+    """预处理后调用 Coze 工作流，返回 (coze_result, 预处理统计)
 
-        logger.info("[Coze] 单条数据转换后数据: %s", json.dumps(transformed, ensure_ascii=False))
+    同一张图片（内容摘要相同）正在分析时，后到的请求等待并共享同一次调用的结果，
+    统计中 coalesced 为 True。
+    """
+    if not COZE_SINGLEFLIGHT_ENABLED:
+        return await _run_coze_with_preprocess(content, filename)
+    digest = hashlib.sha256(content).hexdigest()
+    (coze_result, stats), shared = await coze_flight.do(
+        digest, lambda: _run_coze_with_preprocess(content, filename))
+    stats["coalesced"] = shared
+    return coze_result, stats
 
-        return {"analysis": transformed, "practices": practices}
 
+async def _run_coze_with_preprocess(content: bytes, filename: Optional[str]):
+    """预处理后调用 Coze 工作流，返回 (coze_result, 预处理统计)
 
+    延迟变化按本次实际上传吞吐估算：省下的字节若按原图上传需要多花的时间，
+    与预处理耗时相抵，latency_change_ms 为负表示整体更快。
+    """
+    coze_content, coze_filename, stats = await preprocess_for_upload(content, filename)
+    timings = {}
+    coze_started = time.perf_counter()
+    coze_result = await call_coze_workflow(coze_content, coze_filename, timings=timings)
+    stats["coze_ms"] = round((time.perf_counter() - coze_started) * 1000, 1)
+    stats.update(timings)
 
-    logger.error("[Coze] 返回数据类型 %s 暂不支持", type(coze_payload).__name__)
+    upload_ms = timings.get("upload_ms")
+    if upload_ms is not None and stats["processed_bytes"]:
+        upload_ms_saved = upload_ms * stats["bytes_saved"] / stats["processed_bytes"]
+        stats["estimated_upload_ms_saved"] = round(upload_ms_saved, 1)
+        stats["latency_change_ms"] = round(stats["preprocess_ms"] - upload_ms_saved, 1)
+    logger.info(f"[预处理] 上传统计: {json.dumps(stats, ensure_ascii=False)}")
+    return coze_result, stats
 
-    raise HTTPException(status_code=502, detail="Coze 返回数据格式不支持，请检查工作流输出。")
 
+PDF_SPLIT_ENABLED = os.getenv("PDF_SPLIT_ENABLED", "1") == "1"
 
 
-@app.get("/")
+def _normalize_coze_result(coze_result):
+    """Coze 结果统一为 (analysis, practices)"""
+    if not coze_result:
+        return [], []
+    if isinstance(coze_result, list):
+        return coze_result, []
+    return coze_result.get("analysis", []), coze_result.get("practices", [])
 
-def read_root():
 
-    missing_keys = []
+def _save_record(file_data, analysis, practices):
+    db = SessionLocal()
+    try:
+        return save_mistake_record(db, file_data, analysis, practices)
+    finally:
+        db.close()
 
-    for key in ["BAIDU_OCR_API_KEY", "BAIDU_ASR_API_KEY", "BAIDU_TTS_API_KEY", "LLM_API_KEY", "COZE_API_KEY", "COZE_WORKFLOW_ID"]:
 
-        if not os.getenv(key):
+async def persist_mistake_record(file_data, analysis, practices):
+    """保存错题记录，返回记录ID
 
-            missing_keys.append(key)
+    SQLite 后端交给单写线程串行执行并合并提交，避免并发上传互相等待写锁；
+    PostgreSQL 后端在线程池中用独立会话提交，不阻塞事件循环。
+    file_data 未指定 user_id 时归属当前请求的用户（单写线程中读不到请求的 contextvar，在这里显式传入）。
+    """
+    file_data = {"user_id": current_user_id(), **file_data}
+    if DB_BACKEND == "sqlite":
+        record_id = await get_writer().save_mistake_record(file_data, analysis, practices)
+    else:
+        record_id = await asyncio.to_thread(_save_record, file_data, analysis, practices)
+    # 该客户端接下来的读请求在复制追上之前走主库
+    router.mark_write()
+    return record_id
 
-    if missing_keys:
 
-        return {"status": "warning", "missing_keys": missing_keys}
+def _write_session(fn, *args):
+    db = SessionLocal()
+    try:
+        result = fn(db, *args)
+        db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
 
-    return {"status": "ok", "message": "mistake_note API is running."}
+
+async def run_write(fn, *args):
+    """在主库上执行写操作 fn(session, *args) 并提交，返回 fn 的返回值（SQLite 后端交给单写线程）"""
+    if DB_BACKEND == "sqlite":
+        return await get_writer().run(fn, *args)
+    return await asyncio.to_thread(_write_session, fn, *args)
+
+
+def run_write_blocking(fn, *args):
+    """run_write 的同步版本，供线程池中的后台批处理逐批写入（SQLite 后端同样交给单写线程）"""
+    if DB_BACKEND == "sqlite":
+        return get_writer().submit(fn, *args).result()
+    return _write_session(fn, *args)
+
+
+# 相同 Idempotency-Key 的请求正在处理时，建议客户端等待的秒数
+IDEMPOTENCY_RETRY_AFTER_SECONDS = int(os.getenv("IDEMPOTENCY_RETRY_AFTER_SECONDS", "5"))
+IDEMPOTENCY_PURGE_SECONDS = int(os.getenv("IDEMPOTENCY_PURGE_SECONDS", "3600"))
+
+
+async def _release_idempotency(scope, key, attempt):
+    try:
+        await run_write(release_idempotency_key, scope, key, attempt)
+    except Exception as e:
+        logger.error(f"[幂等] 删除 {scope} 键 {key} 的处理标记失败（租约过期后可重试）: {e}")
+
+
+async def run_idempotent(scope, key, content, filename, process, recover):
+    """按 Idempotency-Key 执行请求：同一个键在有效期内只处理一次，重试直接返回保存的响应
+
+    处理前先写入 in_progress 标记（预写标记，带租约），完成后保存响应；处理失败删除标记，
+    重试时重新处理。进程在处理中途崩溃时标记会残留，租约过期后的重试接管该键：
+    recover(file_id) 先查找崩溃前已保存的错题记录，有则直接返回，没有才调用 process(file_id)
+    重新处理。process 返回 (响应, 是否保存为幂等结果)。
+    """
+    if len(key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key 过长（最多 255 个字符）")
+    request_hash = hashlib.sha256(content + b"\0" + (filename or "").encode("utf-8")).hexdigest()
+    scope = f"{scope}@{current_user_id()}"  # 幂等键按用户隔离，不同用户使用相同的键互不影响
+    state, claim = await run_write(claim_idempotency_key, scope, key, request_hash, str(uuid.uuid4()))
+    if state == "completed":
+        logger.info(f"[幂等] {scope} 键 {key} 已处理，返回保存的响应")
+        return JSONResponse(claim["response"], status_code=claim["status_code"],
+                            headers={"Idempotent-Replayed": "true"})
+    if state == "in_progress":
+        raise HTTPException(status_code=409, detail="相同 Idempotency-Key 的请求正在处理中，请稍后重试",
+                            headers={"Retry-After": str(IDEMPOTENCY_RETRY_AFTER_SECONDS)})
+    if state == "mismatch":
+        raise HTTPException(status_code=422, detail="Idempotency-Key 已用于内容不同的请求")
+
+    file_id, attempt = claim["resource_id"], claim["attempt"]
+    try:
+        result, cacheable = None, True
+        if state == "taken_over":
+            result = await asyncio.to_thread(recover, file_id)
+        if result is None:
+            result, cacheable = await process(file_id)
+    except BaseException:
+        # 包括客户端断开（CancelledError），标记删除后重试可重新处理
+        await asyncio.shield(_release_idempotency(scope, key, attempt))
+        raise
+
+    response = jsonable_encoder(result)
+    if not cacheable:
+        await _release_idempotency(scope, key, attempt)
+        return response
+    try:
+        if not await run_write(complete_idempotency_key, scope, key, attempt, 200, response):
+            logger.warning(f"[幂等] {scope} 键 {key} 的租约已被其他请求接管，本次结果未保存")
+    except Exception as e:
+        logger.error(f"[幂等] 保存 {scope} 键 {key} 的响应失败: {e}")
+    return response
+
+
+def recover_saved_result(file_id: str, analysis_key: str):
+    """读取中断的请求在崩溃前已保存的错题记录（图片按 file_id，PDF 各页按 source_file_id），没有则返回 None"""
+    db = SessionLocal()
+    try:
+        records = (
+            db.query(MistakeRecord.id, MistakeRecord.page_index)
+            .filter((MistakeRecord.file_id == file_id) | (MistakeRecord.source_file_id == file_id))
+            .order_by(MistakeRecord.page_index, MistakeRecord.id)
+            .all()
+        )
+    finally:
+        db.close()
+    saved = [(page_index, load_duplicate_result(record_id)) for record_id, page_index in records]
+    saved = [(page_index, existing) for page_index, existing in saved if existing]
+    if not saved:
+        return None
+
+    analysis, practices = [], []
+    for page_index, existing in saved:
+        for key, items in (("analysis", analysis), ("practices", practices)):
+            items.extend(item if page_index is None else {**item, "page_index": page_index}
+                         for item in existing[key])
+    logger.info(f"[幂等] 文件 {file_id} 在中断前已保存 {len(saved)} 条错题记录，直接返回")
+    result = {
+        "status": "success",
+        "message": "请求已处理，返回已保存的分析结果",
+        "file_id": file_id,
+        analysis_key: analysis,
+        "practices": practices,
+        "mistake_record_ids": [existing["record"].id for _, existing in saved],
+    }
+    if len(saved) == 1 and saved[0][0] is None:
+        record = saved[0][1]["record"]
+        result.update({
+            "mistake_record_id": record.id,
+            "filename": record.filename,
+            "file_url": record.file_url,
+            "upload_time": record.upload_time.isoformat() if record.upload_time else None,
+            "file_size": record.file_size,
+            "file_type": record.file_type,
+            "derivatives": derivative_urls(record.filename),
+        })
+    return result
+
+
+COZE_REPLAY_INTERVAL_SECONDS = int(os.getenv("COZE_REPLAY_INTERVAL_SECONDS", "30"))
+COZE_REPLAY_RETRY_SECONDS = int(os.getenv("COZE_REPLAY_RETRY_SECONDS", "60"))
+replay_stats = {"queued": 0, "replayed": 0, "retried": 0}
+
+
+async def queue_pending_analysis(file_data, original_filename, exc: CozeUnavailableError):
+    """Coze 熔断时保存待分析任务，返回队列ID；文件需已保存在 media/uploads"""
+    job_id = await run_write(enqueue_pending_analysis, {"user_id": current_user_id(), **file_data,
+                                                        "original_filename": original_filename})
+    replay_stats["queued"] += 1
+    logger.warning(f"[待分析队列] Coze 熔断中，文件 {file_data['file_id']} 已入队（任务 {job_id}），恢复后自动分析")
+    return {
+        "pending_analysis_id": job_id,
+        "pending_analysis_url": f"/pending-analyses/{job_id}",
+        "retry_after": max(1, round(exc.retry_after)),
+    }
+
+
+async def replay_pending_analysis(job):
+    """重放一条待分析任务：调用 Coze 并保存错题记录；Coze 仍熔断时抛出 CozeUnavailableError"""
+    with open(os.path.join(media_dir, "uploads", job["filename"]), "rb") as f:
+        content = f.read()
+    coze_result, _ = await call_coze_with_preprocess(content, job["original_filename"] or job["filename"])
+    analysis, practices = _normalize_coze_result(coze_result)
+    record_id = None
+    if analysis or practices:
+        file_data = {
+            "file_id": job["file_id"],
+            "filename": job["filename"],
+            "file_url": f"/media/uploads/{job['filename']}",
+            "file_size": job["file_size"],
+            "file_type": job["file_type"],
+            "upload_time": job["upload_time"],
+            "image_phash": job["image_phash"],
+            "user_id": job["user_id"],
+        }
+        record_id = await persist_mistake_record(file_data, analysis, practices)
+        remember_upload_phash(job["image_phash"], record_id, job["user_id"])
+    await run_write(complete_pending_analysis, job["id"], record_id)
+    replay_stats["replayed"] += 1
+    logger.info(f"[待分析队列] 任务 {job['id']} 分析完成，错题记录ID: {record_id}")
+    return record_id
+
+
+async def replay_pending_analyses_once(limit: int = 20):
+    """逐条领取并重放到期的待分析任务，熔断器打开时停止，返回本次完成的任务数"""
+    done = 0
+    for _ in range(limit):
+        if coze_breaker.state == "open":
+            break
+        job = await run_write(claim_pending_analysis)
+        if job is None:
+            break
+        try:
+            await replay_pending_analysis(job)
+            done += 1
+        except CozeUnavailableError as e:
+            # 未真正调用 Coze，不计入重试次数
+            await run_write(retry_pending_analysis, job["id"], e.detail, e.retry_after, False)
+            break
+        except Exception as e:
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            replay_stats["retried"] += 1
+            await run_write(retry_pending_analysis, job["id"], error, COZE_REPLAY_RETRY_SECONDS * job["attempts"])
+    return done
+
+
+async def replay_pending_analyses_periodically():
+    """后台定时重放 Coze 熔断期间排队的分析任务"""
+    while True:
+        try:
+            await replay_pending_analyses_once()
+        except Exception as e:
+            logger.error(f"[待分析队列] 重放失败: {e}")
+        await asyncio.sleep(COZE_REPLAY_INTERVAL_SECONDS)
+
+
+def _write_upload(filename, content):
+    with open(os.path.join(media_dir, "uploads", filename), "wb") as f:
+        f.write(content)
+
+
+def _pdf_result_cacheable(pages, timing):
+    """有页面分析失败（含熔断 503）或超出页数上限被截断时不保存为幂等结果，重试时重新分析"""
+    return not timing["truncated"] and not any(page.get("error") for page in pages)
+
+
+async def analyze_pdf_pages(content: bytes, original_filename: Optional[str], file_id: str):
+    """PDF 按页栅格化后并发分析，每页保存为一条错题记录
+
+    页面渲染在进程池中进行，Coze 调用按 PDF_PAGE_CONCURRENCY 限制并发，
+    整份 PDF 的耗时约等于最慢一页（页数超过并发上限时按批次叠加）。
+    返回 (按页结果列表, 耗时统计)；PDF 损坏或加密时返回 400。
+    超过 PDF_MAX_PAGES 的部分不分析，耗时统计中 total_pages / truncated 标明截断情况。
+    """
+    started = time.perf_counter()
+    try:
+        page_images, total_pages = await rasterize_pdf(content)
+    except InvalidPDFError as e:
+        logger.warning(f"[PDF] {original_filename}: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    render_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(PDF_PAGE_CONCURRENCY)
+    stem = os.path.splitext(os.path.basename(original_filename or "upload.pdf"))[0]
+
+    async def analyze_page(page_index, page_content):
+        page_file_id = f"{file_id}-p{page_index + 1:03d}"
+        page_filename = f"{page_file_id}.jpg"
+        await asyncio.to_thread(_write_upload, page_filename, page_content)
+        loop.run_in_executor(None, generate_derivatives, media_dir, page_filename)
+
+        page = {
+            "page_index": page_index,
+            "source_file_id": file_id,
+            "file_id": page_file_id,
+            "filename": page_filename,
+            "file_url": f"/media/uploads/{page_filename}",
+            "file_size": len(page_content),
+            "file_type": "image/jpeg",
+            "upload_time": datetime.now().isoformat(),
+            "derivatives": derivative_urls(page_filename),
+        }
+        async with semaphore:
+            try:
+                coze_result, preprocess_stats = await call_coze_with_preprocess(
+                    page_content, f"{stem}-p{page_index + 1}.jpg")
+            except HTTPException as e:
+                logger.error(f"[PDF] 第 {page_index + 1} 页分析失败: {e.detail}")
+                page["error"] = e.detail
+                return page
+
+        analysis, practices = _normalize_coze_result(coze_result)
+        page.update({"coze_analysis": analysis, "practices": practices, "preprocess": preprocess_stats})
+        if DATABASE_AVAILABLE and (analysis or practices):
+            try:
+                page["mistake_record_id"] = await persist_mistake_record(page, analysis, practices)
+            except Exception as e:
+                logger.error(f"[PDF] 第 {page_index + 1} 页保存数据库失败: {e}")
+        return page
+
+    pages = await asyncio.gather(*(analyze_page(i, image) for i, image in enumerate(page_images)))
+    timing = {
+        "page_count": len(pages),
+        "total_pages": total_pages,
+        "truncated": len(pages) < total_pages,
+        "render_ms": render_ms,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    logger.info(f"[PDF] {original_filename}: {json.dumps(timing, ensure_ascii=False)}")
+    return list(pages), timing
+
+
+def _pdf_message(prefix, timing):
+    if timing["truncated"]:
+        return f"{prefix}，共 {timing['total_pages']} 页，超过上限只处理了前 {timing['page_count']} 页"
+    return f"{prefix}，共 {timing['page_count']} 页"
+
+
+def _flatten_pages(pages, key):
+    """合并各页的分析 / 类练习，并标注所在页"""
+    items = []
+    for page in pages:
+        for item in page.get(key) or []:
+            items.append({**item, "page_index": page["page_index"]} if isinstance(item, dict) else item)
+    return items
+
+
+def remember_upload_phash(image_phash, record_id, user_id=None):
+    """新错题记录入库后加入所属用户（缺省为当前用户）的感知哈希索引"""
+    if image_phash is None or not record_id:
+        return
+    try:
+        db = next(get_db())
+        get_phash_index(db, current_user_id() if user_id is None else user_id).add(to_unsigned(image_phash), record_id)
+    except Exception as e:
+        logger.error(f"更新感知哈希索引失败: {e}")
+
+
+def load_duplicate_result(record_id: int):
+    """读取近重复图片对应的已有错题记录、分析结果与类练习；读取失败时返回 None，按正常流程处理"""
+    try:
+        db = next(get_db())
+        mistake_record = db.query(MistakeRecord).filter(MistakeRecord.id == record_id).first()
+        if not mistake_record:
+            return None
+        analyses = db.query(MistakeAnalysis).filter(MistakeAnalysis.mistake_record_id == record_id).all()
+        practices = db.query(MistakePractice).filter(MistakePractice.mistake_record_id == record_id).all()
+    except Exception as e:
+        logger.error(f"读取近重复错题记录失败: {e}")
+        return None
+
+    return {
+        "record": mistake_record,
+        "analysis": [
+            {
+                "id": analysis.id,
+                "subject": analysis.subject or "",
+                "section": analysis.section or "",
+                "question": analysis.question or "",
+                "answer": analysis.answer or "",
+                "is_question": analysis.is_question,
+                "is_correct": analysis.is_correct,
+                "correct_answer": analysis.correct_answer or "",
+                "comment": analysis.comment or "",
+                "error_type": analysis.error_type,
+                "knowledge_point": analysis.knowledge_point,
+            }
+            for analysis in analyses
+        ],
+        "practices": [
+            {
+                "question": p.question or "",
+                "correct_answer": p.correct_answer or "",
+                "comment": p.comment or "",
+            }
+            for p in practices
+        ],
+    }
 
 
 
 @app.post("/upload/image")
 
-async def upload_image(image: UploadFile = File(...)):
+async def upload_image(image: UploadFile = File(...),
+                       idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+
+    """上传图片文件并进行处理
 
-    """上传图片文件并进行处理"""
+    带 Idempotency-Key 请求头时，有效期内（IDEMPOTENCY_TTL_SECONDS）相同键的重试直接返回首次的响应，
+    不重复保存文件、写错题记录和调用 Coze。
+    """
 
     
 
@@ -459,11 +1021,57 @@ async def upload_image(image: UploadFile = File(...)):
 
         )
 
+    if idempotency_key and DATABASE_AVAILABLE:
+        return await run_idempotent(
+            "upload/image", idempotency_key, content, image.filename,
+            lambda file_id: _process_upload_image(image, content, file_extension, file_id),
+            lambda file_id: recover_saved_result(file_id, "coze_analysis"),
+        )
+    result, _ = await _process_upload_image(image, content, file_extension)
+    return result
+
+
+async def _process_upload_image(image: UploadFile, content: bytes, file_extension: str, file_id: Optional[str] = None):
+    """上传图片的处理流程，返回 (响应, 是否可保存为幂等结果)；Coze 调用失败时不保存，重试重新分析"""
+
+    # 近重复检测（感知哈希）
+
+    image_phash, duplicate_of = await find_duplicate_upload(content)
+
+    if duplicate_of and PHASH_DUP_MODE == "short_circuit":
+
+        existing = load_duplicate_result(duplicate_of["mistake_record_id"])
+
+        if existing:
+
+            record = existing["record"]
+
+            logger.info(f"近重复图片直接复用错题记录 {record.id}，跳过 Coze 调用")
+
+            result = {
+                "status": "success",
+                "message": "检测到重复图片，已复用历史分析结果",
+                "file_id": record.file_id,
+                "filename": record.filename,
+                "file_url": record.file_url,
+                "upload_time": record.upload_time.isoformat() if record.upload_time else None,
+                "file_size": record.file_size,
+                "file_type": record.file_type,
+                "derivatives": derivative_urls(record.filename),
+                "coze_analysis": existing["analysis"],
+                "duplicate_of": duplicate_of,
+            }
+
+            if existing["practices"]:
+                result["practices"] = existing["practices"]
+
+            return result, True
+
     
 
     # 生成唯一文件名
 
-    file_id = str(uuid.uuid4())
+    file_id = file_id or str(uuid.uuid4())
 
     filename = f"{file_id}{file_extension}"
 
@@ -477,19 +1085,75 @@ async def upload_image(image: UploadFile = File(...)):
 
         f.write(content)
 
+    # 后台生成缩略图等衍生图（请求到达时若尚未生成会惰性补齐）
+    if derivative_urls(filename):
+        asyncio.get_running_loop().run_in_executor(None, generate_derivatives, media_dir, filename)
+
+    # 多页 PDF：逐页栅格化并发分析，每页一条错题记录
+    if file_extension == ".pdf" and PDF_SPLIT_ENABLED and pdf_split_available():
+        try:
+            pages, timing = await analyze_pdf_pages(content, image.filename, file_id)
+        except HTTPException:
+            os.remove(file_path)  # 损坏或加密的 PDF 不保留
+            raise
+        return {
+            "status": "success",
+            "message": _pdf_message("PDF 上传成功", timing),
+            "file_id": file_id,
+            "filename": filename,
+            "file_url": f"/media/uploads/{filename}",
+            "upload_time": datetime.now().isoformat(),
+            "file_size": len(content),
+            "file_type": image.content_type,
+            "coze_analysis": _flatten_pages(pages, "coze_analysis"),
+            "practices": _flatten_pages(pages, "practices"),
+            "pages": pages,
+            "pdf_timing": timing,
+        }, _pdf_result_cacheable(pages, timing)
+
     
 
     # 调用 Coze API 进行分析
 
+    preprocess_stats = None
+    coze_failed = False
+
     try:
 
-        coze_result = await call_coze_workflow(content, image.filename)
+        coze_result, preprocess_stats = await call_coze_with_preprocess(content, image.filename)
 
-    except HTTPException:
+    except CozeUnavailableError as e:
+
+        # 熔断中：文件已保存，加入待分析队列，恢复后自动分析
+        if not DATABASE_AVAILABLE:
+            raise
+        file_data = {
+            "file_id": file_id,
+            "filename": filename,
+            "file_url": f"/media/uploads/{filename}",
+            "upload_time": datetime.now().isoformat(),
+            "file_size": len(content),
+            "file_type": image.content_type,
+            "image_phash": image_phash,
+        }
+        queued = await queue_pending_analysis(file_data, image.filename, e)
+        file_data.pop("image_phash")
+        return {
+            "status": "queued",
+            "message": "分析服务暂不可用，图片已保存，将在服务恢复后自动分析",
+            **file_data,
+            "derivatives": derivative_urls(filename),
+            "coze_analysis": [],
+            **queued,
+        }, True
+
+    except HTTPException as e:
 
         # 如果 Coze API 调用失败，返回基础的上传信息
 
+        logger.warning(f"Coze 分析失败，仅返回上传信息: {e.status_code} {e.detail}")
         coze_result = None
+        coze_failed = True
 
     if coze_result is None:
         coze_result = {"analysis": [], "practices": []}
@@ -518,7 +1182,9 @@ async def upload_image(image: UploadFile = File(...)):
 
         "file_size": len(content),
 
-        "file_type": image.content_type
+        "file_type": image.content_type,
+
+        "derivatives": derivative_urls(filename)
 
     }
 
@@ -527,6 +1193,10 @@ async def upload_image(image: UploadFile = File(...)):
     result["coze_analysis"] = coze_analysis
     if practices:
         result["practices"] = practices
+    if duplicate_of:
+        result["duplicate_of"] = duplicate_of
+    if preprocess_stats:
+        result["preprocess"] = preprocess_stats
 
     # 保存数据到数据库
 
@@ -542,9 +1212,9 @@ async def upload_image(image: UploadFile = File(...)):
 
             
 
-            db = next(get_db())
+            record_id = await persist_mistake_record({**result, "image_phash": image_phash}, coze_analysis, practices)
 
-            record_id = save_mistake_record(db, result, coze_analysis, practices)
+            remember_upload_phash(image_phash, record_id)
 
             logger.info(f"数据保存成功！错题记录ID: {record_id}, 文件ID: {file_id}")
 
@@ -568,15 +1238,19 @@ async def upload_image(image: UploadFile = File(...)):
 
             logger.info("没有分析数据，跳过数据库保存")
 
-    return result
+    return result, not coze_failed
 
 
 
 @app.post("/analyze/image")
 
-async def analyze_image(image: UploadFile = File(...)):
+async def analyze_image(image: UploadFile = File(...),
+                        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
 
-    """直接分析图片，并保存到数据库"""
+    """直接分析图片，并保存到数据库
+
+    带 Idempotency-Key 请求头时，有效期内相同键的重试直接返回首次的响应（见 upload_image）。
+    """
 
     
 
@@ -616,11 +1290,78 @@ async def analyze_image(image: UploadFile = File(...)):
 
         )
 
-    
+    if idempotency_key and DATABASE_AVAILABLE:
+        return await run_idempotent(
+            "analyze/image", idempotency_key, content, image.filename,
+            lambda file_id: _process_analyze_image(image, content, file_extension, file_id),
+            lambda file_id: recover_saved_result(file_id, "analysis"),
+        )
+    result, _ = await _process_analyze_image(image, content, file_extension)
+    return result
+
+
+async def _process_analyze_image(image: UploadFile, content: bytes, file_extension: str, file_id: Optional[str] = None):
+    """分析图片的处理流程，返回 (响应, 是否可保存为幂等结果)；Coze 调用失败直接抛出 HTTPException"""
+
+    # 近重复检测（感知哈希）
+    image_phash, duplicate_of = await find_duplicate_upload(content)
+    if duplicate_of and PHASH_DUP_MODE == "short_circuit":
+        existing = load_duplicate_result(duplicate_of["mistake_record_id"])
+        if existing:
+            logger.info(f"[analyze/image] 近重复图片直接复用错题记录 {existing['record'].id}，跳过 Coze 调用")
+            return {
+                "status": "success",
+                "message": "检测到重复图片，已复用历史分析结果",
+                "analysis": existing["analysis"],
+                "practices": existing["practices"],
+                "analyze_time": datetime.now().isoformat(),
+                "mistake_record_id": existing["record"].id,
+                "duplicate_of": duplicate_of
+            }, True
+
+    # 多页 PDF：逐页栅格化并发分析，每页一条错题记录
+    if file_extension == ".pdf" and PDF_SPLIT_ENABLED and pdf_split_available():
+        pages, timing = await analyze_pdf_pages(content, image.filename, file_id or str(uuid.uuid4()))
+        return {
+            "status": "success",
+            "message": _pdf_message("PDF 分析完成", timing),
+            "analysis": _flatten_pages(pages, "coze_analysis"),
+            "practices": _flatten_pages(pages, "practices"),
+            "analyze_time": datetime.now().isoformat(),
+            "mistake_record_ids": [p["mistake_record_id"] for p in pages if p.get("mistake_record_id")],
+            "pages": pages,
+            "pdf_timing": timing,
+        }, _pdf_result_cacheable(pages, timing)
 
     # 调用 Coze API 进行分析
 
-    coze_result = await call_coze_workflow(content, image.filename)
+    try:
+        coze_result, preprocess_stats = await call_coze_with_preprocess(content, image.filename)
+    except CozeUnavailableError as e:
+        # 熔断中：保存文件并加入待分析队列，恢复后自动分析
+        if not DATABASE_AVAILABLE:
+            raise
+        file_id = file_id or str(uuid.uuid4())
+        filename = f"{file_id}{file_extension}"
+        with open(os.path.join(media_dir, "uploads", filename), "wb") as f:
+            f.write(content)
+        queued = await queue_pending_analysis({
+            "file_id": file_id,
+            "filename": filename,
+            "file_size": len(content),
+            "file_type": image.content_type,
+            "upload_time": datetime.now().isoformat(),
+            "image_phash": image_phash,
+        }, image.filename, e)
+        return {
+            "status": "queued",
+            "message": "分析服务暂不可用，图片已保存，将在服务恢复后自动分析",
+            "analysis": [],
+            "practices": [],
+            "analyze_time": datetime.now().isoformat(),
+            "file_id": file_id,
+            **queued,
+        }, True
 
     # ??? Coze ????,????????????
     if not coze_result:
@@ -632,7 +1373,7 @@ async def analyze_image(image: UploadFile = File(...)):
     practices = coze_result.get("practices", [])
 
     # 生成文件信息用于数据库保存
-    file_id = str(uuid.uuid4())
+    file_id = file_id or str(uuid.uuid4())
     filename = f"{file_id}{file_extension}"
 
     # 准备数据库保存数据
@@ -642,7 +1383,8 @@ async def analyze_image(image: UploadFile = File(...)):
         "file_url": f"/media/uploads/{filename}",
         "file_size": len(content),
         "file_type": image.content_type,
-        "upload_time": datetime.now().isoformat()
+        "upload_time": datetime.now().isoformat(),
+        "image_phash": image_phash
     }
 
     # 保存数据到数据库
@@ -658,9 +1400,9 @@ async def analyze_image(image: UploadFile = File(...)):
 
             
 
-            db = next(get_db())
+            record_id = await persist_mistake_record(file_data, coze_analysis, practices)
 
-            record_id = save_mistake_record(db, file_data, coze_analysis, practices)
+            remember_upload_phash(image_phash, record_id)
 
             logger.info(f"[analyze/image] 数据保存成功！错题记录ID: {record_id}, 文件ID: {file_id}")
 
@@ -696,6 +1438,9 @@ async def analyze_image(image: UploadFile = File(...)):
     # 若已保存到数据库，附加错题记录ID
     if DATABASE_AVAILABLE and coze_analysis:
         response_data["mistake_record_id"] = record_id
+    if duplicate_of:
+        response_data["duplicate_of"] = duplicate_of
+    response_data["preprocess"] = preprocess_stats
     
     # 组装类练习到返回结果（analyze 接口）
     try:
@@ -710,7 +1455,161 @@ async def analyze_image(image: UploadFile = File(...)):
     except Exception:
         pass
 
-    return response_data
+    return response_data, True
+
+
+# 流式分析统计；首题耗时保留最近 COZE_STREAM_METRIC_WINDOW 次，/metrics 中报告 p50 / p95
+stream_stats = {"streams": 0, "questions": 0, "errors": 0, "rebuilt": 0}
+first_question_samples = deque(maxlen=int(os.getenv("COZE_STREAM_METRIC_WINDOW", "500")))
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+
+def _save_stream_result(db, file_data, record_id, analyses, practices=(), replace=False):
+    """流式分析入库：首批题目到达时创建错题记录，之后追加；replace 时以最终结果替换已保存的题目"""
+    if record_id is None:
+        return add_mistake_record(db, file_data, analyses, list(practices))
+    if replace:
+        replace_mistake_analyses(db, record_id, analyses)
+    else:
+        add_mistake_analyses(db, record_id, analyses)
+    add_mistake_practices(db, record_id, list(practices))
+    return record_id
+
+
+async def _persist_stream_result(file_data, record_id, analyses, practices=(), replace=False):
+    """入库失败只记录日志（与 /analyze/image 一致），不中断推送"""
+    if not DATABASE_AVAILABLE or not (analyses or practices or replace):
+        return record_id
+    try:
+        record_id = await run_write(_save_stream_result, file_data, record_id, analyses, practices, replace)
+        router.mark_write()
+    except Exception as e:
+        logger.error(f"[analyze/stream] 保存数据到数据库失败: {e}")
+    return record_id
+
+
+async def _analyze_stream_events(content: bytes, filename: Optional[str], file_data: dict):
+    """调用 Coze 流式工作流，逐题推送并入库，产出 SSE 文本"""
+    started = time.perf_counter()
+    stream_stats["streams"] += 1
+    yield _sse("start", {"file_id": file_data["file_id"]})
+
+    questions = CozeQuestionStream()
+    timing = {}
+    record_id = None
+    try:
+        coze_content, coze_filename, _ = await preprocess_for_upload(content, filename)
+        async for node, text in stream_coze_workflow(coze_content, coze_filename, timings=timing):
+            arrived = questions.feed(text, node)
+            if not arrived:
+                continue
+            if "first_question_ms" not in timing:
+                timing["first_question_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                first_question_samples.append(timing["first_question_ms"])
+            first_index = len(questions.emitted) - len(arrived)
+            for offset, question in enumerate(arrived):
+                yield _sse("question", {"index": first_index + offset, "question": question})
+            stream_stats["questions"] += len(arrived)
+            record_id = await _persist_stream_result(file_data, record_id, arrived)
+
+        try:
+            result, consistent = questions.finish()
+        except CozePayloadError as e:
+            raise HTTPException(status_code=502, detail=str(e)) from e
+        analysis, practices = result["analysis"], result["practices"]
+        if consistent:
+            record_id = await _persist_stream_result(file_data, record_id, analysis[len(questions.emitted):], practices)
+        else:
+            # 逐题解析与完整解析不一致（如题目字段顺序特殊），以完整解析为准重写
+            stream_stats["rebuilt"] += 1
+            logger.warning(f"[analyze/stream] 逐题结果与完整结果不一致，按完整结果重写 {len(analysis)} 道题目")
+            record_id = await _persist_stream_result(file_data, record_id, analysis, practices,
+                                                     replace=record_id is not None)
+        remember_upload_phash(file_data.get("image_phash"), record_id, file_data["user_id"])
+    except HTTPException as e:
+        stream_stats["errors"] += 1
+        yield _sse("error", {"status_code": e.status_code, "detail": e.detail, "mistake_record_id": record_id})
+        return
+
+    timing["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"[analyze/stream] {file_data['file_id']}: {len(analysis)} 道题目，{json.dumps(timing)}")
+    yield _sse("done", {
+        "status": "success",
+        "analysis": analysis,
+        "practices": practices,
+        "mistake_record_id": record_id,
+        "timing": timing,
+    })
+
+
+def _duplicate_stream_events(existing, duplicate_of):
+    """近重复图片：直接推送已有的分析结果"""
+    yield _sse("start", {"file_id": existing["record"].file_id})
+    for index, question in enumerate(existing["analysis"]):
+        yield _sse("question", {"index": index, "question": question})
+    yield _sse("done", {
+        "status": "success",
+        "message": "检测到重复图片，已复用历史分析结果",
+        "analysis": existing["analysis"],
+        "practices": existing["practices"],
+        "mistake_record_id": existing["record"].id,
+        "duplicate_of": duplicate_of,
+    })
+
+
+@app.post("/analyze/image/stream")
+async def analyze_image_stream(image: UploadFile = File(...)):
+    """流式分析图片（Server-Sent Events）：每道题目解析完成立即推送并入库
+
+    事件：
+      - start：{"file_id"}
+      - question：{"index", "question"}，question 与 /analyze/image 返回的 analysis 元素结构相同
+      - done：{"analysis", "practices", "mistake_record_id", "timing"}；analysis 为完整解析的最终结果，
+        与逐题推送的内容不一致时以此为准；timing.first_question_ms 为首题耗时
+      - error：{"status_code", "detail", "mistake_record_id"}（出错前已推送的题目已入库）
+    仅支持图片；PDF 请使用 /analyze/image。
+    """
+    allowed_extensions = {'.jpg', '.jpeg', '.png'}
+    file_extension = os.path.splitext(image.filename)[1].lower()
+    if file_extension not in allowed_extensions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的文件格式。流式分析支持格式: {', '.join(allowed_extensions)}"
+        )
+    max_size = 10 * 1024 * 1024  # 10MB
+    content = await image.read()
+    if len(content) > max_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"文件大小超过限制。最大支持: {max_size // (1024*1024)}MB"
+        )
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    image_phash, duplicate_of = await find_duplicate_upload(content)
+    if duplicate_of and PHASH_DUP_MODE == "short_circuit":
+        existing = load_duplicate_result(duplicate_of["mistake_record_id"])
+        if existing:
+            logger.info(f"[analyze/stream] 近重复图片直接复用错题记录 {existing['record'].id}，跳过 Coze 调用")
+            return StreamingResponse(_duplicate_stream_events(existing, duplicate_of),
+                                     media_type="text/event-stream", headers=headers)
+
+    file_id = str(uuid.uuid4())
+    filename = f"{file_id}{file_extension}"
+    file_data = {
+        "file_id": file_id,
+        "filename": filename,
+        "file_url": f"/media/uploads/{filename}",
+        "file_size": len(content),
+        "file_type": image.content_type,
+        "upload_time": datetime.now().isoformat(),
+        "image_phash": image_phash,
+        "user_id": current_user_id() if DATABASE_AVAILABLE else None,  # 生成器在响应阶段执行，显式带上当前用户
+    }
+    return StreamingResponse(_analyze_stream_events(content, image.filename, file_data),
+                             media_type="text/event-stream", headers=headers)
 
 
 @app.get("/mistake/{mistake_id}")
@@ -725,11 +1624,12 @@ async def get_mistake_detail(mistake_id: int):
             detail="数据库不可用，无法查询错题详情"
         )
     
+    db = router.reader()
     try:
-        db = next(get_db())
         
         # 根据主键ID查询错题记录
-        mistake_record = db.query(MistakeRecord).filter(MistakeRecord.id == mistake_id).first()
+        mistake_record = db.query(MistakeRecord).filter(MistakeRecord.id == mistake_id,
+                                                         MistakeRecord.user_id == current_user_id()).first()
         
         if not mistake_record:
             raise HTTPException(
@@ -750,6 +1650,9 @@ async def get_mistake_detail(mistake_id: int):
                 "file_url": mistake_record.file_url,
                 "file_size": mistake_record.file_size,
                 "file_type": mistake_record.file_type,
+                "derivatives": derivative_urls(mistake_record.filename),
+                "source_file_id": mistake_record.source_file_id,
+                "page_index": mistake_record.page_index,
                 "upload_time": mistake_record.upload_time.isoformat() if mistake_record.upload_time else None,
                 "created_at": mistake_record.created_at.isoformat() if mistake_record.created_at else None
             },
@@ -825,6 +1728,8 @@ async def get_mistake_detail(mistake_id: int):
             status_code=500,
             detail=f"查询错题详情时发生错误: {str(e)}"
         )
+    finally:
+        db.close()
 
 
 @app.get("/mistakes")
@@ -832,16 +1737,25 @@ async def get_mistakes_list(
     subject: str = '',
     error_type: str = '',
     knowledge_point: str = '',
+    incorrect_only: bool = False,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    fields: str = '',
+    preview_chars: Optional[int] = None,
     skip: int = 0,
     limit: int = 100
 ):
     """错题本一览查询 API
-    支持按学科、按错误类型、按知识点查询（知识点支持模糊查询）
+    支持按学科、按错误类型、按知识点查询（知识点支持模糊查询），按最近创建倒序返回
     
     参数:
     - subject: 学科（如：数学、物理、化学等）
     - error_type: 错误类型（如：计算错误、概念不清等）
     - knowledge_point: 知识点（支持模糊查询）
+    - incorrect_only: 只返回做错的题
+    - date_from / date_to: 创建日期范围（YYYY-MM-DD，含首尾两天），指定后只扫描对应月份的分区
+    - fields: 只返回指定字段（逗号分隔，如 question,subject,file_info.derivatives），为空返回全部字段
+    - preview_chars: 题目、作答、正确答案、点评截断为预览的长度（默认 MISTAKE_LIST_PREVIEW_CHARS），0 表示返回全文
     - skip: 跳过的记录数（分页用）
     - limit: 返回的最大记录数（分页用）
     
@@ -854,72 +1768,42 @@ async def get_mistakes_list(
         )
     
     try:
-        db = next(get_db())
-        
-        # 构建查询
-        query = db.query(MistakeAnalysis).join(MistakeRecord)
-
-        logger.info(f"查询错题列表，初始记录数: {query.count()}")
-        
-        # 按学科查询
-        if subject:
-            query = query.filter(MistakeAnalysis.subject == subject)
-        
-        # 按错误类型查询
-        if error_type:
-            query = query.filter(MistakeAnalysis.error_type == error_type)
+        analysis_fields, file_fields = parse_mistake_list_fields(fields, file_extras=("derivatives",))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # 衍生图地址由文件名计算
+    query_file_fields = list(file_fields)
+    if "derivatives" in file_fields and "filename" not in file_fields:
+        query_file_fields.append("filename")
+
+    db = router.reader()
+    try:
         
-        # 按知识点查询（支持模糊查询）
-        if knowledge_point:
-            query = query.filter(MistakeAnalysis.knowledge_point.ilike(f"%{knowledge_point}%"))
+        # 构建查询（筛选组合与复合索引对应，见 MistakeAnalysis.__table_args__）
+        query = build_mistakes_query(db, subject, error_type, knowledge_point, incorrect_only,
+                                     date_from, date_to, current_user_id())
         
-        # 应用分页
-        total_count = query.count()
-        analysis_data = query.offset(skip).limit(limit).all()
+        # 按列投影查询当前页（一条 SQL，不加载 ORM 实体与 analysis_data 等大字段）
+        total_count = count_mistakes(query)
+        mistakes = select_mistakes_page(
+            query, analysis_fields, query_file_fields, skip, limit,
+            MISTAKE_LIST_PREVIEW_CHARS if preview_chars is None else preview_chars)
+        if "derivatives" in file_fields:
+            for item in mistakes:
+                file_info = item["file_info"]
+                filename = file_info["filename"] if "filename" in file_fields else file_info.pop("filename")
+                file_info["derivatives"] = derivative_urls(filename)
         
         # 构建响应数据
         response_data = {
             "total_count": total_count,
             "skip": skip,
             "limit": limit,
-            "mistakes": []
+            "mistakes": mistakes
         }
         
-        # 添加所有错题记录
-        for analysis in analysis_data:
-            mistake_record = analysis.mistake_record
-            
-            # 构建错题项
-            mistake_item = {
-                "mistake_record_id": mistake_record.id,
-                "file_info": {
-                    "file_id": mistake_record.file_id,
-                    "filename": mistake_record.filename,
-                    "file_url": mistake_record.file_url,
-                    "file_size": mistake_record.file_size,
-                    "file_type": mistake_record.file_type,
-                    "upload_time": mistake_record.upload_time.isoformat() if mistake_record.upload_time else None,
-                    "created_at": mistake_record.created_at.isoformat() if mistake_record.created_at else None
-                },
-                "analysis": {
-                    "id": analysis.id,
-                    "subject": analysis.subject,
-                    "section": analysis.section,
-                    "question": analysis.question,
-                    "answer": analysis.answer,
-                    "is_question": analysis.is_question,
-                    "is_correct": analysis.is_correct,
-                    "correct_answer": analysis.correct_answer,
-                    "comment": analysis.comment,
-                    "error_type": analysis.error_type,
-                    "knowledge_point": analysis.knowledge_point,
-                    "created_at": analysis.created_at.isoformat() if analysis.created_at else None
-                }
-            }
-            response_data["mistakes"].append(mistake_item)
-        
         logger.info(f"查询错题列表成功，总数: {total_count}, 返回: {len(response_data['mistakes'])} 条记录")
-        logger.info(f"查询条件: subject={subject}, error_type={error_type}, knowledge_point={knowledge_point}")
+        logger.info(f"查询条件: subject={subject}, error_type={error_type}, knowledge_point={knowledge_point}, incorrect_only={incorrect_only}")
 
         # 返回构造好的数据
         return response_data
@@ -932,10 +1816,391 @@ async def get_mistakes_list(
             status_code=500,
             detail=f"查询错题列表时发生错误: {str(e)}"
         )
+    finally:
+        db.close()
 
 
+@app.get("/mistakes/export")
+async def export_mistakes(
+    format: str = 'ndjson',
+    subject: str = '',
+    error_type: str = '',
+    knowledge_point: str = '',
+    incorrect_only: bool = False,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    """导出错题本（流式）
+    筛选参数与 /mistakes 相同，不分页，返回全部匹配的题目（全文，每道题一行）
 
+    参数:
+    - format: ndjson（默认）/ csv / parquet（需安装 pyarrow）
 
+    返回: 分块传输的文件，服务端按批读取（服务端游标）、按批编码，内存占用与总行数无关
+    """
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="数据库不可用，无法导出错题本")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}，可选 {', '.join(EXPORT_FORMATS)}")
+    if format == "parquet" and not is_parquet_available():
+        raise HTTPException(status_code=501, detail="服务端未安装 pyarrow，无法导出 Parquet")
+
+    columns = {name: column.type.python_type for name, column in MISTAKE_EXPORT_COLUMNS.items()}
+    user_id = current_user_id()  # 生成器在线程池中迭代，读不到请求的 contextvar
+
+    def stream():
+        # 同步生成器由 Starlette 在线程池中迭代，数据库读取不阻塞事件循环
+        db = router.reader()
+        rows = 0
+        started = time.perf_counter()
+        try:
+            query = build_mistakes_query(db, subject, error_type, knowledge_point, incorrect_only,
+                                         date_from, date_to, user_id)
+
+            def batches():
+                nonlocal rows
+                for batch in iter_mistake_export_batches(query):
+                    rows += len(batch)
+                    yield batch
+
+            yield from iter_export(format, columns, batches())
+            logger.info(f"导出错题本完成: format={format}, 行数={rows}, 耗时={time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            # 响应头已发出，只能中断传输
+            logger.error(f"导出错题本失败（已输出 {rows} 行）: {e}")
+            raise
+        finally:
+            db.close()
 
+    spec = EXPORT_FORMATS[format]
+    filename = f"mistakes-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{spec['extension']}"
+    return StreamingResponse(stream(), media_type=spec["media_type"],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 
+# 学习单 PDF 按内容哈希缓存；相同内容的并发请求只渲染一次
+sheet_cache = SheetCache()
+sheet_flight = SingleFlight("learning_sheet")
+
+
+@app.post("/export/learning_sheet")
+async def export_learning_sheet(
+    analysis_ids: list[int] = Body(..., embed=True),
+    title: str = Body("学习单", embed=True),
+    include_practices: bool = Body(True, embed=True),
+):
+    """导出学习单（PDF）：选中的错题（错题回顾 / 概念要点 / 常见坑）加上所属记录的类练习清单
+
+    PDF 在进程池中渲染，按内容哈希缓存，内容不变的重复导出直接返回缓存文件（响应头 X-Sheet-Cache: hit）。
+    """
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="数据库不可用，无法导出学习单")
+    if not sheet_export_available():
+        raise HTTPException(status_code=501, detail="服务端未安装 pymupdf，无法生成 PDF")
+    if not analysis_ids or len(analysis_ids) > SHEET_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"analysis_ids 应包含 1–{SHEET_MAX_ITEMS} 个错题ID")
+
+    db = router.reader()
+    try:
+        mistakes, practices = get_learning_sheet_items(db, analysis_ids, current_user_id(), include_practices)
+    finally:
+        db.close()
+    if not mistakes:
+        raise HTTPException(status_code=404, detail="未找到指定的错题")
+
+    markdown_text = build_sheet_markdown(mistakes, practices, title)
+    digest = sheet_digest(markdown_text)
+    path = sheet_cache.get(digest)
+    cached = path is not None
+    if not cached:
+        started = time.perf_counter()
+        try:
+            path, _ = await sheet_flight.do(digest, lambda: sheet_cache.render(digest, markdown_text))
+        except Exception as e:
+            logger.error(f"[学习单] 渲染失败: {e}")
+            raise HTTPException(status_code=500, detail=f"生成学习单时发生错误: {str(e)}")
+        logger.info(f"[学习单] {len(mistakes)} 道错题、{len(practices)} 道练习，渲染耗时 "
+                    f"{(time.perf_counter() - started) * 1000:.0f}ms")
+    return FileResponse(path, media_type="application/pdf", filename=f"learning_sheet-{digest[:12]}.pdf",
+                        headers={"X-Sheet-Cache": "hit" if cached else "miss", "ETag": f'"{digest}"'})
+
+
+def _rebuild_practice_pools_once():
+    db = SessionLocal()
+    try:
+        return rebuild_practice_pools(db, write=run_write_blocking)
+    finally:
+        db.close()
+
+
+async def refresh_practice_pools_periodically():
+    """后台定时重建类练习推荐池（在线程池中执行，不阻塞事件循环）"""
+    while True:
+        try:
+            pool_count, text_count = await asyncio.to_thread(_rebuild_practice_pools_once)
+            logger.info(f"类练习推荐池已刷新：练习池 {pool_count} 个，题干 {text_count} 条")
+        except Exception as e:
+            logger.error(f"刷新类练习推荐池失败: {e}")
+        await asyncio.sleep(PRACTICE_POOL_REFRESH_SECONDS)
+
+
+async def ensure_partitions_periodically():
+    """后台定时预建 mistake_analysis 的月份分区，避免新数据落入 DEFAULT 分区
+
+    过期分区的归档删除是破坏性操作，不在应用内执行，由 scripts/partition_maintenance.py 定时运行。
+    """
+    while True:
+        try:
+            created = await asyncio.to_thread(ensure_partitions_once, engine)
+            if created:
+                logger.info(f"已预建分区: {', '.join(created)}")
+        except Exception as e:
+            logger.error(f"预建分区失败: {e}")
+        await asyncio.sleep(PARTITION_MAINTENANCE_SECONDS)
+
+
+async def purge_idempotency_keys_periodically():
+    """后台定时删除过期的幂等键"""
+    while True:
+        try:
+            purged = await run_write(purge_expired_idempotency_keys)
+            if purged:
+                logger.info(f"[幂等] 已删除 {purged} 个过期的幂等键")
+        except Exception as e:
+            logger.error(f"[幂等] 删除过期幂等键失败: {e}")
+        await asyncio.sleep(IDEMPOTENCY_PURGE_SECONDS)
+
+
+@app.get("/practices/recommendations")
+async def get_practice_recommendations(
+    knowledge_point: str = '',
+    error_type: str = '',
+    limit: int = 10
+):
+    """相似练习推荐 API
+    从后台预计算的练习池中按（当前用户, 知识点, 错因）主键查询，不在请求时扫描 mistake_practices
+
+    参数:
+    - knowledge_point: 知识点（多个知识点以逗号分隔）
+    - error_type: 错误类型
+    - limit: 返回的最大练习数
+    """
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(
+            status_code=503,
+            detail="数据库不可用，无法查询推荐练习"
+        )
+    if not knowledge_point and not error_type:
+        raise HTTPException(
+            status_code=400,
+            detail="knowledge_point 与 error_type 至少需要提供一个"
+        )
+
+    try:
+        db = next(get_db())
+        practices = get_recommendations(db, knowledge_point, error_type, max(1, min(limit, 50)),
+                                        user_id=current_user_id())
+        return {
+            "knowledge_point": knowledge_point,
+            "error_type": error_type,
+            "practices": practices
+        }
+    except Exception as e:
+        logger.error(f"查询推荐练习失败: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"查询推荐练习时发生错误: {str(e)}"
+        )
+
+
+def _schedule_reviews_once():
+    db = SessionLocal()
+    try:
+        return schedule_reviews(db, write=run_write_blocking)
+    finally:
+        db.close()
+
+
+async def schedule_reviews_periodically():
+    """后台定时为新错题建复习卡片并记录当天复习计划（在线程池中执行，不阻塞事件循环）"""
+    while True:
+        try:
+            await asyncio.to_thread(_schedule_reviews_once)
+        except Exception as e:
+            logger.error(f"复习调度失败: {e}")
+        await asyncio.sleep(REVIEW_SCHEDULE_SECONDS)
+
+
+@app.get("/review/due")
+async def get_review_due(as_of: Optional[date] = None, skip: int = 0, limit: int = 50):
+    """今天（或 as_of 当天）到期的复习卡片
+
+    直接按 review_cards 的 (user_id, due_date, analysis_id) 索引范围扫描，不在请求时重新计算调度；
+    新错题由后台调度任务（REVIEW_SCHEDULE_SECONDS）建卡，建卡前不会出现在这里。
+    """
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="数据库不可用")
+    day = as_of or date.today()
+    db = SessionLocal()
+    try:
+        items = get_due_reviews(db, day, max(0, skip), max(1, min(limit, 200)), user_id=current_user_id())
+        total = count_due_review_cards(db, day, user_id=current_user_id())
+    except Exception as e:
+        logger.error(f"查询到期复习失败: {e}")
+        raise HTTPException(status_code=500, detail=f"查询到期复习时发生错误: {str(e)}")
+    finally:
+        db.close()
+    return {"date": day.isoformat(), "total": total, "items": items}
+
+
+@app.post("/review/{analysis_id}/grade")
+async def grade_review(analysis_id: int, grade: int = Body(..., embed=True, ge=0, le=5)):
+    """提交一次复习评分（0–5，SM-2：低于 3 分视为遗忘，次日重新复习），返回更新后的卡片"""
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="数据库不可用")
+    card = await run_write(grade_review_card, analysis_id, grade, None, current_user_id())
+    if card is None:
+        raise HTTPException(status_code=404, detail="复习卡片不存在")
+    router.mark_write()
+    return card
+
+
+@app.get("/pending-analyses/{job_id}")
+async def get_pending_analysis_status(job_id: int):
+    """查询熔断期间排队的分析任务：status 为 pending / done / failed，完成后返回 mistake_record_id"""
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="数据库不可用")
+    db = SessionLocal()
+    try:
+        job = get_pending_analysis(db, job_id)
+    finally:
+        db.close()
+    if job is None or job["user_id"] != current_user_id():
+        raise HTTPException(status_code=404, detail="待分析任务不存在")
+    return {key: job[key] for key in ("id", "file_id", "status", "attempts", "last_error", "mistake_record_id")}
+
+
+# 百度 OCR / ASR / TTS：结果按输入内容与参数缓存（内存 LRU + 磁盘），见 integration/baidu.py
+baidu = BaiduServices.from_env()
+BAIDU_AUDIO_FORMATS = {".wav": "wav", ".pcm": "pcm", ".amr": "amr", ".m4a": "m4a"}
+TTS_MAX_CHARS = 500
+
+
+async def _call_baidu(client, service, call):
+    """调用百度服务：未配置密钥返回 503，接口错误返回 502"""
+    if not client.configured:
+        raise HTTPException(status_code=503, detail=f"未配置百度{service}密钥")
+    try:
+        return await call()
+    except BaiduAPIError as e:
+        logger.error(f"[百度{service}] {e}")
+        raise HTTPException(status_code=502, detail=str(e))
+    except httpx.HTTPError as e:
+        logger.error(f"[百度{service}] 请求失败: {e}")
+        raise HTTPException(status_code=502, detail=f"百度{service}服务请求失败")
+
+
+@app.post("/ocr/run")
+async def run_ocr(image: UploadFile = File(...), kind: str = "handwriting"):
+    """识别图片中的文字（kind：handwriting 手写 / general_basic 通用 / accurate_basic 高精度 / formula 公式）
+
+    相同图片与参数的结果直接取缓存（响应中 cached 为 true），不重复调用百度接口。
+    """
+    if kind not in OCR_KINDS:
+        raise HTTPException(status_code=400, detail=f"不支持的识别类型: {kind}，可选 {', '.join(OCR_KINDS)}")
+    content = await image.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="图片为空")
+    lines, cached = await _call_baidu(baidu.ocr_client, "OCR", lambda: baidu.ocr(content, kind))
+    return {"kind": kind, "lines": lines, "text": "\n".join(lines), "cached": cached}
+
+
+@app.post("/voice/asr")
+async def run_asr(audio: UploadFile = File(...), rate: int = 16000):
+    """短语音识别（wav / pcm / amr / m4a，单声道，rate 为采样率 16000 或 8000），返回转写文本"""
+    audio_format = BAIDU_AUDIO_FORMATS.get(os.path.splitext(audio.filename or "")[1].lower())
+    if audio_format is None:
+        raise HTTPException(status_code=400, detail=f"不支持的音频格式，可选 {', '.join(BAIDU_AUDIO_FORMATS)}")
+    if rate not in (8000, 16000):
+        raise HTTPException(status_code=400, detail="采样率只支持 16000 或 8000")
+    content = await audio.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="音频为空")
+    transcript, cached = await _call_baidu(baidu.asr_client, "ASR", lambda: baidu.asr(content, audio_format, rate))
+    return {"transcript": transcript, "cached": cached}
+
+
+@app.post("/voice/tts")
+async def run_tts(
+    text: str = Body(..., embed=True),
+    person: int = Body(0, embed=True),
+    speed: int = Body(5, embed=True, ge=0, le=15),
+    aue: int = Body(3, embed=True),
+):
+    """语音合成，直接返回音频（aue：3 mp3 / 4、5 pcm / 6 wav）；响应头 X-Cache 为 hit / miss"""
+    text = text.strip()
+    if not text or len(text) > TTS_MAX_CHARS:
+        raise HTTPException(status_code=400, detail=f"文本长度应为 1–{TTS_MAX_CHARS} 个字符")
+    if aue not in TTS_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的音频格式: {aue}")
+    audio, cached = await _call_baidu(baidu.tts_client, "TTS",
+                                      lambda: baidu.tts(text, person=person, speed=speed, aue=aue))
+    return Response(audio, media_type=TTS_FORMATS[aue][1], headers={"X-Cache": "hit" if cached else "miss"})
+
+
+def _percentiles(samples):
+    values = list(samples)
+    if not values:
+        return {"count": 0, "p50": None, "p95": None}
+    if len(values) == 1:
+        return {"count": 1, "p50": values[0], "p95": values[0]}
+    cuts = statistics.quantiles(values, n=20, method="inclusive")
+    return {"count": len(values), "p50": round(cuts[9], 1), "p95": round(cuts[18], 1)}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """运行指标（进程内计数，重启清零）
+    - coze_singleflight: Coze 调用合并情况（calls 总请求数 / executions 实际调用数 / coalesced 被合并的请求数）
+    - coze_circuit: Coze 熔断器状态（closed / open / half_open）与调用、失败、拒绝次数
+    - coze_capture: 原始输出采集（COZE_CAPTURE_DIR）写入、重复跳过、超出上限与写入失败次数
+    - learning_sheet: 学习单缓存命中（hits）、渲染（renders）、淘汰（evicted）次数与渲染合并情况
+    - baidu_cache: 百度 OCR / ASR / TTS 结果缓存的内存 / 磁盘命中、未命中、过期、淘汰次数与命中率（hit_rate）
+    - pending_analyses: 熔断期间入队（queued）、重放完成（replayed）、重放失败待重试（retried）的任务数
+    - coze_stream: 流式分析次数、推送题目数、出错次数、按完整结果重写次数，以及首题耗时 p50 / p95（毫秒）
+    """
+    return {
+        "coze_singleflight": coze_flight.snapshot(),
+        "coze_circuit": coze_breaker.snapshot(),
+        "coze_capture": coze_capture.snapshot(),
+        "baidu_cache": baidu.snapshot(),
+        "learning_sheet": {**sheet_cache.snapshot(), "singleflight": sheet_flight.snapshot()},
+        "pending_analyses": replay_stats,
+        "coze_stream": {**stream_stats, "first_question_ms": _percentiles(first_question_samples)},
+    }
+
+
+@app.get("/stats")
+async def get_stats(limit: Optional[int] = None):
+    """错题统计 API
+    按学科 / 错因类型 / 知识点返回题目数与错题数，读取写入时增量维护的汇总表，
+    不扫描 mistake_analysis
+
+    参数:
+    - limit: 每个维度最多返回的条目数（按错题数降序），不传返回全部
+    """
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(
+            status_code=503,
+            detail="数据库不可用，无法查询统计数据"
+        )
+
+    try:
+        db = next(get_db())
+        return get_mistake_stats(db, limit=max(1, limit) if limit else None, user_id=current_user_id())
+    except Exception as e:
+        logger.error(f"查询统计数据失败: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"查询统计数据时发生错误: {str(e)}"
+        )
@@ -0,0 +1,20 @@
+"""CPU 密集任务共用的进程池
+
+图片预处理（core/vision/preprocess.py）、PDF 分页渲染（core/vision/pdf.py）和学习单排版
+（core/exporter/sheet.py）都是纯 CPU 计算。三者共用一个进程池，子进程总数由 CPU_POOL_WORKERS
+统一决定（默认 CPU 核数的一半），混合负载下不会因为各建一个池而超出核数。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+_executor = None
+
+
+def get_process_pool():
+    """获取共用进程池（首次调用时创建）"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS)
+    return _executor
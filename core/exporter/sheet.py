@@ -0,0 +1,228 @@
+"""学习单导出（Markdown → PDF）
+
+学习单由选中的错题及其类练习组成：错题回顾 / 概念要点（知识点）/ 常见坑（错因与点评）/ 练习清单。
+先按模板生成 Markdown，再转成简单的 HTML 交给 PyMuPDF 的 Story 排版为 A4 PDF；中文使用 MuPDF
+内置的 CJK 回退字体，输出前做字体子集化（否则每份 PDF 都会嵌入数 MB 的完整字体）。
+
+排版是纯 CPU 计算，在与图片预处理、PDF 渲染共用的进程池（core/cpu_pool.py，CPU_POOL_WORKERS）中执行，
+不占用事件循环、也不受 GIL 限制。
+渲染结果按 Markdown 内容的哈希缓存在 SHEET_CACHE_DIR（不在公开的 media 目录下）：内容相同直接返回
+已有文件；缓存文件数超过 SHEET_CACHE_MAX_FILES 时删除最久未使用的。Markdown 不含生成时间等易变
+内容，同一组错题总是得到同一个哈希。
+
+依赖 PyMuPDF（`pip install pymupdf`，可选）；未安装时 is_available() 为 False。
+"""
+import asyncio
+import hashlib
+import html
+import io
+import logging
+import os
+import re
+
+from core.cpu_pool import get_process_pool
+from core.vision.pdf import is_available  # noqa: F401  学习单同样只依赖 PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+SHEET_CACHE_DIR = os.getenv(
+    "SHEET_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data", "sheets"),
+)
+SHEET_CACHE_MAX_FILES = int(os.getenv("SHEET_CACHE_MAX_FILES", "1000"))
+SHEET_MAX_ITEMS = int(os.getenv("SHEET_MAX_ITEMS", "50"))  # 一份学习单最多包含的错题数
+
+PAGE_MARGIN = 50  # pt
+SHEET_CSS = """
+body { font-size: 11pt; line-height: 1.5; }
+h1 { font-size: 18pt; text-align: center; }
+h2 { font-size: 14pt; margin-top: 14pt; }
+h3 { font-size: 12pt; margin-top: 8pt; }
+li { margin-bottom: 2pt; }
+"""
+
+def _text(value):
+    """单行文本：合并空白，Markdown 中每个字段占一行"""
+    return " ".join(str(value).split()) if value else ""
+
+
+def build_sheet_markdown(mistakes, practices=(), title="学习单"):
+    """按模板生成学习单 Markdown
+
+    mistakes 为错题字典（question / answer / correct_answer / comment / subject / error_type / knowledge_point），
+    practices 为类练习字典（question / correct_answer / comment）。
+    """
+    lines = [f"# {_text(title) or '学习单'}", ""]
+
+    lines += ["## 错题回顾", ""]
+    for number, mistake in enumerate(mistakes, 1):
+        heading = " · ".join(filter(None, (_text(mistake.get("subject")), _text(mistake.get("knowledge_point")))))
+        lines.append(f"### {number}. {heading}" if heading else f"### {number}.")
+        lines.append(_text(mistake.get("question")) or "（无题干）")
+        if mistake.get("answer"):
+            lines.append(f"- 我的答案：{_text(mistake['answer'])}")
+        if mistake.get("correct_answer"):
+            lines.append(f"- 正确答案：{_text(mistake['correct_answer'])}")
+        if mistake.get("comment"):
+            lines.append(f"- 解析：{_text(mistake['comment'])}")
+        lines.append("")
+
+    points = {}
+    for mistake in mistakes:
+        for point in re.split(r"[,，、;；]", mistake.get("knowledge_point") or ""):
+            if point.strip():
+                points[point.strip()] = points.get(point.strip(), 0) + 1
+    if points:
+        lines += ["## 概念要点", ""]
+        lines += [f"- {point}（{count} 题）" for point, count in sorted(points.items(), key=lambda kv: -kv[1])]
+        lines.append("")
+
+    pitfalls = {}
+    for mistake in mistakes:
+        error_type = _text(mistake.get("error_type"))
+        if error_type:
+            pitfalls.setdefault(error_type, [])
+            if mistake.get("comment") and len(pitfalls[error_type]) < 3:
+                pitfalls[error_type].append(_text(mistake["comment"]))
+    if pitfalls:
+        lines += ["## 常见坑", ""]
+        for error_type, comments in pitfalls.items():
+            lines.append(f"- {error_type}" + (f"：{'；'.join(comments)}" if comments else ""))
+        lines.append("")
+
+    if practices:
+        lines += ["## 练习清单", ""]
+        lines += [f"{number}. {_text(practice.get('question'))}" for number, practice in enumerate(practices, 1)]
+        answers = [(number, practice) for number, practice in enumerate(practices, 1)
+                   if practice.get("correct_answer") or practice.get("comment")]
+        if answers:
+            lines += ["", "### 参考答案", ""]
+            for number, practice in answers:
+                answer = "；".join(filter(None, (_text(practice.get("correct_answer")), _text(practice.get("comment")))))
+                lines.append(f"- {number}. {answer}")  # 只列有答案的题，用无序列表保留原题号
+        lines.append("")
+    return "\n".join(lines)
+
+
+_HEADING = re.compile(r"^(#{1,3})\s+(.*)$")
+_BULLET = re.compile(r"^-\s+(.*)$")
+_ORDERED = re.compile(r"^\d+\.\s+(.*)$")
+
+
+def markdown_to_html(text):
+    """把 build_sheet_markdown 用到的 Markdown 子集（标题、无序 / 有序列表、段落）转成 HTML，内容全部转义"""
+    parts = []
+    list_tag = None
+    for line in text.splitlines():
+        line = line.rstrip()
+        heading = _HEADING.match(line)
+        bullet = _BULLET.match(line)
+        ordered = _ORDERED.match(line) if not heading else None
+        tag = "ul" if bullet else "ol" if ordered else None
+        if list_tag and tag != list_tag:
+            parts.append(f"</{list_tag}>")
+            list_tag = None
+        if heading:
+            level = len(heading.group(1))
+            parts.append(f"<h{level}>{html.escape(heading.group(2))}</h{level}>")
+        elif tag:
+            if list_tag is None:
+                parts.append(f"<{tag}>")
+                list_tag = tag
+            parts.append(f"<li>{html.escape((bullet or ordered).group(1))}</li>")
+        elif line:
+            parts.append(f"<p>{html.escape(line)}</p>")
+    if list_tag:
+        parts.append(f"</{list_tag}>")
+    return "\n".join(parts)
+
+
+def render_sheet_pdf(markdown_text):
+    """把学习单 Markdown 排版为 A4 PDF（在子进程中运行），返回 PDF 字节"""
+    import pymupdf
+
+    story = pymupdf.Story(html=markdown_to_html(markdown_text), user_css=SHEET_CSS)
+    buffer = io.BytesIO()
+    writer = pymupdf.DocumentWriter(buffer)
+    page = pymupdf.paper_rect("a4")
+    body = page + (PAGE_MARGIN, PAGE_MARGIN, -PAGE_MARGIN, -PAGE_MARGIN)
+    more = True
+    while more:
+        device = writer.begin_page(page)
+        more, _ = story.place(body)
+        story.draw(device)
+        writer.end_page()
+    writer.close()
+
+    with pymupdf.open(stream=buffer.getvalue(), filetype="pdf") as document:
+        document.subset_fonts()
+        return document.tobytes(garbage=3, deflate=True)
+
+
+def sheet_digest(markdown_text):
+    return hashlib.sha256(markdown_text.encode("utf-8")).hexdigest()
+
+
+async def render_sheet(markdown_text):
+    """在进程池中渲染学习单，返回 PDF 字节"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), render_sheet_pdf, markdown_text)
+
+
+class SheetCache:
+    """按内容哈希缓存渲染好的学习单；文件的修改时间即最近使用时间"""
+
+    def __init__(self, directory=SHEET_CACHE_DIR, max_files=SHEET_CACHE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self.stats = {"hits": 0, "renders": 0, "evicted": 0, "errors": 0}
+
+    def path(self, digest):
+        return os.path.join(self.directory, f"{digest}.pdf")
+
+    def get(self, digest):
+        """已缓存时返回文件路径（并刷新最近使用时间），否则返回 None"""
+        path = self.path(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        self.stats["hits"] += 1
+        return path
+
+    def put(self, digest, data):
+        """原子写入（先写临时文件再改名），返回文件路径"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(digest)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.stats["renders"] += 1
+        self.prune()
+        return path
+
+    def prune(self):
+        """文件数超过上限时删除最久未使用的缓存"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".pdf")]
+        except OSError:
+            return
+        excess = len(entries) - self.max_files
+        if excess <= 0:
+            return
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime)[:excess]:
+            try:
+                os.remove(entry.path)
+                self.stats["evicted"] += 1
+            except OSError as e:
+                self.stats["errors"] += 1
+                logger.warning(f"[学习单] 删除缓存 {entry.path} 失败: {e}")
+
+    async def render(self, digest, markdown_text):
+        """渲染并写入缓存，返回文件路径"""
+        data = await render_sheet(markdown_text)
+        return await asyncio.to_thread(self.put, digest, data)
+
+    def snapshot(self):
+        return {**self.stats, "directory": self.directory}
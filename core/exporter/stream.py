@@ -0,0 +1,129 @@
+"""错题本流式导出（NDJSON / CSV / Parquet）
+
+输入为按批次产生的行元组（见 db.crud.iter_mistake_export_batches），每处理完一批就产出
+一段字节，HTTP 层直接分块发送，内存占用只与批大小有关、与总行数无关。
+
+Parquet 依赖 pyarrow（`pip install pyarrow`，可选）；每批写成一个 row group，
+写完立即把缓冲区内容交给调用方，文件尾（元数据）在最后一批之后产出。
+"""
+import csv
+import io
+import json
+from datetime import date, datetime, timezone
+
+EXPORT_FORMATS = {
+    "ndjson": {"media_type": "application/x-ndjson", "extension": "ndjson"},
+    "csv": {"media_type": "text/csv; charset=utf-8", "extension": "csv"},
+    "parquet": {"media_type": "application/vnd.apache.parquet", "extension": "parquet"},
+}
+
+
+def is_parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def iter_ndjson(columns, batches):
+    """每行一个 JSON 对象"""
+    names = list(columns)
+    for batch in batches:
+        lines = [json.dumps(dict(zip(names, map(_json_value, row))), ensure_ascii=False) for row in batch]
+        if lines:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def iter_csv(columns, batches):
+    """CSV（带 UTF-8 BOM，Excel 直接打开中文不乱码）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(list(columns))
+    for batch in batches:
+        writer.writerows([_json_value(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的内存缓冲，供 ParquetWriter 写入，调用方按需取走已写入的字节"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+
+    types = {int: pa.int64(), bool: pa.bool_(), float: pa.float64(), datetime: pa.timestamp("us", tz="UTC"),
+             date: pa.date32()}
+    return pa.schema([(name, types.get(python_type, pa.string())) for name, python_type in columns.items()])
+
+
+def _arrow_value(value):
+    # 不带时区的时间按 UTC 处理（SQLite 存储的时间不带时区）
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def iter_parquet(columns, batches):
+    """Parquet，每批一个 row group"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for batch in batches:
+            if not batch:
+                continue
+            arrays = [pa.array([_arrow_value(value) for value in values], type=field.type)
+                      for values, field in zip(zip(*batch), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_export(fmt, columns, batches):
+    """按格式流式编码；columns 为 {列名: Python 类型}（Parquet 据此确定列类型）"""
+    if fmt == "ndjson":
+        return iter_ndjson(columns, batches)
+    if fmt == "csv":
+        return iter_csv(columns, batches)
+    if fmt == "parquet":
+        return iter_parquet(columns, batches)
+    raise ValueError(f"不支持的导出格式: {fmt}")
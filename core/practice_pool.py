@@ -0,0 +1,197 @@
+"""类练习推荐池
+
+后台任务定期扫描全部 mistake_practices，按（用户, 知识点, 错因）聚合出排序好的
+练习池写入 practice_pools；题干按规范化文本哈希去重后存入 practice_texts。
+推荐接口只需按主键取当前用户的一行练习池，再按主键取题干，不随数据量增长；
+每个用户只会拿到由自己的错题生成的练习。
+
+排序规则：同一练习在该键下出现的错题记录数（越常见越靠前），其次按最近出现时间。
+
+重建分两步：先在传入的会话上读取并聚合，再把新题干与练习池通过 write(fn, *args) 一次写入
+（SQLite 后端由 app 交给单写线程，聚合期间不持有写锁），默认在传入的会话上执行并提交。
+
+用法（也可由 app 启动时的后台任务定时执行）：
+  python core/practice_pool.py
+"""
+import hashlib
+import logging
+import os
+import re
+import sys
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_config import MistakeAnalysis, MistakePractice, PracticePool, PracticeText  # noqa: E402
+from db.tenancy import DEFAULT_USER_ID  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+PRACTICE_POOL_SIZE = int(os.getenv("PRACTICE_POOL_SIZE", "50"))
+PRACTICE_POOL_REFRESH_SECONDS = int(os.getenv("PRACTICE_POOL_REFRESH_SECONDS", "3600"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(text):
+    """规范化题干：去首尾空白、合并连续空白"""
+    return _WHITESPACE.sub(" ", (text or "").strip())
+
+
+def content_hash(question):
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+
+def split_knowledge_points(value):
+    """Coze 返回的知识点以逗号拼接，拆成单个知识点"""
+    if not value:
+        return []
+    return [p.strip() for p in re.split(r"[,，、]", value) if p.strip()]
+
+
+def pool_keys(knowledge_point, error_type):
+    """一条错题对应的练习池键：精确键 + 仅知识点 + 仅错因"""
+    error_type = (error_type or "").strip()
+    keys = set()
+    for point in split_knowledge_points(knowledge_point):
+        keys.add((point, error_type))
+        keys.add((point, ""))
+    if error_type:
+        keys.add(("", error_type))
+    return keys
+
+
+def rebuild_practice_pools(db, pool_size=PRACTICE_POOL_SIZE, batch_size=1000, write=None):
+    """全量重建练习池，返回 (练习池数, 去重后题干数)"""
+    # 每条错题记录对应的练习池键（只看判错的题），键带上记录所属用户
+    record_keys = defaultdict(set)
+    analyses = (db.query(MistakeAnalysis.mistake_record_id, MistakeAnalysis.user_id,
+                         MistakeAnalysis.knowledge_point, MistakeAnalysis.error_type)
+                .filter(MistakeAnalysis.is_correct.is_(False))
+                .yield_per(batch_size))
+    for record_id, user_id, knowledge_point, error_type in analyses:
+        record_keys[record_id].update((user_id, *key) for key in pool_keys(knowledge_point, error_type))
+
+    existing = dict(db.query(PracticeText.content_hash, PracticeText.id))
+    new_texts = {}
+    # (key) -> {content_hash: [记录集合, 最近出现时间]}
+    stats = defaultdict(dict)
+
+    practices = (db.query(MistakePractice.mistake_record_id, MistakePractice.question,
+                          MistakePractice.correct_answer, MistakePractice.comment,
+                          MistakePractice.created_at)
+                 .yield_per(batch_size))
+    for record_id, question, correct_answer, comment, created_at in practices:
+        if not normalize_question(question):
+            continue
+        keys = record_keys.get(record_id)
+        if not keys:
+            continue
+        digest = content_hash(question)
+        if digest not in existing and digest not in new_texts:
+            new_texts[digest] = {"content_hash": digest, "question": normalize_question(question),
+                                 "correct_answer": correct_answer, "comment": comment}
+        for key in keys:
+            entry = stats[key].setdefault(digest, [set(), created_at])
+            entry[0].add(record_id)
+            if created_at and (entry[1] is None or created_at > entry[1]):
+                entry[1] = created_at
+
+    db.rollback()  # 结束读事务，写入阶段不持有旧快照
+
+    ranked = {}
+    for key, entries in stats.items():
+        ordered = sorted(entries.items(),
+                         key=lambda item: (len(item[1][0]), item[1][1].timestamp() if item[1][1] else 0),
+                         reverse=True)
+        ranked[key] = [digest for digest, _ in ordered[:pool_size]]
+
+    try:
+        if write is None:
+            pool_count = _save_practice_pools(db, ranked, list(new_texts.values()), existing)
+            db.commit()
+        else:
+            pool_count = write(_save_practice_pools, ranked, list(new_texts.values()), existing)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"重建类练习推荐池失败: {e}")
+        raise
+
+    logger.info(f"类练习推荐池重建完成：练习池 {pool_count} 个，新增题干 {len(new_texts)} 条")
+    return pool_count, len(existing) + len(new_texts)
+
+
+def _save_practice_pools(db, ranked, new_texts, existing):
+    """写入新题干并整体替换练习池（不提交），返回练习池数"""
+    text_ids = dict(existing)
+    if new_texts:
+        texts = [PracticeText(**fields) for fields in new_texts]
+        db.add_all(texts)
+        db.flush()
+        text_ids.update({text.content_hash: text.id for text in texts})
+
+    db.query(PracticePool).delete(synchronize_session=False)
+    pools = [
+        {
+            "user_id": user_id,
+            "knowledge_point": knowledge_point,
+            "error_type": error_type,
+            "practice_ids": [text_ids[digest] for digest in digests],
+        }
+        for (user_id, knowledge_point, error_type), digests in ranked.items()
+    ]
+    if pools:
+        db.bulk_insert_mappings(PracticePool, pools)
+    return len(pools)
+
+
+def get_recommendations(db, knowledge_point="", error_type="", limit=10, user_id=DEFAULT_USER_ID):
+    """查询用户的推荐练习：按主键取练习池，精确键缺失时退化为仅知识点 / 仅错因"""
+    error_type = (error_type or "").strip()
+    points = split_knowledge_points(knowledge_point) or [""]
+
+    ranked_lists = []
+    for point in points:
+        candidates = [(point, error_type), (point, ""), ("", error_type)]
+        for key in candidates:
+            if key == ("", ""):
+                continue
+            pool = db.get(PracticePool, (user_id, *key))
+            if pool and pool.practice_ids:
+                ranked_lists.append(pool.practice_ids)
+                break
+
+    # 多个知识点时轮流取，保证每个知识点都有练习
+    practice_ids = []
+    for column in range(max((len(ids) for ids in ranked_lists), default=0)):
+        for ids in ranked_lists:
+            if column < len(ids) and ids[column] not in practice_ids:
+                practice_ids.append(ids[column])
+        if len(practice_ids) >= limit:
+            break
+    practice_ids = practice_ids[:limit]
+    if not practice_ids:
+        return []
+
+    texts = {t.id: t for t in db.query(PracticeText).filter(PracticeText.id.in_(practice_ids))}
+    return [
+        {
+            "id": texts[pid].id,
+            "question": texts[pid].question,
+            "correct_answer": texts[pid].correct_answer,
+            "comment": texts[pid].comment,
+        }
+        for pid in practice_ids if pid in texts
+    ]
+
+
+if __name__ == "__main__":
+    from db.database_config import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    session = SessionLocal()
+    try:
+        pool_count, text_count = rebuild_practice_pools(session)
+        print(f"练习池 {pool_count} 个，题干 {text_count} 条")
+    finally:
+        session.close()
@@ -0,0 +1,233 @@
+"""错题间隔复习调度（SM-2）
+
+每道判错的题目对应 review_cards 中的一张卡片，保存 SM-2 状态与下次复习日期 due_date。
+卡片表本身就是到期队列：“今天要复习什么”是 (user_id, due_date, analysis_id) 索引上的一次范围扫描，
+请求时不重新计算调度；调度只在作答评分时按 SM-2 更新单张卡片。
+
+后台批处理（也可由 app 启动时的后台任务定时执行）按 id 区间分批：
+- 为新出现的错题建卡（INSERT ... SELECT + NOT EXISTS，在数据库内完成，不逐条加载到 Python）
+- 删除对应分析记录已不存在的卡片
+- 把当天的到期数写入 review_plans（每天一行，user_id 为空），作为每日复习计划的记录
+每批一个事务，数百万张卡片也不会长时间持有锁。写事务经由调用方传入的 write(fn, *args) 执行
+（SQLite 后端由 app 交给单写线程，与请求写入串行），默认在传入的会话上执行并提交。
+
+用法：
+  python core/review_scheduler.py
+"""
+import logging
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import Date, Float, Integer, delete, exists, func, insert, literal, select
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.models import MistakeAnalysis, ReviewCard, ReviewPlan  # noqa: E402
+from db.tenancy import DEFAULT_USER_ID  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+REVIEW_SCHEDULE_SECONDS = int(os.getenv("REVIEW_SCHEDULE_SECONDS", "3600"))
+REVIEW_SCHEDULE_BATCH_SIZE = int(os.getenv("REVIEW_SCHEDULE_BATCH_SIZE", "10000"))
+REVIEW_FIRST_INTERVAL_DAYS = int(os.getenv("REVIEW_FIRST_INTERVAL_DAYS", "1"))  # 新错题首次复习间隔
+
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+PASSING_GRADE = 3  # 0–5 分，低于 3 分视为遗忘
+DAILY_PLAN_NAME = "每日复习"
+
+
+def sm2(repetitions, interval_days, ease, grade):
+    """SM-2：根据本次评分（0–5）返回新的 (repetitions, interval_days, ease, 是否遗忘)"""
+    if not 0 <= grade <= 5:
+        raise ValueError("评分应在 0–5 之间")
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    if grade < PASSING_GRADE:
+        return 0, 1, ease, True
+    if repetitions == 0:
+        interval_days = 1
+    elif repetitions == 1:
+        interval_days = 6
+    else:
+        interval_days = max(1, round(interval_days * ease))
+    return repetitions + 1, interval_days, ease, False
+
+
+def _id_ranges(db, column, batch_size):
+    upper = db.execute(select(func.max(column))).scalar() or 0
+    db.rollback()  # 结束读事务，批处理期间不持有旧快照
+    for start in range(0, upper, batch_size):
+        yield start, start + batch_size
+
+
+def _committing_write(db):
+    """默认的 write：在 db 上执行 fn(db, *args) 并提交"""
+    def write(fn, *args):
+        try:
+            result = fn(db, *args)
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+    return write
+
+
+def _create_cards_in_range(db, start, end, due_date):
+    candidates = (
+        select(MistakeAnalysis.id, MistakeAnalysis.user_id, literal(due_date, Date), literal(0, Integer),
+               literal(INITIAL_EASE, Float), literal(0, Integer), literal(0, Integer))
+        .where(
+            MistakeAnalysis.id > start,
+            MistakeAnalysis.id <= end,
+            MistakeAnalysis.is_correct.is_(False),
+            MistakeAnalysis.is_question.isnot(False),
+            ~exists().where(ReviewCard.analysis_id == MistakeAnalysis.id),
+        )
+    )
+    result = db.execute(insert(ReviewCard).from_select(
+        ["analysis_id", "user_id", "due_date", "interval_days", "ease", "repetitions", "lapses"], candidates))
+    return max(result.rowcount or 0, 0)
+
+
+def _remove_orphans_in_range(db, start, end):
+    result = db.execute(delete(ReviewCard).where(
+        ReviewCard.analysis_id > start,
+        ReviewCard.analysis_id <= end,
+        ~exists().where(MistakeAnalysis.id == ReviewCard.analysis_id),
+    ))
+    return max(result.rowcount or 0, 0)
+
+
+def create_review_cards(db, today=None, batch_size=REVIEW_SCHEDULE_BATCH_SIZE, write=None):
+    """为还没有卡片的错题建卡，首次复习日期为 today + REVIEW_FIRST_INTERVAL_DAYS；返回新建卡片数"""
+    write = write or _committing_write(db)
+    due_date = (today or date.today()) + timedelta(days=REVIEW_FIRST_INTERVAL_DAYS)
+    created = 0
+    for start, end in _id_ranges(db, MistakeAnalysis.id, batch_size):
+        created += write(_create_cards_in_range, start, end, due_date)
+    return created
+
+
+def remove_orphan_review_cards(db, batch_size=REVIEW_SCHEDULE_BATCH_SIZE, write=None):
+    """删除分析记录已不存在（如流式分析按完整结果重写）的卡片；返回删除数"""
+    write = write or _committing_write(db)
+    removed = 0
+    for start, end in _id_ranges(db, ReviewCard.analysis_id, batch_size):
+        removed += write(_remove_orphans_in_range, start, end)
+    return removed
+
+
+def _due_filter(today, user_id):
+    conditions = [ReviewCard.due_date <= (today or date.today())]
+    if user_id is not None:
+        conditions.insert(0, ReviewCard.user_id == user_id)
+    return conditions
+
+
+def count_due_review_cards(db, today=None, user_id=DEFAULT_USER_ID):
+    """到期卡片数；user_id 为 None 时统计全部用户（每日复习计划）"""
+    return db.execute(select(func.count()).select_from(ReviewCard).where(*_due_filter(today, user_id))).scalar()
+
+
+def _record_daily_plan(db, today, created, removed):
+    """写入当天的复习计划（每天一行，重复执行时覆盖），返回到期卡片数"""
+    due = count_due_review_cards(db, today, user_id=None)
+    scheduled_date = datetime.combine(today, datetime.min.time())
+    db.query(ReviewPlan).filter(ReviewPlan.user_id.is_(None), ReviewPlan.plan_name == DAILY_PLAN_NAME,
+                                ReviewPlan.scheduled_date == scheduled_date).delete(synchronize_session=False)
+    db.add(ReviewPlan(plan_name=DAILY_PLAN_NAME, scheduled_date=scheduled_date, plan_data={
+        "due": due,
+        "new_cards": created,
+        "removed_cards": removed,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+    }))
+    db.flush()
+    return due
+
+
+def schedule_reviews(db, today=None, batch_size=REVIEW_SCHEDULE_BATCH_SIZE, write=None):
+    """批处理一次：建卡、清理失效卡片、记录当天复习计划；返回统计信息
+
+    db 只用于读取 id 区间；每批写入通过 write(fn, *args) 执行，fn 以 (session, *args) 调用且不自行提交。
+    """
+    today = today or date.today()
+    write = write or _committing_write(db)
+    try:
+        created = create_review_cards(db, today, batch_size, write)
+        removed = remove_orphan_review_cards(db, batch_size, write)
+        due = write(_record_daily_plan, today, created, removed)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"复习调度失败: {e}")
+        raise
+
+    logger.info(f"复习调度完成：新建卡片 {created} 张，清理 {removed} 张，{today} 到期 {due} 张")
+    return {"date": today.isoformat(), "new_cards": created, "removed_cards": removed, "due": due}
+
+
+def get_due_reviews(db, today=None, skip=0, limit=50, user_id=DEFAULT_USER_ID):
+    """查询用户的到期卡片（due_date <= today），按 (user_id, due_date, analysis_id) 索引顺序分页，附带题目内容"""
+    rows = db.execute(
+        select(ReviewCard, MistakeAnalysis.mistake_record_id, MistakeAnalysis.subject, MistakeAnalysis.question,
+               MistakeAnalysis.correct_answer, MistakeAnalysis.knowledge_point, MistakeAnalysis.error_type)
+        .join(MistakeAnalysis, MistakeAnalysis.id == ReviewCard.analysis_id)
+        .where(*_due_filter(today, user_id))
+        .order_by(ReviewCard.due_date, ReviewCard.analysis_id)
+        .offset(skip)
+        .limit(limit)
+    )
+    return [
+        {
+            **_card_dict(card),
+            "mistake_record_id": mistake_record_id,
+            "subject": subject,
+            "question": question,
+            "correct_answer": correct_answer,
+            "knowledge_point": knowledge_point,
+            "error_type": error_type,
+        }
+        for card, mistake_record_id, subject, question, correct_answer, knowledge_point, error_type in rows
+    ]
+
+
+def _card_dict(card):
+    return {
+        "analysis_id": card.analysis_id,
+        "due_date": card.due_date.isoformat(),
+        "interval_days": card.interval_days,
+        "ease": round(card.ease, 2),
+        "repetitions": card.repetitions,
+        "lapses": card.lapses,
+        "last_grade": card.last_grade,
+        "last_reviewed_at": card.last_reviewed_at.isoformat() if card.last_reviewed_at else None,
+    }
+
+
+def grade_review_card(db, analysis_id, grade, today=None, user_id=DEFAULT_USER_ID):
+    """记录一次复习评分并按 SM-2 更新卡片（只 flush，由调用方提交）；卡片不存在或不属于该用户时返回 None"""
+    card = db.get(ReviewCard, analysis_id)
+    if card is None or card.user_id != user_id:
+        return None
+    today = today or date.today()
+    card.repetitions, card.interval_days, card.ease, lapsed = sm2(card.repetitions, card.interval_days,
+                                                                   card.ease, grade)
+    if lapsed:
+        card.lapses += 1
+    card.due_date = today + timedelta(days=card.interval_days)
+    card.last_grade = grade
+    card.last_reviewed_at = datetime.now(timezone.utc)
+    db.flush()
+    return _card_dict(card)
+
+
+if __name__ == "__main__":
+    from db.database_config import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    session = SessionLocal()
+    try:
+        print(schedule_reviews(session))
+    finally:
+        session.close()
@@ -0,0 +1,126 @@
+"""上传图片近重复检测（感知哈希）
+
+同一页作业换个角度再拍一次，感知哈希（pHash）的汉明距离通常只有个位数。
+HammingIndex 使用多索引哈希（multi-index hashing）：把 64 位哈希切成
+max_distance + 1 段，由抽屉原理，距离不超过 max_distance 的两个哈希至少有
+一段完全相同，因此只需在每段的哈希表里取同桶候选，再精确计算汉明距离。
+每个桶用紧凑数组存储，候选校验用 numpy 向量化 popcount，百万级图片下单次
+查询在亚毫秒级（max_distance 越大，每段位数越少、桶越大，查询越慢）。
+"""
+import io
+import logging
+import os
+import threading
+from array import array
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PHASH_DUP_DISTANCE = int(os.getenv("PHASH_DUP_DISTANCE", "6"))
+PHASH_DUP_MODE = os.getenv("PHASH_DUP_MODE", "flag")  # flag: 仅标记；short_circuit: 直接复用已有分析
+HASH_BITS = 64
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(values):
+        return np.bitwise_count(values)
+else:  # numpy < 2.0
+    _BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _BYTE_POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def compute_phash(content):
+    """计算图片 64 位 pHash（无符号整数）；无法解码（如 PDF）时返回 None"""
+    try:
+        import imagehash
+        from PIL import Image
+
+        with Image.open(io.BytesIO(content)) as image:
+            return int(str(imagehash.phash(image)), 16)
+    except Exception as e:
+        logger.info(f"无法计算图片感知哈希，跳过近重复检测: {e}")
+        return None
+
+
+def to_signed(value):
+    """无符号 64 位 -> BIGINT 可存储的有符号整数"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class HammingIndex:
+    """64 位哈希的多索引汉明距离索引"""
+
+    def __init__(self, max_distance=PHASH_DUP_DISTANCE):
+        self.max_distance = max_distance
+        num_chunks = min(max_distance + 1, HASH_BITS)
+        base, extra = divmod(HASH_BITS, num_chunks)
+        self._chunks = []  # (shift, mask)
+        shift = 0
+        for i in range(num_chunks):
+            width = base + (1 if i < extra else 0)
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+        # 每段一个哈希表：段值 -> (哈希数组, 记录ID数组)
+        self._tables = [dict() for _ in self._chunks]
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def add(self, value, record_id):
+        with self._lock:
+            for table, (shift, mask) in zip(self._tables, self._chunks):
+                bucket = table.get((value >> shift) & mask)
+                if bucket is None:
+                    bucket = table[(value >> shift) & mask] = (array("Q"), array("q"))
+                bucket[0].append(value)
+                bucket[1].append(record_id)
+            self.size += 1
+
+    def search(self, value, max_distance=None):
+        """返回距离最近的 (record_id, distance)；没有近重复时返回 None"""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        best = None
+        query = np.uint64(value)
+        # 持锁期间桶数组不会扩容，可以安全地零拷贝读取
+        with self._lock:
+            for table, (shift, mask) in zip(self._tables, self._chunks):
+                bucket = table.get((value >> shift) & mask)
+                if bucket is None:
+                    continue
+                distances = _popcount(np.frombuffer(bucket[0], dtype=np.uint64) ^ query)
+                idx = int(distances.argmin())
+                distance = int(distances[idx])
+                if distance <= max_distance and (best is None or distance < best[1]):
+                    best = (bucket[1][idx], distance)
+                    if distance == 0:
+                        break
+        return best
+
+
+_indexes = {}  # user_id -> HammingIndex
+_index_lock = threading.Lock()
+
+
+def get_phash_index(db, user_id=0):
+    """进程内按用户划分的索引（只在本人的错题中查重），首次使用时从该用户的 mistake_records.image_phash 加载"""
+    index = _indexes.get(user_id)
+    if index is not None:
+        return index
+    with _index_lock:
+        if user_id not in _indexes:
+            from db.database_config import MistakeRecord
+
+            index = HammingIndex()
+            rows = (db.query(MistakeRecord.id, MistakeRecord.image_phash)
+                    .filter(MistakeRecord.user_id == user_id, MistakeRecord.image_phash.isnot(None))
+                    .yield_per(10000))
+            for record_id, phash in rows:
+                index.add(to_unsigned(phash), record_id)
+            logger.info(f"用户 {user_id} 的感知哈希索引加载完成，共 {index.size} 条")
+            _indexes[user_id] = index
+    return _indexes[user_id]
@@ -0,0 +1,83 @@
+"""PDF 分页栅格化
+
+多页作业 PDF 整体上传 Coze 往往失败或得到一大坨结果。这里先把 PDF 按页渲染
+成 JPEG：页码按进程数切成连续区间，每个子进程只打开一次文档、渲染自己那段，
+渲染结果再交给上层按页并发分析。进程池与图片预处理、学习单排版共用（core/cpu_pool.py）。
+
+依赖 PyMuPDF（`pip install pymupdf`，可选）；未安装时 is_available() 为 False，
+上层退化为整份 PDF 直接上传。损坏或加密的 PDF 抛出 InvalidPDFError。
+"""
+import asyncio
+import logging
+import os
+
+from core.cpu_pool import CPU_POOL_WORKERS, get_process_pool
+
+logger = logging.getLogger(__name__)
+
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "150"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+PDF_PAGE_CONCURRENCY = int(os.getenv("PDF_PAGE_CONCURRENCY", "8"))  # 同时分析的页数上限
+PDF_JPEG_QUALITY = int(os.getenv("PDF_JPEG_QUALITY", "85"))
+
+class InvalidPDFError(ValueError):
+    """PDF 损坏或已加密，无法渲染"""
+
+
+def is_available():
+    """是否安装了 PyMuPDF（PDF 分页与学习单导出共用）"""
+    try:
+        import pymupdf  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def count_pages(content):
+    """返回 PDF 页数；无法打开或需要密码时抛出 InvalidPDFError"""
+    import pymupdf
+
+    try:
+        document = pymupdf.open(stream=content, filetype="pdf")
+    except Exception as e:
+        raise InvalidPDFError(f"无法解析 PDF 文件: {e}") from e
+    with document:
+        if document.needs_pass:
+            raise InvalidPDFError("PDF 文件已加密，请上传未加密的文件")
+        return document.page_count
+
+
+def render_pages(content, page_indexes, dpi=PDF_RENDER_DPI, quality=PDF_JPEG_QUALITY):
+    """渲染指定页（在子进程中运行），返回与 page_indexes 对应的 JPEG 字节列表"""
+    import pymupdf
+
+    images = []
+    with pymupdf.open(stream=content, filetype="pdf") as document:
+        for index in page_indexes:
+            pixmap = document[index].get_pixmap(dpi=dpi, colorspace=pymupdf.csRGB, alpha=False)
+            images.append(pixmap.tobytes("jpeg", jpg_quality=quality))
+    return images
+
+
+async def rasterize_pdf(content, dpi=PDF_RENDER_DPI, max_pages=PDF_MAX_PAGES):
+    """在进程池中渲染 PDF，返回 (按页顺序排列的 JPEG 字节列表, PDF 总页数)
+
+    最多渲染前 max_pages 页；总页数大于列表长度即表示结果被截断。
+    """
+    loop = asyncio.get_running_loop()
+    total_pages = await loop.run_in_executor(None, count_pages, content)
+    page_count = min(total_pages, max_pages)
+    if page_count < total_pages:
+        logger.warning(f"PDF 共 {total_pages} 页，超过上限 {max_pages}，只处理前 {max_pages} 页")
+    if page_count == 0:
+        return [], total_pages
+
+    executor = get_process_pool()
+    chunk_count = min(CPU_POOL_WORKERS, page_count)
+    chunk_size = -(-page_count // chunk_count)
+    chunks = [list(range(start, min(start + chunk_size, page_count)))
+              for start in range(0, page_count, chunk_size)]
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor, render_pages, content, chunk, dpi) for chunk in chunks
+    ))
+    return [image for chunk_images in results for image in chunk_images], total_pages
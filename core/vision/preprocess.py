@@ -0,0 +1,177 @@
+"""上传前图像预处理（CPU）
+
+手机拍摄的作业照片通常 4–8MB，直接上传 Coze 既慢又占带宽。预处理流程：
+  灰度化 → 按目标 DPI 缩放 → 纠偏（deskew）→（可选）自适应阈值二值化 → 重新编码为 JPEG/WebP
+
+二值化默认关闭（PREPROCESS_BINARIZE=1 开启）：浅色铅笔字迹、批改痕迹会被阈值抹掉，影响模型识别。
+
+处理在进程池（与 PDF 渲染、学习单排版共用，见 core/cpu_pool.py）中执行，不占用 API 事件循环；结果按「原图内容 + 参数」的
+SHA-256 缓存到磁盘（读写缓存文件在线程池中执行），同一张图重复上传直接命中。PDF 等无法解码的文件原样返回。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from core.cpu_pool import get_process_pool
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_CONFIG = {
+    "enabled": os.getenv("IMAGE_PREPROCESS_ENABLED", "1") == "1",
+    "target_dpi": int(os.getenv("PREPROCESS_TARGET_DPI", "150")),
+    "page_inches": float(os.getenv("PREPROCESS_PAGE_INCHES", "11.69")),  # A4 长边
+    "format": os.getenv("PREPROCESS_FORMAT", "jpeg"),  # jpeg / webp
+    "quality": int(os.getenv("PREPROCESS_QUALITY", "80")),
+    "binarize": os.getenv("PREPROCESS_BINARIZE", "0") == "1",
+    "deskew": os.getenv("PREPROCESS_DESKEW", "1") == "1",
+    "max_skew_degrees": float(os.getenv("PREPROCESS_MAX_SKEW", "15")),
+    "cache_dir": os.getenv(
+        "PREPROCESS_CACHE_DIR",
+        os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                     "data", "cache", "preprocess"),
+    ),
+}
+
+# 参与缓存键计算的参数（改动任一项都会产生新的缓存）
+_OPTION_KEYS = ("target_dpi", "page_inches", "format", "quality", "binarize", "deskew", "max_skew_degrees")
+
+def _estimate_skew(gray, max_skew_degrees):
+    """基于前景像素最小外接矩形估计倾斜角（度），超出范围时视为无法判断"""
+    import cv2
+    import numpy as np
+
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    coords = np.column_stack(np.where(mask > 0))[:, ::-1].astype(np.float32)
+    if len(coords) < 100:
+        return 0.0
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    return angle if abs(angle) <= max_skew_degrees else 0.0
+
+
+def preprocess_image(content, options):
+    """执行预处理（在子进程中运行），返回 (输出字节, 处理信息)；无法解码时返回 (None, 信息)"""
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None, {"reason": "无法解码图片"}
+
+    info = {"original_size": [int(image.shape[1]), int(image.shape[0])]}
+
+    # 按目标 DPI 缩放（只缩小不放大）
+    max_long_edge = int(options["target_dpi"] * options["page_inches"])
+    long_edge = max(image.shape[:2])
+    if long_edge > max_long_edge:
+        scale = max_long_edge / long_edge
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    if options["deskew"]:
+        angle = _estimate_skew(image, options["max_skew_degrees"])
+        if abs(angle) >= 0.3:
+            h, w = image.shape[:2]
+            matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+            image = cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_REPLICATE)
+        info["skew_degrees"] = round(float(angle), 2)
+
+    if options["binarize"]:
+        image = cv2.adaptiveThreshold(image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                      cv2.THRESH_BINARY, 31, 15)
+
+    if options["format"] == "webp":
+        ok, encoded = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, options["quality"]])
+    else:
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, options["quality"],
+                                                   cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    if not ok:
+        return None, {"reason": "图片编码失败"}
+
+    info["processed_size"] = [int(image.shape[1]), int(image.shape[0])]
+    return encoded.tobytes(), info
+
+
+def _cache_path(content, options):
+    key_source = json.dumps({k: options[k] for k in _OPTION_KEYS}, sort_keys=True).encode("utf-8")
+    digest = hashlib.sha256(hashlib.sha256(content).digest() + key_source).hexdigest()
+    extension = "webp" if options["format"] == "webp" else "jpg"
+    return os.path.join(options["cache_dir"], digest[:2], f"{digest}.{extension}")
+
+
+def _read_cache(path):
+    """读取缓存文件，不存在时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_cache(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+async def preprocess_for_upload(content, filename, config=None):
+    """上传 Coze 前的预处理入口
+
+    返回 (待上传字节, 待上传文件名, 统计信息)。预处理关闭、文件不是图片、
+    处理失败或处理后反而更大时返回原始内容。
+    """
+    options = dict(PREPROCESS_CONFIG if config is None else config)
+    stats = {
+        "applied": False,
+        "cache_hit": False,
+        "original_bytes": len(content),
+        "processed_bytes": len(content),
+        "bytes_saved": 0,
+        "preprocess_ms": 0.0,
+    }
+    if not options["enabled"] or (filename or "").lower().endswith(".pdf"):
+        return content, filename, stats
+
+    started = time.perf_counter()
+    cache_path = _cache_path(content, options)
+    processed = await asyncio.to_thread(_read_cache, cache_path)
+    if processed is not None:
+        stats["cache_hit"] = True
+    else:
+        try:
+            loop = asyncio.get_running_loop()
+            processed, info = await loop.run_in_executor(get_process_pool(), preprocess_image, content, options)
+            stats.update(info)
+        except Exception as e:
+            logger.error(f"[预处理] 图片预处理失败，使用原图上传: {e}")
+            processed = None
+        if processed is not None:
+            try:
+                await asyncio.to_thread(_write_cache, cache_path, processed)
+            except OSError as e:
+                logger.warning(f"[预处理] 写入缓存失败: {e}")
+    stats["preprocess_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    if processed is None or len(processed) >= len(content):
+        return content, filename, stats
+
+    extension = ".webp" if options["format"] == "webp" else ".jpg"
+    stem = os.path.splitext(os.path.basename(filename or "upload"))[0]
+    stats.update({
+        "applied": True,
+        "processed_bytes": len(processed),
+        "bytes_saved": len(content) - len(processed),
+    })
+    logger.info(
+        f"[预处理] {filename}: {len(content)} -> {len(processed)} 字节，"
+        f"节省 {stats['bytes_saved']} 字节，耗时 {stats['preprocess_ms']}ms，缓存命中={stats['cache_hit']}"
+    )
+    return processed, f"{stem}{extension}", stats
@@ -0,0 +1,637 @@
+"""数据访问函数（PostgreSQL 与 SQLite 共用，均以会话为参数）"""
+import logging
+import os
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
+
+from db.models import IdempotencyKey, MistakeAnalysis, MistakePractice, MistakeRecord, MistakeStatsRollup, PendingAnalysis
+from db.tenancy import DEFAULT_USER_ID
+
+logger = logging.getLogger(__name__)
+
+
+def add_mistake_record(db, file_data, analysis_data=None, practices_data=None):
+    """在当前事务中写入错题记录、分析结果与类练习（不提交），返回错题记录ID
+
+    file_data["user_id"] 为所属用户，缺省为 DEFAULT_USER_ID；分析结果与类练习沿用记录的 user_id。
+    """
+    # 创建错题记录
+    mistake_record = MistakeRecord(
+        user_id=file_data.get("user_id", DEFAULT_USER_ID),
+        file_id=file_data.get("file_id"),
+        filename=file_data.get("filename"),
+        file_url=file_data.get("file_url"),
+        file_size=file_data.get("file_size"),
+        file_type=file_data.get("file_type"),
+        image_phash=file_data.get("image_phash"),
+        source_file_id=file_data.get("source_file_id"),
+        page_index=file_data.get("page_index"),
+        upload_time=datetime.fromisoformat(file_data.get("upload_time")) if file_data.get("upload_time") else None
+    )
+    
+    db.add(mistake_record)
+    db.flush()  # 获取生成的ID
+    logger.info(f"✅ 错题记录创建成功，记录ID: {mistake_record.id}")
+    
+    add_mistake_analyses(db, mistake_record.id, analysis_data)
+    add_mistake_practices(db, mistake_record.id, practices_data)
+    return mistake_record.id
+
+
+def _record_user_id(db, mistake_record_id):
+    # 刚写入的记录在会话的 identity map 中，不会再查询数据库
+    return db.get(MistakeRecord, mistake_record_id).user_id
+
+
+def add_mistake_analyses(db, mistake_record_id, analysis_data):
+    """在当前事务中为错题记录追加分析结果，并增量更新统计汇总（不提交）"""
+    # 保存分析结果
+    if analysis_data:
+        user_id = _record_user_id(db, mistake_record_id)
+        logger.info(f"📊 开始保存分析数据，共 {len(analysis_data)} 条记录")
+        for i, analysis in enumerate(analysis_data):
+            mistake_analysis = MistakeAnalysis(
+                user_id=user_id,
+                mistake_record_id=mistake_record_id,
+                subject=analysis.get("subject"),  # 保存学科字段
+                section=analysis.get("section"),
+                question=analysis.get("question"),
+                answer=analysis.get("answer"),
+                is_question=analysis.get("is_question", True),
+                is_correct=analysis.get("is_correct", False),
+                correct_answer=analysis.get("correct_answer"),
+                comment=analysis.get("comment"),
+                error_type=analysis.get("error_type"),
+                knowledge_point=analysis.get("knowledge_point"),
+                analysis_data=analysis
+            )
+            db.add(mistake_analysis)
+            logger.info(f"📋 分析记录 {i+1}: subject={analysis.get('subject')}, section={analysis.get('section')}, question={(analysis.get('question') or '')[:50]}...")
+    
+        # 增量更新统计汇总（与明细同一事务提交）
+        upsert_stats_rollup(db, stats_rollup_deltas(analysis_data), user_id)
+
+
+def add_mistake_practices(db, mistake_record_id, practices_data):
+    """在当前事务中为错题记录追加类练习（不提交）"""
+    # 保存类练习（如果有）
+    if practices_data:
+        user_id = _record_user_id(db, mistake_record_id)
+        for p in practices_data:
+            mp = MistakePractice(
+                user_id=user_id,
+                mistake_record_id=mistake_record_id,
+                question=p.get("question"),
+                correct_answer=p.get("correct_answer"),
+                comment=p.get("comment"),
+            )
+            db.add(mp)
+
+
+def replace_mistake_analyses(db, mistake_record_id, analysis_data):
+    """用新的分析结果替换错题记录已有的分析结果，统计汇总同步扣减 / 累加（不提交）"""
+    existing = db.query(MistakeAnalysis).filter(MistakeAnalysis.mistake_record_id == mistake_record_id).all()
+    deltas = stats_rollup_deltas([
+        {"is_question": a.is_question, "is_correct": a.is_correct, "subject": a.subject,
+         "error_type": a.error_type, "knowledge_point": a.knowledge_point}
+        for a in existing
+    ])
+    upsert_stats_rollup(db, {key: [-total, -incorrect] for key, (total, incorrect) in deltas.items()},
+                        _record_user_id(db, mistake_record_id))
+    for analysis in existing:
+        db.delete(analysis)
+    db.flush()
+    add_mistake_analyses(db, mistake_record_id, analysis_data)
+
+
+def save_mistake_record(db, file_data, analysis_data=None, practices_data=None):
+    """保存错题记录和分析结果"""
+    try:
+        logger.info(f"📝 开始保存错题记录到数据库...")
+        logger.info(f"📁 文件信息: file_id={file_data.get('file_id')}, filename={file_data.get('filename')}, size={file_data.get('file_size')}")
+
+        record_id = add_mistake_record(db, file_data, analysis_data, practices_data)
+
+        db.commit()
+        logger.info(f"🎉 数据库保存完成！错题记录ID: {record_id}, 分析记录数: {len(analysis_data or [])}, 类练习数: {len(practices_data or [])}")
+        return record_id
+        
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ 保存错题记录失败: {e}")
+        logger.error(f"❌ 错误详情: {str(e)}")
+        raise
+
+def get_mistake_records(db, skip: int = 0, limit: int = 100):
+    """获取错题记录列表"""
+    return db.query(MistakeRecord).offset(skip).limit(limit).all()
+
+def get_mistake_analysis_by_file_id(db, file_id: str):
+    """根据文件ID获取错题分析"""
+    mistake_record = db.query(MistakeRecord).filter(MistakeRecord.file_id == file_id).first()
+    if mistake_record:
+        return db.query(MistakeAnalysis).filter(MistakeAnalysis.mistake_record_id == mistake_record.id).all()
+    return []
+
+def build_mistakes_query(db, subject=None, error_type=None, knowledge_point=None, incorrect_only=False,
+                         date_from=None, date_to=None, user_id=None):
+    """错题本一览查询：按最近创建倒序（created_at DESC, id DESC），与复合索引顺序一致
+
+    user_id 为当前用户（接口总是传入，复合索引以 user_id 开头；None 仅供脚本查询全部数据）。
+    date_from / date_to 为日期（含首尾两天），PostgreSQL 分区表下只扫描命中的月份分区。
+    """
+    query = db.query(MistakeAnalysis).join(MistakeRecord)
+    if user_id is not None:
+        query = query.filter(MistakeAnalysis.user_id == user_id)
+    if date_from:
+        query = query.filter(MistakeAnalysis.created_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        query = query.filter(
+            MistakeAnalysis.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    if subject:
+        query = query.filter(MistakeAnalysis.subject == subject)
+    if error_type:
+        query = query.filter(MistakeAnalysis.error_type == error_type)
+    if knowledge_point:
+        # 前后模糊匹配无法使用 B-Tree，PostgreSQL 下由 pg_trgm GIN 索引支持
+        query = query.filter(MistakeAnalysis.knowledge_point.ilike(f"%{knowledge_point}%"))
+    if incorrect_only:
+        # 写成 = false 而不是 IS false，才能匹配部分索引的 WHERE 条件
+        query = query.filter(MistakeAnalysis.is_correct == False)  # noqa: E712
+    return query.order_by(MistakeAnalysis.created_at.desc(), MistakeAnalysis.id.desc())
+
+# 错题本一览可返回的字段（fields 参数的取值范围）；不加载 analysis_data 等大字段
+MISTAKE_LIST_ANALYSIS_COLUMNS = {
+    "id": MistakeAnalysis.id,
+    "subject": MistakeAnalysis.subject,
+    "section": MistakeAnalysis.section,
+    "question": MistakeAnalysis.question,
+    "answer": MistakeAnalysis.answer,
+    "is_question": MistakeAnalysis.is_question,
+    "is_correct": MistakeAnalysis.is_correct,
+    "correct_answer": MistakeAnalysis.correct_answer,
+    "comment": MistakeAnalysis.comment,
+    "error_type": MistakeAnalysis.error_type,
+    "knowledge_point": MistakeAnalysis.knowledge_point,
+    "created_at": MistakeAnalysis.created_at,
+}
+MISTAKE_LIST_FILE_COLUMNS = {
+    "file_id": MistakeRecord.file_id,
+    "filename": MistakeRecord.filename,
+    "file_url": MistakeRecord.file_url,
+    "file_size": MistakeRecord.file_size,
+    "file_type": MistakeRecord.file_type,
+    "source_file_id": MistakeRecord.source_file_id,
+    "page_index": MistakeRecord.page_index,
+    "upload_time": MistakeRecord.upload_time,
+    "created_at": MistakeRecord.created_at,
+}
+# 一览中截断为预览的长文本字段（完整内容见 /mistake/{id}）
+MISTAKE_LIST_PREVIEW_FIELDS = ("question", "answer", "correct_answer", "comment")
+MISTAKE_LIST_PREVIEW_CHARS = int(os.getenv("MISTAKE_LIST_PREVIEW_CHARS", "120"))
+
+
+def parse_mistake_list_fields(fields=None, file_extras=()):
+    """解析 fields 参数（逗号分隔），返回 (analysis 字段列表, file_info 字段列表)
+
+    取值为 analysis.<字段>、file_info.<字段> 或分组名 analysis / file_info，不带前缀的字段名视为
+    analysis 字段；file_extras 为调用方自行计算的 file_info 字段（如 derivatives）。
+    为空时返回全部字段；analysis.id 总是返回。未知字段抛出 ValueError。
+    """
+    all_analysis = list(MISTAKE_LIST_ANALYSIS_COLUMNS)
+    all_file = list(MISTAKE_LIST_FILE_COLUMNS) + list(file_extras)
+    if not fields or not fields.strip():
+        return all_analysis, all_file
+    analysis_fields, file_fields = {"id"}, set()
+    for name in (part.strip() for part in fields.split(",")):
+        if not name:
+            continue
+        group, _, field = name.rpartition(".")
+        if name == "analysis":
+            analysis_fields.update(all_analysis)
+        elif name == "file_info":
+            file_fields.update(all_file)
+        elif group in ("", "analysis") and field in MISTAKE_LIST_ANALYSIS_COLUMNS:
+            analysis_fields.add(field)
+        elif group == "file_info" and field in all_file:
+            file_fields.add(field)
+        else:
+            raise ValueError(f"未知字段: {name}")
+    # 保持固定的字段顺序
+    return ([f for f in all_analysis if f in analysis_fields], [f for f in all_file if f in file_fields])
+
+
+def count_mistakes(query):
+    """统计 build_mistakes_query 的结果数（去掉排序，只 COUNT 主键）"""
+    return query.order_by(None).with_entities(func.count(MistakeAnalysis.id)).scalar()
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def select_mistakes_page(query, analysis_fields, file_fields, skip=0, limit=100,
+                         preview_chars=MISTAKE_LIST_PREVIEW_CHARS):
+    """按列投影查询一页错题（一条 SQL，不加载 ORM 实体），返回与 /mistakes 响应项结构相同的字典列表
+
+    长文本在数据库端截取 preview_chars + 1 个字符，超出部分以"…"结尾；preview_chars 为 0 时返回全文。
+    file_fields 中不在 MISTAKE_LIST_FILE_COLUMNS 里的字段（调用方计算的字段）会被忽略。
+    """
+    columns = [MistakeAnalysis.mistake_record_id.label("mistake_record_id")]
+    for name in analysis_fields:
+        column = MISTAKE_LIST_ANALYSIS_COLUMNS[name]
+        if preview_chars > 0 and name in MISTAKE_LIST_PREVIEW_FIELDS:
+            column = func.substr(column, 1, preview_chars + 1)
+        columns.append(column.label(f"a_{name}"))
+    file_columns = [name for name in file_fields if name in MISTAKE_LIST_FILE_COLUMNS]
+    columns.extend(MISTAKE_LIST_FILE_COLUMNS[name].label(f"f_{name}") for name in file_columns)
+
+    items = []
+    for row in query.with_entities(*columns).offset(skip).limit(limit):
+        mapping = row._mapping
+        analysis = {}
+        for name in analysis_fields:
+            value = mapping[f"a_{name}"]
+            if (preview_chars > 0 and name in MISTAKE_LIST_PREVIEW_FIELDS and value
+                    and len(value) > preview_chars):
+                value = value[:preview_chars] + "…"
+            analysis[name] = _iso(value)
+        items.append({
+            "mistake_record_id": mapping["mistake_record_id"],
+            "file_info": {name: _iso(mapping[f"f_{name}"]) for name in file_columns},
+            "analysis": analysis,
+        })
+    return items
+
+
+# 导出的列（扁平结构，每道题一行），取值为全文
+MISTAKE_EXPORT_COLUMNS = {
+    "mistake_record_id": MistakeAnalysis.mistake_record_id,
+    "analysis_id": MistakeAnalysis.id,
+    "file_id": MistakeRecord.file_id,
+    "filename": MistakeRecord.filename,
+    "file_url": MistakeRecord.file_url,
+    "upload_time": MistakeRecord.upload_time,
+    "subject": MistakeAnalysis.subject,
+    "section": MistakeAnalysis.section,
+    "question": MistakeAnalysis.question,
+    "answer": MistakeAnalysis.answer,
+    "is_question": MistakeAnalysis.is_question,
+    "is_correct": MistakeAnalysis.is_correct,
+    "correct_answer": MistakeAnalysis.correct_answer,
+    "comment": MistakeAnalysis.comment,
+    "error_type": MistakeAnalysis.error_type,
+    "knowledge_point": MistakeAnalysis.knowledge_point,
+    "created_at": MistakeAnalysis.created_at,
+}
+MISTAKE_EXPORT_BATCH_SIZE = int(os.getenv("MISTAKE_EXPORT_BATCH_SIZE", "5000"))
+
+
+def iter_mistake_export_batches(query, batch_size=MISTAKE_EXPORT_BATCH_SIZE):
+    """按批次逐步读取 build_mistakes_query 的全部结果（每批为行元组列表，列顺序同 MISTAKE_EXPORT_COLUMNS）
+
+    使用 yield_per：PostgreSQL 下为服务端游标，内存占用与总行数无关。
+    """
+    statement = query.with_entities(*MISTAKE_EXPORT_COLUMNS.values()).statement
+    result = query.session.execute(statement, execution_options={"yield_per": batch_size})
+    try:
+        for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+    finally:
+        result.close()
+
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# 租约应长于一次请求的最长处理时间（Coze 工作流 + 入库），过期未完成视为处理中途崩溃
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "300"))
+
+
+def _utc(value):
+    # SQLite 读出的时间不带时区，按 UTC 处理
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _idempotency_dict(record):
+    return {
+        "scope": record.scope,
+        "key": record.key,
+        "resource_id": record.resource_id,
+        "status": record.status,
+        "attempt": record.attempt,
+        "status_code": record.status_code,
+        "response": record.response,
+        "lease_expires_at": _utc(record.lease_expires_at),
+    }
+
+
+def claim_idempotency_key(db, scope, key, request_hash, resource_id, now=None,
+                          lease_seconds=None, ttl_seconds=None):
+    """处理请求前登记幂等键（不提交），返回 (状态, 幂等键信息)
+
+    状态：
+      - acquired：首次出现，已写入 in_progress 标记，由当前请求处理
+      - taken_over：上次处理的租约已过期（中途崩溃），由当前请求接管，resource_id 沿用上次的值
+      - completed：已处理完成，直接返回保存的响应
+      - in_progress：另一个请求正在处理
+      - mismatch：同一个键已用于内容不同的请求
+    """
+    now = now or datetime.now(timezone.utc)
+    lease = timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS if lease_seconds is None else lease_seconds)
+    ttl = timedelta(seconds=IDEMPOTENCY_TTL_SECONDS if ttl_seconds is None else ttl_seconds)
+
+    # 会话可能长期复用（SQLite 单写线程），始终以数据库中的值为准
+    record = db.get(IdempotencyKey, (scope, key), populate_existing=True)
+    if record is not None and _utc(record.expires_at) <= now:
+        db.delete(record)
+        db.flush()
+        record = None
+    if record is None:
+        record = IdempotencyKey(scope=scope, key=key, request_hash=request_hash, resource_id=resource_id,
+                                status="in_progress", attempt=1, lease_expires_at=now + lease,
+                                expires_at=now + ttl)
+        try:
+            with db.begin_nested():
+                db.add(record)
+            return "acquired", _idempotency_dict(record)
+        except IntegrityError:
+            # 并发的相同请求先写入了标记
+            record = db.get(IdempotencyKey, (scope, key), populate_existing=True)
+            if record is None:
+                raise
+
+    if record.request_hash != request_hash:
+        return "mismatch", _idempotency_dict(record)
+    if record.status == "completed":
+        return "completed", _idempotency_dict(record)
+    if _utc(record.lease_expires_at) > now:
+        return "in_progress", _idempotency_dict(record)
+
+    # 以 attempt 作为乐观锁，多个重试同时到达时只有一个能接管
+    result = db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key,
+               IdempotencyKey.status == "in_progress", IdempotencyKey.attempt == record.attempt)
+        .values(attempt=record.attempt + 1, lease_expires_at=now + lease, expires_at=now + ttl)
+        .execution_options(synchronize_session=False)
+    )
+    record = db.get(IdempotencyKey, (scope, key), populate_existing=True)
+    if result.rowcount != 1:
+        return ("completed" if record.status == "completed" else "in_progress"), _idempotency_dict(record)
+    logger.warning(f"[幂等] {scope} 键 {key} 上次处理未完成（租约已过期），第 {record.attempt} 次尝试接管")
+    return "taken_over", _idempotency_dict(record)
+
+
+def complete_idempotency_key(db, scope, key, attempt, status_code, response, now=None, ttl_seconds=None):
+    """保存处理结果（不提交）；只有持有该次 attempt 的请求能写入，返回是否成功"""
+    now = now or datetime.now(timezone.utc)
+    ttl = timedelta(seconds=IDEMPOTENCY_TTL_SECONDS if ttl_seconds is None else ttl_seconds)
+    result = db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.attempt == attempt)
+        .values(status="completed", status_code=status_code, response=response,
+                lease_expires_at=None, expires_at=now + ttl)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def release_idempotency_key(db, scope, key, attempt):
+    """处理失败时删除标记（不提交），下次重试重新处理"""
+    result = db.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.attempt == attempt)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def purge_expired_idempotency_keys(db, now=None):
+    """删除已过期的幂等键（不提交），返回删除行数"""
+    now = now or datetime.now(timezone.utc)
+    result = db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now)
+                        .execution_options(synchronize_session=False))
+    return result.rowcount or 0
+
+
+PENDING_ANALYSIS_LEASE_SECONDS = int(os.getenv("PENDING_ANALYSIS_LEASE_SECONDS", "600"))
+PENDING_ANALYSIS_MAX_ATTEMPTS = int(os.getenv("PENDING_ANALYSIS_MAX_ATTEMPTS", "5"))
+
+_PENDING_ANALYSIS_FIELDS = ("file_id", "filename", "original_filename", "file_type", "file_size", "image_phash",
+                            "upload_time", "user_id")
+
+
+def _pending_analysis_dict(job):
+    return {
+        "id": job.id,
+        **{field: getattr(job, field) for field in _PENDING_ANALYSIS_FIELDS},
+        "status": job.status,
+        "attempts": job.attempts,
+        "last_error": job.last_error,
+        "mistake_record_id": job.mistake_record_id,
+    }
+
+
+def enqueue_pending_analysis(db, file_data, now=None):
+    """加入待分析队列（不提交），返回队列ID；同一个 file_id 只入队一次"""
+    existing = db.query(PendingAnalysis).filter(PendingAnalysis.file_id == file_data["file_id"]).first()
+    if existing:
+        return existing.id
+    job = PendingAnalysis(**{field: file_data.get(field) for field in _PENDING_ANALYSIS_FIELDS
+                             if file_data.get(field) is not None},
+                          status="pending", attempts=0, available_at=now or datetime.now(timezone.utc))
+    db.add(job)
+    db.flush()
+    return job.id
+
+
+def claim_pending_analysis(db, now=None, lease_seconds=None):
+    """领取一条到期的待分析任务（不提交）：attempts 加一并推后 available_at，返回任务信息，没有则返回 None"""
+    now = now or datetime.now(timezone.utc)
+    lease = timedelta(seconds=PENDING_ANALYSIS_LEASE_SECONDS if lease_seconds is None else lease_seconds)
+    job = (
+        db.query(PendingAnalysis)
+        .filter(PendingAnalysis.status == "pending", PendingAnalysis.available_at <= now)
+        .order_by(PendingAnalysis.available_at, PendingAnalysis.id)
+        .with_for_update(skip_locked=True)
+        .populate_existing()
+        .first()
+    )
+    if job is None:
+        return None
+    job.attempts += 1
+    job.available_at = now + lease
+    db.flush()
+    return _pending_analysis_dict(job)
+
+
+def complete_pending_analysis(db, job_id, mistake_record_id=None):
+    """标记任务完成（不提交）"""
+    db.execute(update(PendingAnalysis).where(PendingAnalysis.id == job_id)
+               .values(status="done", mistake_record_id=mistake_record_id, last_error=None)
+               .execution_options(synchronize_session=False))
+
+
+def retry_pending_analysis(db, job_id, error, delay_seconds, count_attempt=True, now=None,
+                           max_attempts=None):
+    """任务处理失败（不提交）：delay_seconds 后重试，超过最大次数标记为 failed，返回新状态
+
+    count_attempt=False 表示未真正调用上游（如熔断器仍打开），不计入重试次数。
+    """
+    now = now or datetime.now(timezone.utc)
+    max_attempts = PENDING_ANALYSIS_MAX_ATTEMPTS if max_attempts is None else max_attempts
+    job = db.get(PendingAnalysis, job_id, populate_existing=True)
+    if job is None:
+        return None
+    if not count_attempt:
+        job.attempts = max(job.attempts - 1, 0)
+    job.last_error = str(error)[:2000]
+    if job.attempts >= max_attempts:
+        job.status = "failed"
+        logger.error(f"[待分析队列] 任务 {job_id}（{job.file_id}）重试 {job.attempts} 次仍失败，放弃: {error}")
+    else:
+        job.available_at = now + timedelta(seconds=delay_seconds)
+    db.flush()
+    return job.status
+
+
+def get_pending_analysis(db, job_id):
+    job = db.get(PendingAnalysis, job_id)
+    return _pending_analysis_dict(job) if job else None
+
+
+def get_similar_mistakes(db, error_type: str = None, knowledge_point: str = None):
+    """获取相似错题"""
+    query = db.query(MistakeAnalysis)
+    
+    if error_type:
+        query = query.filter(MistakeAnalysis.error_type == error_type)
+    if knowledge_point:
+        query = query.filter(MistakeAnalysis.knowledge_point == knowledge_point)
+    
+    return query.all()
+
+LEARNING_SHEET_FIELDS = ("id", "mistake_record_id", "subject", "question", "answer", "correct_answer", "comment",
+                         "error_type", "knowledge_point")
+
+
+def get_learning_sheet_items(db, analysis_ids, user_id=DEFAULT_USER_ID, include_practices=True):
+    """学习单内容：按 analysis_ids 的顺序返回该用户的错题，以及这些错题所属记录的类练习（按题干去重）
+
+    返回 (mistakes, practices)，均为字典列表；不存在或不属于该用户的 ID 忽略。
+    """
+    columns = [getattr(MistakeAnalysis, field) for field in LEARNING_SHEET_FIELDS]
+    rows = db.query(*columns).filter(MistakeAnalysis.user_id == user_id,
+                                     MistakeAnalysis.id.in_(set(analysis_ids))).all()
+    by_id = {row.id: dict(zip(LEARNING_SHEET_FIELDS, row)) for row in rows}
+    mistakes = [by_id[analysis_id] for analysis_id in dict.fromkeys(analysis_ids) if analysis_id in by_id]
+    if not include_practices or not mistakes:
+        return mistakes, []
+
+    record_ids = list(dict.fromkeys(mistake["mistake_record_id"] for mistake in mistakes))
+    practices = {}
+    for practice in (db.query(MistakePractice.question, MistakePractice.correct_answer, MistakePractice.comment)
+                     .filter(MistakePractice.user_id == user_id, MistakePractice.mistake_record_id.in_(record_ids))
+                     .order_by(MistakePractice.mistake_record_id, MistakePractice.id)):
+        key = " ".join((practice.question or "").split())
+        if key and key not in practices:
+            practices[key] = {"question": practice.question, "correct_answer": practice.correct_answer,
+                              "comment": practice.comment}
+    return mistakes, list(practices.values())
+
+
+STATS_DIMENSIONS = ("subject", "error_type", "knowledge_point")
+
+
+def stats_rollup_deltas(analyses):
+    """计算一批分析记录对统计汇总的增量：{(dimension, value): [total, incorrect]}"""
+    deltas = defaultdict(lambda: [0, 0])
+    for analysis in analyses:
+        if not isinstance(analysis, dict):
+            analysis = dict(analysis._mapping)
+        if analysis.get("is_question", True) is False:
+            continue
+        incorrect = 0 if analysis.get("is_correct", False) else 1
+        keys = [("all", ""), ("subject", (analysis.get("subject") or "").strip()[:200]),
+                ("error_type", (analysis.get("error_type") or "").strip()[:200])]
+        points = [p.strip()[:200] for p in re.split(r"[,，、]", analysis.get("knowledge_point") or "") if p.strip()]
+        keys.extend(("knowledge_point", point) for point in (points or [""]))
+        for key in keys:
+            deltas[key][0] += 1
+            deltas[key][1] += incorrect
+    return deltas
+
+
+def upsert_stats_rollup(db, deltas, user_id=DEFAULT_USER_ID):
+    """按增量累加用户的统计汇总（PostgreSQL / SQLite 均使用 INSERT ... ON CONFLICT DO UPDATE）"""
+    if not deltas:
+        return
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    # 按主键固定顺序写入，避免并发事务互相等待形成死锁
+    rows = [
+        {"user_id": user_id, "dimension": dimension, "value": value, "total": total, "incorrect": incorrect}
+        for (dimension, value), (total, incorrect) in sorted(deltas.items())
+    ]
+    stmt = insert(MistakeStatsRollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MistakeStatsRollup.user_id, MistakeStatsRollup.dimension, MistakeStatsRollup.value],
+        set_={
+            "total": MistakeStatsRollup.total + stmt.excluded.total,
+            "incorrect": MistakeStatsRollup.incorrect + stmt.excluded.incorrect,
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(stmt)
+
+
+def rebuild_stats_rollup(db, batch_size=1000):
+    """全量重建统计汇总（首次上线回填或校正偏差），返回汇总行数"""
+    user_deltas = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    rows = (db.query(MistakeAnalysis.subject, MistakeAnalysis.error_type, MistakeAnalysis.knowledge_point,
+                     MistakeAnalysis.is_question, MistakeAnalysis.is_correct, MistakeAnalysis.user_id)
+            .yield_per(batch_size))
+    for row in rows:
+        deltas = user_deltas[row.user_id]
+        for key, (total, incorrect) in stats_rollup_deltas([row]).items():
+            deltas[key][0] += total
+            deltas[key][1] += incorrect
+    try:
+        db.query(MistakeStatsRollup).delete(synchronize_session=False)
+        for user_id, deltas in sorted(user_deltas.items()):
+            upsert_stats_rollup(db, deltas, user_id)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"重建统计汇总失败: {e}")
+        raise
+    rows = sum(len(deltas) for deltas in user_deltas.values())
+    logger.info(f"统计汇总重建完成，{len(user_deltas)} 个用户共 {rows} 行")
+    return rows
+
+
+def get_mistake_stats(db, limit=None, user_id=DEFAULT_USER_ID):
+    """读取用户的统计汇总（按主键前缀取该用户的全部汇总行），各维度按错题数降序"""
+    stats = {"total": 0, "incorrect": 0}
+    for dimension in STATS_DIMENSIONS:
+        stats[f"by_{dimension}"] = []
+    rows = db.query(MistakeStatsRollup).filter(MistakeStatsRollup.user_id == user_id, MistakeStatsRollup.total > 0)
+    for row in rows:
+        if row.dimension == "all":
+            stats["total"], stats["incorrect"] = row.total, row.incorrect
+        elif row.dimension in STATS_DIMENSIONS:
+            stats[f"by_{row.dimension}"].append(
+                {"value": row.value or None, "total": row.total, "incorrect": row.incorrect})
+    for dimension in STATS_DIMENSIONS:
+        items = sorted(stats[f"by_{dimension}"], key=lambda item: (-item["incorrect"], -item["total"]))
+        stats[f"by_{dimension}"] = items[:limit] if limit else items
+    return stats
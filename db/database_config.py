@@ -1,10 +1,30 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, ForeignKey, JSON, text
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-from sqlalchemy.sql import func
-from datetime import datetime
+import sys
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
 import logging
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 模型与数据访问函数与 SQLite 后端共用，这里重新导出以保持原有导入方式
+from db.models import (  # noqa: E402,F401
+    Base, MistakeRecord, MistakeAnalysis, MistakePractice, PracticeText, PracticePool,
+    MistakeStatsRollup, IdempotencyKey, PendingAnalysis, User, ReviewPlan, ReviewCard,
+)
+from db.crud import (  # noqa: E402,F401
+    save_mistake_record, add_mistake_record, add_mistake_analyses, add_mistake_practices, replace_mistake_analyses,
+    get_mistake_records, get_mistake_analysis_by_file_id, build_mistakes_query,
+    parse_mistake_list_fields, count_mistakes, select_mistakes_page, MISTAKE_LIST_PREVIEW_CHARS,
+    MISTAKE_EXPORT_COLUMNS, iter_mistake_export_batches,
+    IDEMPOTENCY_LEASE_SECONDS, IDEMPOTENCY_TTL_SECONDS, claim_idempotency_key, complete_idempotency_key,
+    release_idempotency_key, purge_expired_idempotency_keys,
+    enqueue_pending_analysis, claim_pending_analysis, complete_pending_analysis, retry_pending_analysis,
+    get_pending_analysis, get_learning_sheet_items,
+    get_similar_mistakes, STATS_DIMENSIONS, stats_rollup_deltas, upsert_stats_rollup,
+    rebuild_stats_rollup, get_mistake_stats,
+)
+from db.routing import SessionRouter  # noqa: E402
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
@@ -30,85 +50,21 @@ engine = create_engine(
     pool_recycle=3600    # 连接回收时间（秒）
 )
 
-# 创建基类
-Base = declarative_base()
-
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# 数据库模型定义
-class MistakeRecord(Base):
-    """错题记录表"""
-    __tablename__ = "mistake_records"
-
-    id = Column(Integer, primary_key=True, index=True)
-    file_id = Column(String(255), unique=True, index=True, nullable=False)
-    filename = Column(String(500), nullable=False)
-    file_url = Column(String(1000))
-    file_size = Column(Integer)
-    file_type = Column(String(100))
-    upload_time = Column(DateTime(timezone=True), default=func.now())
-    created_at = Column(DateTime(timezone=True), default=func.now())
-    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
-
-    # 关系
-    analyses = relationship("MistakeAnalysis", back_populates="mistake_record", cascade="all, delete-orphan")
-    practices = relationship("MistakePractice", back_populates="mistake_record", cascade="all, delete-orphan")
-
-class MistakeAnalysis(Base):
-    """错题分析表"""
-    __tablename__ = "mistake_analysis"
-
-    id = Column(Integer, primary_key=True, index=True)
-    mistake_record_id = Column(Integer, ForeignKey("mistake_records.id", ondelete="CASCADE"))
-    subject = Column(String(100))  # 学科
-    section = Column(String(200))
-    question = Column(Text)
-    answer = Column(Text)
-    is_question = Column(Boolean, default=True)
-    is_correct = Column(Boolean, default=False)
-    correct_answer = Column(Text)
-    comment = Column(Text)
-    error_type = Column(String(100))  # 错因类型
-    knowledge_point = Column(String(200))  # 知识点
-    analysis_data = Column(JSON)  # 完整的分析数据
-    created_at = Column(DateTime(timezone=True), default=func.now())
-
-    # 关系
-    mistake_record = relationship("MistakeRecord", back_populates="analyses")
-
-class MistakePractice(Base):
-    """类练习（相似练习）"""
-    __tablename__ = "mistake_practices"
-
-    id = Column(Integer, primary_key=True, index=True)
-    mistake_record_id = Column(Integer, ForeignKey("mistake_records.id", ondelete="CASCADE"))
-    question = Column(Text)
-    correct_answer = Column(Text)
-    comment = Column(Text)
-    created_at = Column(DateTime(timezone=True), default=func.now())
-
-    mistake_record = relationship("MistakeRecord", back_populates="practices")
-
-class User(Base):
-    """用户表（用于未来扩展）"""
-    __tablename__ = "users"
-
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String(100), unique=True, index=True)
-    email = Column(String(255), unique=True, index=True)
-    created_at = Column(DateTime(timezone=True), default=func.now())
-
-class ReviewPlan(Base):
-    """复习计划表"""
-    __tablename__ = "review_plans"
-
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
-    plan_name = Column(String(200))
-    plan_data = Column(JSON)  # 复习计划详情
-    created_at = Column(DateTime(timezone=True), default=func.now())
-    scheduled_date = Column(DateTime)
+# 只读副本（逗号分隔的完整数据库 URL，为空时读写都走主库）
+READ_REPLICA_URLS = [url.strip() for url in os.getenv('DB_READ_REPLICA_URLS', '').split(',') if url.strip()]
+replica_engines = [
+    create_engine(url, echo=False, pool_size=5, max_overflow=10, pool_pre_ping=True, pool_recycle=3600)
+    for url in READ_REPLICA_URLS
+]
+
+# 读写路由：错题本一览 / 详情走副本，写入后短时间内的读请求回到主库（读己之写）
+router = SessionRouter(
+    SessionLocal,
+    [sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) for replica_engine in replica_engines],
+)
 
 # 数据库工具函数
 def get_db():
@@ -120,108 +76,16 @@ def get_db():
         db.close()
 
 def init_db():
-    """初始化数据库表"""
-    try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("数据库表创建成功")
-    except Exception as e:
-        logger.error(f"数据库表创建失败: {e}")
-        raise
+    """初始化数据库表：新库按模型建表，已有库执行未应用的迁移"""
+    from db.migrate import migrate
 
-def save_mistake_record(db, file_data, analysis_data=None, practices_data=None):
-    """保存错题记录和分析结果"""
     try:
-        logger.info(f"📝 开始保存错题记录到数据库...")
-        logger.info(f"📁 文件信息: file_id={file_data.get('file_id')}, filename={file_data.get('filename')}, size={file_data.get('file_size')}")
-        
-        # 创建错题记录
-        mistake_record = MistakeRecord(
-            file_id=file_data.get("file_id"),
-            filename=file_data.get("filename"),
-            file_url=file_data.get("file_url"),
-            file_size=file_data.get("file_size"),
-            file_type=file_data.get("file_type"),
-            upload_time=datetime.fromisoformat(file_data.get("upload_time")) if file_data.get("upload_time") else None
-        )
-        
-        db.add(mistake_record)
-        db.flush()  # 获取生成的ID
-        logger.info(f"✅ 错题记录创建成功，记录ID: {mistake_record.id}")
-        
-        # 保存分析结果
-        analysis_count = 0
-        if analysis_data:
-            logger.info(f"📊 开始保存分析数据，共 {len(analysis_data)} 条记录")
-            for i, analysis in enumerate(analysis_data):
-                mistake_analysis = MistakeAnalysis(
-                    mistake_record_id=mistake_record.id,
-                    subject=analysis.get("subject"),  # 保存学科字段
-                    section=analysis.get("section"),
-                    question=analysis.get("question"),
-                    answer=analysis.get("answer"),
-                    is_question=analysis.get("is_question", True),
-                    is_correct=analysis.get("is_correct", False),
-                    correct_answer=analysis.get("correct_answer"),
-                    comment=analysis.get("comment"),
-                    error_type=analysis.get("error_type"),
-                    knowledge_point=analysis.get("knowledge_point"),
-                    analysis_data=analysis
-                )
-                db.add(mistake_analysis)
-                analysis_count += 1
-                logger.info(f"📋 分析记录 {i+1}: subject={analysis.get('subject')}, section={analysis.get('section')}, question={analysis.get('question')[:50]}...")
-        
-        # 保存类练习（如果有）
-        practices_count = 0
-        if practices_data:
-            for j, p in enumerate(practices_data):
-                mp = MistakePractice(
-                    mistake_record_id=mistake_record.id,
-                    question=p.get("question"),
-                    correct_answer=p.get("correct_answer"),
-                    comment=p.get("comment"),
-                )
-                db.add(mp)
-                practices_count += 1
-
-        db.commit()
-        logger.info(f"🎉 数据库保存完成！错题记录ID: {mistake_record.id}, 分析记录数: {analysis_count}")
-        # 记录类练习数量
-        if 'practices_count' in locals():
-            try:
-                logger.info(f"类练习数: {practices_count}")
-            except Exception:
-                pass
-        return mistake_record.id
-        
+        applied = migrate(engine)
+        logger.info(f"数据库表初始化成功，本次执行迁移: {applied or '无'}")
     except Exception as e:
-        db.rollback()
-        logger.error(f"❌ 保存错题记录失败: {e}")
-        logger.error(f"❌ 错误详情: {str(e)}")
+        logger.error(f"数据库表创建失败: {e}")
         raise
 
-def get_mistake_records(db, skip: int = 0, limit: int = 100):
-    """获取错题记录列表"""
-    return db.query(MistakeRecord).offset(skip).limit(limit).all()
-
-def get_mistake_analysis_by_file_id(db, file_id: str):
-    """根据文件ID获取错题分析"""
-    mistake_record = db.query(MistakeRecord).filter(MistakeRecord.file_id == file_id).first()
-    if mistake_record:
-        return db.query(MistakeAnalysis).filter(MistakeAnalysis.mistake_record_id == mistake_record.id).all()
-    return []
-
-def get_similar_mistakes(db, error_type: str = None, knowledge_point: str = None):
-    """获取相似错题"""
-    query = db.query(MistakeAnalysis)
-    
-    if error_type:
-        query = query.filter(MistakeAnalysis.error_type == error_type)
-    if knowledge_point:
-        query = query.filter(MistakeAnalysis.knowledge_point == knowledge_point)
-    
-    return query.all()
-
 # 测试数据库连接
 def test_connection():
     """测试数据库连接"""
@@ -6,15 +6,20 @@ CREATE TABLE IF NOT EXISTS mistake_records (
     file_url VARCHAR(1000),
     file_size INTEGER,
     file_type VARCHAR(100),
+    image_phash BIGINT, -- 图片感知哈希（64 位 pHash，有符号存储）
+    source_file_id VARCHAR(255), -- 多页 PDF 拆页时，原 PDF 的 file_id
+    page_index INTEGER, -- 多页 PDF 拆页时的页码（从 0 开始）
+    user_id INTEGER NOT NULL DEFAULT 0, -- 所属用户（X-User-Id 请求头，缺省为 0）
     upload_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
--- 创建错题分析表
+-- 创建错题分析表（应用启动时由迁移 006 转换为按 created_at 的月分区表，见 db/partitions.py）
 CREATE TABLE IF NOT EXISTS mistake_analysis (
     id SERIAL PRIMARY KEY,
     mistake_record_id INTEGER REFERENCES mistake_records(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL DEFAULT 0, -- 所属用户（与错题记录一致）
     subject VARCHAR(100), -- 学科
     section VARCHAR(200),
     question TEXT,
@@ -29,6 +34,17 @@ CREATE TABLE IF NOT EXISTS mistake_analysis (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- 创建类练习表（Coze 返回的相似练习）
+CREATE TABLE IF NOT EXISTS mistake_practices (
+    id SERIAL PRIMARY KEY,
+    mistake_record_id INTEGER REFERENCES mistake_records(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL DEFAULT 0,
+    question TEXT,
+    correct_answer TEXT,
+    comment TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
 -- 创建用户表（可选，用于未来扩展）
 CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
@@ -47,13 +63,109 @@ CREATE TABLE IF NOT EXISTS review_plans (
     scheduled_date DATE
 );
 
+-- 创建类练习题干去重表
+CREATE TABLE IF NOT EXISTS practice_texts (
+    id SERIAL PRIMARY KEY,
+    content_hash VARCHAR(64) UNIQUE NOT NULL, -- 规范化题干的 SHA-256
+    question TEXT,
+    correct_answer TEXT,
+    comment TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 创建类练习推荐池（按知识点 + 错因预计算，空字符串表示不限）
+CREATE TABLE IF NOT EXISTS practice_pools (
+    knowledge_point VARCHAR(200) NOT NULL,
+    error_type VARCHAR(100) NOT NULL,
+    practice_ids JSONB, -- 按推荐顺序排列的 practice_texts.id
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (knowledge_point, error_type)
+);
+
+-- 错题统计汇总表（写入分析记录时增量维护，供 /stats 使用）
+CREATE TABLE IF NOT EXISTS mistake_stats_rollup (
+    user_id INTEGER NOT NULL DEFAULT 0,
+    dimension VARCHAR(50) NOT NULL, -- all / subject / error_type / knowledge_point
+    value VARCHAR(200) NOT NULL, -- 空字符串表示未填写
+    total INTEGER NOT NULL DEFAULT 0, -- 题目数
+    incorrect INTEGER NOT NULL DEFAULT 0, -- 错题数
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, dimension, value)
+);
+
+-- 幂等键表（Idempotency-Key 请求头，处理前写入 in_progress 标记，完成后保存响应）
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope VARCHAR(100) NOT NULL, -- 接口，如 upload/image
+    key VARCHAR(255) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    resource_id VARCHAR(255), -- 预先分配的 file_id
+    status VARCHAR(20) NOT NULL, -- in_progress / completed
+    attempt INTEGER NOT NULL DEFAULT 1,
+    status_code INTEGER,
+    response JSON,
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (scope, key)
+);
+
+-- 待分析队列（Coze 熔断期间保存的上传，恢复后由后台任务重放分析）
+CREATE TABLE IF NOT EXISTS pending_analyses (
+    id SERIAL PRIMARY KEY,
+    file_id VARCHAR(255) UNIQUE NOT NULL,
+    filename VARCHAR(500) NOT NULL, -- media/uploads 下的文件名
+    original_filename VARCHAR(500),
+    file_type VARCHAR(100),
+    file_size INTEGER,
+    image_phash BIGINT,
+    upload_time VARCHAR(50),
+    user_id INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending / done / failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    mistake_record_id INTEGER,
+    available_at TIMESTAMP WITH TIME ZONE NOT NULL, -- 可被领取的时间（领取时推后一个租约）
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 创建间隔复习卡片表（每道错题一张，SM-2 调度状态；analysis_id 对应 mistake_analysis.id）
+CREATE TABLE IF NOT EXISTS review_cards (
+    analysis_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL DEFAULT 0,
+    due_date DATE NOT NULL, -- 下次复习日期
+    interval_days INTEGER NOT NULL DEFAULT 0,
+    ease DOUBLE PRECISION NOT NULL DEFAULT 2.5, -- SM-2 难度系数
+    repetitions INTEGER NOT NULL DEFAULT 0,
+    lapses INTEGER NOT NULL DEFAULT 0,
+    last_grade INTEGER,
+    last_reviewed_at TIMESTAMP WITH TIME ZONE
+);
+
 -- 创建索引以提高查询性能
 CREATE INDEX IF NOT EXISTS idx_mistake_records_file_id ON mistake_records(file_id);
 CREATE INDEX IF NOT EXISTS idx_mistake_records_upload_time ON mistake_records(upload_time);
+CREATE INDEX IF NOT EXISTS ix_mistake_records_created_at ON mistake_records(created_at);
+CREATE INDEX IF NOT EXISTS idx_mistake_records_image_phash ON mistake_records(image_phash);
+CREATE INDEX IF NOT EXISTS idx_mistake_records_source_file_id ON mistake_records(source_file_id);
 CREATE INDEX IF NOT EXISTS idx_mistake_analysis_mistake_record_id ON mistake_analysis(mistake_record_id);
-CREATE INDEX IF NOT EXISTS idx_mistake_analysis_subject ON mistake_analysis(subject);
-CREATE INDEX IF NOT EXISTS idx_mistake_analysis_error_type ON mistake_analysis(error_type);
+CREATE INDEX IF NOT EXISTS idx_mistake_practices_mistake_record_id ON mistake_practices(mistake_record_id);
 CREATE INDEX IF NOT EXISTS idx_mistake_analysis_knowledge_point ON mistake_analysis(knowledge_point);
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys(expires_at);
+CREATE INDEX IF NOT EXISTS ix_pending_analyses_status_available ON pending_analyses(status, available_at);
+CREATE INDEX IF NOT EXISTS ix_review_cards_user_due ON review_cards(user_id, due_date, analysis_id);
+CREATE INDEX IF NOT EXISTS ix_mistake_records_user_created ON mistake_records(user_id, created_at);
+-- /mistakes 筛选组合对应的复合索引：user_id 与等值条件在前，排序键 (created_at DESC, id DESC) 在后
+CREATE INDEX IF NOT EXISTS ix_mistake_analysis_user_recent ON mistake_analysis(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_mistake_analysis_user_subject_recent ON mistake_analysis(user_id, subject, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_mistake_analysis_user_error_type_recent ON mistake_analysis(user_id, error_type, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_mistake_analysis_user_subject_error_type_recent ON mistake_analysis(user_id, subject, error_type, created_at DESC, id DESC);
+-- 只看错题（incorrect_only）时使用的部分索引
+CREATE INDEX IF NOT EXISTS ix_mistake_analysis_user_incorrect_recent ON mistake_analysis(user_id, created_at DESC, id DESC) WHERE is_correct = false;
+CREATE INDEX IF NOT EXISTS ix_mistake_analysis_user_incorrect_subject_error_type_recent ON mistake_analysis(user_id, subject, error_type, created_at DESC, id DESC) WHERE is_correct = false;
+-- 知识点前后模糊匹配（ILIKE '%...%'）
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS ix_mistake_analysis_knowledge_point_trgm ON mistake_analysis USING gin (knowledge_point gin_trgm_ops);
 CREATE INDEX IF NOT EXISTS idx_review_plans_user_id ON review_plans(user_id);
 CREATE INDEX IF NOT EXISTS idx_review_plans_scheduled_date ON review_plans(scheduled_date);
 
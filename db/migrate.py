@@ -0,0 +1,256 @@
+"""版本化数据库迁移（PostgreSQL / SQLite 共用）
+
+迁移脚本位于 db/migrations/NNN_描述.py，按编号顺序执行，已执行的版本记录在
+schema_migrations 表中。每个脚本定义 upgrade(conn)，用本模块的辅助函数做跨方言的在线变更：
+  - add_column：只加可空、无默认值的列（PostgreSQL 下只改元数据，不重写表）
+  - create_index / drop_index：PostgreSQL 下使用 CONCURRENTLY，不阻塞读写
+  - backfill：按主键区间分批 UPDATE，每批单独提交，避免长事务和大范围行锁
+  - scan：按主键区间分批读取（自动提交连接上不能使用服务端游标）
+CONCURRENTLY 不能在事务中执行，迁移运行在自动提交连接上，因此脚本必须可重复执行（幂等）：
+中途失败后修复问题再次运行即可。PostgreSQL 下会设置 lock_timeout，拿不到锁时快速失败，
+而不是排在业务查询前面阻塞整张表；并用 advisory lock 防止多个实例同时迁移。
+
+新库（尚无 mistake_records 表）直接按模型建表，并把所有版本标记为已执行；模型表达不了的结构
+（如 PostgreSQL 分区表）由声明了 APPLY_ON_FRESH_DB = True 的迁移在建表后补上。
+
+用法:
+  python db/migrate.py                                   # 使用 database_config 的 PostgreSQL 配置
+  python db/migrate.py --db-url sqlite:///db/mistake_note.db
+  python db/migrate.py --status
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import re
+import sys
+import time
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, inspect, select, text
+from sqlalchemy.sql import func
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.models import Base  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))
+MIGRATION_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+_ADVISORY_LOCK_ID = 20250301  # 迁移专用 advisory lock 编号
+
+_FILENAME = re.compile(r"^(\d{3})_(\w+)\.py$")
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("version", String(20), primary_key=True),
+    Column("name", String(200)),
+    Column("duration_ms", Integer),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+def discover_migrations(directory=MIGRATIONS_DIR):
+    """返回按版本排序的 [(version, name, path)]"""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = _FILENAME.match(filename)
+        if match:
+            migrations.append((match.group(1), match.group(2), os.path.join(directory, filename)))
+    return migrations
+
+
+def _load_module(version, path):
+    spec = importlib.util.spec_from_file_location(f"db_migration_{version}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def is_postgres(conn):
+    return conn.dialect.name == "postgresql"
+
+
+def has_table(conn, table):
+    return inspect(conn).has_table(table)
+
+
+def has_column(conn, table, column):
+    return column in {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def has_index(conn, name):
+    if is_postgres(conn):
+        sql = "SELECT 1 FROM pg_indexes WHERE schemaname = current_schema() AND indexname = :name"
+    else:
+        sql = "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"
+    return conn.execute(text(sql), {"name": name}).first() is not None
+
+
+def add_column(conn, table, column, ddl_type):
+    """列不存在时添加（应为可空、无默认值，避免重写整表）"""
+    if has_column(conn, table, column):
+        return False
+    conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}")
+    logger.info(f"[迁移] {table} 新增列 {column} {ddl_type}")
+    return True
+
+
+def create_index(conn, name, table, columns, where=None, using=None, unique=False):
+    """在线创建索引；PostgreSQL 专用的索引（using 如 gin）在 SQLite 下跳过"""
+    postgres = is_postgres(conn)
+    if using and not postgres:
+        return False
+    if postgres:
+        # 上次 CONCURRENTLY 中途失败会留下 INVALID 索引，IF NOT EXISTS 会误判为已存在
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"), {"name": name}).first()
+        if invalid:
+            conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    if has_index(conn, name):
+        return False
+    sql = "CREATE {unique}INDEX {concurrently}IF NOT EXISTS {name} ON {table} {using}({columns}){where}".format(
+        unique="UNIQUE " if unique else "",
+        concurrently="CONCURRENTLY " if postgres else "",
+        name=name,
+        table=table,
+        using=f"USING {using} " if using else "",
+        columns=columns,
+        where=f" WHERE {where}" if where else "",
+    )
+    started = time.perf_counter()
+    conn.exec_driver_sql(sql)
+    logger.info(f"[迁移] 创建索引 {name}，耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
+    return True
+
+
+def drop_index(conn, name):
+    """删除索引；分区表上的索引不支持 CONCURRENTLY，改为在 lock_timeout 下直接删除（只短暂加锁）"""
+    if not is_postgres(conn):
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+        return
+    partitioned = conn.execute(text(
+        "SELECT 1 FROM pg_class WHERE relname = :name AND relkind = 'I'"), {"name": name}).first()
+    if not partitioned:
+        conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        return
+    conn.exec_driver_sql("BEGIN")
+    try:
+        conn.exec_driver_sql(f"SET LOCAL lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+        conn.exec_driver_sql("COMMIT")
+    except Exception:
+        conn.exec_driver_sql("ROLLBACK")
+        raise
+
+
+def backfill(conn, table, set_sql, where_sql, batch_size=None, key="id", params=None):
+    """按主键区间分批执行 UPDATE table SET set_sql WHERE where_sql，每批单独提交，返回更新行数
+
+    where_sql 必须在回填后不再成立（如 `col IS NULL`），保证中断后重跑只处理剩余行。
+    """
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
+    low, high = conn.execute(text(f"SELECT MIN({key}), MAX({key}) FROM {table} WHERE {where_sql}"),
+                             params or {}).first()
+    if low is None:
+        return 0
+    updated = 0
+    statement = text(f"UPDATE {table} SET {set_sql} WHERE {key} >= :_start AND {key} < :_end AND ({where_sql})")
+    for start in range(low, high + 1, batch_size):
+        result = conn.execute(statement, {**(params or {}), "_start": start, "_end": start + batch_size})
+        updated += result.rowcount or 0
+    logger.info(f"[迁移] 回填 {table}: {updated} 行（每批 {batch_size}）")
+    return updated
+
+
+def scan(conn, table, columns, batch_size=None, key="id"):
+    """按主键区间分批 SELECT columns FROM table，逐行返回，内存占用不随表大小增长"""
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
+    low, high = conn.execute(text(f"SELECT MIN({key}), MAX({key}) FROM {table}")).first()
+    if low is None:
+        return
+    statement = text(f"SELECT {columns} FROM {table} WHERE {key} >= :_start AND {key} < :_end")
+    for start in range(low, high + 1, batch_size):
+        yield from conn.execute(statement, {"_start": start, "_end": start + batch_size})
+
+
+def _record(conn, version, name, duration_ms):
+    conn.execute(schema_migrations.insert().values(version=version, name=name, duration_ms=duration_ms))
+
+
+def migrate(engine, directory=MIGRATIONS_DIR):
+    """执行所有未应用的迁移，返回本次执行的版本列表"""
+    migrations = discover_migrations(directory)
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        postgres = is_postgres(conn)
+        if postgres:
+            conn.execute(text(f"SET lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'"))
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": _ADVISORY_LOCK_ID})
+        try:
+            _metadata.create_all(conn)
+            applied = {row[0] for row in conn.execute(select(schema_migrations.c.version))}
+
+            if not has_table(conn, "mistake_records"):
+                Base.metadata.create_all(conn)
+                for version, name, path in migrations:
+                    if version in applied:
+                        continue
+                    module = _load_module(version, path)
+                    if getattr(module, "APPLY_ON_FRESH_DB", False):
+                        module.upgrade(conn)
+                    _record(conn, version, name, 0)
+                logger.info(f"[迁移] 新库按模型建表，{len(migrations)} 个迁移标记为已执行")
+                return []
+
+            executed = []
+            for version, name, path in migrations:
+                if version in applied:
+                    continue
+                logger.info(f"[迁移] 执行 {version}_{name}")
+                started = time.perf_counter()
+                _load_module(version, path).upgrade(conn)
+                duration_ms = int((time.perf_counter() - started) * 1000)
+                _record(conn, version, name, duration_ms)
+                executed.append(version)
+                logger.info(f"[迁移] {version}_{name} 完成，耗时 {duration_ms}ms")
+            return executed
+        finally:
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": _ADVISORY_LOCK_ID})
+
+
+def migration_status(engine, directory=MIGRATIONS_DIR):
+    """返回 [(version, name, 是否已执行)]"""
+    with engine.connect() as conn:
+        applied = set()
+        if has_table(conn, "schema_migrations"):
+            applied = {row[0] for row in conn.execute(select(schema_migrations.c.version))}
+    return [(version, name, version in applied) for version, name, _ in discover_migrations(directory)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="执行数据库迁移")
+    parser.add_argument("--db-url", help="数据库 URL，默认使用 db/database_config.py 中的配置")
+    parser.add_argument("--status", action="store_true", help="只查看迁移状态")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.db_url:
+        engine = create_engine(args.db_url)
+    else:
+        from db.database_config import engine
+
+    if args.status:
+        for version, name, done in migration_status(engine):
+            print(f"{'[x]' if done else '[ ]'} {version}_{name}")
+        return
+    executed = migrate(engine)
+    print(f"迁移完成，本次执行: {', '.join(executed) if executed else '无'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""000: 基线
+
+迁移框架引入前，PostgreSQL 由 01-init-tables.sql 建表，SQLite 由旧版 sqlite_config.py 建表，
+两者并不一致：SQLite 缺少 mistake_analysis.subject 与 mistake_practices，
+PostgreSQL 初始化脚本缺少 mistake_practices。这里补齐缺失的表与列，并从
+analysis_data 中回填 subject。
+"""
+from sqlalchemy import (BigInteger, Boolean, Column, DateTime, ForeignKey, Index, Integer, JSON, MetaData, String,
+                        Table, Text)
+from sqlalchemy.sql import func
+
+from db.migrate import add_column, backfill, is_postgres
+
+# 本版本的表结构快照（不引用 db.models，模型之后的变化由后续迁移发布）
+_metadata = MetaData()
+Table(
+    "users", _metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String(100), unique=True, index=True),
+    Column("email", String(255), unique=True, index=True),
+    Column("created_at", DateTime(timezone=True), default=func.now()),
+)
+Table(
+    "mistake_records", _metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("file_id", String(255), unique=True, index=True, nullable=False),
+    Column("filename", String(500), nullable=False),
+    Column("file_url", String(1000)),
+    Column("file_size", Integer),
+    Column("file_type", String(100)),
+    Column("image_phash", BigInteger, index=True),
+    Column("source_file_id", String(255), index=True),
+    Column("page_index", Integer),
+    Column("upload_time", DateTime(timezone=True), default=func.now()),
+    Column("created_at", DateTime(timezone=True), default=func.now()),
+    Column("updated_at", DateTime(timezone=True), default=func.now(), onupdate=func.now()),
+)
+Table(
+    "mistake_analysis", _metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("mistake_record_id", Integer, ForeignKey("mistake_records.id", ondelete="CASCADE")),
+    Column("subject", String(100)),
+    Column("section", String(200)),
+    Column("question", Text),
+    Column("answer", Text),
+    Column("is_question", Boolean, default=True),
+    Column("is_correct", Boolean, default=False),
+    Column("correct_answer", Text),
+    Column("comment", Text),
+    Column("error_type", String(100)),
+    Column("knowledge_point", String(200)),
+    Column("analysis_data", JSON),
+    Column("created_at", DateTime(timezone=True), default=func.now()),
+)
+_practices = Table(
+    "mistake_practices", _metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("mistake_record_id", Integer, ForeignKey("mistake_records.id", ondelete="CASCADE")),
+    Column("question", Text),
+    Column("correct_answer", Text),
+    Column("comment", Text),
+    Column("created_at", DateTime(timezone=True), default=func.now()),
+)
+Index("idx_mistake_practices_mistake_record_id", _practices.c.mistake_record_id)
+Table(
+    "review_plans", _metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE")),
+    Column("plan_name", String(200)),
+    Column("plan_data", JSON),
+    Column("created_at", DateTime(timezone=True), default=func.now()),
+    Column("scheduled_date", DateTime),
+)
+Table(
+    "practice_texts", _metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("content_hash", String(64), unique=True, index=True, nullable=False),
+    Column("question", Text),
+    Column("correct_answer", Text),
+    Column("comment", Text),
+    Column("created_at", DateTime(timezone=True), default=func.now()),
+)
+Table(
+    "practice_pools", _metadata,
+    Column("knowledge_point", String(200), primary_key=True),
+    Column("error_type", String(100), primary_key=True),
+    Column("practice_ids", JSON),
+    Column("updated_at", DateTime(timezone=True), default=func.now()),
+)
+
+
+def upgrade(conn):
+    _metadata.create_all(conn)  # 只建缺失的表，已有的表不做改动
+
+    add_column(conn, "mistake_analysis", "subject", "VARCHAR(100)")
+    if is_postgres(conn):
+        subject_expr = "analysis_data->>'subject'"
+    else:
+        subject_expr = "json_extract(analysis_data, '$.subject')"
+    backfill(conn, "mistake_analysis", f"subject = {subject_expr}",
+             f"subject IS NULL AND {subject_expr} IS NOT NULL")
@@ -0,0 +1,7 @@
+"""001: 上传图片近重复检测（感知哈希列）"""
+from db.migrate import add_column, create_index
+
+
+def upgrade(conn):
+    add_column(conn, "mistake_records", "image_phash", "BIGINT")
+    create_index(conn, "idx_mistake_records_image_phash", "mistake_records", "image_phash")
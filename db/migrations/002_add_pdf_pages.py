@@ -0,0 +1,8 @@
+"""002: 多页 PDF 拆页分析（每页一条 mistake_records，记录原 PDF 的 file_id 与页码）"""
+from db.migrate import add_column, create_index
+
+
+def upgrade(conn):
+    add_column(conn, "mistake_records", "source_file_id", "VARCHAR(255)")
+    add_column(conn, "mistake_records", "page_index", "INTEGER")
+    create_index(conn, "idx_mistake_records_source_file_id", "mistake_records", "source_file_id")
@@ -0,0 +1,53 @@
+"""003: 错题统计汇总表
+
+汇总表由 save_mistake_record 增量维护；建表后从已有分析记录回填一次。
+表结构与回填逻辑是本版本的快照，不引用 db.models / db.crud：之后模型变化（如 010 按用户划分）
+不改变本迁移的行为，由后续迁移负责升级。
+"""
+import re
+from collections import defaultdict
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+from sqlalchemy.sql import func
+
+from db.migrate import has_table, scan
+
+_metadata = MetaData()
+mistake_stats_rollup = Table(
+    "mistake_stats_rollup", _metadata,
+    Column("dimension", String(50), primary_key=True),
+    Column("value", String(200), primary_key=True),
+    Column("total", Integer, nullable=False, default=0),
+    Column("incorrect", Integer, nullable=False, default=0),
+    Column("updated_at", DateTime(timezone=True), default=func.now(), onupdate=func.now()),
+)
+
+
+def rollup_deltas(rows):
+    """{(dimension, value): [total, incorrect]}；与 003 上线时的 stats_rollup_deltas 一致"""
+    deltas = defaultdict(lambda: [0, 0])
+    for row in rows:
+        if row.is_question is not None and not row.is_question:
+            continue
+        incorrect = 0 if row.is_correct else 1
+        keys = [("all", ""), ("subject", (row.subject or "").strip()[:200]),
+                ("error_type", (row.error_type or "").strip()[:200])]
+        points = [p.strip()[:200] for p in re.split(r"[,，、]", row.knowledge_point or "") if p.strip()]
+        keys.extend(("knowledge_point", point) for point in (points or [""]))
+        for key in keys:
+            deltas[key][0] += 1
+            deltas[key][1] += incorrect
+    return deltas
+
+
+def upgrade(conn):
+    if has_table(conn, mistake_stats_rollup.name):
+        return
+    mistake_stats_rollup.create(conn)
+    deltas = rollup_deltas(scan(conn, "mistake_analysis",
+                                "subject, error_type, knowledge_point, is_question, is_correct"))
+    if deltas:
+        conn.execute(mistake_stats_rollup.insert(), [
+            {"dimension": dimension, "value": value, "total": total, "incorrect": incorrect}
+            for (dimension, value), (total, incorrect) in sorted(deltas.items())
+        ])
@@ -0,0 +1,31 @@
+"""004: /mistakes 筛选组合对应的复合索引与部分索引
+
+等值条件在前，排序键 (created_at DESC, id DESC) 在后；incorrect_only 走 is_correct = false
+的部分索引。单列的 subject / error_type 索引是新复合索引的前缀，建好后删除以减少写放大。
+"""
+from db.migrate import create_index, drop_index, is_postgres
+
+RECENT = "created_at DESC, id DESC"
+
+
+def upgrade(conn):
+    # 与查询中 SQLAlchemy 渲染的常量保持一致，部分索引才能被匹配
+    incorrect = "is_correct = false" if is_postgres(conn) else "is_correct = 0"
+    create_index(conn, "ix_mistake_analysis_recent", "mistake_analysis", RECENT)
+    create_index(conn, "ix_mistake_analysis_subject_recent", "mistake_analysis", f"subject, {RECENT}")
+    create_index(conn, "ix_mistake_analysis_error_type_recent", "mistake_analysis", f"error_type, {RECENT}")
+    create_index(conn, "ix_mistake_analysis_subject_error_type_recent", "mistake_analysis",
+                 f"subject, error_type, {RECENT}")
+    create_index(conn, "ix_mistake_analysis_incorrect_recent", "mistake_analysis", RECENT,
+                 where=incorrect)
+    create_index(conn, "ix_mistake_analysis_incorrect_subject_error_type_recent", "mistake_analysis",
+                 f"subject, error_type, {RECENT}", where=incorrect)
+
+    if is_postgres(conn):
+        # 知识点前后模糊匹配（ILIKE '%...%'）
+        conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        create_index(conn, "ix_mistake_analysis_knowledge_point_trgm", "mistake_analysis",
+                     "knowledge_point gin_trgm_ops", using="gin")
+        conn.exec_driver_sql("ANALYZE mistake_analysis")
+    drop_index(conn, "idx_mistake_analysis_subject")
+    drop_index(conn, "idx_mistake_analysis_error_type")
@@ -0,0 +1,6 @@
+"""005: mistake_practices 按错题记录查询 / 级联删除所用的外键索引"""
+from db.migrate import create_index
+
+
+def upgrade(conn):
+    create_index(conn, "idx_mistake_practices_mistake_record_id", "mistake_practices", "mistake_record_id")
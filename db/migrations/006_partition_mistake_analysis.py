@@ -0,0 +1,15 @@
+"""006: mistake_analysis 按月分区（仅 PostgreSQL），mistake_records 增加 created_at 索引
+
+分区转换见 db/partitions.py 的 partition_mistake_analysis：分批复制数据后在短事务内切换表名。
+新库按模型建表后同样需要转换（模型无法声明分区），因此设置 APPLY_ON_FRESH_DB。
+"""
+from db.migrate import create_index
+from db.partitions import partition_mistake_analysis
+
+APPLY_ON_FRESH_DB = True
+
+
+def upgrade(conn):
+    # 保留任务按 created_at 查找旧错题记录
+    create_index(conn, "ix_mistake_records_created_at", "mistake_records", "created_at")
+    partition_mistake_analysis(conn)
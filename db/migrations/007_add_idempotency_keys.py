@@ -0,0 +1,27 @@
+"""007: 幂等键表（/upload/image、/analyze/image 的 Idempotency-Key）"""
+from sqlalchemy import JSON, Column, DateTime, Integer, MetaData, String, Table
+from sqlalchemy.sql import func
+
+from db.migrate import has_table
+
+# 本版本的表结构快照（不引用 db.models）
+idempotency_keys = Table(
+    "idempotency_keys", MetaData(),
+    Column("scope", String(100), primary_key=True),
+    Column("key", String(255), primary_key=True),
+    Column("request_hash", String(64), nullable=False),
+    Column("resource_id", String(255)),
+    Column("status", String(20), nullable=False),
+    Column("attempt", Integer, nullable=False, default=1),
+    Column("status_code", Integer),
+    Column("response", JSON),
+    Column("lease_expires_at", DateTime(timezone=True)),
+    Column("expires_at", DateTime(timezone=True), nullable=False, index=True),
+    Column("created_at", DateTime(timezone=True), default=func.now()),
+)
+
+
+def upgrade(conn):
+    if has_table(conn, idempotency_keys.name):
+        return
+    idempotency_keys.create(conn)
@@ -0,0 +1,32 @@
+"""008: 待分析队列表（Coze 熔断期间保存的上传，恢复后重放分析）"""
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, MetaData, String, Table, Text
+from sqlalchemy.sql import func
+
+from db.migrate import has_table
+
+# 本版本的表结构快照（不引用 db.models；user_id 由 010 添加）
+pending_analyses = Table(
+    "pending_analyses", MetaData(),
+    Column("id", Integer, primary_key=True, index=True),
+    Column("file_id", String(255), unique=True, nullable=False),
+    Column("filename", String(500), nullable=False),
+    Column("original_filename", String(500)),
+    Column("file_type", String(100)),
+    Column("file_size", Integer),
+    Column("image_phash", BigInteger),
+    Column("upload_time", String(50)),
+    Column("status", String(20), nullable=False, default="pending"),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("last_error", Text),
+    Column("mistake_record_id", Integer),
+    Column("available_at", DateTime(timezone=True), nullable=False),
+    Column("created_at", DateTime(timezone=True), default=func.now()),
+    Column("updated_at", DateTime(timezone=True), default=func.now(), onupdate=func.now()),
+)
+Index("ix_pending_analyses_status_available", pending_analyses.c.status, pending_analyses.c.available_at)
+
+
+def upgrade(conn):
+    if has_table(conn, pending_analyses.name):
+        return
+    pending_analyses.create(conn)
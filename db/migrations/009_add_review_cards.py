@@ -0,0 +1,24 @@
+"""009: 间隔复习卡片表（SM-2 调度状态，兼作到期复习队列）"""
+from sqlalchemy import Column, Date, DateTime, Float, Index, Integer, MetaData, Table
+
+from db.migrate import has_table
+
+# 本版本的表结构快照（不引用 db.models；user_id 与按用户的索引由 010 添加）
+review_cards = Table(
+    "review_cards", MetaData(),
+    Column("analysis_id", Integer, primary_key=True, autoincrement=False),
+    Column("due_date", Date, nullable=False),
+    Column("interval_days", Integer, nullable=False, default=0),
+    Column("ease", Float, nullable=False, default=2.5),
+    Column("repetitions", Integer, nullable=False, default=0),
+    Column("lapses", Integer, nullable=False, default=0),
+    Column("last_grade", Integer),
+    Column("last_reviewed_at", DateTime(timezone=True)),
+)
+Index("ix_review_cards_due", review_cards.c.due_date, review_cards.c.analysis_id)
+
+
+def upgrade(conn):
+    if has_table(conn, review_cards.name):
+        return
+    review_cards.create(conn)
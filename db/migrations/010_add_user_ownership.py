@@ -0,0 +1,103 @@
+"""010: 按用户隔离数据：user_id 列、以 user_id 开头的复合索引、按用户的统计汇总表
+
+- 各表新增 user_id INTEGER NOT NULL DEFAULT 0（PostgreSQL 11+ 常量默认值只改元数据，不重写整表），
+  历史数据归属默认用户 0；
+- /mistakes、复习队列的复合索引改为 user_id 开头（新索引建好后再删旧索引，期间查询不退化为全表扫描）；
+  mistake_analysis 已分区时按分区逐个在线建索引，见 db/partitions.py 的 create_partitioned_index；
+- mistake_stats_rollup 主键加上 user_id：汇总表可由分析记录重建，直接删表重建后按用户回填；
+- 表结构与回填逻辑是本版本的快照，不引用 db.models / db.crud；
+- 设置了 MISTAKE_USER_HASH_PARTITIONS 时开启按用户哈希的子分区（新库同样需要，因此设置 APPLY_ON_FRESH_DB）。
+"""
+import re
+from collections import defaultdict
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+from sqlalchemy.sql import func
+
+from db.migrate import add_column, create_index, drop_index, has_column, has_table, is_postgres, scan
+from db.partitions import create_partitioned_index, enable_user_hash_partitions
+
+APPLY_ON_FRESH_DB = True
+
+RECENT = "created_at DESC, id DESC"
+USER_TABLES = ["mistake_records", "mistake_analysis", "mistake_practices", "review_cards", "pending_analyses"]
+OLD_INDEXES = [
+    "ix_mistake_analysis_recent",
+    "ix_mistake_analysis_subject_recent",
+    "ix_mistake_analysis_error_type_recent",
+    "ix_mistake_analysis_subject_error_type_recent",
+    "ix_mistake_analysis_incorrect_recent",
+    "ix_mistake_analysis_incorrect_subject_error_type_recent",
+    "ix_review_cards_due",
+]
+
+mistake_stats_rollup = Table(
+    "mistake_stats_rollup", MetaData(),
+    Column("user_id", Integer, primary_key=True, default=0),
+    Column("dimension", String(50), primary_key=True),
+    Column("value", String(200), primary_key=True),
+    Column("total", Integer, nullable=False, default=0),
+    Column("incorrect", Integer, nullable=False, default=0),
+    Column("updated_at", DateTime(timezone=True), default=func.now(), onupdate=func.now()),
+)
+
+
+def rollup_deltas(rows):
+    """{(user_id, dimension, value): [total, incorrect]}；与 010 上线时的 rebuild_stats_rollup 一致"""
+    deltas = defaultdict(lambda: [0, 0])
+    for row in rows:
+        if row.is_question is not None and not row.is_question:
+            continue
+        incorrect = 0 if row.is_correct else 1
+        keys = [("all", ""), ("subject", (row.subject or "").strip()[:200]),
+                ("error_type", (row.error_type or "").strip()[:200])]
+        points = [p.strip()[:200] for p in re.split(r"[,，、]", row.knowledge_point or "") if p.strip()]
+        keys.extend(("knowledge_point", point) for point in (points or [""]))
+        for dimension, value in keys:
+            deltas[(row.user_id, dimension, value)][0] += 1
+            deltas[(row.user_id, dimension, value)][1] += incorrect
+    return deltas
+
+
+def rebuild_rollup(conn):
+    mistake_stats_rollup.drop(conn, checkfirst=True)
+    mistake_stats_rollup.create(conn)
+    deltas = rollup_deltas(scan(conn, "mistake_analysis",
+                                "user_id, subject, error_type, knowledge_point, is_question, is_correct"))
+    if deltas:
+        conn.execute(mistake_stats_rollup.insert(), [
+            {"user_id": user_id, "dimension": dimension, "value": value, "total": total, "incorrect": incorrect}
+            for (user_id, dimension, value), (total, incorrect) in sorted(deltas.items())
+        ])
+
+
+def upgrade(conn):
+    for table in USER_TABLES:
+        if has_table(conn, table):
+            add_column(conn, table, "user_id", "INTEGER NOT NULL DEFAULT 0")
+
+    # 与查询中 SQLAlchemy 渲染的常量保持一致，部分索引才能被匹配
+    incorrect = "is_correct = false" if is_postgres(conn) else "is_correct = 0"
+    for name, columns, where in [
+        ("ix_mistake_analysis_user_recent", f"user_id, {RECENT}", None),
+        ("ix_mistake_analysis_user_subject_recent", f"user_id, subject, {RECENT}", None),
+        ("ix_mistake_analysis_user_error_type_recent", f"user_id, error_type, {RECENT}", None),
+        ("ix_mistake_analysis_user_subject_error_type_recent", f"user_id, subject, error_type, {RECENT}", None),
+        ("ix_mistake_analysis_user_incorrect_recent", f"user_id, {RECENT}", incorrect),
+        ("ix_mistake_analysis_user_incorrect_subject_error_type_recent",
+         f"user_id, subject, error_type, {RECENT}", incorrect),
+    ]:
+        create_partitioned_index(conn, name, "mistake_analysis", columns, where)
+    create_index(conn, "ix_mistake_records_user_created", "mistake_records", "user_id, created_at")
+    if has_table(conn, "review_cards"):
+        create_index(conn, "ix_review_cards_user_due", "review_cards", "user_id, due_date, analysis_id")
+    for name in OLD_INDEXES:
+        drop_index(conn, name)
+
+    rollup = mistake_stats_rollup.name
+    if not has_table(conn, rollup) or not has_column(conn, rollup, "user_id"):
+        rebuild_rollup(conn)
+
+    enable_user_hash_partitions(conn)
+    if is_postgres(conn):
+        conn.exec_driver_sql("ANALYZE mistake_analysis")
@@ -0,0 +1,26 @@
+"""011: 类练习推荐池按用户划分
+
+practice_pools 主键加上 user_id。练习池是后台任务从错题与类练习算出的派生数据，直接删表重建；
+应用启动时的刷新任务会立即按用户重新生成（也可手动执行 python core/practice_pool.py）。
+表结构是本版本的快照，不引用 db.models。
+"""
+from sqlalchemy import JSON, Column, DateTime, Integer, MetaData, String, Table
+from sqlalchemy.sql import func
+
+from db.migrate import has_column, has_table
+
+practice_pools = Table(
+    "practice_pools", MetaData(),
+    Column("user_id", Integer, primary_key=True, default=0),
+    Column("knowledge_point", String(200), primary_key=True),
+    Column("error_type", String(100), primary_key=True),
+    Column("practice_ids", JSON),
+    Column("updated_at", DateTime(timezone=True), default=func.now()),
+)
+
+
+def upgrade(conn):
+    if has_table(conn, practice_pools.name) and has_column(conn, practice_pools.name, "user_id"):
+        return
+    practice_pools.drop(conn, checkfirst=True)
+    practice_pools.create(conn)
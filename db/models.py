@@ -0,0 +1,233 @@
+"""数据库模型定义（PostgreSQL 与 SQLite 共用）
+
+database_config.py（PostgreSQL）与 sqlite_config.py（SQLite）只负责创建各自的引擎与会话，
+模型统一在这里定义；表结构变更通过 db/migrations 下的版本化迁移发布（见 db/migrate.py）。
+
+错题相关表的 user_id 为数据所属用户（见 db/tenancy.py），不设外键：用户由上游鉴权系统管理，
+users 表中不一定有对应行；历史数据归属 DEFAULT_USER_ID（0）。
+"""
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, Date, DateTime, Float, ForeignKey, JSON, Index
+from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.sql import func
+
+# 创建基类
+Base = declarative_base()
+
+class MistakeRecord(Base):
+    """错题记录表"""
+    __tablename__ = "mistake_records"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, default=0, server_default="0")
+    file_id = Column(String(255), unique=True, index=True, nullable=False)
+    filename = Column(String(500), nullable=False)
+    file_url = Column(String(1000))
+    file_size = Column(Integer)
+    file_type = Column(String(100))
+    image_phash = Column(BigInteger, index=True)  # 图片感知哈希（64 位 pHash，有符号存储）
+    source_file_id = Column(String(255), index=True)  # 多页 PDF 拆页时，原 PDF 的 file_id
+    page_index = Column(Integer)  # 多页 PDF 拆页时的页码（从 0 开始）
+    upload_time = Column(DateTime(timezone=True), default=func.now())
+    created_at = Column(DateTime(timezone=True), default=func.now(), index=True)
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+    # 关系
+    analyses = relationship("MistakeAnalysis", back_populates="mistake_record", cascade="all, delete-orphan")
+    practices = relationship("MistakePractice", back_populates="mistake_record", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # 按用户加载感知哈希索引
+        Index("ix_mistake_records_user_created", user_id, created_at),
+    )
+
+class MistakeAnalysis(Base):
+    """错题分析表
+
+    PostgreSQL 下按 created_at 按月分区，数据库主键为 (id, created_at)，见 db/partitions.py；
+    id 仍由序列生成、全局唯一，ORM 只以 id 作为标识。user_id 与所属错题记录一致（冗余存储，
+    列表查询无需关联 mistake_records 即可按用户过滤）。
+    """
+    __tablename__ = "mistake_analysis"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, default=0, server_default="0")
+    mistake_record_id = Column(Integer, ForeignKey("mistake_records.id", ondelete="CASCADE"))
+    subject = Column(String(100))  # 学科
+    section = Column(String(200))
+    question = Column(Text)
+    answer = Column(Text)
+    is_question = Column(Boolean, default=True)
+    is_correct = Column(Boolean, default=False)
+    correct_answer = Column(Text)
+    comment = Column(Text)
+    error_type = Column(String(100))  # 错因类型
+    knowledge_point = Column(String(200))  # 知识点
+    analysis_data = Column(JSON)  # 完整的分析数据
+    created_at = Column(DateTime(timezone=True), default=func.now())
+
+    # 关系
+    mistake_record = relationship("MistakeRecord", back_populates="analyses")
+
+    # 与 /mistakes 的筛选组合一一对应：user_id 在最前（每个查询都按用户过滤），其余等值条件其次，
+    # 排序键 (created_at DESC, id DESC) 在后，分页时无需额外排序；仅看错题时走 is_correct = false 的部分索引
+    __table_args__ = (
+        Index("ix_mistake_analysis_user_recent", user_id, created_at.desc(), id.desc()),
+        Index("ix_mistake_analysis_user_subject_recent", user_id, subject, created_at.desc(), id.desc()),
+        Index("ix_mistake_analysis_user_error_type_recent", user_id, error_type, created_at.desc(), id.desc()),
+        Index("ix_mistake_analysis_user_subject_error_type_recent",
+              user_id, subject, error_type, created_at.desc(), id.desc()),
+        Index("ix_mistake_analysis_user_incorrect_recent", user_id, created_at.desc(), id.desc(),
+              postgresql_where=is_correct == False, sqlite_where=is_correct == False),  # noqa: E712
+        Index("ix_mistake_analysis_user_incorrect_subject_error_type_recent",
+              user_id, subject, error_type, created_at.desc(), id.desc(),
+              postgresql_where=is_correct == False, sqlite_where=is_correct == False),  # noqa: E712
+    )
+
+class MistakePractice(Base):
+    """类练习（相似练习）"""
+    __tablename__ = "mistake_practices"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, default=0, server_default="0")
+    mistake_record_id = Column(Integer, ForeignKey("mistake_records.id", ondelete="CASCADE"))
+    question = Column(Text)
+    correct_answer = Column(Text)
+    comment = Column(Text)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+
+    mistake_record = relationship("MistakeRecord", back_populates="practices")
+
+    __table_args__ = (
+        Index("idx_mistake_practices_mistake_record_id", mistake_record_id),
+    )
+
+class PracticeText(Base):
+    """类练习题干去重表（按规范化题干哈希去重）"""
+    __tablename__ = "practice_texts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), unique=True, index=True, nullable=False)
+    question = Column(Text)
+    correct_answer = Column(Text)
+    comment = Column(Text)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+
+class PracticePool(Base):
+    """类练习推荐池（按用户 + 知识点 + 错因预计算，空字符串表示不限）
+
+    每个用户的练习池只由该用户的错题生成；practice_texts 按内容哈希去重、不区分用户，只能经由练习池取到。
+    """
+    __tablename__ = "practice_pools"
+
+    user_id = Column(Integer, primary_key=True, default=0)
+    knowledge_point = Column(String(200), primary_key=True)
+    error_type = Column(String(100), primary_key=True)
+    practice_ids = Column(JSON)  # 按推荐顺序排列的 practice_texts.id
+    updated_at = Column(DateTime(timezone=True), default=func.now())
+
+class MistakeStatsRollup(Base):
+    """错题统计汇总表（按维度预聚合，写入分析记录时增量维护）
+
+    dimension 取 all / subject / error_type / knowledge_point，value 为空字符串表示未填写；
+    多个知识点以逗号拼接时分别计数。按用户分别汇总，/stats 只读当前用户的行。
+    """
+    __tablename__ = "mistake_stats_rollup"
+
+    user_id = Column(Integer, primary_key=True, default=0)
+    dimension = Column(String(50), primary_key=True)
+    value = Column(String(200), primary_key=True)
+    total = Column(Integer, nullable=False, default=0)  # 题目数
+    incorrect = Column(Integer, nullable=False, default=0)  # 错题数
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+class IdempotencyKey(Base):
+    """幂等键（Idempotency-Key 请求头）
+
+    处理前先写入 in_progress 标记并持有租约（lease_expires_at），完成后写入响应；
+    租约过期仍未完成说明处理中途崩溃，重试请求可以接管（attempt 递增，作为乐观锁）。
+    resource_id 为预先分配的 file_id，接管时沿用，据此找回崩溃前已保存的错题记录。
+    """
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String(100), primary_key=True)  # 接口，如 upload/image
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)  # 请求内容摘要，同一个键不允许用于不同请求
+    resource_id = Column(String(255))
+    status = Column(String(20), nullable=False)  # in_progress / completed
+    attempt = Column(Integer, nullable=False, default=1)
+    status_code = Column(Integer)
+    response = Column(JSON)
+    lease_expires_at = Column(DateTime(timezone=True))
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+
+class PendingAnalysis(Base):
+    """待分析队列（Coze 熔断期间已保存的上传，恢复后由后台任务重放分析）
+
+    available_at 为可被领取的时间：领取时推后一个租约时长，处理中途崩溃时租约到期后重新领取。
+    """
+    __tablename__ = "pending_analyses"
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_id = Column(String(255), unique=True, nullable=False)
+    filename = Column(String(500), nullable=False)  # media/uploads 下的文件名
+    original_filename = Column(String(500))
+    file_type = Column(String(100))
+    file_size = Column(Integer)
+    image_phash = Column(BigInteger)
+    upload_time = Column(String(50))
+    user_id = Column(Integer, nullable=False, default=0, server_default="0")
+    status = Column(String(20), nullable=False, default="pending")  # pending / done / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    mistake_record_id = Column(Integer)
+    available_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_pending_analyses_status_available", status, available_at),
+    )
+
+class User(Base):
+    """用户表（用于未来扩展）"""
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String(100), unique=True, index=True)
+    email = Column(String(255), unique=True, index=True)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+
+class ReviewPlan(Base):
+    """复习计划表"""
+    __tablename__ = "review_plans"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    plan_name = Column(String(200))
+    plan_data = Column(JSON)  # 复习计划详情
+    created_at = Column(DateTime(timezone=True), default=func.now())
+    scheduled_date = Column(DateTime)
+
+class ReviewCard(Base):
+    """间隔复习卡片（每道判错的题目一张，SM-2 调度状态）
+
+    表本身就是复习队列：due_date 为下次复习日期，/review/due 按 (user_id, due_date, analysis_id) 索引范围扫描，
+    请求时不重新计算调度。analysis_id 对应 mistake_analysis.id；该表在 PostgreSQL 下分区、主键为
+    (id, created_at)，无法建外键，分析记录删除后由调度任务清理对应卡片。
+    """
+    __tablename__ = "review_cards"
+
+    analysis_id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False, default=0, server_default="0")  # 与分析记录一致
+    due_date = Column(Date, nullable=False)
+    interval_days = Column(Integer, nullable=False, default=0)
+    ease = Column(Float, nullable=False, default=2.5)  # SM-2 难度系数（EF），不低于 1.3
+    repetitions = Column(Integer, nullable=False, default=0)  # 连续答对次数
+    lapses = Column(Integer, nullable=False, default=0)  # 累计遗忘次数
+    last_grade = Column(Integer)
+    last_reviewed_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_review_cards_user_due", user_id, due_date, analysis_id),
+    )
@@ -0,0 +1,402 @@
+"""mistake_analysis 按月分区与数据保留（仅 PostgreSQL）
+
+mistake_analysis 以 created_at 做 RANGE 分区，每月一个分区（mistake_analysis_pYYYYMM），
+另有 DEFAULT 分区兜底超出预建范围的数据。/mistakes 带日期范围查询时只扫描命中的月份分区，
+各分区上的索引也只覆盖当月数据，热数据的索引始终很小。
+
+保留策略：超过 MISTAKE_RETENTION_MONTHS 个月的分区先用 COPY 导出为 gzip 压缩的 CSV 写入 ARCHIVE_DIR
+（冷存储，可再同步到对象存储），导出成功后在同一事务中从统计汇总 mistake_stats_rollup 按用户减去
+该分区的计数、DETACH 并 DROP：任何一步失败分区都保持原样，下次维护重新归档；随后把
+已没有分析记录的旧 mistake_records（连同类练习）同样导出后分批删除。旧版本中途失败留下的
+已 DETACH 未 DROP 的月份分区，会在删除错题记录之前先补完归档（否则其分析记录会随外键级联删除而未归档）。
+
+按用户哈希分区（可选，MISTAKE_USER_HASH_PARTITIONS > 0）：之后新建的月份分区再按 HASH (user_id)
+拆成 N 个子分区（mistake_analysis_pYYYYMM_hK），带 user_id 的查询只扫描一个子分区，单个用户的查询
+耗时不随用户总数增长。子分区要求主键包含 user_id，开启时主键改为 (id, created_at, user_id)，
+见 enable_user_hash_partitions；已有数据的月份分区保持原样，随保留策略自然过期。
+
+mistake_records 不分区：它是 mistake_analysis / mistake_practices 外键引用的表，且 file_id
+需要全局唯一，分区后主键和唯一约束都必须带上分区键，两者都无法保持。
+
+SQLite 后端不支持分区，本模块的函数在 SQLite 下直接返回。
+"""
+import gzip
+import hashlib
+import logging
+import os
+import re
+from collections import defaultdict
+from datetime import date, datetime, timezone
+
+from sqlalchemy import inspect, text
+
+from db.migrate import MIGRATION_BATCH_SIZE, MIGRATION_LOCK_TIMEOUT, create_index, is_postgres, scan
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLE = "mistake_analysis"
+PARTITION_KEY = "created_at"
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))  # 提前建好未来几个月的分区
+PARTITION_MAINTENANCE_SECONDS = int(os.getenv("PARTITION_MAINTENANCE_SECONDS", "86400"))  # 0 表示不在应用内维护
+MISTAKE_RETENTION_MONTHS = int(os.getenv("MISTAKE_RETENTION_MONTHS", "24"))  # 0 表示永久保留
+MISTAKE_USER_HASH_PARTITIONS = int(os.getenv("MISTAKE_USER_HASH_PARTITIONS", "0"))  # 每月按用户哈希的子分区数，0 表示不拆分
+USER_KEY = "user_id"
+ARCHIVE_DIR = os.getenv(
+    "ARCHIVE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "archive"),
+)
+
+_PARTITION_NAME = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def month_start(value):
+    """所在月份的第一天"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month, table=PARTITIONED_TABLE):
+    return f"{table}_p{month.year:04d}{month.month:02d}"
+
+
+def partition_month(name):
+    """从分区名解析月份，DEFAULT 等其他分区返回 None"""
+    match = _PARTITION_NAME.search(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def partitions_to_archive(names, today=None, retention_months=MISTAKE_RETENTION_MONTHS):
+    """返回整月都早于保留期的分区名（按月份升序）"""
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(month_start(today or date.today()), -retention_months)
+    months = [(partition_month(name), name) for name in names]
+    return [name for month, name in sorted(m for m in months if m[0]) if month < cutoff]
+
+
+def is_partitioned(conn, table=PARTITIONED_TABLE):
+    if not is_postgres(conn):
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :table AND pg_table_is_visible(c.oid)"), {"table": table}).first() is not None
+
+
+def list_partitions(conn, table=PARTITIONED_TABLE):
+    return [row[0] for row in conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :table AND pg_table_is_visible(p.oid) ORDER BY c.relname"), {"table": table})]
+
+
+def primary_key_columns(conn, table=PARTITIONED_TABLE):
+    return inspect(conn).get_pk_constraint(table)["constrained_columns"]
+
+
+def ensure_partitions(conn, start=None, months_ahead=PARTITION_PREMAKE_MONTHS, table=PARTITIONED_TABLE,
+                      partition_prefix=PARTITIONED_TABLE, hash_partitions=None):
+    """建好 start 所在月到当前月之后 months_ahead 个月的分区（已存在的跳过），返回新建的分区名
+
+    hash_partitions（缺省取 MISTAKE_USER_HASH_PARTITIONS）大于 0 且主键包含 user_id 时，
+    新建的月份分区再按 HASH (user_id) 拆成子分区。
+    """
+    if not is_partitioned(conn, table):
+        return []
+    hash_partitions = MISTAKE_USER_HASH_PARTITIONS if hash_partitions is None else hash_partitions
+    if hash_partitions > 0 and USER_KEY not in primary_key_columns(conn, table):
+        logger.warning(f"[分区] {table} 主键不含 {USER_KEY}，新分区不按用户拆分（先执行 enable_user_hash_partitions）")
+        hash_partitions = 0
+    existing = set(list_partitions(conn, table))
+    month = month_start(start or date.today())
+    last = add_months(month_start(date.today()), months_ahead)
+    created = []
+    while month <= last:
+        name = partition_name(month, partition_prefix)
+        if name not in existing:
+            try:
+                subpartition = f" PARTITION BY HASH ({USER_KEY})" if hash_partitions > 0 else ""
+                conn.exec_driver_sql(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}'){subpartition}")
+                for remainder in range(hash_partitions):
+                    conn.exec_driver_sql(
+                        f"CREATE TABLE IF NOT EXISTS {name}_h{remainder} PARTITION OF {name} "
+                        f"FOR VALUES WITH (MODULUS {hash_partitions}, REMAINDER {remainder})")
+                created.append(name)
+            except Exception as e:
+                # DEFAULT 分区里已有该月数据时无法直接建分区，需要人工迁出后重试
+                logger.error(f"[分区] 创建分区 {name} 失败: {e}")
+        month = add_months(month, 1)
+    default = f"{partition_prefix}_default"
+    if default not in existing:
+        conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {default} PARTITION OF {table} DEFAULT")
+        created.append(default)
+    if created:
+        logger.info(f"[分区] {table} 新建分区: {', '.join(created)}")
+    return created
+
+
+def rewrite_index_def(indexdef, source_table, target_table, suffix):
+    """把 pg_indexes.indexdef 改写为在 target_table 上建同样的索引（索引名加 suffix）"""
+    indexdef = re.sub(r"^CREATE INDEX (\S+) ON ", lambda m: f"CREATE INDEX {m.group(1)}{suffix} ON ", indexdef)
+    return re.sub(rf" ON (?:\w+\.)?{source_table} ", f" ON {target_table} ", indexdef, count=1)
+
+
+def partition_mistake_analysis(conn, batch_size=None, months_ahead=PARTITION_PREMAKE_MONTHS):
+    """把普通的 mistake_analysis 表在线转换为按月分区表（迁移 006 调用，可重复执行）
+
+    1. 新建分区父表 mistake_analysis_partitioned（主键改为 (id, created_at)，不受 MISTAKE_USER_HASH_PARTITIONS
+       影响），建好覆盖现有数据的月份分区和原表的全部普通索引；
+    2. 按主键区间分批复制数据，每批单独提交，期间原表照常读写；
+    3. 在一个短事务中对原表加 EXCLUSIVE 锁（阻塞写、不阻塞读），补齐复制期间新增的行，
+       把 id 序列转交新表，删除原表并改名，恢复外键。
+    mistake_analysis 只插入不更新，补齐时只需复制 id 更大的新行。
+    """
+    if not is_postgres(conn) or is_partitioned(conn):
+        return False
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
+    source, target, suffix = PARTITIONED_TABLE, f"{PARTITIONED_TABLE}_partitioned", "_part"
+
+    columns = [column["name"] for column in inspect(conn).get_columns(source)]
+    select_list = ", ".join(f"COALESCE({c}, now())" if c == PARTITION_KEY else c for c in columns)
+    copy_sql = f"INSERT INTO {target} ({', '.join(columns)}) SELECT {select_list} FROM {source} "
+
+    if not is_partitioned(conn, target):
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {target}")  # 上次中途失败的残留
+        # 主键固定为 (id, created_at)：已有库执行到这里时还没有 user_id 列（010 才加），
+        # 按用户哈希的子分区由 010 的 enable_user_hash_partitions 改主键后再开启
+        conn.exec_driver_sql(
+            f"CREATE TABLE {target} (LIKE {source} INCLUDING DEFAULTS, PRIMARY KEY (id, {PARTITION_KEY})) "
+            f"PARTITION BY RANGE ({PARTITION_KEY})")
+        oldest = conn.execute(text(f"SELECT MIN({PARTITION_KEY}) FROM {source}")).scalar()
+        ensure_partitions(conn, start=oldest, months_ahead=months_ahead, table=target, hash_partitions=0)
+        index_defs = conn.execute(text(
+            "SELECT indexname, indexdef FROM pg_indexes "
+            "WHERE tablename = :table AND schemaname = current_schema()"), {"table": source}).all()
+        for name, indexdef in index_defs:
+            if indexdef.startswith("CREATE INDEX"):  # 主键和唯一索引不迁移（分区表上必须带分区键）
+                conn.exec_driver_sql(rewrite_index_def(indexdef, source, target, suffix))
+
+    copied = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {target}")).scalar()
+    high = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {source}")).scalar()
+    for start in range(copied + 1, high + 1, batch_size):
+        conn.execute(text(copy_sql + "WHERE id >= :start AND id < :end"), {"start": start, "end": start + batch_size})
+    logger.info(f"[分区] {source} 已复制到 {target}（id <= {high}）")
+
+    index_names = [row[0] for row in conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = :table AND schemaname = current_schema()"),
+        {"table": target}) if row[0].endswith(suffix)]
+    sequence = conn.execute(text(f"SELECT pg_get_serial_sequence('{source}', 'id')")).scalar()
+
+    conn.exec_driver_sql("BEGIN")
+    try:
+        conn.exec_driver_sql(f"SET LOCAL lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+        conn.exec_driver_sql(f"LOCK TABLE {source} IN EXCLUSIVE MODE")
+        conn.execute(text(copy_sql + "WHERE id > :high"), {"high": high})
+        if sequence:
+            conn.exec_driver_sql(f"ALTER SEQUENCE {sequence} OWNED BY {target}.id")
+        conn.exec_driver_sql(f"DROP TABLE {source}")
+        conn.exec_driver_sql(f"ALTER TABLE {target} RENAME TO {source}")
+        conn.exec_driver_sql(f"ALTER INDEX {target}_pkey RENAME TO {source}_pkey")
+        for name in index_names:
+            conn.exec_driver_sql(f"ALTER INDEX {name} RENAME TO {name[:-len(suffix)]}")
+        conn.exec_driver_sql(
+            f"ALTER TABLE {source} ADD CONSTRAINT {source}_mistake_record_id_fkey FOREIGN KEY (mistake_record_id) "
+            f"REFERENCES mistake_records (id) ON DELETE CASCADE")
+        conn.exec_driver_sql("COMMIT")
+    except Exception:
+        conn.exec_driver_sql("ROLLBACK")
+        raise
+    conn.exec_driver_sql(f"ANALYZE {source}")
+    logger.info(f"[分区] {source} 已切换为按月分区表")
+    return True
+
+
+def enable_user_hash_partitions(conn, hash_partitions=None):
+    """开启按用户哈希的子分区（迁移 010 调用，可重复执行），返回是否做了变更
+
+    1. 主键不含 user_id 时改为 (id, created_at, user_id)：重建主键索引期间整表加锁，
+       数据量大时应在低峰期执行（只在显式设置 MISTAKE_USER_HASH_PARTITIONS 时发生）；
+    2. 尚未写入数据的未来月份分区删除后按子分区重建，已有数据的分区保持原样。
+    """
+    hash_partitions = MISTAKE_USER_HASH_PARTITIONS if hash_partitions is None else hash_partitions
+    if hash_partitions <= 0 or not is_partitioned(conn):
+        return False
+    table = PARTITIONED_TABLE
+    if USER_KEY not in primary_key_columns(conn, table):
+        conn.exec_driver_sql("BEGIN")
+        try:
+            conn.exec_driver_sql(f"SET LOCAL lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+            conn.exec_driver_sql(
+                f"ALTER TABLE {table} DROP CONSTRAINT {table}_pkey, "
+                f"ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, {PARTITION_KEY}, {USER_KEY})")
+            conn.exec_driver_sql("COMMIT")
+        except Exception:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+        logger.info(f"[分区] {table} 主键改为 (id, {PARTITION_KEY}, {USER_KEY})")
+
+    current = month_start(date.today())
+    for name in list_partitions(conn, table):
+        month = partition_month(name)
+        if month is None or month <= current or is_partitioned(conn, name):
+            continue
+        conn.exec_driver_sql("BEGIN")
+        try:
+            conn.exec_driver_sql(f"SET LOCAL lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+            conn.exec_driver_sql(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE")
+            if conn.execute(text(f"SELECT 1 FROM {name} LIMIT 1")).first() is None:
+                conn.exec_driver_sql(f"DROP TABLE {name}")
+            conn.exec_driver_sql("COMMIT")
+        except Exception:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+    ensure_partitions(conn, hash_partitions=hash_partitions)
+    return True
+
+
+def create_partitioned_index(conn, name, table, columns, where=None):
+    """在（可能已分区的）表上在线建索引，可重复执行
+
+    分区表不支持 CREATE INDEX CONCURRENTLY：先 ON ONLY 在父表上建一个无效的索引（只改元数据），
+    再在各分区（子分区递归处理）上 CONCURRENTLY 建索引并 ATTACH，全部挂上后父表索引自动生效；
+    之后新建的分区自动带上该索引。未分区的表（含 SQLite）直接调用 create_index。
+    """
+    if not is_partitioned(conn, table):
+        return create_index(conn, name, table, columns, where=where)
+    where_sql = f" WHERE {where}" if where else ""
+    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} ({columns}){where_sql}")
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]  # 分区索引名不超过 63 个字符
+    for partition in list_partitions(conn, table):
+        child = f"{partition}_{digest}"
+        create_partitioned_index(conn, child, partition, columns, where)
+        conn.exec_driver_sql(f"ALTER INDEX {name} ATTACH PARTITION {child}")  # 已挂上时不做任何事
+    return True
+
+
+def _copy_to_gzip(conn, query, path):
+    """COPY 导出为 gzip 压缩的 CSV（先写临时文件，完成后改名）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    raw = conn.connection.dbapi_connection
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        with raw.cursor() as cursor:
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def subtract_stats_rollup(conn, table, batch_size=None):
+    """从统计汇总中按用户减去 table（已 DETACH 的分区）中分析记录的计数，返回扣减的汇总行数
+
+    计数减到 0 的汇总行直接删除，结果与按剩余数据 rebuild_stats_rollup 一致。
+    """
+    from db.crud import stats_rollup_deltas
+
+    user_deltas = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    for row in scan(conn, table, "user_id, subject, error_type, knowledge_point, is_question, is_correct",
+                    batch_size):
+        deltas = user_deltas[row.user_id]
+        for key, (total, incorrect) in stats_rollup_deltas([row]).items():
+            deltas[key][0] += total
+            deltas[key][1] += incorrect
+    params = [
+        {"user_id": user_id, "dimension": dimension, "value": value, "total": total, "incorrect": incorrect}
+        for user_id, deltas in sorted(user_deltas.items())
+        for (dimension, value), (total, incorrect) in sorted(deltas.items())
+    ]
+    if params:
+        conn.execute(text("UPDATE mistake_stats_rollup SET total = total - :total, incorrect = incorrect - :incorrect, "
+                          "updated_at = CURRENT_TIMESTAMP "
+                          "WHERE user_id = :user_id AND dimension = :dimension AND value = :value"), params)
+        conn.execute(text("DELETE FROM mistake_stats_rollup WHERE total <= 0"))
+    return len(params)
+
+
+def detached_partitions(conn, table=PARTITIONED_TABLE):
+    """已 DETACH 但还没有 DROP 的月份分区（旧版本归档中途失败留下的）"""
+    names = [row[0] for row in conn.execute(text(
+        "SELECT relname FROM pg_class WHERE relkind IN ('r', 'p') AND NOT relispartition "
+        "AND relname LIKE :pattern AND pg_table_is_visible(oid) ORDER BY relname"),
+        {"pattern": f"{table}\\_p%"})]
+    return [name for name in names if partition_month(name)]
+
+
+def archive_partition(conn, name, archive_dir=ARCHIVE_DIR):
+    """导出分区到冷存储 → 扣减统计汇总、DETACH 并 DROP（同一事务），返回归档文件路径"""
+    path = _copy_to_gzip(conn, f"SELECT * FROM {name}", os.path.join(archive_dir, f"{name}.csv.gz"))
+    # 扣减、DETACH、DROP 在同一事务中提交：中途失败时分区仍挂在父表上，下次维护重新归档，不会重复扣减。
+    # 先锁住分区本身（只阻塞对该分区的写入）再读取计数；父表的排他锁只在最后 DETACH 时短暂持有
+    attached = name in list_partitions(conn)
+    conn.exec_driver_sql("BEGIN")
+    try:
+        conn.exec_driver_sql(f"SET LOCAL lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+        conn.exec_driver_sql(f"LOCK TABLE {name} IN SHARE MODE")
+        subtracted = subtract_stats_rollup(conn, name)
+        if attached:
+            conn.exec_driver_sql(f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {name}")
+        conn.exec_driver_sql(f"DROP TABLE {name}")
+        conn.exec_driver_sql("COMMIT")
+    except Exception:
+        conn.exec_driver_sql("ROLLBACK")
+        raise
+    logger.info(f"[保留] 分区 {name} 已归档到 {path}，统计汇总扣减 {subtracted} 行")
+    return path
+
+
+def archive_orphan_records(conn, cutoff, archive_dir=ARCHIVE_DIR, batch_size=None):
+    """归档并删除早于 cutoff 且已没有分析记录的错题记录（类练习随外键级联删除），返回删除行数"""
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
+    orphan = (f"created_at < '{cutoff.isoformat()}' AND NOT EXISTS "
+              f"(SELECT 1 FROM {PARTITIONED_TABLE} a WHERE a.mistake_record_id = mistake_records.id)")
+    low, high = conn.execute(text(f"SELECT MIN(id), MAX(id) FROM mistake_records WHERE {orphan}")).first()
+    if low is None:
+        return 0
+    stamp = cutoff.strftime("%Y%m")
+    _copy_to_gzip(conn, f"SELECT * FROM mistake_records WHERE {orphan} AND id <= {high}",
+                  os.path.join(archive_dir, f"mistake_records_before_{stamp}.csv.gz"))
+    _copy_to_gzip(conn, f"SELECT p.* FROM mistake_practices p JOIN mistake_records ON mistake_records.id = "
+                        f"p.mistake_record_id WHERE {orphan} AND mistake_records.id <= {high}",
+                  os.path.join(archive_dir, f"mistake_practices_before_{stamp}.csv.gz"))
+    deleted = 0
+    for start in range(low, high + 1, batch_size):
+        result = conn.execute(text(f"DELETE FROM mistake_records WHERE id >= :start AND id < :end AND {orphan}"),
+                              {"start": start, "end": min(start + batch_size, high + 1)})
+        deleted += result.rowcount or 0
+    logger.info(f"[保留] 归档并删除 {deleted} 条 {cutoff} 之前的错题记录")
+    return deleted
+
+
+def run_maintenance(engine, retention_months=MISTAKE_RETENTION_MONTHS, archive_dir=ARCHIVE_DIR, dry_run=False):
+    """预建分区并执行保留策略，返回执行摘要"""
+    summary = {"created": [], "archived": [], "records_deleted": 0}
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not is_partitioned(conn):
+            logger.info("[分区] mistake_analysis 不是分区表（SQLite 或迁移 006 未执行），跳过")
+            return summary
+        summary["created"] = ensure_partitions(conn)
+        # 上次中途失败留下的分区排在最前：必须在删除孤立的错题记录之前归档
+        expired = detached_partitions(conn) + partitions_to_archive(list_partitions(conn),
+                                                                     retention_months=retention_months)
+        summary["archived"] = expired
+        if dry_run:
+            return summary
+        for name in expired:
+            archive_partition(conn, name, archive_dir)
+        if retention_months <= 0:
+            return summary
+        cutoff = add_months(month_start(datetime.now(timezone.utc)), -retention_months)
+        summary["records_deleted"] = archive_orphan_records(conn, cutoff, archive_dir)
+    return summary
+
+
+def ensure_partitions_once(engine):
+    """只预建分区（应用内定时调用），返回新建的分区名"""
+    with engine.connect() as conn:
+        return ensure_partitions(conn.execution_options(isolation_level="AUTOCOMMIT"))
+
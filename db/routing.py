@@ -0,0 +1,84 @@
+"""数据库读写路由（主库 + 只读副本）
+
+写操作始终走主库；错题本一览、错题详情等读请求轮询分配到只读副本，减轻主库压力。
+副本存在复制延迟，客户端刚写入后立刻查询可能看不到自己的数据，因此提供"读己之写"：
+某个客户端写入后 READ_REPLICA_STICKY_SECONDS 秒内，它的读请求仍走主库。
+
+客户端标识通过 contextvar 传递（应用在中间件中按请求设置），写入方和读取方无需显式传参；
+未配置副本时所有读请求直接走主库。
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+READ_REPLICA_STICKY_SECONDS = float(os.getenv("READ_REPLICA_STICKY_SECONDS", "5"))
+
+_route_key = ContextVar("db_route_key", default=None)
+
+
+def set_route_key(key):
+    """设置当前请求的客户端标识，返回用于恢复的 token"""
+    return _route_key.set(key)
+
+
+def reset_route_key(token):
+    _route_key.reset(token)
+
+
+class SessionRouter:
+    """按读写类型分配会话：writer() 走主库，reader() 走副本（最近写过的客户端走主库）"""
+
+    def __init__(self, primary, replicas=(), sticky_seconds=READ_REPLICA_STICKY_SECONDS, clock=time.monotonic):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.sticky_seconds = sticky_seconds
+        self.clock = clock
+        self.stats = {"primary_reads": 0, "replica_reads": 0, "sticky_reads": 0}
+        self._recent_writes = {}  # 客户端标识 -> 粘滞到期时间
+        self._lock = threading.Lock()
+        self._next_replica = itertools.count()
+
+    @property
+    def has_replicas(self):
+        return bool(self.replicas)
+
+    def writer(self):
+        return self.primary()
+
+    def mark_write(self, key=None):
+        """记录客户端刚写入（key 缺省时取当前请求的客户端标识）"""
+        if not self.replicas or self.sticky_seconds <= 0:
+            return
+        key = key if key is not None else _route_key.get()
+        now = self.clock()
+        with self._lock:
+            self._recent_writes[key] = now + self.sticky_seconds
+            if len(self._recent_writes) > 10000:
+                self._recent_writes = {k: v for k, v in self._recent_writes.items() if v > now}
+
+    def is_sticky(self, key=None):
+        key = key if key is not None else _route_key.get()
+        with self._lock:
+            deadline = self._recent_writes.get(key)
+            if deadline is None:
+                return False
+            if deadline <= self.clock():
+                del self._recent_writes[key]
+                return False
+            return True
+
+    def reader(self, key=None):
+        """返回读会话：无副本或客户端处于读己之写窗口内时走主库，否则轮询副本"""
+        if not self.replicas:
+            self.stats["primary_reads"] += 1
+            return self.primary()
+        if self.is_sticky(key):
+            self.stats["sticky_reads"] += 1
+            return self.primary()
+        self.stats["replica_reads"] += 1
+        return self.replicas[next(self._next_replica) % len(self.replicas)]()
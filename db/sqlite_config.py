@@ -1,85 +1,114 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, ForeignKey, JSON
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy.sql import func
-from datetime import datetime
+import sys
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
 import logging
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 模型与数据访问函数与 PostgreSQL 后端共用（见 db/models.py、db/crud.py）
+from db.models import (  # noqa: E402,F401
+    Base, MistakeRecord, MistakeAnalysis, MistakePractice, PracticeText, PracticePool,
+    MistakeStatsRollup, IdempotencyKey, PendingAnalysis, User, ReviewPlan, ReviewCard,
+)
+from db.crud import (  # noqa: E402,F401
+    save_mistake_record, add_mistake_record, add_mistake_analyses, add_mistake_practices, replace_mistake_analyses,
+    get_mistake_records, get_mistake_analysis_by_file_id, build_mistakes_query,
+    parse_mistake_list_fields, count_mistakes, select_mistakes_page, MISTAKE_LIST_PREVIEW_CHARS,
+    MISTAKE_EXPORT_COLUMNS, iter_mistake_export_batches,
+    IDEMPOTENCY_LEASE_SECONDS, IDEMPOTENCY_TTL_SECONDS, claim_idempotency_key, complete_idempotency_key,
+    release_idempotency_key, purge_expired_idempotency_keys,
+    enqueue_pending_analysis, claim_pending_analysis, complete_pending_analysis, retry_pending_analysis,
+    get_pending_analysis, get_learning_sheet_items,
+    get_similar_mistakes, rebuild_stats_rollup, get_mistake_stats,
+)
+from db.routing import SessionRouter  # noqa: E402
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# SQLite数据库配置
-DATABASE_URL = "sqlite:///./mistake_note.db"
+# SQLite数据库配置（单机部署的生产模式）
+SQLITE_CONFIG = {
+    'url': os.getenv('SQLITE_DATABASE_URL', 'sqlite:///./mistake_note.db'),
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),  # WAL：读不阻塞写，写不阻塞读
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),  # WAL 下 NORMAL 断电最多丢最近的提交，不会损坏数据库
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),  # 字节
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', str(-64 * 1024))),  # 负数表示 KiB，即 64MB 页缓存
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),  # 拿不到锁时等待的毫秒数
+}
+
+DATABASE_URL = SQLITE_CONFIG['url']
+
+
+def create_sqlite_engine(url=None, config=None):
+    """创建 SQLite 引擎：每个新连接设置 WAL 等 PRAGMA
+
+    pysqlite 默认不会在 SAVEPOINT 前开启事务，单写线程的合并提交依赖 SAVEPOINT，
+    因此关闭驱动自带的事务管理，改为在 SQLAlchemy 开启事务时显式发出 BEGIN
+    （连接设置 sqlite_begin_immediate 时发出 BEGIN IMMEDIATE，一开始就拿写锁，避免读锁升级时死锁）。
+    """
+    config = {**SQLITE_CONFIG, **(config or {})}
+    engine = create_engine(url or config['url'], connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA busy_timeout = {int(config['busy_timeout'])}")
+            cursor.execute(f"PRAGMA journal_mode = {config['journal_mode']}")
+            cursor.execute(f"PRAGMA synchronous = {config['synchronous']}")
+            cursor.execute(f"PRAGMA mmap_size = {int(config['mmap_size'])}")
+            cursor.execute(f"PRAGMA cache_size = {int(config['cache_size'])}")
+            cursor.execute("PRAGMA temp_store = MEMORY")
+            cursor.execute("PRAGMA foreign_keys = ON")
+        finally:
+            cursor.close()
 
-# 创建数据库引擎
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        options = conn.get_execution_options()
+        if options.get("isolation_level") == "AUTOCOMMIT":
+            return
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if options.get("sqlite_begin_immediate") else "BEGIN")
 
-# 创建基类
-Base = declarative_base()
+    return engine
+
+
+# 创建数据库引擎
+engine = create_sqlite_engine(DATABASE_URL)
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# 数据库模型定义
-class MistakeRecord(Base):
-    """错题记录表"""
-    __tablename__ = "mistake_records"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    file_id = Column(String(255), unique=True, index=True, nullable=False)
-    filename = Column(String(500), nullable=False)
-    file_url = Column(String(1000))
-    file_size = Column(Integer)
-    file_type = Column(String(100))
-    upload_time = Column(DateTime(timezone=True), default=func.now())
-    created_at = Column(DateTime(timezone=True), default=func.now())
-    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+# 单机部署没有副本，读请求都走本库（与 PostgreSQL 后端保持相同接口）
+router = SessionRouter(SessionLocal)
 
-    # 关系
-    analyses = relationship("MistakeAnalysis", back_populates="mistake_record", cascade="all, delete-orphan")
+_writer = None
+_writer_lock = threading.Lock()
 
-class MistakeAnalysis(Base):
-    """错题分析表"""
-    __tablename__ = "mistake_analysis"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    mistake_record_id = Column(Integer, ForeignKey("mistake_records.id", ondelete="CASCADE"))
-    section = Column(String(200))
-    question = Column(Text)
-    answer = Column(Text)
-    is_question = Column(Boolean, default=True)
-    is_correct = Column(Boolean, default=False)
-    correct_answer = Column(Text)
-    comment = Column(Text)
-    error_type = Column(String(100))  # 错因类型
-    knowledge_point = Column(String(200))  # 知识点
-    analysis_data = Column(JSON)  # 完整的分析数据
-    created_at = Column(DateTime(timezone=True), default=func.now())
 
-    # 关系
-    mistake_record = relationship("MistakeRecord", back_populates="analyses")
+def get_writer():
+    """获取单写线程（首次调用时启动），所有错题写入经由它串行执行并合并提交"""
+    global _writer
+    from db.sqlite_writer import SQLiteWriter
 
-class User(Base):
-    """用户表（用于未来扩展）"""
-    __tablename__ = "users"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String(100), unique=True, index=True)
-    email = Column(String(255), unique=True, index=True)
-    created_at = Column(DateTime(timezone=True), default=func.now())
+    with _writer_lock:
+        if _writer is None:
+            writer_engine = engine.execution_options(sqlite_begin_immediate=True)
+            _writer = SQLiteWriter(sessionmaker(autocommit=False, autoflush=False, bind=writer_engine))
+        return _writer
 
-class ReviewPlan(Base):
-    """复习计划表"""
-    __tablename__ = "review_plans"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
-    plan_name = Column(String(200))
-    plan_data = Column(JSON)  # 复习计划详情
-    created_at = Column(DateTime(timezone=True), default=func.now())
-    scheduled_date = Column(DateTime)
+
+def close_writer():
+    """停止单写线程（处理完已排队的写入）"""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
 
 # 数据库工具函数
 def get_db():
@@ -91,10 +120,12 @@ def get_db():
         db.close()
 
 def init_db():
-    """初始化数据库表"""
+    """初始化数据库表：新库按模型建表，已有库执行未应用的迁移"""
+    from db.migrate import migrate
+
     try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("SQLite数据库表创建成功")
+        applied = migrate(engine)
+        logger.info(f"SQLite数据库表初始化成功，本次执行迁移: {applied or '无'}")
         
         # 插入示例数据
         db = SessionLocal()
@@ -129,6 +160,7 @@ def init_db():
                 example_analyses = [
                     MistakeAnalysis(
                         mistake_record_id=1,
+                        subject="数学",
                         section="计算题",
                         question="计算：1/2 + 1/3 = ?",
                         answer="",
@@ -141,6 +173,7 @@ def init_db():
                     ),
                     MistakeAnalysis(
                         mistake_record_id=2,
+                        subject="数学",
                         section="几何题", 
                         question="求三角形的面积",
                         answer="10平方厘米",
@@ -169,71 +202,6 @@ def init_db():
         logger.error(f"数据库表创建失败: {e}")
         raise
 
-def save_mistake_record(db, file_data, analysis_data=None):
-    """保存错题记录和分析结果"""
-    try:
-        # 创建错题记录
-        mistake_record = MistakeRecord(
-            file_id=file_data.get("file_id"),
-            filename=file_data.get("filename"),
-            file_url=file_data.get("file_url"),
-            file_size=file_data.get("file_size"),
-            file_type=file_data.get("file_type"),
-            upload_time=datetime.fromisoformat(file_data.get("upload_time")) if file_data.get("upload_time") else None
-        )
-        
-        db.add(mistake_record)
-        db.flush()  # 获取生成的ID
-        
-        # 保存分析结果
-        if analysis_data:
-            for analysis in analysis_data:
-                mistake_analysis = MistakeAnalysis(
-                    mistake_record_id=mistake_record.id,
-                    section=analysis.get("section"),
-                    question=analysis.get("question"),
-                    answer=analysis.get("answer"),
-                    is_question=analysis.get("is_question", True),
-                    is_correct=analysis.get("is_correct", False),
-                    correct_answer=analysis.get("correct_answer"),
-                    comment=analysis.get("comment"),
-                    error_type=analysis.get("error_type"),
-                    knowledge_point=analysis.get("knowledge_point"),
-                    analysis_data=analysis
-                )
-                db.add(mistake_analysis)
-        
-        db.commit()
-        logger.info(f"错题记录保存成功，文件ID: {file_data.get('file_id')}")
-        return mistake_record
-        
-    except Exception as e:
-        db.rollback()
-        logger.error(f"保存错题记录失败: {e}")
-        raise
-
-def get_mistake_records(db, skip: int = 0, limit: int = 100):
-    """获取错题记录列表"""
-    return db.query(MistakeRecord).offset(skip).limit(limit).all()
-
-def get_mistake_analysis_by_file_id(db, file_id: str):
-    """根据文件ID获取错题分析"""
-    mistake_record = db.query(MistakeRecord).filter(MistakeRecord.file_id == file_id).first()
-    if mistake_record:
-        return db.query(MistakeAnalysis).filter(MistakeAnalysis.mistake_record_id == mistake_record.id).all()
-    return []
-
-def get_similar_mistakes(db, error_type: str = None, knowledge_point: str = None):
-    """获取相似错题"""
-    query = db.query(MistakeAnalysis)
-    
-    if error_type:
-        query = query.filter(MistakeAnalysis.error_type == error_type)
-    if knowledge_point:
-        query = query.filter(MistakeAnalysis.knowledge_point == knowledge_point)
-    
-    return query.all()
-
 def test_database():
     """测试数据库功能"""
     db = SessionLocal()
@@ -0,0 +1,112 @@
+"""SQLite 单写线程（合并提交）
+
+SQLite 同一时刻只允许一个写事务，多个请求各自提交时会互相等待锁，出现
+"database is locked"。这里用一个专用线程串行执行所有写操作：取到第一个任务后，
+在 SQLITE_WRITER_MAX_DELAY_MS 内继续收集排队的任务（最多 SQLITE_WRITER_MAX_BATCH 个），
+每个任务在各自的 SAVEPOINT 中执行，整批只 COMMIT 一次（一次 WAL fsync）。
+单个任务失败只回滚它自己的 SAVEPOINT，不影响同批其他任务。
+WAL 模式下读操作不受写线程影响，继续使用普通会话并发执行。
+"""
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db.crud import add_mistake_record
+
+logger = logging.getLogger(__name__)
+
+SQLITE_WRITER_MAX_BATCH = int(os.getenv("SQLITE_WRITER_MAX_BATCH", "64"))
+SQLITE_WRITER_MAX_DELAY_MS = float(os.getenv("SQLITE_WRITER_MAX_DELAY_MS", "5"))
+
+_STOP = object()
+
+
+class SQLiteWriter:
+    """串行执行写操作并合并提交的后台线程"""
+
+    def __init__(self, session_factory, max_batch=SQLITE_WRITER_MAX_BATCH, max_delay_ms=SQLITE_WRITER_MAX_DELAY_MS):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.stats = {"jobs": 0, "commits": 0, "failed": 0}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        """提交写任务 fn(session, *args)，返回 concurrent.futures.Future（结果为 fn 的返回值）"""
+        if not self._thread.is_alive():
+            raise RuntimeError("SQLite 写线程已停止")
+        future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    async def save_mistake_record(self, file_data, analysis_data=None, practices_data=None):
+        """异步保存错题记录，返回错题记录ID"""
+        return await self.run(add_mistake_record, file_data, analysis_data, practices_data)
+
+    def close(self, timeout=10):
+        """处理完已排队的任务后停止"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(job)
+            if job is _STOP:
+                break
+        return batch
+
+    def _run(self):
+        session = self.session_factory()
+        try:
+            while True:
+                batch = self._collect(self._queue.get())
+                stop = batch[-1] is _STOP
+                jobs = [job for job in batch if job is not _STOP]
+                if jobs:
+                    self._execute(session, jobs)
+                if stop:
+                    break
+        finally:
+            session.close()
+
+    def _execute(self, session, jobs):
+        results = []
+        for fn, args, future in jobs:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with session.begin_nested():
+                    results.append((future, fn(session, *args), None))
+            except Exception as e:
+                results.append((future, None, e))
+        try:
+            session.commit()
+            self.stats["commits"] += 1
+        except Exception as e:
+            session.rollback()
+            logger.error(f"[SQLite写线程] 批量提交失败（{len(results)} 个任务）: {e}")
+            results = [(future, None, error or e) for future, _, error in results]
+        for future, result, error in results:
+            self.stats["jobs"] += 1
+            if error is None:
+                future.set_result(result)
+            else:
+                self.stats["failed"] += 1
+                future.set_exception(error)
@@ -0,0 +1,75 @@
+"""按用户隔离数据（多租户）
+
+mistake_records / mistake_analysis / mistake_practices 等表带 user_id 列，列表、详情、统计等查询
+都按当前用户过滤，复合索引以 user_id 开头，单个用户的查询只扫描自己的数据。
+
+当前用户由应用中间件从 X-User-Id 请求头解析后通过 contextvar 传递（与 db/routing.py 的客户端标识相同），
+缺省为 DEFAULT_USER_ID（未启用多用户的部署，历史数据也归属该用户）。contextvar 不会传到 SQLite 单写线程，
+写入时 user_id 随 file_data 显式传递。
+
+X-User-Id 不是鉴权手段：本服务不校验用户身份，只信任前面的网关。网关完成认证后设置该请求头（并丢弃客户端
+自带的同名头），网关地址配置在 USER_ID_TRUSTED_PROXIES 中；其他来源携带该请求头一律拒绝。
+"""
+import ipaddress
+import os
+from contextvars import ContextVar
+
+DEFAULT_USER_ID = int(os.getenv("DEFAULT_USER_ID", "0"))
+USER_ID_HEADER = "X-User-Id"
+# 可信代理（IP 或 CIDR，逗号分隔；"*" 信任所有来源，仅用于本地开发）。默认为空：不接受 X-User-Id
+USER_ID_TRUSTED_PROXIES = os.getenv("USER_ID_TRUSTED_PROXIES", "")
+
+_current_user_id = ContextVar("current_user_id", default=None)
+
+
+def parse_user_id(value):
+    """解析请求头中的用户 ID：缺省返回 DEFAULT_USER_ID，非法值抛出 ValueError"""
+    if value is None or not value.strip():
+        return DEFAULT_USER_ID
+    user_id = int(value.strip())
+    if user_id < 0 or user_id > 2 ** 31 - 1:
+        raise ValueError(f"用户 ID 超出范围: {value}")
+    return user_id
+
+
+def parse_trusted_proxies(value):
+    """解析可信代理配置，返回网络列表；"*" 返回 None 表示信任所有来源"""
+    items = [item.strip() for item in (value or "").split(",") if item.strip()]
+    if "*" in items:
+        return None
+    return [ipaddress.ip_network(item, strict=False) for item in items]
+
+
+_trusted_proxies = parse_trusted_proxies(USER_ID_TRUSTED_PROXIES)
+
+
+def is_trusted_proxy(host, proxies=_trusted_proxies):
+    """请求来源地址是否为可信代理"""
+    if proxies is None:
+        return True
+    try:
+        address = ipaddress.ip_address(host or "")
+    except ValueError:
+        return False
+    return any(address in network for network in proxies)
+
+
+def resolve_user_id(value, client_host, proxies=_trusted_proxies):
+    """确定请求的用户：没有请求头时为 DEFAULT_USER_ID；非可信代理携带请求头抛出 PermissionError，非法值抛出 ValueError"""
+    if value is not None and value.strip() and not is_trusted_proxy(client_host, proxies):
+        raise PermissionError(f"{client_host} 不是可信代理，不接受 {USER_ID_HEADER} 请求头")
+    return parse_user_id(value)
+
+
+def set_current_user_id(user_id):
+    """设置当前请求的用户，返回用于恢复的 token"""
+    return _current_user_id.set(user_id)
+
+
+def reset_current_user_id(token):
+    _current_user_id.reset(token)
+
+
+def current_user_id():
+    user_id = _current_user_id.get()
+    return DEFAULT_USER_ID if user_id is None else user_id
@@ -0,0 +1,186 @@
+"""百度 OCR / ASR / TTS 客户端（带两级结果缓存）
+
+三个服务的结果都只取决于输入内容与参数，按 storage.cache.cache_key 缓存（见 storage/cache.py）：
+- OCR：图片字节 + 识别类型（handwriting 手写 / general_basic 通用），缓存识别出的文字行；
+- ASR：音频字节 + 格式 / 采样率 / 识别模型，缓存转写结果；
+- TTS：文本 + 发音人 / 语速 / 音调 / 音量 / 音频格式，缓存合成的音频。
+各自的 TTL 由 BAIDU_{OCR,ASR,TTS}_CACHE_TTL_SECONDS 配置，磁盘缓存位于 CACHE_DIR/baidu-{ocr,asr,tts}。
+
+鉴权使用 API Key + Secret Key 换取 access_token（有效期内复用）。服务地址可通过
+BAIDU_AIP_URL / BAIDU_VOP_URL / BAIDU_TSN_URL 指向本地的模拟服务，便于测试。
+"""
+import base64
+import logging
+import os
+import time
+
+import httpx
+
+from storage.cache import CACHE_DIR, ContentCache, cache_key
+
+logger = logging.getLogger(__name__)
+
+BAIDU_AIP_URL = os.getenv("BAIDU_AIP_URL", "https://aip.baidubce.com")  # 鉴权与 OCR
+BAIDU_VOP_URL = os.getenv("BAIDU_VOP_URL", "https://vop.baidu.com")  # 语音识别
+BAIDU_TSN_URL = os.getenv("BAIDU_TSN_URL", "https://tsn.baidu.com")  # 语音合成
+BAIDU_TIMEOUT_SECONDS = float(os.getenv("BAIDU_TIMEOUT_SECONDS", "15"))
+BAIDU_CUID = os.getenv("BAIDU_CUID", "mistake_note")
+
+BAIDU_OCR_CACHE_TTL_SECONDS = int(os.getenv("BAIDU_OCR_CACHE_TTL_SECONDS", str(30 * 86400)))
+BAIDU_ASR_CACHE_TTL_SECONDS = int(os.getenv("BAIDU_ASR_CACHE_TTL_SECONDS", str(7 * 86400)))
+BAIDU_TTS_CACHE_TTL_SECONDS = int(os.getenv("BAIDU_TTS_CACHE_TTL_SECONDS", str(90 * 86400)))
+BAIDU_CACHE_MEMORY_MB = int(os.getenv("BAIDU_CACHE_MEMORY_MB", "64"))  # 每个服务的内存层上限
+BAIDU_CACHE_DISK_MB = int(os.getenv("BAIDU_CACHE_DISK_MB", "1024"))  # 每个服务的磁盘层上限
+
+OCR_KINDS = ("handwriting", "general_basic", "accurate_basic", "formula")
+TTS_FORMATS = {3: ("mp3", "audio/mpeg"), 4: ("pcm", "audio/basic"), 5: ("pcm", "audio/basic"), 6: ("wav", "audio/wav")}
+
+
+class BaiduAPIError(Exception):
+    """百度接口返回错误（error_code / err_no 非 0）或响应无法解析"""
+
+    def __init__(self, service, code, message):
+        super().__init__(f"百度{service}接口错误 {code}: {message}")
+        self.service = service
+        self.code = code
+
+
+class BaiduClient:
+    """单个百度应用（一对 API Key / Secret Key）的客户端；transport 仅供测试替换"""
+
+    def __init__(self, api_key, secret_key, aip_url=BAIDU_AIP_URL, vop_url=BAIDU_VOP_URL, tsn_url=BAIDU_TSN_URL,
+                 timeout=BAIDU_TIMEOUT_SECONDS, transport=None, clock=time.time):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.aip_url = aip_url.rstrip("/")
+        self.vop_url = vop_url.rstrip("/")
+        self.tsn_url = tsn_url.rstrip("/")
+        self._http = httpx.AsyncClient(timeout=timeout, transport=transport)
+        self._clock = clock
+        self._token = None
+        self._token_expires_at = 0.0
+        self.stats = {"requests": 0, "errors": 0, "token_refreshes": 0}
+
+    @property
+    def configured(self):
+        return bool(self.api_key and self.secret_key)
+
+    async def close(self):
+        await self._http.aclose()
+
+    async def access_token(self):
+        """获取 access_token；提前 5 分钟刷新"""
+        if self._token and self._clock() < self._token_expires_at - 300:
+            return self._token
+        response = await self._http.post(f"{self.aip_url}/oauth/2.0/token", params={
+            "grant_type": "client_credentials", "client_id": self.api_key, "client_secret": self.secret_key})
+        data = response.json()
+        if "access_token" not in data:
+            raise BaiduAPIError("鉴权", data.get("error", response.status_code), data.get("error_description", ""))
+        self._token = data["access_token"]
+        self._token_expires_at = self._clock() + int(data.get("expires_in", 2592000))
+        self.stats["token_refreshes"] += 1
+        return self._token
+
+    async def _request(self, method, url, **kwargs):
+        self.stats["requests"] += 1
+        try:
+            response = await self._http.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+        except httpx.HTTPError:
+            self.stats["errors"] += 1
+            raise
+
+    async def ocr(self, image, kind="handwriting"):
+        """文字识别，返回文字行列表"""
+        if kind not in OCR_KINDS:
+            raise ValueError(f"不支持的 OCR 类型: {kind}")
+        token = await self.access_token()
+        response = await self._request("POST", f"{self.aip_url}/rest/2.0/ocr/v1/{kind}",
+                                       params={"access_token": token},
+                                       data={"image": base64.b64encode(image).decode("ascii")})
+        data = response.json()
+        if data.get("error_code"):
+            self.stats["errors"] += 1
+            raise BaiduAPIError("OCR", data["error_code"], data.get("error_msg", ""))
+        return [item.get("words", "") for item in data.get("words_result", [])]
+
+    async def asr(self, audio, audio_format="wav", rate=16000, dev_pid=1537):
+        """短语音识别（dev_pid 1537 为普通话），返回转写文本"""
+        token = await self.access_token()
+        response = await self._request("POST", f"{self.vop_url}/server_api", json={
+            "format": audio_format, "rate": rate, "channel": 1, "cuid": BAIDU_CUID, "token": token,
+            "dev_pid": dev_pid, "speech": base64.b64encode(audio).decode("ascii"), "len": len(audio)})
+        data = response.json()
+        if data.get("err_no"):
+            self.stats["errors"] += 1
+            raise BaiduAPIError("ASR", data["err_no"], data.get("err_msg", ""))
+        return "".join(data.get("result", []))
+
+    async def tts(self, text, person=0, speed=5, pitch=5, volume=5, aue=3):
+        """语音合成，返回音频字节（aue 3 为 mp3）；成功时响应为音频，失败时为 JSON"""
+        token = await self.access_token()
+        response = await self._request("POST", f"{self.tsn_url}/text2audio", data={
+            "tex": text, "tok": token, "cuid": BAIDU_CUID, "ctp": 1, "lan": "zh",
+            "per": person, "spd": speed, "pit": pitch, "vol": volume, "aue": aue})
+        if not response.headers.get("content-type", "").startswith("audio/"):
+            self.stats["errors"] += 1
+            data = response.json()
+            raise BaiduAPIError("TTS", data.get("err_no", response.status_code), data.get("err_msg", ""))
+        return response.content
+
+
+def _cache(name, ttl_seconds):
+    return ContentCache(name, directory=os.path.join(CACHE_DIR, name), ttl_seconds=ttl_seconds,
+                        max_memory_bytes=BAIDU_CACHE_MEMORY_MB * 1024 * 1024,
+                        max_disk_bytes=BAIDU_CACHE_DISK_MB * 1024 * 1024)
+
+
+class BaiduServices:
+    """OCR / ASR / TTS 三个应用的客户端与各自的结果缓存（文字行列表 / 转写文本 / 音频字节）"""
+
+    def __init__(self, ocr_client, asr_client, tts_client, ocr_cache=None, asr_cache=None, tts_cache=None):
+        self.ocr_client = ocr_client
+        self.asr_client = asr_client
+        self.tts_client = tts_client
+        self.ocr_cache = ocr_cache or _cache("baidu-ocr", BAIDU_OCR_CACHE_TTL_SECONDS)
+        self.asr_cache = asr_cache or _cache("baidu-asr", BAIDU_ASR_CACHE_TTL_SECONDS)
+        self.tts_cache = tts_cache or _cache("baidu-tts", BAIDU_TTS_CACHE_TTL_SECONDS)
+
+    @classmethod
+    def from_env(cls):
+        def client(service):
+            return BaiduClient(os.getenv(f"BAIDU_{service}_API_KEY"), os.getenv(f"BAIDU_{service}_SECRET_KEY"))
+
+        return cls(client("OCR"), client("ASR"), client("TTS"))
+
+    async def close(self):
+        for client in (self.ocr_client, self.asr_client, self.tts_client):
+            await client.close()
+
+    async def ocr(self, image, kind="handwriting"):
+        """返回 (文字行列表, 是否命中缓存)"""
+        async def compute():
+            return await self.ocr_client.ocr(image, kind)
+
+        return await self.ocr_cache.get_or_compute(cache_key(image, kind=kind), compute)
+
+    async def asr(self, audio, audio_format="wav", rate=16000, dev_pid=1537):
+        """返回 (转写文本, 是否命中缓存)"""
+        async def compute():
+            return await self.asr_client.asr(audio, audio_format, rate, dev_pid)
+
+        key = cache_key(audio, format=audio_format, rate=rate, dev_pid=dev_pid)
+        return await self.asr_cache.get_or_compute(key, compute)
+
+    async def tts(self, text, person=0, speed=5, pitch=5, volume=5, aue=3):
+        """返回 (音频字节, 是否命中缓存)"""
+        async def compute():
+            return await self.tts_client.tts(text, person, speed, pitch, volume, aue)
+
+        key = cache_key(text, person=person, speed=speed, pitch=pitch, volume=volume, aue=aue)
+        return await self.tts_cache.get_or_compute(key, compute)
+
+    def snapshot(self):
+        return {"ocr": self.ocr_cache.snapshot(), "asr": self.asr_cache.snapshot(), "tts": self.tts_cache.snapshot()}
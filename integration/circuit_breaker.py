@@ -0,0 +1,122 @@
+"""熔断器（closed → open → half_open → closed）
+
+上游（Coze）故障时每次调用都要等到超时才失败，请求堆积、连接耗尽。熔断器统计连续失败次数，
+达到阈值后打开：recovery_seconds 内的调用直接抛出 CircuitOpenError，不再访问上游；
+到期后进入半开状态，只放行 half_open_max_calls 个探测调用，探测成功则关闭，失败则重新打开。
+
+只在事件循环线程中使用，不加锁。
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开（或半开探测名额已满）时拒绝调用"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"熔断器 {name} 已打开，约 {retry_after:.0f} 秒后重试")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, recovery_seconds=30.0, half_open_max_calls=1,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._state = CLOSED
+        self._failures = 0  # 关闭状态下的连续失败次数
+        self._opened_at = 0.0
+        self._probes = 0  # 半开状态下进行中的探测调用数
+        self.stats = {"calls": 0, "successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self):
+        if self._state == OPEN and self._clock() - self._opened_at >= self.recovery_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+            logger.info(f"[熔断:{self.name}] 进入半开状态，放行探测调用")
+        return self._state
+
+    def retry_after(self):
+        """打开状态下距离可以探测的剩余秒数"""
+        if self.state == OPEN:
+            return max(0.0, self.recovery_seconds - (self._clock() - self._opened_at))
+        return 0.0
+
+    def acquire(self):
+        """调用前检查，拒绝时抛出 CircuitOpenError；返回本次调用是否为半开探测"""
+        state = self.state
+        if state == OPEN or (state == HALF_OPEN and self._probes >= self.half_open_max_calls):
+            self.stats["rejected"] += 1
+            raise CircuitOpenError(self.name, self.retry_after() or self.recovery_seconds)
+        self.stats["calls"] += 1
+        if state == HALF_OPEN:
+            self._probes += 1
+            return True
+        return False
+
+    def record_success(self, probe=False):
+        self.stats["successes"] += 1
+        if probe:
+            self._probes -= 1
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._failures = 0
+                logger.info(f"[熔断:{self.name}] 探测成功，熔断器关闭")
+        elif self._state == CLOSED:
+            self._failures = 0
+
+    def record_failure(self, probe=False):
+        self.stats["failures"] += 1
+        if probe:
+            self._probes -= 1
+            if self._state == HALF_OPEN:
+                self._open("探测失败")
+        elif self._state == CLOSED:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._open(f"连续失败 {self._failures} 次")
+
+    def release(self, probe=False):
+        """调用被取消、没有结论时归还探测名额"""
+        if probe:
+            self._probes -= 1
+
+    def _open(self, reason):
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._failures = 0
+        self._probes = 0
+        self.stats["opened"] += 1
+        logger.warning(f"[熔断:{self.name}] {reason}，熔断 {self.recovery_seconds:.0f} 秒")
+
+    @contextmanager
+    def guard(self):
+        """with breaker.guard(): await 上游调用 —— 抛出异常记为失败，正常结束记为成功
+
+        取消（CancelledError）或在异步生成器中途关闭（GeneratorExit）没有结论，只归还探测名额。
+        """
+        probe = self.acquire()
+        try:
+            yield
+        except Exception:
+            self.record_failure(probe)
+            raise
+        except BaseException:
+            self.release(probe)
+            raise
+        self.record_success(probe)
+
+    def snapshot(self):
+        return {**self.stats, "state": self.state, "consecutive_failures": self._failures,
+                "retry_after": round(self.retry_after(), 1)}
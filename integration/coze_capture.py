@@ -0,0 +1,128 @@
+"""Coze 工作流原始输出采集（离线回放语料）
+
+设置 COZE_CAPTURE_DIR 后，每次真实调用 Coze 得到的原始输出（即日志中的“完整响应”）脱敏后写入该目录，
+一次调用一个 JSON 文件：
+  {"source": "run" | "stream", "captured_at": ..., "raw_payload": "...", "chunks": [[节点, 文本], ...]}
+chunks 只有流式调用才有，保留原始分段以便回放增量解析。文件名取脱敏后内容的哈希，相同输出只保存一份；
+目录中文件数达到 COZE_CAPTURE_MAX_FILES 后不再写入。语料由 scripts/replay_coze_corpus.py 回放。
+
+脱敏在原始文本上按正则替换（不重新序列化 JSON），尽量保持载荷的长度与结构不变：
+URL 查询串（签名、token）、Coze 访问令牌、邮箱、手机号。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+_SANITIZE_RULES = [
+    # 带签名的文件链接：保留路径，去掉查询串（JSON 字符串内遇到引号、反斜杠或空白即结束）
+    (re.compile(r"(https?://[^\s\"'\\?]+)\?[^\s\"'\\]*"), r"\1?redacted"),
+    (re.compile(r"\b(?:pat|sat|cztei)_[A-Za-z0-9]{16,}"), "<token>"),
+    (re.compile(r"(?i)\bBearer\s+[A-Za-z0-9._\-]+"), "Bearer <token>"),
+    (re.compile(r"[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}"), "<email>"),
+    (re.compile(r"(?<!\d)1[3-9]\d{9}(?!\d)"), "<phone>"),
+]
+
+
+def sanitize_coze_payload(text):
+    """脱敏原始输出文本"""
+    for pattern, replacement in _SANITIZE_RULES:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _sanitize_chunks(chunks):
+    """按节点拼接后整体脱敏（敏感内容可能跨分段），再按原分段长度切回"""
+    by_node = {}
+    for node, text in chunks:
+        by_node.setdefault(node, []).append(text)
+    sanitized = {node: sanitize_coze_payload("".join(texts)) for node, texts in by_node.items()}
+    remaining = {node: len(texts) for node, texts in by_node.items()}
+    offsets = dict.fromkeys(by_node, 0)
+    result = []
+    for node, text in chunks:
+        remaining[node] -= 1
+        start = offsets[node]
+        # 脱敏可能改变长度，节点的最后一段取剩余全部内容
+        end = len(sanitized[node]) if remaining[node] == 0 else min(start + len(text), len(sanitized[node]))
+        result.append([node, sanitized[node][start:end]])
+        offsets[node] = end
+    return result
+
+
+class CozeCapture:
+    """把原始输出写入语料目录；directory 为空时不采集"""
+
+    def __init__(self, directory=None, max_files=10000):
+        self.directory = directory or None
+        self.max_files = max_files
+        self._count = None
+        self.stats = {"captured": 0, "duplicates": 0, "skipped": 0, "errors": 0}
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def write(self, raw_payload, source="run", chunks=None):
+        """脱敏后写入一条语料，返回文件路径；未启用、重复、超出上限或写入失败时返回 None
+
+        采集只用于离线分析，任何错误都只记录日志，不影响正常请求。
+        """
+        if not self.enabled or not raw_payload:
+            return None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if self._count is None:
+                self._count = sum(1 for name in os.listdir(self.directory) if name.endswith(".json"))
+            if self._count >= self.max_files:
+                self.stats["skipped"] += 1
+                return None
+
+            sanitized = sanitize_coze_payload(raw_payload)
+            digest = hashlib.sha256(sanitized.encode("utf-8")).hexdigest()[:16]
+            path = os.path.join(self.directory, f"{source}-{digest}.json")
+            if os.path.exists(path):
+                self.stats["duplicates"] += 1
+                return None
+
+            entry = {
+                "source": source,
+                "captured_at": datetime.now(timezone.utc).isoformat(),
+                "raw_payload": sanitized,
+            }
+            if chunks is not None:
+                entry["chunks"] = _sanitize_chunks(chunks)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.stats["errors"] += 1
+            logger.warning(f"[Coze采集] 写入语料失败: {e}")
+            return None
+
+        self._count += 1
+        self.stats["captured"] += 1
+        logger.info(f"[Coze采集] 已保存 {path}（{len(sanitized)} 字符）")
+        return path
+
+    def snapshot(self):
+        return {**self.stats, "enabled": self.enabled, "directory": self.directory}
+
+
+def load_coze_corpus(directory):
+    """按文件名顺序读取语料目录，返回条目列表（每条附带 path）"""
+    entries = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(directory, name)
+        with open(path, encoding="utf-8") as f:
+            entry = json.load(f)
+        entry["path"] = path
+        entries.append(entry)
+    return entries
@@ -0,0 +1,308 @@
+"""Coze 工作流输出的解析与标准化
+
+非流式调用（workflows.runs.create）的输出由 parse_coze_output + normalize_coze_payload 处理；
+流式调用（workflows.runs.stream）的输出由 CozeQuestionStream 增量解析，每道题目的 JSON
+对象一闭合就标准化产出，不必等整张作业分析完。
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def transform_coze_result(coze_data):
+    """将 Coze API 返回的题目列表标准化为前端需要的结构"""
+    if not isinstance(coze_data, list):
+        return []
+
+    normalized = []
+    for item in coze_data:
+        # 处理嵌套结构：如果 item 包含 output 字段，则提取其中的 questions
+        if isinstance(item, dict) and "output" in item and isinstance(item["output"], list):
+            for output_item in item["output"]:
+                if isinstance(output_item, dict) and "questions" in output_item and isinstance(output_item["questions"], list):
+                    for question in output_item["questions"]:
+                        normalized_item = {
+                            "id": output_item.get("id", ""),
+                            "subject": output_item.get("subject") or "",  # 学科
+                            "section": output_item.get("section") or "",
+                            "question": question.get("question") or "",
+                            "answer": question.get("answer") or "",
+                            "is_question": bool(question.get("is_question", True)),
+                            "is_correct": bool(question.get("is_correct", False)),
+                            "correct_answer": question.get("correct_answer") or "",
+                            "comment": question.get("comment") or "",
+                            "error_type": None,
+                            "knowledge_point": ", ".join(output_item.get("knowledge_points", [])) if output_item.get("knowledge_points") else None
+                        }
+                        normalized.append(normalized_item)
+        else:
+            # 处理普通结构
+            normalized_item = {
+                "id": str(item.get("id", "")),
+                "subject": item.get("subject") or "",  # 学科
+                "section": item.get("section") or "",
+                "question": item.get("question") or "",
+                "answer": item.get("answer") or "",
+                "is_question": bool(item.get("is_question", True)),
+                "is_correct": bool(item.get("is_correct", False)),
+                "correct_answer": item.get("correct_answer") or "",
+                "comment": item.get("comment") or "",
+            }
+
+            for key, value in item.items():
+                if key not in normalized_item:
+                    normalized_item[key] = value
+
+            normalized.append(normalized_item)
+
+    return normalized
+
+
+
+def extract_practices_from_payload(data):
+    """从 Coze 返回中提取 practices 列表。
+    兼容顶层/嵌套 output 节点两种结构。
+    """
+    practices = []
+
+    def normalize(p):
+        return {
+            "question": (p or {}).get("question") or "",
+            "correct_answer": (p or {}).get("correct_answer") or "",
+            "comment": (p or {}).get("comment") or "",
+        }
+
+    def collect_from_obj(obj):
+        if not isinstance(obj, dict):
+            return
+        if isinstance(obj.get("practices"), list):
+            for p in obj["practices"]:
+                if isinstance(p, dict):
+                    practices.append(normalize(p))
+        # 遍历 output 节点
+        outs = obj.get("output")
+        if isinstance(outs, list):
+            for out in outs:
+                if isinstance(out, dict) and isinstance(out.get("practices"), list):
+                    for p in out["practices"]:
+                        if isinstance(p, dict):
+                            practices.append(normalize(p))
+                # 同时检查每个 output 下的 questions 中是否内嵌 practices
+                if isinstance(out, dict) and isinstance(out.get("questions"), list):
+                    for q in out["questions"]:
+                        if isinstance(q, dict) and isinstance(q.get("practices"), list):
+                            for p in q["practices"]:
+                                if isinstance(p, dict):
+                                    practices.append(normalize(p))
+
+    if isinstance(data, list):
+        for item in data:
+            if isinstance(item, dict):
+                collect_from_obj(item)
+    elif isinstance(data, dict):
+        collect_from_obj(data)
+        # 常见嵌套载荷 data/items/records 等
+        for key in ("data", "items", "records", "result", "payload"):
+            v = data.get(key)
+            if isinstance(v, (list, dict)):
+                practices.extend(extract_practices_from_payload(v))
+
+    return practices
+
+
+class CozePayloadError(ValueError):
+    """Coze 工作流输出为空、不是 JSON 或结构不支持"""
+
+
+def parse_coze_output(raw_payload):
+    """解析工作流输出文本，返回待标准化的载荷（外层为 {"data": ...} 时取 data）"""
+    if not (raw_payload or "").strip():
+        raise CozePayloadError("Coze 未返回任何数据，请检查工作流输出。")
+    try:
+        parsed_payload = json.loads(raw_payload)
+    except json.JSONDecodeError as exc:
+        logger.error("[Coze] 工作流返回非 JSON，示例=%s", raw_payload[:200])
+        raise CozePayloadError("Coze 返回内容无法解析，请检查工作流输出。") from exc
+    if isinstance(parsed_payload, dict) and "data" in parsed_payload:
+        return parsed_payload.get("data")
+    return parsed_payload
+
+
+def normalize_coze_payload(coze_payload):
+    """标准化工作流输出，返回 {"analysis": [...], "practices": [...]}
+
+    支持题目列表、{"data"/"items"/"records"/"questions": [...]} 以及单条 dict（含 output 嵌套结构）。
+    """
+    logger.info("[Coze] 转换前数据类型: %s", type(coze_payload).__name__)
+    practices = extract_practices_from_payload(coze_payload)
+    logger.info("[Coze] 提取到类练习条目数: %d", len(practices))
+
+    if isinstance(coze_payload, list):
+        transformed = transform_coze_result(coze_payload)
+        logger.info("[Coze] 转换后数据: %s", json.dumps(transformed, ensure_ascii=False))
+        return {"analysis": transformed, "practices": practices}
+
+    if isinstance(coze_payload, dict):
+        logger.info("[Coze] 返回 dict 数据: %s", json.dumps(coze_payload, ensure_ascii=False))
+        nested_candidates = []
+        for key in ("data", "items", "records", "questions"):
+            value = coze_payload.get(key)
+            if isinstance(value, list):
+                nested_candidates = value
+                break
+
+        if nested_candidates:
+            transformed = transform_coze_result(nested_candidates)
+            logger.info("[Coze] 嵌套列表转换后数据: %s", json.dumps(transformed, ensure_ascii=False))
+            return {"analysis": transformed, "practices": practices}
+
+        transformed = transform_coze_result([coze_payload])
+        logger.info("[Coze] 单条数据转换后数据: %s", json.dumps(transformed, ensure_ascii=False))
+        return {"analysis": transformed, "practices": practices}
+
+    logger.error("[Coze] 返回数据类型 %s 暂不支持", type(coze_payload).__name__)
+    raise CozePayloadError("Coze 返回数据格式不支持，请检查工作流输出。")
+
+
+_WHITESPACE = " \t\r\n"
+_SCALAR_CHARS = set("+-.0123456789eEtrufalsn")
+
+
+class IncrementalJSONParser:
+    """增量 JSON 解析器：文本可以在任意位置分段喂入，每个对象 / 数组闭合时回调
+
+    on_close(value, parents)：parents 为从根到该值的父容器链 [(container, key)]，container 为父容器
+    当前已解析的部分（对象只含已完整解析的键），key 为该值在父容器中的键或下标。
+    顶层可以连续出现多个 JSON 值（解析结果依次追加到 values）；顶层 JSON 之外的文本
+    （如 ```json 代码块标记）忽略。
+    """
+
+    def __init__(self, on_close=None):
+        self.values = []
+        self._on_close = on_close
+        self._stack = []  # [容器, 对象中待赋值的键]
+        self._string = None  # 未结束的字符串（含开头引号）
+        self._escape = False
+        self._scalar = None  # 未结束的数字 / true / false / null
+
+    def feed(self, text):
+        for ch in text:
+            if self._string is not None:
+                self._string.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    raw, self._string = "".join(self._string), None
+                    self._add(json.loads(raw), is_string=True)
+                continue
+            if self._scalar is not None:
+                if ch in _SCALAR_CHARS:
+                    self._scalar.append(ch)
+                    continue
+                self._finish_scalar()
+            if not self._stack and ch not in "{[":
+                continue
+            if ch in _WHITESPACE or ch in ",:":
+                continue
+            if ch == '"':
+                self._string = [ch]
+            elif ch == "{":
+                self._stack.append([{}, None])
+            elif ch == "[":
+                self._stack.append([[], None])
+            elif ch in "}]":
+                value = self._stack.pop()[0]
+                if self._on_close is not None:
+                    self._on_close(value, self.parents())
+                self._add(value)
+            else:
+                self._scalar = [ch]
+
+    def close(self):
+        if self._scalar is not None:
+            self._finish_scalar()
+
+    def parents(self):
+        return [(container, len(container) if isinstance(container, list) else key)
+                for container, key in self._stack]
+
+    def _finish_scalar(self):
+        raw, self._scalar = "".join(self._scalar), None
+        self._add(json.loads(raw))
+
+    def _add(self, value, is_string=False):
+        if not self._stack:
+            self.values.append(value)
+            return
+        frame = self._stack[-1]
+        container = frame[0]
+        if isinstance(container, list):
+            container.append(value)
+        elif frame[1] is None and is_string:
+            frame[1] = value  # 对象的键
+        else:
+            container[frame[1]] = value
+            frame[1] = None
+
+
+def _is_question(value, parents):
+    """判断闭合的对象是否为一道题目（而不是类练习等嵌套对象），返回 (是否题目, 嵌套结构的上下文)"""
+    if not isinstance(value, dict) or "question" not in value:
+        return False, None
+    if any(key in ("practices", "question") for _, key in parents):
+        return False, None
+    # {"output": [{"subject": ..., "questions": [题目, ...]}]}
+    if (len(parents) >= 4 and parents[-2][1] == "questions" and isinstance(parents[-2][0], dict)
+            and parents[-4][1] == "output"):
+        return True, parents[-2][0]
+    return True, None
+
+
+class CozeQuestionStream:
+    """从 Coze 流式输出中逐题提取题目，并按 transform_coze_result 标准化
+
+    各节点的输出分别解析；feed 返回本段文本中新完成的题目。finish 以最后输出的节点的完整内容
+    按 normalize_coze_payload 计算最终结果（与非流式调用一致），逐题结果是其预览。
+    """
+
+    def __init__(self):
+        self._parsers = {}
+        self._texts = {}
+        self._last_node = None
+        self._pending = []
+        self.emitted = []
+
+    def feed(self, text, node=""):
+        parser = self._parsers.get(node)
+        if parser is None:
+            parser = self._parsers[node] = IncrementalJSONParser(on_close=self._on_close)
+            self._texts[node] = []
+        self._texts[node].append(text)
+        self._last_node = node
+        parser.feed(text)
+        questions, self._pending = self._pending, []
+        self.emitted.extend(questions)
+        return questions
+
+    def _on_close(self, value, parents):
+        is_question, context = _is_question(value, parents)
+        if not is_question:
+            return
+        if context is not None:
+            item = {"output": [{**{k: v for k, v in context.items() if k != "questions"}, "questions": [value]}]}
+        else:
+            item = value
+        self._pending.extend(transform_coze_result([item]))
+
+    @property
+    def raw_payload(self):
+        return "".join(self._texts.get(self._last_node, []))
+
+    def finish(self):
+        """返回 (最终结果 {"analysis", "practices"}, 逐题结果是否为最终结果的前缀)"""
+        result = normalize_coze_payload(parse_coze_output(self.raw_payload))
+        analysis = result["analysis"]
+        return result, analysis[:len(self.emitted)] == self.emitted
@@ -0,0 +1,73 @@
+"""请求合并（single-flight）
+
+同一时刻对同一个 key 的多次调用只真正执行一次：第一个调用方（leader）启动任务，
+后续调用方（follower）等待同一个任务并共享结果或异常。用于避免重复提交、多人同时上传
+同一张作业图时并发发起多次相同的 Coze 工作流（按次计费、耗时数十秒）。
+
+任务运行在独立的 asyncio.Task 中，调用方通过 asyncio.shield 等待：某个调用方的请求断开
+（协程被取消）不会影响其他等待者；只有当所有等待者都已取消时才取消任务本身。
+每个调用方拿到的是结果的深拷贝，互相修改不会串扰。
+"""
+import asyncio
+import copy
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按 key 合并并发中的相同调用"""
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self.stats = {"calls": 0, "executions": 0, "coalesced": 0, "errors": 0, "cancelled": 0}
+
+    @property
+    def in_flight(self):
+        return len(self._flights)
+
+    def snapshot(self):
+        return {**self.stats, "in_flight": self.in_flight}
+
+    async def do(self, key, fn):
+        """执行 fn()（无参协程函数）或加入同 key 正在进行的调用，返回 (结果, 是否为合并的调用)"""
+        self.stats["calls"] += 1
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if shared:
+            self.stats["coalesced"] += 1
+            logger.info(f"[single-flight:{self.name}] 合并相同请求 key={key[:16]}，等待进行中的调用")
+        else:
+            self.stats["executions"] += 1
+            flight = _Flight(asyncio.create_task(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # 所有等待者都已离开，没有必要继续占用上游资源
+                flight.task.cancel()
+                self.stats["cancelled"] += 1
+                logger.info(f"[single-flight:{self.name}] 等待者全部取消，终止调用 key={key[:16]}")
+            raise
+        flight.waiters -= 1
+        return copy.deepcopy(result), shared
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled() and flight.task.exception() is not None:
+            self.stats["errors"] += 1
@@ -0,0 +1,59 @@
+"""文本向量嵌入（CPU 友好）"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CONFIG = {
+    "model": "BAAI/bge-m3",
+    "device": "cpu",
+    "max_seq_length": 512,
+    "batch_size": 32,
+}
+
+
+class TextEmbedder:
+    def __init__(self, model_name=EMBEDDING_CONFIG["model"], device=EMBEDDING_CONFIG["device"]):
+        """初始化嵌入模型"""
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as exc:
+            raise ImportError("请安装sentence-transformers: pip install sentence-transformers") from exc
+        self.model = SentenceTransformer(model_name, device=device)
+        self.model.max_seq_length = EMBEDDING_CONFIG["max_seq_length"]  # 优化CPU性能
+
+    async def embed(self, text, embedding_type="question"):
+        """生成文本嵌入向量"""
+        if not text or not text.strip():
+            return np.zeros(self.get_dimension(), dtype=np.float32)
+        embeddings = self.model.encode([self._preprocess_text(text, embedding_type)],
+                                       batch_size=1,
+                                       show_progress_bar=False,
+                                       normalize_embeddings=True)
+        return embeddings[0]
+
+    def _preprocess_text(self, text, embedding_type):
+        """根据嵌入类型预处理文本"""
+        preprocessing_rules = {
+            "question": lambda t: f"题目：{t}",
+            "solution": lambda t: f"解法：{t}",
+            "concept": lambda t: f"知识点：{t}",
+            "error": lambda t: f"错因：{t}",
+        }
+        preprocessor = preprocessing_rules.get(embedding_type, lambda t: t)
+        return preprocessor(text.strip())
+
+    async def batch_embed(self, texts, embedding_type="question"):
+        """批量生成嵌入向量"""
+        if not texts:
+            return np.zeros((0, self.get_dimension()), dtype=np.float32)
+        processed_texts = [self._preprocess_text(text or "", embedding_type) for text in texts]
+        return self.model.encode(processed_texts,
+                                 batch_size=min(EMBEDDING_CONFIG["batch_size"], len(texts)),
+                                 show_progress_bar=False,
+                                 normalize_embeddings=True)
+
+    def get_dimension(self):
+        """获取向量维度"""
+        return self.model.get_sentence_embedding_dimension()
@@ -0,0 +1,140 @@
+"""检索结果重排
+
+交叉编码器在 CPU 上较慢（20 个候选可达数百毫秒），因此：
+  - 候选对按 batch_size 分批，在专用线程池中计算，不阻塞事件循环；
+  - (query, document) 打分结果进入 LRU 缓存，重复检索直接命中；
+  - 每次请求有时间预算，超时放弃重排，回退为向量检索原排序。
+    超时时已在计算的批次不会中断，完成后仍写入缓存供后续请求使用。
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RERANK_CONFIG = {
+    "model": os.getenv("RERANK_MODEL", "BAAI/bge-reranker-base"),
+    "batch_size": int(os.getenv("RERANK_BATCH_SIZE", "8")),
+    "cache_size": int(os.getenv("RERANK_CACHE_SIZE", "4096")),
+    "deadline_ms": int(os.getenv("RERANK_DEADLINE_MS", "300")),
+    "max_workers": int(os.getenv("RERANK_WORKERS", "1")),
+}
+
+
+class Reranker:
+    def __init__(self, model_name=RERANK_CONFIG["model"], batch_size=RERANK_CONFIG["batch_size"],
+                 cache_size=RERANK_CONFIG["cache_size"], deadline_ms=RERANK_CONFIG["deadline_ms"],
+                 max_workers=RERANK_CONFIG["max_workers"], scorer=None):
+        """初始化重排模型
+
+        scorer: 可选的打分函数 pairs -> scores，不传则加载 FlagReranker
+        """
+        self.batch_size = max(1, batch_size)
+        self.cache_size = cache_size
+        self.deadline_ms = deadline_ms
+        self._cache = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="rerank")
+        self.stats = {"requests": 0, "pairs": 0, "cache_hits": 0, "pairs_scored": 0,
+                      "timeouts": 0, "fallbacks": 0}
+
+        self.scorer = scorer
+        if self.scorer is None:
+            try:
+                from FlagEmbedding import FlagReranker
+                model = FlagReranker(model_name, use_fp16=False)
+                self.scorer = model.compute_score
+            except ImportError:
+                logger.warning("重排模型不可用，将使用基础排序")
+
+    def _cache_key(self, query, document):
+        return hashlib.sha1(f"{query}\x00{document}".encode("utf-8")).hexdigest()
+
+    def _cache_put(self, key, score):
+        self._cache[key] = score
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _score_batch(self, pairs):
+        """在线程池中执行的实际打分"""
+        # compute_score 可能返回列表、numpy 数组，单个候选对时返回标量
+        return [float(s) for s in np.atleast_1d(self.scorer(pairs)).tolist()]
+
+    def _fallback(self, candidates, top_k):
+        self.stats["fallbacks"] += 1
+        return sorted(candidates, key=lambda x: x.get("score", 0), reverse=True)[:top_k]
+
+    async def rerank(self, query, candidates, top_k=5, deadline_ms=None):
+        """重排检索结果；超出时间预算时回退为向量排序"""
+        if not self.scorer or len(candidates) <= 1:
+            return candidates[:top_k]
+
+        self.stats["requests"] += 1
+        self.stats["pairs"] += len(candidates)
+        loop = asyncio.get_running_loop()
+        budget = (self.deadline_ms if deadline_ms is None else deadline_ms) / 1000.0
+
+        keys = [self._cache_key(query, c["document"]) for c in candidates]
+        scores = {}
+        missing = {}
+        for key, candidate in zip(keys, candidates):
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                scores[key] = self._cache[key]
+            elif key not in missing:
+                missing[key] = (query, candidate["document"])
+        self.stats["cache_hits"] += len(candidates) - len(missing)
+
+        if missing:
+            missing_keys = list(missing)
+            futures = {}
+            for start in range(0, len(missing_keys), self.batch_size):
+                batch_keys = missing_keys[start:start + self.batch_size]
+                job = self._executor.submit(self._score_batch, [missing[k] for k in batch_keys])
+                job.add_done_callback(lambda j, ks=batch_keys: self._store_batch(loop, j, ks))
+                futures[asyncio.wrap_future(job, loop=loop)] = (job, batch_keys)
+
+            done, pending = await asyncio.wait(futures, timeout=budget)
+            if pending:
+                # 尚未开始的批次直接取消；正在计算的批次完成后仍会写入缓存
+                for future in pending:
+                    futures[future][0].cancel()
+                    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                self.stats["timeouts"] += 1
+                logger.warning("重排超出时间预算 %.0fms，回退为向量排序", budget * 1000)
+                return self._fallback(candidates, top_k)
+            for future in done:
+                if future.exception() is not None:
+                    logger.error(f"重排失败: {future.exception()}")
+                    return self._fallback(candidates, top_k)
+                scores.update(zip(futures[future][1], future.result()))
+
+        # 更新分数并重排
+        for key, candidate in zip(keys, candidates):
+            rerank_score = scores[key]
+            candidate["rerank_score"] = rerank_score
+            candidate["final_score"] = 0.7 * candidate.get("score", 0) + 0.3 * rerank_score
+        reranked = sorted(candidates, key=lambda x: x["final_score"], reverse=True)
+        return reranked[:top_k]
+
+    def _store_batch(self, loop, job, batch_keys):
+        """批次完成回调（在线程池线程中执行），切回事件循环写缓存"""
+        if job.cancelled() or job.exception() is not None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._store_scores, batch_keys, job.result())
+        except RuntimeError:
+            pass  # 事件循环已关闭，丢弃本批结果
+
+    def _store_scores(self, batch_keys, scores):
+        for key, score in zip(batch_keys, scores):
+            self._cache_put(key, score)
+        self.stats["pairs_scored"] += len(batch_keys)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
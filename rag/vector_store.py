@@ -0,0 +1,216 @@
+"""向量存储
+
+QuantizedVectorStore 与 DEVSPEC 中基于 Chroma 的 VectorStore 接口保持一致
+（add_documents / search / delete_documents / get_collection_stats），
+内存中只保留量化后的码字：
+  - quantization="none"：float32 原始向量（基线）
+  - quantization="int8"：标量量化，内存约为 float32 的 1/4
+  - quantization="pq"：乘积量化，每条向量 pq_m 字节
+量化方式为 int8 / pq 时须先用代表性样本调用 train()。
+
+同一 id 重复添加时旧行打墓碑标记，检索只返回最新的一条。
+
+码字缓冲区按容量倍增扩展，批量追加的均摊开销与已有数据量无关。
+
+开启 rescore 时，float32 原始向量追加写入 persist_directory 下的文件，
+检索先用码字粗排出 n_results * rescore_factor 个候选，再通过 memmap
+读取这些候选的原始向量精排，只有被访问到的页会进入内存。码字与 id 不落盘，
+文件在实例初始化时清空，行号与内存中的码字一一对应；同一目录同一时间只应由一个实例使用。
+"""
+import logging
+import os
+import uuid
+
+import numpy as np
+
+from rag.quantization import ProductQuantizer, ScalarQuantizer
+
+logger = logging.getLogger(__name__)
+
+
+class QuantizedVectorStore:
+    def __init__(self, dim, quantization="int8", pq_m=64, rescore=True,
+                 rescore_factor=4, persist_directory=None):
+        """初始化量化向量库"""
+        if quantization not in ("none", "int8", "pq"):
+            raise ValueError(f"不支持的量化方式: {quantization}")
+
+        self.dim = dim
+        self.quantization = quantization
+        self.rescore = rescore and quantization != "none"
+        self.rescore_factor = max(1, rescore_factor)
+        self.persist_directory = persist_directory
+
+        if quantization == "int8":
+            self.quantizer = ScalarQuantizer()
+        elif quantization == "pq":
+            self.quantizer = ProductQuantizer(m=pq_m)
+        else:
+            self.quantizer = None
+
+        code_dtype = {"none": np.float32, "int8": np.int8, "pq": np.uint8}[quantization]
+        code_width = pq_m if quantization == "pq" else dim
+        # 预留容量的缓冲区，前 len(self.ids) 行有效
+        self._codes = np.empty((0, code_width), dtype=code_dtype)
+        self._alive = np.zeros(0, dtype=bool)
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self._id_to_row = {}
+
+        # 精排用的原始向量：有持久化目录时落盘，否则只能留在内存里
+        self._raw_path = None
+        self._raw_memmap = None
+        self._raw_in_memory = []
+        if self.rescore and persist_directory:
+            os.makedirs(persist_directory, exist_ok=True)
+            self._raw_path = os.path.join(persist_directory, "vectors.f32")
+            open(self._raw_path, "wb").close()
+        elif self.rescore:
+            logger.warning("未配置 persist_directory，精排向量将保存在内存中，无法节省内存")
+
+    def train(self, vectors):
+        """训练量化器（int8 / PQ 添加文档前必须先训练）"""
+        if self.quantizer is not None:
+            self.quantizer.fit(vectors)
+
+    def _reserve(self, rows):
+        """码字缓冲区容量不足时按倍增扩展"""
+        capacity = len(self._codes)
+        if rows <= capacity:
+            return
+        capacity = max(rows, capacity * 2, 64)
+        size = len(self.ids)
+        codes = np.empty((capacity, self._codes.shape[1]), dtype=self._codes.dtype)
+        codes[:size] = self._codes[:size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:size] = self._alive[:size]
+        self._codes, self._alive = codes, alive
+
+    async def add_documents(self, documents, embeddings, metadatas=None, ids=None):
+        """添加文档到向量库"""
+        if not documents or embeddings is None or len(embeddings) == 0:
+            return []
+
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if ids is None:
+            ids = [f"doc_{uuid.uuid4().hex}" for _ in documents]
+        if metadatas is None:
+            metadatas = [{} for _ in documents]
+
+        if self.quantizer is None:
+            codes = vectors
+        else:
+            if not self.quantizer.is_trained:
+                # 用首批数据自动拟合不可靠：单条向量时 min == max，后续码字全部饱和
+                raise RuntimeError(f"{self.quantization} 量化器尚未训练，请先调用 train()")
+            codes = self.quantizer.encode(vectors)
+
+        start = len(self.ids)
+        self._reserve(start + len(codes))
+        self._codes[start:start + len(codes)] = codes
+        self._alive[start:start + len(codes)] = True
+        for offset, doc_id in enumerate(ids):
+            old_row = self._id_to_row.get(doc_id)
+            if old_row is not None:
+                self._alive[old_row] = False
+            self._id_to_row[doc_id] = start + offset
+        self.ids.extend(ids)
+        self.documents.extend(documents)
+        self.metadatas.extend(metadatas)
+
+        if self.rescore:
+            if self._raw_path:
+                with open(self._raw_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                self._raw_memmap = None
+            else:
+                self._raw_in_memory.append(vectors)
+
+        return ids
+
+    def _raw_vectors(self):
+        if self._raw_path:
+            if self._raw_memmap is None or len(self._raw_memmap) != len(self.ids):
+                self._raw_memmap = np.memmap(self._raw_path, dtype=np.float32, mode="r",
+                                             shape=(len(self.ids), self.dim))
+            return self._raw_memmap
+        if len(self._raw_in_memory) > 1:
+            self._raw_in_memory = [np.concatenate(self._raw_in_memory)]
+        return self._raw_in_memory[0]
+
+    def _match_filter(self, row, where_filter):
+        metadata = self.metadatas[row]
+        return all(metadata.get(key) == value for key, value in where_filter.items())
+
+    async def search(self, query_embedding, n_results=5, where_filter=None):
+        """向量相似度搜索"""
+        if not self.ids:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(self.dim)
+        size = len(self.ids)
+        if self.quantizer is None:
+            scores = self._codes[:size] @ query
+        else:
+            scores = self.quantizer.score(query, self._codes[:size])
+
+        mask = self._alive[:size].copy()
+        if where_filter:
+            for row in np.flatnonzero(mask):
+                if not self._match_filter(row, where_filter):
+                    mask[row] = False
+        scores = np.where(mask, scores, -np.inf)
+
+        n_valid = int(mask.sum())
+        if n_valid == 0:
+            return []
+        n_candidates = min(n_valid, n_results * (self.rescore_factor if self.rescore else 1))
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+
+        if self.rescore:
+            raw = self._raw_vectors()
+            rows = np.sort(candidates)  # 顺序读取 memmap 更友好
+            exact = np.asarray(raw[rows]) @ query
+            scores = np.full(len(scores), -np.inf, dtype=np.float32)
+            scores[rows] = exact
+
+        top = candidates[np.argsort(-scores[candidates], kind="stable")][:n_results]
+        return self._format_search_results(top, scores)
+
+    def _format_search_results(self, rows, scores):
+        """格式化搜索结果（与 Chroma 版本字段一致）"""
+        formatted = []
+        for row in rows:
+            score = float(scores[row])
+            formatted.append({
+                "id": self.ids[row],
+                "document": self.documents[row],
+                "metadata": self.metadatas[row],
+                "distance": 1 - score,
+                "score": score,
+            })
+        return formatted
+
+    async def delete_documents(self, document_ids):
+        """删除文档（打墓碑标记，码字在重建索引时回收）"""
+        for doc_id in document_ids:
+            row = self._id_to_row.pop(doc_id, None)
+            if row is not None:
+                self._alive[row] = False
+
+    async def get_collection_stats(self):
+        """获取集合统计信息"""
+        return int(self._alive.sum())
+
+    def memory_usage(self):
+        """常驻内存估算（字节）：码字缓冲区（含预留容量）+ 量化器参数，不含落盘的精排向量"""
+        total = self._codes.nbytes
+        if isinstance(self.quantizer, ScalarQuantizer) and self.quantizer.is_trained:
+            total += self.quantizer.vmin.nbytes + self.quantizer.scale.nbytes
+        elif isinstance(self.quantizer, ProductQuantizer) and self.quantizer.is_trained:
+            total += self.quantizer.centroids.nbytes
+        if self.rescore and not self._raw_path:
+            total += sum(chunk.nbytes for chunk in self._raw_in_memory)
+        return total
+
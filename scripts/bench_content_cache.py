@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""两级内容缓存（storage/cache.py）读写吞吐基准测试
+
+在临时目录（或 --directory）中写入 --keys 个值（每个 --value-size 字节），分别报告：
+- 内存层：set / get 命中（只用内存层）；
+- 磁盘层：set（含写文件）/ get 命中（内存层只保留 1 条，读取全部落到磁盘）；
+- 并发：--concurrency 个协程同时 aget（磁盘命中在线程池中执行）；
+- 淘汰：磁盘上限为写入总量一半时的 set 吞吐（后台淘汰）与最终磁盘占用。
+
+用法:
+  python scripts/bench_content_cache.py
+  python scripts/bench_content_cache.py --keys 20000 --value-size 4096 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.cache import ContentCache, cache_key  # noqa: E402
+
+
+def timed(fn, keys):
+    started = time.perf_counter()
+    for key in keys:
+        fn(key)
+    return time.perf_counter() - started
+
+
+def row(name, count, elapsed):
+    print(f"| {name} | {count} | {elapsed:.3f}s | {count / elapsed:,.0f} |")
+
+
+async def concurrent_gets(cache, keys, concurrency):
+    queue = list(keys)
+
+    async def worker():
+        while queue:
+            await cache.aget(queue.pop())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="两级内容缓存读写吞吐基准测试")
+    parser.add_argument("--keys", type=int, default=5000, help="写入的键数")
+    parser.add_argument("--value-size", type=int, default=2048, help="每个值的字节数")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发读取的协程数")
+    parser.add_argument("--directory", help="磁盘层目录（默认临时目录，结束后删除）")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    keys = [cache_key(str(i)) for i in range(args.keys)]
+    values = {key: rng.randbytes(args.value_size) for key in keys}
+    shuffled = keys[:]
+    rng.shuffle(shuffled)
+    total_bytes = args.keys * args.value_size
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = args.directory or tmp
+        print(f"{args.keys} 个键，每个 {args.value_size} 字节，磁盘目录 {base}")
+        print("| 操作 | 次数 | 耗时 | 次/秒 |")
+        print("|---|---|---|---|")
+
+        memory = ContentCache("bench-memory", max_memory_items=args.keys, max_memory_bytes=total_bytes * 2)
+        row("内存 set", args.keys, timed(lambda key: memory.set(key, values[key]), keys))
+        row("内存 get（命中）", args.keys, timed(memory.get, shuffled))
+        row("内存 get（未命中）", args.keys, timed(memory.get, [cache_key("miss", i) for i in range(args.keys)]))
+
+        disk_dir = os.path.join(base, "disk")
+        disk = ContentCache("bench-disk", directory=disk_dir, max_memory_items=1, max_disk_bytes=total_bytes * 2)
+        row("磁盘 set", args.keys, timed(lambda key: disk.set(key, values[key]), keys))
+        row("磁盘 get（命中）", args.keys, timed(disk.get, shuffled))
+
+        reader = ContentCache("bench-async", directory=disk_dir, max_memory_items=1, max_disk_bytes=total_bytes * 2)
+        elapsed = asyncio.run(concurrent_gets(reader, shuffled, args.concurrency))
+        row(f"并发 aget（{args.concurrency} 协程，磁盘命中）", args.keys, elapsed)
+
+        bounded = ContentCache("bench-evict", directory=os.path.join(base, "evict"), max_memory_items=1,
+                               max_disk_bytes=total_bytes // 2)
+        elapsed = timed(lambda key: bounded.set(key, values[key]), keys)
+        bounded.wait_for_eviction()
+        row("磁盘 set（上限为总量一半，后台淘汰）", args.keys, elapsed)
+
+        snapshot = bounded.snapshot()
+        print()
+        print(f"淘汰 {snapshot['disk_evictions']} 个文件，磁盘占用 {snapshot['disk_bytes'] / 1024 / 1024:.1f} MB"
+              f"（上限 {bounded.max_disk_bytes / 1024 / 1024:.1f} MB）")
+
+
+if __name__ == "__main__":
+    main()
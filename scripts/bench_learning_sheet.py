@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""学习单 PDF 渲染基准测试
+
+生成 --sheets 份内容各不相同的学习单（每份 --items 道错题 + 同样数量的类练习），不经过缓存，
+分别用不同进程数的进程池渲染，报告吞吐量（份/秒）与平均 PDF 大小；再在每次一个新进程中单独渲染
+--memory-samples 份，报告单次渲染耗时与内存增量（子进程 ru_maxrss 的增长，包含 MuPDF 的原生内存，
+基线在导入 pymupdf 之后）。
+
+用法:
+  python scripts/bench_learning_sheet.py
+  python scripts/bench_learning_sheet.py --sheets 200 --items 30 --workers 1,2,4
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.cpu_pool import CPU_POOL_WORKERS  # noqa: E402
+from core.exporter.sheet import build_sheet_markdown, is_available, render_sheet_pdf  # noqa: E402
+
+SUBJECTS = ["数学", "语文", "英语", "物理", "化学"]
+ERROR_TYPES = ["计算错误", "概念不清", "审题不清", "粗心", "步骤缺失"]
+
+
+def make_sheets(count, items, seed=42):
+    rng = random.Random(seed)
+    sheets = []
+    for sheet in range(count):
+        mistakes = [
+            {
+                "subject": rng.choice(SUBJECTS),
+                "question": f"第 {sheet}-{i} 题：计算 {rng.randint(10, 99)} × {rng.randint(10, 99)} + "
+                            f"{rng.randint(100, 999)} ÷ {rng.randint(2, 9)}，并说明运算顺序。",
+                "answer": str(rng.randint(100, 9999)),
+                "correct_answer": str(rng.randint(100, 9999)),
+                "comment": "先算乘除，再算加减；注意除法结果保留两位小数。" * rng.randint(1, 3),
+                "error_type": rng.choice(ERROR_TYPES),
+                "knowledge_point": f"知识点{rng.randint(1, 30)}, 知识点{rng.randint(1, 30)}",
+            }
+            for i in range(items)
+        ]
+        practices = [
+            {"question": f"练习 {sheet}-{i}：{rng.randint(10, 99)} × {rng.randint(10, 99)} = ?",
+             "correct_answer": str(rng.randint(100, 9999)), "comment": "列竖式计算"}
+            for i in range(items)
+        ]
+        sheets.append(build_sheet_markdown(mistakes, practices, title=f"学习单 {sheet}"))
+    return sheets
+
+
+def measure_render(markdown_text):
+    """在新进程中渲染一份，返回 (PDF 字节数, 耗时秒数, 内存增量字节数)"""
+    import pymupdf  # noqa: F401  导入开销计入基线
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    size = len(render_sheet_pdf(markdown_text))
+    elapsed = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return size, elapsed, (after - before) * 1024  # Linux 下 ru_maxrss 单位为 KB
+
+
+def run_pool(sheets, workers):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(abs, range(workers)))  # 先拉起全部子进程，计时不含进程启动
+        started = time.perf_counter()
+        sizes = [len(pdf) for pdf in executor.map(render_sheet_pdf, sheets)]
+        elapsed = time.perf_counter() - started
+    return elapsed, sum(sizes) / len(sizes)
+
+
+def _mb(size):
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="学习单 PDF 渲染基准测试")
+    parser.add_argument("--sheets", type=int, default=100, help="每种进程数渲染的学习单份数")
+    parser.add_argument("--items", type=int, default=20, help="每份学习单的错题数（类练习数相同）")
+    parser.add_argument("--workers", default=",".join(sorted({"1", str(CPU_POOL_WORKERS)})),
+                        help="逗号分隔的进程数，默认 1 与 CPU_POOL_WORKERS")
+    parser.add_argument("--memory-samples", type=int, default=5, help="统计单次内存增量的渲染次数，0 表示不统计")
+    args = parser.parse_args()
+
+    if not is_available():
+        parser.error("未安装 pymupdf")
+
+    started = time.perf_counter()
+    sheets = make_sheets(args.sheets, args.items)
+    markdown_elapsed = time.perf_counter() - started
+    print(f"生成 {len(sheets)} 份 Markdown（每份 {args.items} 道错题），{len(sheets) / markdown_elapsed:,.0f} 份/秒")
+
+    print("| 进程数 | 份数 | 耗时 | 份/秒 | 平均 PDF 大小 |")
+    print("|---|---|---|---|---|")
+    for workers in sorted({int(value) for value in args.workers.split(",")}):
+        elapsed, mean_size = run_pool(sheets, workers)
+        print(f"| {workers} | {len(sheets)} | {elapsed:.2f}s | {len(sheets) / elapsed:,.1f} | {mean_size / 1024:.1f} KB |")
+
+    if args.memory_samples > 0:
+        # 每个任务一个新进程，ru_maxrss 的增长只反映这一次渲染
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+            samples = list(executor.map(measure_render, sheets[:args.memory_samples]))
+        times = [elapsed for _, elapsed, _ in samples]
+        memory = [delta for _, _, delta in samples]
+        print()
+        print("| 样本数 | 单次耗时（平均 / 最大） | 内存增量（平均 / 最大） |")
+        print("|---|---|---|")
+        print(f"| {len(samples)} | {sum(times) / len(times) * 1000:.0f} / {max(times) * 1000:.0f} ms | "
+              f"{_mb(sum(memory) / len(memory))} / {_mb(max(memory))} |")
+
+
+if __name__ == "__main__":
+    main()
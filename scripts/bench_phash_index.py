@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""感知哈希近重复索引（core/vision/dedup.py 的 HammingIndex）查询延迟基准测试
+
+随机生成 --size 个 64 位哈希建索引，再用 --queries 个随机哈希（大多无近重复）与若干翻转了
+少量位的已有哈希（近重复）查询，报告单次查询的平均 / P99 延迟、平均比较的候选数，
+并与 numpy 暴力扫描对比。
+
+用法:
+  python scripts/bench_phash_index.py
+  python scripts/bench_phash_index.py --size 1000000 --queries 2000 --max-distance 8
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.vision.dedup import PHASH_DUP_DISTANCE, HammingIndex, _popcount  # noqa: E402
+
+
+def timed_queries(search, queries):
+    latencies = []
+    for value in queries:
+        started = time.perf_counter()
+        search(value)
+        latencies.append(time.perf_counter() - started)
+    return np.array(latencies) * 1000
+
+
+def row(name, latencies, candidates):
+    print(f"| {name} | {latencies.mean():.3f}ms | {np.percentile(latencies, 99):.3f}ms | {candidates:,.0f} |")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="感知哈希近重复索引查询延迟基准测试")
+    parser.add_argument("--size", type=int, default=200000, help="索引中的哈希数")
+    parser.add_argument("--queries", type=int, default=1000, help="查询次数")
+    parser.add_argument("--max-distance", type=int, default=PHASH_DUP_DISTANCE, help="近重复的最大汉明距离")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    hashes = rng.integers(0, 2**63, size=args.size, dtype=np.int64).astype(np.uint64)
+    index = HammingIndex(max_distance=args.max_distance)
+    started = time.perf_counter()
+    for record_id, value in enumerate(hashes.tolist()):
+        index.add(value, record_id)
+    print(f"{args.size} 个哈希，建索引耗时 {time.perf_counter() - started:.2f}s，"
+          f"分段数 {len(index._chunks)}，最大距离 {args.max_distance}")
+
+    queries = [int(v) for v in rng.integers(0, 2**63, size=args.queries, dtype=np.int64)]
+    for i, value in enumerate(hashes[:args.queries // 10].tolist()):
+        queries[i] = value ^ (1 << int(rng.integers(64)))  # 近重复：翻转 1 位
+
+    def candidates(value):
+        buckets = [table.get((value >> shift) & mask) for table, (shift, mask) in zip(index._tables, index._chunks)]
+        return sum(len(bucket[0]) for bucket in buckets if bucket is not None)
+
+    def brute_force(value):
+        distances = _popcount(hashes ^ np.uint64(value))
+        idx = int(distances.argmin())
+        return (idx, int(distances[idx])) if distances[idx] <= args.max_distance else None
+
+    print("| 方式 | 平均延迟 | P99 延迟 | 平均候选数 |")
+    print("|---|---|---|---|")
+    row("多索引 HammingIndex", timed_queries(index.search, queries),
+        sum(candidates(value) for value in queries) / len(queries))
+    row("numpy 暴力扫描", timed_queries(brute_force, queries), args.size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""mistake_analysis 分区维护与数据保留（仅 PostgreSQL）
+
+预建未来几个月的分区；把超过保留期（MISTAKE_RETENTION_MONTHS 个月）的分区 DETACH 后导出为
+gzip 压缩的 CSV 存入冷存储目录再删除，并归档删除已没有分析记录的旧错题记录。建议每天定时执行。
+
+用法:
+  python scripts/partition_maintenance.py --dry-run            # 只预建分区，列出将被归档的分区
+  python scripts/partition_maintenance.py
+  python scripts/partition_maintenance.py --retention-months 12 --archive-dir /mnt/cold/mistake_note
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.partitions import ARCHIVE_DIR, MISTAKE_RETENTION_MONTHS, run_maintenance  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mistake_analysis 分区维护与数据保留")
+    parser.add_argument("--db-url", help="数据库 URL，默认使用 db/database_config.py 中的配置")
+    parser.add_argument("--retention-months", type=int, default=MISTAKE_RETENTION_MONTHS,
+                        help="保留最近多少个月的数据，0 表示永久保留")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="归档文件（.csv.gz）输出目录")
+    parser.add_argument("--dry-run", action="store_true", help="不归档、不删除，只输出将被归档的分区")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.db_url:
+        from sqlalchemy import create_engine
+
+        engine = create_engine(args.db_url)
+    else:
+        from db.database_config import engine
+
+    summary = run_maintenance(engine, args.retention_months, args.archive_dir, dry_run=args.dry_run)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
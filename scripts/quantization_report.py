@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""向量量化 Recall@k / 内存 对比报告
+
+从 mistake_analysis 表读取题干，生成 bge-m3 向量后，分别用 float32、int8、PQ
+（含/不含 float 精排）建库，以 float32 精确检索为基准统计 Recall@k、常驻内存
+与单次查询延迟，输出 Markdown 表格，用于选择量化方案。
+
+用法:
+  python scripts/quantization_report.py --k 10 --queries 200
+  python scripts/quantization_report.py --db-url sqlite:///db/mistake_note.db --output report.md
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.quantization import recall_at_k  # noqa: E402
+from rag.vector_store import QuantizedVectorStore  # noqa: E402
+
+
+def load_questions(db_url=None, limit=None):
+    """读取 mistake_analysis 中非空题干"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from db.database_config import MistakeAnalysis, SessionLocal
+
+    session_factory = sessionmaker(bind=create_engine(db_url)) if db_url else SessionLocal
+    db = session_factory()
+    try:
+        query = (db.query(MistakeAnalysis.id, MistakeAnalysis.question)
+                 .filter(MistakeAnalysis.question.isnot(None), MistakeAnalysis.question != "")
+                 .order_by(MistakeAnalysis.id))
+        if limit:
+            query = query.limit(limit)
+        return [(row.id, row.question) for row in query]
+    finally:
+        db.close()
+
+
+def build_configs(dim):
+    configs = [("float32", dict(quantization="none"))]
+    configs.append(("int8", dict(quantization="int8", rescore=False)))
+    configs.append(("int8+rescore", dict(quantization="int8", rescore=True)))
+    for m in (16, 32, 64, 128):
+        if dim % m == 0:
+            configs.append((f"pq{m}", dict(quantization="pq", pq_m=m, rescore=False)))
+            configs.append((f"pq{m}+rescore", dict(quantization="pq", pq_m=m, rescore=True)))
+    return configs
+
+
+async def evaluate(vectors, query_rows, k, configs, rescore_factor=4):
+    """对每种配置建库并统计指标；查询自身从结果中剔除"""
+    n, dim = vectors.shape
+    ids = [str(i) for i in range(n)]
+    documents = [""] * n
+
+    def top_ids(results, self_id):
+        return [r["id"] for r in results if r["id"] != self_id][:k]
+
+    exact = []
+    for row in query_rows:
+        scores = vectors @ vectors[row]
+        scores[row] = -np.inf
+        order = np.argsort(-scores)[:k]
+        exact.append([str(i) for i in order])
+
+    report = []
+    for name, params in configs:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = QuantizedVectorStore(dim, rescore_factor=rescore_factor,
+                                         persist_directory=tmp, **params)
+            if params["quantization"] != "none":
+                store.train(vectors)
+            await store.add_documents(documents, vectors, ids=ids)
+
+            approx = []
+            started = time.perf_counter()
+            for row in query_rows:
+                results = await store.search(vectors[row], n_results=k + 1)
+                approx.append(top_ids(results, str(row)))
+            latency_ms = (time.perf_counter() - started) * 1000 / max(1, len(query_rows))
+
+            memory = store.memory_usage()
+            report.append({
+                "config": name,
+                "bytes_per_vector": memory / n,
+                "memory_mb": memory / (1024 * 1024),
+                "recall": recall_at_k(approx, exact, k),
+                "latency_ms": latency_ms,
+            })
+    return report
+
+
+def render_markdown(report, n, dim, k):
+    baseline = report[0]["memory_mb"] or 1
+    lines = [
+        f"# 向量量化对比（N={n}, dim={dim}, k={k}）",
+        "",
+        f"| 配置 | 字节/向量 | 常驻内存(MB) | 相对 float32 | Recall@{k} | 查询延迟(ms) |",
+        "|---|---:|---:|---:|---:|---:|",
+    ]
+    for item in report:
+        lines.append(
+            f"| {item['config']} | {item['bytes_per_vector']:.1f} | {item['memory_mb']:.2f} | "
+            f"{item['memory_mb'] / baseline:.1%} | {item['recall']:.4f} | {item['latency_ms']:.2f} |"
+        )
+    lines.append("")
+    lines.append("注：常驻内存不含落盘的 float32 精排向量（通过 memmap 按需读取）。")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mistake_analysis 向量量化 Recall/内存报告")
+    parser.add_argument("--db-url", default=None, help="数据库 URL，默认使用 db.database_config 配置")
+    parser.add_argument("--limit", type=int, default=None, help="最多读取的题目条数")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="抽样查询条数")
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--output", default=None, help="报告输出路径（Markdown）")
+    args = parser.parse_args()
+
+    rows = load_questions(args.db_url, args.limit)
+    if len(rows) <= args.k:
+        print(f"题目数量不足（{len(rows)} 条），无法生成报告")
+        return 1
+
+    from rag.embedder import TextEmbedder
+
+    embedder = TextEmbedder()
+    vectors = np.asarray(asyncio.run(embedder.batch_embed([q for _, q in rows])), dtype=np.float32)
+    n, dim = vectors.shape
+
+    rng = np.random.default_rng(0)
+    query_rows = rng.choice(n, size=min(args.queries, n), replace=False)
+    report = asyncio.run(evaluate(vectors, query_rows, args.k, build_configs(dim), args.rescore_factor))
+    markdown = render_markdown(report, n, dim, args.k)
+
+    print(markdown)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(markdown + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
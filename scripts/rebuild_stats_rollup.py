@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""全量重建错题统计汇总表 mistake_stats_rollup
+
+汇总表在写入分析记录时增量维护；首次上线（回填历史数据）或怀疑计数偏差时执行本脚本。
+
+用法:
+  python scripts/rebuild_stats_rollup.py
+  python scripts/rebuild_stats_rollup.py --db-url sqlite:///db/mistake_note.db
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_config import Base, SessionLocal, rebuild_stats_rollup  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重建错题统计汇总表")
+    parser.add_argument("--db-url", help="数据库 URL，默认使用 db/database_config.py 中的配置")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.db_url:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+
+        engine = create_engine(args.db_url)
+        Base.metadata.create_all(engine, tables=[Base.metadata.tables["mistake_stats_rollup"]])
+        session = sessionmaker(bind=engine)()
+    else:
+        session = SessionLocal()
+    try:
+        rows = rebuild_stats_rollup(session)
+        print(f"统计汇总重建完成，共 {rows} 行")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
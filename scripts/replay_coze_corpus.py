@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Coze 输出离线回放基准测试
+
+读取 COZE_CAPTURE_DIR 采集的语料（见 integration/coze_capture.py），不调用 Coze，按与线上相同的流程
+以最快速度逐阶段回放，报告各阶段吞吐量与内存分配：
+  parse      parse_coze_output（JSON 解析）
+  practices  extract_practices_from_payload
+  normalize  normalize_coze_payload（transform_coze_result + practices，含其日志格式化）
+  stream     CozeQuestionStream 增量解析 + finish（有 chunks 的语料按原始分段，否则按 --chunk-size 切分）
+  persist    save_mistake_record（默认写入临时 SQLite 库，每条一次提交）
+
+每个阶段先计时回放 --repeat 遍；再开启 tracemalloc 单独回放一遍统计分配（不影响计时）：
+单次调用的分配峰值（平均 / 最大）以及整个阶段结束后仍留存的内存。
+
+用法:
+  python scripts/replay_coze_corpus.py --corpus /data/coze_corpus
+  python scripts/replay_coze_corpus.py --corpus /data/coze_corpus --repeat 20 --stages parse,normalize
+  python scripts/replay_coze_corpus.py --corpus /data/coze_corpus --log-level INFO   # 计入日志输出的开销
+"""
+import argparse
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.crud import save_mistake_record  # noqa: E402
+from db.models import Base  # noqa: E402
+from integration.coze_capture import load_coze_corpus  # noqa: E402
+from integration.coze_payload import (  # noqa: E402
+    CozePayloadError,
+    CozeQuestionStream,
+    extract_practices_from_payload,
+    normalize_coze_payload,
+    parse_coze_output,
+)
+
+STAGES = ["parse", "practices", "normalize", "stream", "persist"]
+_record_ids = itertools.count(1)
+_run_id = uuid.uuid4().hex[:8]  # 写入已有数据库（--db-url）时避免 file_id 与上次回放冲突
+
+
+def _chunks(entry, chunk_size):
+    if entry.get("chunks"):
+        return [tuple(chunk) for chunk in entry["chunks"]]
+    raw = entry["raw_payload"]
+    return [("replay", raw[start:start + chunk_size]) for start in range(0, len(raw), chunk_size)]
+
+
+def prepare(entries, chunk_size):
+    """预先算好每个阶段的输入，计时只包含阶段本身；无法解析的语料跳过后续阶段"""
+    items = []
+    errors = 0
+    for entry in entries:
+        try:
+            parsed = parse_coze_output(entry["raw_payload"])
+            normalized = normalize_coze_payload(parsed)
+        except CozePayloadError:
+            errors += 1
+            continue
+        items.append({
+            "raw": entry["raw_payload"],
+            "chunks": _chunks(entry, chunk_size),
+            "parsed": parsed,
+            "normalized": normalized,
+        })
+    return items, errors
+
+
+def _stream(chunks):
+    questions = CozeQuestionStream()
+    for node, text in chunks:
+        questions.feed(text, node)
+    return questions.finish()[1]
+
+
+def stage_calls(stage, items, session_factory):
+    """返回 (逐条调用的函数列表, 阶段结束时的清理函数)"""
+    if stage == "parse":
+        return [lambda item=item: parse_coze_output(item["raw"]) for item in items], None
+    if stage == "practices":
+        return [lambda item=item: extract_practices_from_payload(item["parsed"]) for item in items], None
+    if stage == "normalize":
+        return [lambda item=item: normalize_coze_payload(item["parsed"]) for item in items], None
+    if stage == "stream":
+        return [lambda item=item: _stream(item["chunks"]) for item in items], None
+    if stage == "persist":
+        db = session_factory()
+
+        def persist(item):
+            file_id = f"replay-{_run_id}-{next(_record_ids)}"
+            file_data = {"file_id": file_id, "filename": f"{file_id}.png", "file_url": f"/media/uploads/{file_id}.png"}
+            return save_mistake_record(db, file_data, item["normalized"]["analysis"], item["normalized"]["practices"])
+
+        return [lambda item=item: persist(item) for item in items], db.close
+    raise ValueError(f"未知阶段: {stage}")
+
+
+def measure(stage, items, session_factory, repeat):
+    """计时回放 repeat 遍，返回 (调用次数, 耗时秒数, 额外信息)"""
+    calls, cleanup = stage_calls(stage, items, session_factory)
+    inconsistent = 0
+    try:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for call in calls:
+                result = call()
+                if stage == "stream" and not result:
+                    inconsistent += 1
+        elapsed = time.perf_counter() - started
+    finally:
+        if cleanup:
+            cleanup()
+    extra = f"逐题与完整结果不一致 {inconsistent // repeat} 条" if inconsistent else ""
+    return len(calls) * repeat, elapsed, extra
+
+
+def measure_allocations(stage, items, session_factory):
+    """tracemalloc 下回放一遍，返回 (单次分配峰值平均, 单次分配峰值最大, 阶段留存) 字节数"""
+    calls, cleanup = stage_calls(stage, items, session_factory)
+    peaks = []
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for call in calls:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            call()
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+        if cleanup:
+            cleanup()
+    if not peaks:
+        return 0, 0, 0
+    return sum(peaks) / len(peaks), max(peaks), retained
+
+
+def _kb(size):
+    return f"{size / 1024:.1f} KB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coze 输出离线回放基准测试")
+    parser.add_argument("--corpus", default=os.getenv("COZE_CAPTURE_DIR"), help="语料目录，默认 COZE_CAPTURE_DIR")
+    parser.add_argument("--repeat", type=int, default=10, help="计时时回放语料的遍数")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--chunk-size", type=int, default=64, help="没有原始分段的语料在 stream 阶段的切分长度")
+    parser.add_argument("--db-url", help="persist 阶段使用已有数据库，而不是临时 SQLite 库（会写入数据）")
+    parser.add_argument("--no-trace-memory", action="store_true", help="不统计内存分配")
+    parser.add_argument("--log-level", default="WARNING", help="日志级别，默认 WARNING（不输出逐条 INFO 日志）")
+    args = parser.parse_args()
+
+    if not args.corpus:
+        parser.error("请通过 --corpus 或 COZE_CAPTURE_DIR 指定语料目录")
+    logging.basicConfig(level=args.log_level.upper())
+
+    entries = load_coze_corpus(args.corpus)
+    items, errors = prepare(entries, args.chunk_size)
+    total_bytes = sum(len(item["raw"].encode("utf-8")) for item in items)
+    print(f"语料 {len(entries)} 条（无法解析 {errors} 条），共 {total_bytes / 1024:.1f} KB，回放 {args.repeat} 遍")
+    if not items:
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(args.db_url or f"sqlite:///{os.path.join(tmp, 'replay.db')}")
+        Base.metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine)
+
+        print("| 阶段 | 调用次数 | 耗时 | 条/秒 | MB/秒 | 单次分配峰值（平均 / 最大） | 阶段留存 | 备注 |")
+        print("|---|---|---|---|---|---|---|---|")
+        for stage in args.stages.split(","):
+            calls, elapsed, extra = measure(stage, items, session_factory, args.repeat)
+            rate = calls / elapsed if elapsed else float("inf")
+            throughput = total_bytes * args.repeat / 1024 / 1024 / elapsed if elapsed else float("inf")
+            if args.no_trace_memory:
+                allocations = "- | -"
+            else:
+                mean_peak, max_peak, retained = measure_allocations(stage, items, session_factory)
+                allocations = f"{_kb(mean_peak)} / {_kb(max_peak)} | {_kb(retained)}"
+            print(f"| {stage} | {calls} | {elapsed:.3f}s | {rate:,.0f} | {throughput:.1f} | {allocations} | {extra} |")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""两级内容缓存（内存 LRU + 磁盘按内容寻址）
+
+百度 OCR / ASR / TTS 等外部服务按次计费、耗时数百毫秒，而输入高度重复：同一页作业多次识别、
+同一句引导语反复合成。结果由输入内容与参数唯一确定，按 cache_key(输入, 参数) 的 SHA-256 缓存：
+
+- 内存层：OrderedDict 实现的 LRU（读写均为 O(1)），按条数（max_memory_items）与字节数（max_memory_bytes）双重限制；
+- 磁盘层：{directory}/{digest[:2]}/{digest}，文件头 8 字节为过期时间戳，修改时间即最近使用时间；
+  总大小超过 max_disk_bytes 时由后台线程删除过期文件与最久未使用的文件，写入不等待目录扫描。
+  进程重启后缓存仍然有效。
+
+两层使用同一个 TTL（ttl_seconds，0 表示不过期）；磁盘命中的值回填内存层。值可以是 bytes、str
+或可 JSON 序列化的对象，编码为 1 字节类型标记 + 内容（encode_value），不使用 pickle：缓存文件
+被篡改也不会执行任意代码；内存中同样保存编码后的字节，调用方修改取到的对象不会影响缓存。
+
+get_or_compute 把同一个键的并发未命中合并为一次计算（single-flight）。内存层与统计计数加锁，
+可在事件循环与线程池中同时使用；aget / aset / aclear 把磁盘读写放到线程池中执行。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from integration.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv(
+    "CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cache"),
+)
+
+_HEADER = struct.Struct(">d")  # 过期时间（Unix 时间戳，0 表示不过期）
+_BYTES, _TEXT, _JSON = b"b", b"s", b"j"
+_MISSING = object()
+
+
+def cache_key(*parts, **params):
+    """输入内容（bytes / str）与参数的摘要；参数按键排序后序列化，顺序不影响结果"""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+        digest.update(len(data).to_bytes(8, "big"))  # 带长度前缀，避免 ("ab", "c") 与 ("a", "bc") 冲突
+        digest.update(data)
+    digest.update(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def encode_value(value):
+    """bytes 原样保存，str 按 UTF-8，其余按 JSON；无法 JSON 序列化时抛出 TypeError"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return _BYTES + bytes(value)
+    if isinstance(value, str):
+        return _TEXT + value.encode("utf-8")
+    return _JSON + json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_value(payload):
+    """encode_value 的逆操作；类型标记未知时抛出 ValueError"""
+    tag, data = payload[:1], payload[1:]
+    if tag == _BYTES:
+        return data
+    if tag == _TEXT:
+        return data.decode("utf-8")
+    if tag == _JSON:
+        return json.loads(data)
+    raise ValueError(f"未知的缓存值类型: {tag!r}")
+
+
+class ContentCache:
+    """两级缓存；directory 为空时只使用内存层
+
+    background_eviction 为 False 时在写入的线程中同步淘汰（测试与基准测试中便于得到确定的结果）。
+    """
+
+    def __init__(self, name, directory=None, ttl_seconds=0, max_memory_items=1000, max_memory_bytes=64 * 1024 * 1024,
+                 max_disk_bytes=1024 * 1024 * 1024, background_eviction=True, clock=time.time):
+        self.name = name
+        self.directory = directory or None
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_items = max_memory_items
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.background_eviction = background_eviction
+        self._clock = clock
+        self._memory = OrderedDict()  # key -> (过期时间, 编码后的值)
+        self._memory_bytes = 0
+        self._disk_bytes = None  # 首次写入时扫描目录
+        self._disk_written = 0  # 累计写入的字节数，淘汰时用来补上扫描期间的写入
+        self._lock = threading.Lock()
+        self._evictor = None  # 正在运行的后台淘汰线程
+        self._flight = SingleFlight(f"cache:{name}")
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "expired": 0,
+                      "memory_evictions": 0, "disk_evictions": 0, "errors": 0}
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def _expires_at(self):
+        return self._clock() + self.ttl_seconds if self.ttl_seconds else 0.0
+
+    def _expired(self, expires_at):
+        return bool(expires_at) and expires_at <= self._clock()
+
+    # ---- 内存层 ----
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry[0]):
+                self._memory_pop(key)
+                self.stats["expired"] += 1
+                return None
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return entry[1]
+
+    def _memory_put(self, key, payload, expires_at):
+        if len(payload) > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_pop(key)
+            self._memory[key] = (expires_at, payload)
+            self._memory_bytes += len(payload)
+            while len(self._memory) > self.max_memory_items or self._memory_bytes > self.max_memory_bytes:
+                self._memory_pop(next(iter(self._memory)))
+                self.stats["memory_evictions"] += 1
+
+    def _memory_pop(self, key):
+        _, payload = self._memory.pop(key)
+        self._memory_bytes -= len(payload)
+
+    # ---- 磁盘层 ----
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _disk_get(self, key):
+        """返回 (过期时间, 编码后的值)，未命中返回 None"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            self._count("errors")
+            logger.warning(f"[缓存:{self.name}] 读取 {path} 失败: {e}")
+            return None
+        if len(data) <= _HEADER.size:
+            self._disk_remove(path, len(data))
+            return None
+        (expires_at,) = _HEADER.unpack_from(data)
+        if self._expired(expires_at):
+            self._disk_remove(path, len(data))
+            self._count("expired")
+            return None
+        try:
+            os.utime(path)  # 刷新最近使用时间，淘汰时按修改时间排序
+        except OSError:
+            pass
+        return expires_at, data[_HEADER.size:]
+
+    def _disk_put(self, key, payload, expires_at):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            existing = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(expires_at))
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self._count("errors")
+            logger.warning(f"[缓存:{self.name}] 写入 {path} 失败: {e}")
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                return  # 写入期间缓存被清空，下次写入时重新扫描目录
+            self._disk_bytes += _HEADER.size + len(payload) - existing
+            self._disk_written += _HEADER.size + len(payload) - existing
+            over = self._disk_bytes > self.max_disk_bytes
+        if over:
+            self._schedule_prune()
+
+    def _schedule_prune(self):
+        """超出磁盘上限：后台线程淘汰（同一时刻最多一个）；关闭后台淘汰时同步执行"""
+        if not self.background_eviction:
+            self._disk_prune()
+            return
+        with self._lock:
+            if self._evictor is not None and self._evictor.is_alive():
+                return
+            self._evictor = threading.Thread(target=self._disk_prune, name=f"cache-evict-{self.name}", daemon=True)
+            self._evictor.start()
+
+    def wait_for_eviction(self, timeout=None):
+        """等待正在进行的后台淘汰完成"""
+        evictor = self._evictor
+        if evictor is not None:
+            evictor.join(timeout)
+
+    def _disk_entries(self):
+        """[(路径, 大小, 修改时间)]"""
+        entries = []
+        if not self.directory:
+            return entries
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _read_expiry(self, path):
+        try:
+            with open(path, "rb") as f:
+                header = f.read(_HEADER.size)
+        except OSError:
+            return 0.0
+        return _HEADER.unpack(header)[0] if len(header) == _HEADER.size else 0.0
+
+    def _disk_prune(self):
+        """后台淘汰：一轮结束后仍超出上限（淘汰期间又有写入）就再来一轮；一轮什么都没删掉时停止"""
+        while True:
+            removed = self._disk_prune_once()
+            with self._lock:
+                if not removed or not self.background_eviction or self._disk_bytes is None \
+                        or self._disk_bytes <= self.max_disk_bytes:
+                    return
+
+    def _disk_prune_once(self):
+        """先删除已过期的文件，再按最久未使用删除，直到总大小降到上限的 90% 以下（留出余量，避免频繁扫描目录）
+
+        结束后以本轮扫描实测的大小（加上扫描期间其他线程写入的字节）校正计数。返回删除的文件数。
+        """
+        removed = 0
+        with self._lock:
+            written = self._disk_written
+        try:
+            entries = []
+            total = 0
+            for path, size, mtime in self._disk_entries():
+                if self._expired(self._read_expiry(path)) and self._disk_remove(path, size):
+                    self._count("expired")
+                    removed += 1
+                    continue
+                entries.append((path, size, mtime))
+                total += size
+            target = self.max_disk_bytes * 0.9
+            for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+                if total <= target:
+                    break
+                if self._disk_remove(path, size):
+                    total -= size
+                    removed += 1
+                    self._count("disk_evictions")
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"[缓存:{self.name}] 淘汰磁盘缓存失败: {e}")
+            return removed
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes = total + self._disk_written - written
+        return removed
+
+    def _disk_remove(self, path, size):
+        """删除缓存文件并从计数中扣除其大小"""
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes = max(0, self._disk_bytes - size)
+        return True
+
+    # ---- 对外接口 ----
+
+    def _lookup(self, key):
+        """返回编码后的值，未命中返回 None（磁盘层会阻塞）"""
+        payload = self._memory_get(key)
+        if payload is not None:
+            return payload
+        if self.directory:
+            entry = self._disk_get(key)
+            if entry is not None:
+                self._count("disk_hits")
+                self._memory_put(key, entry[1], entry[0])
+                return entry[1]
+        self._count("misses")
+        return None
+
+    def _decode(self, key, payload, default):
+        try:
+            return decode_value(payload)
+        except ValueError as e:  # 包括 UnicodeDecodeError、JSONDecodeError：按未命中处理并删除
+            self._count("errors")
+            logger.warning(f"[缓存:{self.name}] 无法解码 {key}: {e}")
+            self.delete(key)
+            return default
+
+    def get(self, key, default=None):
+        """同步读取（磁盘层会阻塞，事件循环中应使用 aget）；未命中返回 default"""
+        payload = self._lookup(key)
+        return default if payload is None else self._decode(key, payload, default)
+
+    def set(self, key, value):
+        payload = encode_value(value)
+        expires_at = self._expires_at()
+        self._memory_put(key, payload, expires_at)
+        if self.directory:
+            self._disk_put(key, payload, expires_at)
+        self._count("sets")
+
+    def delete(self, key):
+        """使某个键失效"""
+        with self._lock:
+            if key in self._memory:
+                self._memory_pop(key)
+        if self.directory:
+            path = self._path(key)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return
+            self._disk_remove(path, size)
+
+    def clear(self):
+        """清空两层缓存：磁盘目录先原子改名再整体删除，清空期间的新写入进入新目录，不会被误删"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._disk_bytes = None
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        trash = f"{self.directory}.trash-{uuid.uuid4().hex}"
+        try:
+            os.replace(self.directory, trash)
+        except OSError as e:
+            self._count("errors")
+            logger.warning(f"[缓存:{self.name}] 清空 {self.directory} 失败: {e}")
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    async def aget(self, key, default=None):
+        payload = self._memory_get(key)
+        if payload is not None:
+            return self._decode(key, payload, default)
+        if not self.directory:
+            self._count("misses")
+            return default
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def aset(self, key, value):
+        if self.directory:
+            await asyncio.to_thread(self.set, key, value)
+        else:
+            self.set(key, value)
+
+    async def adelete(self, key):
+        await asyncio.to_thread(self.delete, key)
+
+    async def aclear(self):
+        await asyncio.to_thread(self.clear)
+
+    async def get_or_compute(self, key, compute):
+        """返回 (值, 是否命中缓存)；未命中时 await compute() 并写入缓存
+
+        同一个键的并发未命中只计算一次；compute 抛出异常时不缓存，异常传给所有等待者。
+        """
+        value = await self.aget(key, _MISSING)
+        if value is not _MISSING:
+            return value, True
+
+        async def fill():
+            result = await compute()
+            await self.aset(key, result)
+            return result
+
+        value, _ = await self._flight.do(key, fill)
+        return value, False
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            memory_items, memory_bytes, disk_bytes = len(self._memory), self._memory_bytes, self._disk_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        return {
+            **stats,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            "memory_items": memory_items,
+            "memory_bytes": memory_bytes,
+            "disk_bytes": disk_bytes,
+            "coalesced": self._flight.stats["coalesced"],
+        }
@@ -0,0 +1,98 @@
+"""上传图片的衍生图（缩略图 / 中图 / WebP）
+
+错题本、首页列表每行只需要一张小图，直接加载原图会下载数 MB。衍生图存放在
+media/derived/{variant}/{原文件名去扩展名}.{ext}，随上传生成，缺失时在首次
+请求时惰性生成。上传文件名是 UUID 且内容不再变化，衍生图由原图确定性生成，
+因此可以使用一年期的 immutable 缓存头。
+"""
+import asyncio
+import logging
+import os
+import re
+
+from PIL import Image, ImageOps
+from starlette.staticfiles import StaticFiles
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_VARIANTS = {
+    "thumb": {"max_edge": int(os.getenv("DERIVATIVE_THUMB_EDGE", "320")), "format": "JPEG", "ext": "jpg"},
+    "medium": {"max_edge": int(os.getenv("DERIVATIVE_MEDIUM_EDGE", "1280")), "format": "JPEG", "ext": "jpg"},
+    "webp": {"max_edge": int(os.getenv("DERIVATIVE_MEDIUM_EDGE", "1280")), "format": "WEBP", "ext": "webp"},
+}
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+DERIVATIVE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+_SAFE_STEM = re.compile(r"^[\w\-]+$")
+
+
+def derivative_relpath(filename, variant):
+    """衍生图相对 media 根目录的路径"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return f"derived/{variant}/{stem}.{DERIVATIVE_VARIANTS[variant]['ext']}"
+
+
+def derivative_urls(filename):
+    """上传文件对应的衍生图 URL；非图片（如 PDF）返回空字典"""
+    if not filename or os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+        return {}
+    return {variant: f"/media/{derivative_relpath(filename, variant)}" for variant in DERIVATIVE_VARIANTS}
+
+
+def generate_derivatives(media_root, filename, variants=None):
+    """从 media/uploads/{filename} 生成衍生图，已存在的跳过，返回 {variant: 文件路径}"""
+    source_path = os.path.join(media_root, "uploads", os.path.basename(filename))
+    outputs = {}
+    image = None
+    try:
+        for variant in variants or DERIVATIVE_VARIANTS:
+            spec = DERIVATIVE_VARIANTS[variant]
+            target_path = os.path.join(media_root, *derivative_relpath(filename, variant).split("/"))
+            if not os.path.exists(target_path):
+                if image is None:
+                    with Image.open(source_path) as opened:
+                        # 手机照片常带 EXIF 方向信息，先转正
+                        image = ImageOps.exif_transpose(opened).convert("RGB")
+                resized = image.copy()
+                resized.thumbnail((spec["max_edge"], spec["max_edge"]), Image.LANCZOS)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                tmp_path = f"{target_path}.{os.getpid()}.tmp"
+                if spec["format"] == "JPEG":
+                    resized.save(tmp_path, "JPEG", quality=DERIVATIVE_QUALITY, optimize=True, progressive=True)
+                else:
+                    resized.save(tmp_path, spec["format"], quality=DERIVATIVE_QUALITY, method=4)
+                os.replace(tmp_path, target_path)
+            outputs[variant] = target_path
+    except Exception as e:
+        logger.error(f"生成衍生图失败: {filename}: {e}")
+    return outputs
+
+
+def find_upload_for_derivative(media_root, derived_filename):
+    """根据衍生图文件名找到 uploads 中的原图文件名"""
+    stem = os.path.splitext(derived_filename)[0]
+    if not _SAFE_STEM.match(stem):
+        return None
+    for extension in IMAGE_EXTENSIONS:
+        candidate = f"{stem}{extension}"
+        if os.path.exists(os.path.join(media_root, "uploads", candidate)):
+            return candidate
+    return None
+
+
+class MediaStaticFiles(StaticFiles):
+    """media 静态目录：衍生图缺失时惰性生成，并附加长期 immutable 缓存头"""
+
+    async def get_response(self, path, scope):
+        parts = path.replace(os.sep, "/").split("/")
+        is_derivative = len(parts) == 3 and parts[0] == "derived" and parts[1] in DERIVATIVE_VARIANTS
+        if is_derivative and not os.path.exists(os.path.join(self.directory, path)):
+            source = find_upload_for_derivative(self.directory, parts[2])
+            if source and derivative_relpath(source, parts[1]) == "/".join(parts):
+                await asyncio.to_thread(generate_derivatives, self.directory, source, [parts[1]])
+
+        response = await super().get_response(path, scope)
+        if is_derivative and response.status_code in (200, 304):
+            response.headers["Cache-Control"] = DERIVATIVE_CACHE_CONTROL
+        return response
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from integration.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail(breaker):
+    with pytest.raises(RuntimeError):
+        with breaker.guard():
+            raise RuntimeError("上游超时")
+
+
+def succeed(breaker):
+    with breaker.guard():
+        pass
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("coze", failure_threshold=3, recovery_seconds=30, clock=clock)
+
+
+class TestCircuitBreaker:
+    """熔断器测试"""
+
+    def test_opens_after_consecutive_failures(self, breaker):
+        fail(breaker)
+        fail(breaker)
+        succeed(breaker)  # 成功后重新计数
+        fail(breaker)
+        fail(breaker)
+        assert breaker.state == "closed"
+        fail(breaker)
+        assert breaker.state == "open"
+        with pytest.raises(CircuitOpenError) as exc_info:
+            succeed(breaker)
+        assert exc_info.value.retry_after == 30
+        assert breaker.stats["rejected"] == 1
+
+    def test_half_open_probe_success_closes(self, breaker, clock):
+        for _ in range(3):
+            fail(breaker)
+        clock.now = 29
+        assert breaker.state == "open"
+        assert breaker.retry_after() == 1
+        clock.now = 30
+        assert breaker.state == "half_open"
+        succeed(breaker)
+        assert breaker.state == "closed"
+
+    def test_half_open_probe_failure_reopens(self, breaker, clock):
+        for _ in range(3):
+            fail(breaker)
+        clock.now = 30
+        fail(breaker)
+        assert breaker.state == "open"
+        clock.now = 59
+        assert breaker.state == "open"
+        clock.now = 60
+        assert breaker.state == "half_open"
+
+    def test_half_open_limits_probes(self, breaker, clock):
+        for _ in range(3):
+            fail(breaker)
+        clock.now = 30
+        probe = breaker.acquire()
+        assert probe is True
+        # 探测进行中，其他调用仍被拒绝
+        with pytest.raises(CircuitOpenError):
+            breaker.acquire()
+        breaker.record_success(probe)
+        assert breaker.state == "closed"
+        assert breaker.acquire() is False
+
+    def test_cancelled_probe_released(self, breaker, clock):
+        for _ in range(3):
+            fail(breaker)
+        clock.now = 30
+
+        async def probe():
+            with breaker.guard():
+                await asyncio.sleep(10)
+
+        async def main():
+            task = asyncio.create_task(probe())
+            await asyncio.sleep(0)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(main())
+        # 取消的探测不改变状态，名额归还
+        assert breaker.state == "half_open"
+        succeed(breaker)
+        assert breaker.state == "closed"
+
+    def test_late_failure_after_open_ignored(self, breaker, clock):
+        slow = breaker.acquire()
+        for _ in range(3):
+            fail(breaker)
+        clock.now = 30
+        assert breaker.state == "half_open"
+        # 熔断前发起的慢调用在半开时失败，不影响探测
+        breaker.record_failure(slow)
+        assert breaker.state == "half_open"
+        succeed(breaker)
+        assert breaker.snapshot()["state"] == "closed"
@@ -0,0 +1,309 @@
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from integration.baidu import BaiduAPIError, BaiduClient, BaiduServices
+from storage.cache import ContentCache, cache_key, decode_value, encode_value
+
+
+class _Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class _FakeBaidu:
+    """模拟百度鉴权 / OCR / ASR / TTS 接口，记录每个路径的调用次数"""
+
+    def __init__(self):
+        self.calls = {}
+
+    def __call__(self, request):
+        path = request.url.path
+        self.calls[path] = self.calls.get(path, 0) + 1
+        if path == "/oauth/2.0/token":
+            return httpx.Response(200, json={"access_token": "token-1", "expires_in": 2592000})
+        if path.startswith("/rest/2.0/ocr/v1/"):
+            return httpx.Response(200, json={"words_result": [{"words": "3 + 5 = 9"}, {"words": "答案：8"}]})
+        if path == "/server_api":
+            if json.loads(request.content)["format"] == "amr":
+                return httpx.Response(200, json={"err_no": 3301, "err_msg": "speech quality error."})
+            return httpx.Response(200, json={"err_no": 0, "result": ["三加五等于八"]})
+        if path == "/text2audio":
+            return httpx.Response(200, content=b"ID3-fake-mp3", headers={"content-type": "audio/mp3"})
+        return httpx.Response(404)
+
+
+def _services(tmp_path, fake):
+    transport = httpx.MockTransport(fake)
+
+    def client():
+        return BaiduClient("ak", "sk", aip_url="http://aip", vop_url="http://vop", tsn_url="http://tsn",
+                           transport=transport)
+
+    return BaiduServices(client(), client(), client(),
+                         ocr_cache=ContentCache("ocr", directory=str(tmp_path / "ocr")),
+                         asr_cache=ContentCache("asr", directory=str(tmp_path / "asr")),
+                         tts_cache=ContentCache("tts", directory=str(tmp_path / "tts")))
+
+
+class TestCacheKey:
+    """缓存键测试"""
+
+    def test_params_order_does_not_matter(self):
+        assert cache_key(b"img", kind="a", rate=1) == cache_key(b"img", rate=1, kind="a")
+
+    def test_content_and_params_change_key(self):
+        assert cache_key(b"img", kind="a") != cache_key(b"img2", kind="a")
+        assert cache_key(b"img", kind="a") != cache_key(b"img", kind="b")
+        assert cache_key("ab", "c") != cache_key("a", "bc")
+
+
+class TestSerializer:
+    """缓存值编码测试"""
+
+    def test_round_trip(self):
+        for value in [b"\x00audio", "三加五等于八", ["3 + 5 = 9", "答案：8"], {"n": 1, "ok": True}, None, 0]:
+            assert decode_value(encode_value(value)) == value
+        assert type(decode_value(encode_value(b"x"))) is bytes
+
+    def test_rejects_non_json_objects(self):
+        with pytest.raises(TypeError):
+            encode_value({1, 2})
+        with pytest.raises(ValueError):
+            decode_value(b"p\x80\x04")
+
+    def test_corrupt_entry_is_a_miss(self, tmp_path):
+        cache = ContentCache("test", directory=str(tmp_path))
+        cache.set("k", ["a"])
+        with open(cache._path("k"), "r+b") as f:
+            f.seek(8)
+            f.write(b"p")  # 未知的类型标记
+        fresh = ContentCache("test", directory=str(tmp_path))
+        assert fresh.get("k", "默认") == "默认"
+        assert not os.path.exists(cache._path("k"))
+        assert fresh.stats["errors"] == 1
+
+    def test_cached_objects_are_not_shared(self):
+        cache = ContentCache("test")
+        cache.set("k", {"lines": ["a"]})
+        cache.get("k")["lines"].append("b")
+        assert cache.get("k") == {"lines": ["a"]}
+
+
+class TestContentCache:
+    """两级缓存测试"""
+
+    def test_memory_lru_evicts_by_items_and_bytes(self):
+        cache = ContentCache("test", max_memory_items=2, max_memory_bytes=10)
+        cache.set("a", b"1111")
+        cache.set("b", b"2222")
+        assert cache.get("a") == b"1111"  # a 变为最近使用
+        cache.set("c", b"3333")
+        assert cache.get("b") is None
+        cache.set("d", b"44444444")
+        assert cache.get("a") is None and cache.get("c") is None
+        assert cache.get("d") == b"44444444"
+        assert cache.snapshot()["memory_bytes"] == 9  # 含 1 字节类型标记
+        assert cache.stats["memory_evictions"] == 3
+
+    def test_ttl_expires_in_both_tiers(self, tmp_path):
+        clock = _Clock()
+        cache = ContentCache("test", directory=str(tmp_path), ttl_seconds=60, clock=clock)
+        cache.set("k", b"value")
+        clock.now += 59
+        assert cache.get("k") == b"value"
+        clock.now += 2
+        assert cache.get("k") is None
+        assert cache.stats["expired"] == 2  # 内存层与磁盘层各一次，过期文件已删除
+        assert not os.path.exists(cache._path("k"))
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        ContentCache("test", directory=str(tmp_path)).set("k", b"value")
+        cache = ContentCache("test", directory=str(tmp_path))
+        assert cache.get("k") == b"value"
+        assert cache.get("k") == b"value"
+        assert (cache.stats["disk_hits"], cache.stats["memory_hits"]) == (1, 1)
+
+    def test_disk_prunes_least_recently_used(self, tmp_path):
+        cache = ContentCache("test", directory=str(tmp_path), max_memory_items=1, max_disk_bytes=3 * 109)
+        for index, key in enumerate(["a", "b", "c"]):
+            cache.set(key, bytes(100))
+            os.utime(cache._path(key), (index, index))
+        cache.set("d", bytes(100))  # 超过上限，后台删到 90% 以下：最久未使用的 a、b
+        cache.wait_for_eviction(5)
+        fresh = ContentCache("test", directory=str(tmp_path))
+        assert fresh.get("a") is None and fresh.get("b") is None
+        assert fresh.get("c") is not None and fresh.get("d") is not None
+        assert cache.stats["disk_evictions"] == 2
+        assert cache.snapshot()["disk_bytes"] == 2 * 109  # 8 字节过期时间 + 1 字节类型标记 + 内容
+
+    def test_eviction_removes_expired_files_first(self, tmp_path):
+        clock = _Clock()
+        cache = ContentCache("test", directory=str(tmp_path), ttl_seconds=60, max_memory_items=1,
+                             max_disk_bytes=3 * 109 + 50, background_eviction=False, clock=clock)
+        cache.set("old", bytes(100))
+        os.utime(cache._path("old"), (10**10, 10**10))  # 最近使用过，但已过期
+        clock.now += 61
+        for key in ["a", "b", "c"]:
+            cache.set(key, bytes(100))
+        assert not os.path.exists(cache._path("old"))
+        assert all(os.path.exists(cache._path(key)) for key in ["a", "b", "c"])
+        assert (cache.stats["expired"], cache.stats["disk_evictions"]) == (1, 0)
+
+    def test_expired_reads_keep_disk_bytes_accurate(self, tmp_path):
+        """读取时删除过期文件同样扣减计数；计数偏高时淘汰线程校正后退出，不会空转"""
+        clock = _Clock()
+        cache = ContentCache("test", directory=str(tmp_path), ttl_seconds=60, max_memory_items=1,
+                             max_disk_bytes=8 * 1000, clock=clock)
+        for i in range(8):
+            cache.set(f"k{i}", bytes(1000))
+        cache.wait_for_eviction(5)
+        clock.now += 61
+        assert all(cache.get(f"k{i}") is None for i in range(8))
+        cache.set("new", bytes(1000))
+        cache.wait_for_eviction(5)
+        assert cache.snapshot()["disk_bytes"] == os.path.getsize(cache._path("new"))
+
+        cache._disk_bytes = 10 * cache.max_disk_bytes  # 模拟计数漂移：淘汰一轮后按实测大小校正
+        cache.set("other", bytes(1000))
+        cache.wait_for_eviction(5)
+        assert not cache._evictor.is_alive()
+        assert cache.snapshot()["disk_bytes"] == sum(os.path.getsize(cache._path(k)) for k in ["new", "other"])
+
+    def test_delete_and_clear(self, tmp_path):
+        cache = ContentCache("test", directory=str(tmp_path / "cache"))
+        for key in ["a", "b"]:
+            cache.set(key, key)
+        cache.delete("a")
+        assert cache.get("a") is None and cache.get("b") == "b"
+        asyncio.run(cache.aclear())
+        assert cache.get("b") is None
+        assert os.listdir(tmp_path) == []
+        cache.set("c", "c")
+        assert ContentCache("test", directory=str(tmp_path / "cache")).get("c") == "c"
+
+    def test_set_racing_clear(self, tmp_path, monkeypatch):
+        """写入过程中缓存被清空：不抛出异常，之后的写入重新扫描目录"""
+        cache = ContentCache("test", directory=str(tmp_path / "cache"))
+        cache.set("a", "a")
+        real_replace = os.replace
+        racing = {"clear": True}
+
+        def replace_then_clear(src, dst):
+            real_replace(src, dst)
+            if racing["clear"] and src.endswith(".tmp"):
+                racing["clear"] = False
+                cache.clear()  # 模拟另一个线程在写入文件之后、更新计数之前清空缓存
+
+        monkeypatch.setattr(os, "replace", replace_then_clear)
+        cache.set("b", "b")
+        monkeypatch.setattr(os, "replace", real_replace)
+        assert cache.snapshot()["disk_bytes"] is None and cache.stats["errors"] == 0
+        cache.set("c", "c")
+        assert cache.snapshot()["disk_bytes"] == os.path.getsize(cache._path("c"))
+
+    def test_get_or_compute_coalesces_misses(self):
+        cache = ContentCache("test")
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return b"result"
+
+        async def main():
+            first = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+            return first, await cache.get_or_compute("k", compute)
+
+        first, second = asyncio.run(main())
+        assert len(calls) == 1
+        assert all(value == b"result" and not cached for value, cached in first)
+        assert second == (b"result", True)
+        snapshot = cache.snapshot()
+        assert snapshot["coalesced"] == 4
+        assert snapshot["hit_rate"] == round(1 / 6, 3)
+
+    def test_none_result_is_cached(self):
+        cache = ContentCache("test")
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return None
+
+        async def main():
+            return [await cache.get_or_compute("k", compute) for _ in range(2)]
+
+        assert asyncio.run(main()) == [(None, False), (None, True)]
+        assert len(calls) == 1
+
+    def test_compute_error_is_not_cached(self):
+        cache = ContentCache("test")
+
+        async def fail():
+            raise RuntimeError("上游失败")
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(cache.get_or_compute("k", fail))
+        assert cache.get("k") is None
+
+
+class TestBaiduServices:
+    """百度服务缓存测试（本地模拟接口）"""
+
+    def test_repeated_calls_hit_cache(self, tmp_path):
+        fake = _FakeBaidu()
+        services = _services(tmp_path, fake)
+
+        async def main():
+            results = []
+            for _ in range(2):
+                results.append(await services.ocr(b"image", "handwriting"))
+                results.append(await services.asr(b"audio", "wav", 16000))
+                results.append(await services.tts("三加五等于八"))
+            await services.close()
+            return results
+
+        results = asyncio.run(main())
+        assert results[:3] == [(["3 + 5 = 9", "答案：8"], False), ("三加五等于八", False), (b"ID3-fake-mp3", False)]
+        assert [cached for _, cached in results[3:]] == [True, True, True]
+        assert fake.calls == {"/oauth/2.0/token": 3, "/rest/2.0/ocr/v1/handwriting": 1,
+                              "/server_api": 1, "/text2audio": 1}
+        assert services.snapshot()["ocr"]["memory_hits"] == 1
+
+    def test_different_params_miss_and_token_is_reused(self, tmp_path):
+        fake = _FakeBaidu()
+        services = _services(tmp_path, fake)
+
+        async def main():
+            await services.ocr(b"image", "handwriting")
+            await services.ocr(b"image", "general_basic")
+            await services.close()
+
+        asyncio.run(main())
+        assert fake.calls["/oauth/2.0/token"] == 1
+        assert fake.calls["/rest/2.0/ocr/v1/handwriting"] == fake.calls["/rest/2.0/ocr/v1/general_basic"] == 1
+
+    def test_api_error_is_raised_and_not_cached(self, tmp_path):
+        fake = _FakeBaidu()
+        services = _services(tmp_path, fake)
+
+        async def main():
+            for _ in range(2):
+                with pytest.raises(BaiduAPIError):
+                    await services.asr(b"audio", "amr", 8000)
+            await services.close()
+
+        asyncio.run(main())
+        assert fake.calls["/server_api"] == 2
+        assert services.asr_client.stats["errors"] == 2
@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from integration.coze_capture import CozeCapture, load_coze_corpus, sanitize_coze_payload
+from integration.coze_payload import CozeQuestionStream, normalize_coze_payload, parse_coze_output
+
+RAW = json.dumps([
+    {"subject": "数学", "question": "1+1=? 家长电话 13812345678", "answer": "2", "is_correct": True,
+     "comment": "图片 https://s.coze.cn/f/abc.png?x-sign=secret&expires=1 邮箱 a.b@example.com"},
+    {"subject": "数学", "question": "2+2=?", "answer": "5", "is_correct": False, "correct_answer": "4"},
+], ensure_ascii=False)
+
+
+class TestCozeCapture:
+    """Coze 原始输出采集测试"""
+
+    def test_sanitize(self):
+        text = sanitize_coze_payload(RAW)
+        assert "13812345678" not in text and "secret" not in text and "example.com" not in text
+        assert "https://s.coze.cn/f/abc.png?redacted" in text
+        assert sanitize_coze_payload("token pat_abcdefghijklmnopqrstuvwxyz") == "token <token>"
+        # 脱敏后仍是合法 JSON，标准化结果的题目数不变
+        assert len(normalize_coze_payload(parse_coze_output(text))["analysis"]) == 2
+
+    def test_disabled(self, tmp_path):
+        capture = CozeCapture(None)
+        assert not capture.enabled
+        assert capture.write(RAW) is None
+
+    def test_write_and_dedupe(self, tmp_path):
+        capture = CozeCapture(str(tmp_path / "corpus"))
+        path = capture.write(RAW, "run")
+        assert path and os.path.basename(path).startswith("run-")
+        assert capture.write(RAW, "run") is None
+        assert capture.stats["captured"] == 1 and capture.stats["duplicates"] == 1
+
+        entries = load_coze_corpus(str(tmp_path / "corpus"))
+        assert len(entries) == 1
+        assert entries[0]["raw_payload"] == sanitize_coze_payload(RAW)
+        assert "chunks" not in entries[0]
+
+    def test_max_files(self, tmp_path):
+        capture = CozeCapture(str(tmp_path), max_files=1)
+        assert capture.write(RAW, "run")
+        assert capture.write(RAW + " ", "run") is None
+        assert capture.stats["skipped"] == 1
+
+    def test_stream_chunks_sanitized_across_boundaries(self, tmp_path):
+        # 手机号被切在两段之间，逐段脱敏会漏掉
+        split = RAW.index("13812345678") + 5
+        chunks = [("end", RAW[:split]), ("end", RAW[split:])]
+        CozeCapture(str(tmp_path)).write(RAW, "stream", chunks)
+        entry = load_coze_corpus(str(tmp_path))[0]
+
+        assert entry["source"] == "stream"
+        assert len(entry["chunks"]) == 2
+        replayed = "".join(text for _, text in entry["chunks"])
+        assert replayed == entry["raw_payload"]
+        assert "13812345678" not in replayed and "13812" not in entry["chunks"][0][1]
+
+        questions = CozeQuestionStream()
+        for node, text in entry["chunks"]:
+            questions.feed(text, node)
+        result, consistent = questions.finish()
+        assert consistent and len(result["analysis"]) == 2
@@ -0,0 +1,120 @@
+import json
+import os
+import random
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from integration.coze_payload import (
+    CozeQuestionStream,
+    IncrementalJSONParser,
+    normalize_coze_payload,
+    parse_coze_output,
+)
+
+NESTED = {"output": [
+    {"id": "1", "subject": "数学", "section": "计算题", "knowledge_points": ["分数", "通分"], "questions": [
+        {"question": "1/2 + 1/3 = ?", "answer": "2/5", "is_correct": False, "correct_answer": "5/6",
+         "comment": "先通分，再相加", "practices": [{"question": "1/3 + 1/4 = ?", "correct_answer": "7/12"}]},
+        {"question": "2 × 3 = ?", "answer": "6", "is_correct": True},
+    ]},
+    {"id": "2", "subject": "语文", "section": "拼音", "questions": [
+        {"question": "\"zhōng\" 对应的汉字", "answer": "中", "is_correct": True},
+    ]},
+]}
+
+FLAT = [
+    {"id": 1, "subject": "数学", "question": "3 + 4 = ?", "answer": "8", "is_correct": False, "extra": {"a": [1, 2.5e3]}},
+    {"id": 2, "subject": "数学", "question": "含转义\\n和\\\"引号\\\"", "answer": None, "is_correct": True},
+]
+
+
+def chunks(text, seed):
+    rng = random.Random(seed)
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 12)
+        yield text[position:position + size]
+        position += size
+
+
+def stream_all(payload, seed=0, node="End"):
+    stream = CozeQuestionStream()
+    arrived = []
+    for chunk in chunks(json.dumps(payload, ensure_ascii=False), seed):
+        arrived.extend(stream.feed(chunk, node))
+    return stream, arrived
+
+
+class TestIncrementalJSONParser:
+    """增量 JSON 解析测试"""
+
+    def test_any_split_matches_json_loads(self):
+        text = json.dumps({"nested": NESTED, "flat": FLAT, "n": -12.5, "ok": None, "t": True}, ensure_ascii=False)
+        for seed in range(20):
+            parser = IncrementalJSONParser()
+            for chunk in chunks(text, seed):
+                parser.feed(chunk)
+            parser.close()
+            assert parser.values == [json.loads(text)]
+
+    def test_ignores_text_outside_json(self):
+        parser = IncrementalJSONParser()
+        parser.feed('```json\n[{"a": 1}]\n```')
+        assert parser.values == [[{"a": 1}]]
+
+    def test_close_callback_sees_partial_parents(self):
+        seen = []
+        parser = IncrementalJSONParser(on_close=lambda value, parents: seen.append((value, parents[-2][0].copy())))
+        parser.feed('{"subject": "数学", "questions": [{"question": "q1"}')
+        assert seen == [({"question": "q1"}, {"subject": "数学"})]
+
+
+class TestCozeQuestionStream:
+    """Coze 流式输出逐题解析测试"""
+
+    def test_nested_questions_match_full_parse(self):
+        expected = normalize_coze_payload(NESTED)
+        for seed in range(5):
+            stream, arrived = stream_all(NESTED, seed)
+            assert arrived == expected["analysis"]
+            result, consistent = stream.finish()
+            assert consistent
+            assert result == expected
+        # 类练习不会被当作题目
+        assert len(arrived) == 3
+        assert arrived[0]["knowledge_point"] == "分数, 通分"
+
+    def test_flat_list(self):
+        stream, arrived = stream_all(FLAT, seed=3)
+        assert [q["question"] for q in arrived] == ["3 + 4 = ?", "含转义\\n和\\\"引号\\\""]
+        assert arrived[0]["extra"] == {"a": [1, 2500.0]}
+        assert stream.finish()[1]
+
+    def test_questions_arrive_before_payload_ends(self):
+        text = json.dumps(NESTED, ensure_ascii=False)
+        cut = text.index("2 × 3") + 40
+        stream = CozeQuestionStream()
+        first = stream.feed(text[:cut])
+        assert [q["question"] for q in first] == ["1/2 + 1/3 = ?"]
+        rest = stream.feed(text[cut:])
+        assert len(rest) == 2
+
+    def test_inconsistent_preview_detected(self):
+        # id 出现在 questions 之后：逐题结果缺少 id，最终结果以完整解析为准
+        payload = {"output": [{"subject": "数学", "questions": [{"question": "q"}], "id": "9"}]}
+        stream, arrived = stream_all(payload)
+        assert arrived[0]["id"] == ""
+        result, consistent = stream.finish()
+        assert not consistent
+        assert result["analysis"][0]["id"] == "9"
+
+    def test_final_result_from_last_node(self):
+        stream = CozeQuestionStream()
+        stream.feed("正在分析……", "消息")
+        stream.feed(json.dumps({"data": FLAT}, ensure_ascii=False), "End")
+        result, consistent = stream.finish()
+        assert consistent
+        assert len(result["analysis"]) == 2
+        assert parse_coze_output(json.dumps({"data": FLAT})) == FLAT
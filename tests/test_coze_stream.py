@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("cozepy")
+
+import app.app as app_module  # noqa: E402
+from cozepy import WorkflowEventType  # noqa: E402
+from integration.circuit_breaker import CircuitBreaker  # noqa: E402
+
+
+class _FakeRuns:
+    """模拟 Coze 流式工作流：每隔 delay 秒产出一段输出"""
+
+    def __init__(self, chunks, delay=0.0):
+        self.chunks = chunks
+        self.delay = delay
+        self.closed = False
+
+    async def stream(self, **kwargs):
+        try:
+            for chunk in self.chunks:
+                await asyncio.sleep(self.delay)
+                yield SimpleNamespace(event=WorkflowEventType.MESSAGE, error=None,
+                                      message=SimpleNamespace(node_title="output", content=chunk))
+        finally:
+            self.closed = True
+
+
+def _payload_chunks(size=40):
+    payload = json.dumps({"analysis": app_module.MOCK_COZE_DATA, "practices": []}, ensure_ascii=False)
+    return [payload[start:start + size] for start in range(0, len(payload), size)]
+
+
+@pytest.fixture
+def fake_coze(monkeypatch):
+    """把 Coze 客户端换成 _FakeRuns，熔断器换成新的实例"""
+    def install(runs, timeout):
+        async def prepare(image_data, filename=None, timings=None):
+            return SimpleNamespace(workflows=SimpleNamespace(runs=runs)), {}
+
+        breaker = CircuitBreaker("coze-test", failure_threshold=1, recovery_seconds=30)
+        monkeypatch.setattr(app_module, "_prepare_coze_run", prepare)
+        monkeypatch.setattr(app_module, "coze_breaker", breaker)
+        monkeypatch.setattr(app_module, "COZE_RUN_TIMEOUT_SECONDS", timeout)
+        return breaker
+
+    return install
+
+
+class TestStreamDeadline:
+    """流式调用超时只计算等待 Coze 的时间"""
+
+    def test_slow_consumer_is_not_a_timeout(self, fake_coze):
+        runs = _FakeRuns(["a", "b", "c"])
+        breaker = fake_coze(runs, timeout=0.2)
+
+        async def main():
+            received = []
+            async for _, text in app_module.stream_coze_workflow(b"img", "a.jpg"):
+                received.append(text)
+                await asyncio.sleep(0.15)  # 调用方处理很慢，累计超过超时时间
+            return received
+
+        assert asyncio.run(main()) == ["a", "b", "c"]
+        assert breaker.stats["successes"] == 1 and breaker.stats["failures"] == 0
+        assert runs.closed
+
+    def test_slow_upstream_times_out(self, fake_coze):
+        runs = _FakeRuns(["a", "b", "c"], delay=0.1)
+        breaker = fake_coze(runs, timeout=0.25)
+
+        async def main():
+            received = []
+            with pytest.raises(app_module.HTTPException) as exc_info:
+                async for _, text in app_module.stream_coze_workflow(b"img", "a.jpg"):
+                    received.append(text)
+            return received, exc_info.value
+
+        received, error = asyncio.run(main())
+        assert received == ["a", "b"]
+        assert error.status_code == 504
+        assert breaker.stats["failures"] == 1 and breaker.state == "open"
+
+    def test_consumer_closing_early_releases_breaker(self, fake_coze):
+        runs = _FakeRuns(["a", "b", "c"])
+        breaker = fake_coze(runs, timeout=1)
+
+        async def main():
+            stream = app_module.stream_coze_workflow(b"img", "a.jpg")
+            await anext(stream)
+            await stream.aclose()
+
+        asyncio.run(main())
+        assert breaker.stats["successes"] == breaker.stats["failures"] == 0
+        assert breaker.state == "closed" and runs.closed
+
+    def test_slow_persistence_still_finishes_sse(self, fake_coze, monkeypatch):
+        fake_coze(_FakeRuns(_payload_chunks()), timeout=0.2)
+
+        async def passthrough(content, filename, config=None):
+            return content, filename, {}
+
+        async def slow_persist(file_data, record_id, analyses, practices=(), replace=False):
+            await asyncio.sleep(0.3)  # 入库耗时超过整个超时时间
+            return 1
+
+        monkeypatch.setattr(app_module, "preprocess_for_upload", passthrough)
+        monkeypatch.setattr(app_module, "_persist_stream_result", slow_persist)
+
+        async def main():
+            file_data = {"file_id": "f", "image_phash": None, "user_id": 0}
+            return [event async for event in app_module._analyze_stream_events(b"img", "a.jpg", file_data)]
+
+        events = asyncio.run(main())
+        assert events[0].startswith("event: start")
+        assert events[-1].startswith("event: done")
+        assert not any(event.startswith("event: error") for event in events)
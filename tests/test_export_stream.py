@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+import os
+import sys
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.exporter.stream import iter_export
+from db.database_config import (
+    MISTAKE_EXPORT_COLUMNS,
+    build_mistakes_query,
+    iter_mistake_export_batches,
+    save_mistake_record,
+)
+
+COLUMNS = {name: column.type.python_type for name, column in MISTAKE_EXPORT_COLUMNS.items()}
+
+
+@pytest.fixture
+def db(db):
+    for i in range(7):
+        save_mistake_record(db, {"file_id": f"f{i}", "filename": f"f{i}.png"}, [
+            {"subject": "数学", "question": f"题目{i}，含逗号,和\n换行", "is_correct": i % 2 == 0},
+        ])
+    return db
+
+
+class TestExportStream:
+    """错题本流式导出测试"""
+
+    def test_batches(self, db):
+        batches = list(iter_mistake_export_batches(build_mistakes_query(db), batch_size=3))
+        assert [len(batch) for batch in batches] == [3, 3, 1]
+        assert len(batches[0][0]) == len(MISTAKE_EXPORT_COLUMNS)
+
+    def test_ndjson(self, db):
+        data = b"".join(iter_export("ndjson", COLUMNS, iter_mistake_export_batches(build_mistakes_query(db), 3)))
+        rows = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+        assert len(rows) == 7
+        assert rows[0]["question"] == "题目6，含逗号,和\n换行"  # 按最近创建倒序
+        assert rows[0]["file_id"] == "f6"
+        assert isinstance(rows[0]["created_at"], str)
+
+    def test_csv(self, db):
+        data = b"".join(iter_export("csv", COLUMNS, iter_mistake_export_batches(build_mistakes_query(db), 3)))
+        text = data.decode("utf-8")
+        assert text.startswith("\ufeff")
+        rows = list(csv.DictReader(io.StringIO(text[1:])))
+        assert len(rows) == 7
+        assert rows[-1]["question"] == "题目0，含逗号,和\n换行"
+
+    def test_csv_header_only_when_empty(self, db):
+        query = build_mistakes_query(db, subject="不存在")
+        data = b"".join(iter_export("csv", COLUMNS, iter_mistake_export_batches(query)))
+        assert data.decode("utf-8").strip() == "\ufeff" + ",".join(COLUMNS)
+
+    def test_parquet(self, db):
+        pq = pytest.importorskip("pyarrow.parquet")
+        data = b"".join(iter_export("parquet", COLUMNS, iter_mistake_export_batches(build_mistakes_query(db), 3)))
+        parquet_file = pq.ParquetFile(io.BytesIO(data))
+        assert parquet_file.num_row_groups == 3
+        table = parquet_file.read()
+        assert table.num_rows == 7
+        assert table.column("is_correct").to_pylist()[-1] is True
+
+    def test_output_is_incremental(self, db):
+        consumed = []
+
+        def batches():
+            for batch in iter_mistake_export_batches(build_mistakes_query(db), 2):
+                consumed.append(len(batch))
+                yield batch
+
+        chunks = iter_export("ndjson", COLUMNS, batches())
+        first = next(chunks)
+        # 第一块输出时只读取了第一批
+        assert consumed == [2]
+        assert len(first.decode("utf-8").splitlines()) == 2
+        assert sum(len(chunk.decode("utf-8").splitlines()) for chunk in chunks) == 5
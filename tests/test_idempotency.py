@@ -0,0 +1,104 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_config import (
+    IdempotencyKey,
+    claim_idempotency_key,
+    complete_idempotency_key,
+    purge_expired_idempotency_keys,
+    release_idempotency_key,
+)
+
+NOW = datetime(2025, 3, 1, 8, 0, tzinfo=timezone.utc)
+
+
+def claim(db, key="k1", request_hash="h1", resource_id="file-1", now=NOW):
+    state, record = claim_idempotency_key(db, "upload/image", key, request_hash, resource_id, now=now,
+                                          lease_seconds=60, ttl_seconds=3600)
+    db.commit()
+    return state, record
+
+
+class TestIdempotencyKeys:
+    """幂等键存储测试"""
+
+    def test_first_claim_acquires(self, db):
+        state, record = claim(db)
+        assert state == "acquired"
+        assert record["resource_id"] == "file-1"
+        assert record["attempt"] == 1
+
+    def test_retry_while_in_progress(self, db):
+        claim(db)
+        state, record = claim(db, resource_id="file-2", now=NOW + timedelta(seconds=10))
+        assert state == "in_progress"
+        assert record["resource_id"] == "file-1"
+
+    def test_replay_after_complete(self, db):
+        _, record = claim(db)
+        assert complete_idempotency_key(db, "upload/image", "k1", record["attempt"], 200, {"file_id": "file-1"},
+                                        now=NOW, ttl_seconds=3600)
+        db.commit()
+        state, record = claim(db, now=NOW + timedelta(minutes=30))
+        assert state == "completed"
+        assert record["status_code"] == 200
+        assert record["response"] == {"file_id": "file-1"}
+
+    def test_same_key_different_request(self, db):
+        claim(db)
+        state, _ = claim(db, request_hash="h2")
+        assert state == "mismatch"
+
+    def test_keys_scoped_by_endpoint(self, db):
+        claim(db)
+        state, _ = claim_idempotency_key(db, "analyze/image", "k1", "h1", "file-2", now=NOW)
+        assert state == "acquired"
+
+    def test_release_allows_retry(self, db):
+        _, record = claim(db)
+        assert release_idempotency_key(db, "upload/image", "k1", record["attempt"])
+        db.commit()
+        state, record = claim(db, resource_id="file-2")
+        assert state == "acquired"
+        assert record["resource_id"] == "file-2"
+
+    def test_crashed_request_taken_over(self, db):
+        claim(db)
+        # 租约过期仍未完成：沿用原 resource_id 接管
+        state, record = claim(db, resource_id="file-2", now=NOW + timedelta(seconds=61))
+        assert state == "taken_over"
+        assert record["resource_id"] == "file-1"
+        assert record["attempt"] == 2
+        # 接管后租约重新计时，其他重试需等待
+        state, _ = claim(db, now=NOW + timedelta(seconds=62))
+        assert state == "in_progress"
+
+    def test_stale_attempt_cannot_complete(self, db):
+        _, first = claim(db)
+        _, second = claim(db, now=NOW + timedelta(seconds=61))
+        assert not complete_idempotency_key(db, "upload/image", "k1", first["attempt"], 200, {"stale": True})
+        assert not release_idempotency_key(db, "upload/image", "k1", first["attempt"])
+        assert complete_idempotency_key(db, "upload/image", "k1", second["attempt"], 200, {"ok": True})
+        db.commit()
+        state, record = claim(db, now=NOW + timedelta(seconds=62))
+        assert state == "completed"
+        assert record["response"] == {"ok": True}
+
+    def test_expired_key_reused(self, db):
+        _, record = claim(db)
+        complete_idempotency_key(db, "upload/image", "k1", record["attempt"], 200, {}, now=NOW, ttl_seconds=3600)
+        db.commit()
+        state, record = claim(db, request_hash="h2", resource_id="file-2", now=NOW + timedelta(hours=2))
+        assert state == "acquired"
+        assert record["resource_id"] == "file-2"
+
+    def test_purge_expired(self, db):
+        claim(db, key="old")
+        claim(db, key="new", now=NOW + timedelta(hours=2))
+        assert purge_expired_idempotency_keys(db, now=NOW + timedelta(hours=1, seconds=1)) == 1
+        db.commit()
+        assert [row.key for row in db.query(IdempotencyKey).all()] == ["new"]
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.exporter import sheet
+from core.exporter.sheet import SheetCache, build_sheet_markdown, markdown_to_html, render_sheet_pdf, sheet_digest
+from db.database_config import MistakeAnalysis, get_learning_sheet_items, save_mistake_record
+
+MISTAKES = [
+    {"subject": "数学", "question": "计算：1/2 + 1/3 = ?", "answer": "2/5", "correct_answer": "5/6",
+     "comment": "先通分再相加", "error_type": "计算错误", "knowledge_point": "分数运算, 通分"},
+    {"subject": "数学", "question": "比较 <3/4> 与 2/3 的大小", "correct_answer": "3/4 > 2/3",
+     "error_type": "概念不清", "knowledge_point": "分数运算"},
+]
+PRACTICES = [{"question": "计算 1/4 + 1/6", "correct_answer": "5/12"}, {"question": "计算 2/3 - 1/2"}]
+
+
+class TestLearningSheet:
+    """学习单导出测试"""
+
+    def test_markdown_sections(self):
+        text = build_sheet_markdown(MISTAKES, PRACTICES, title="分数专项")
+        assert text.startswith("# 分数专项")
+        for section in ("## 错题回顾", "## 概念要点", "## 常见坑", "## 练习清单", "### 参考答案"):
+            assert section in text
+        assert "- 分数运算（2 题）" in text and "- 计算错误：先通分再相加" in text
+        # 内容确定，相同输入得到相同的缓存键
+        assert sheet_digest(text) == sheet_digest(build_sheet_markdown(MISTAKES, PRACTICES, title="分数专项"))
+
+    def test_html_escapes_content(self):
+        html = markdown_to_html(build_sheet_markdown(MISTAKES))
+        assert "&lt;3/4&gt;" in html and "<3/4>" not in html
+        assert html.count("<ul>") == html.count("</ul>")
+
+    def test_render_pdf(self):
+        pymupdf = pytest.importorskip("pymupdf")
+        data = render_sheet_pdf(build_sheet_markdown(MISTAKES, PRACTICES))
+        assert data.startswith(b"%PDF")
+        with pymupdf.open(stream=data, filetype="pdf") as document:
+            text = "".join(page.get_text() for page in document)
+        assert "错题回顾" in text and "计算：1/2 + 1/3 = ?" in text
+
+    def test_cache_renders_once_and_evicts(self, tmp_path, monkeypatch):
+        calls = []
+
+        async def fake_render(markdown_text):
+            calls.append(markdown_text)
+            return b"%PDF-" + markdown_text.encode("utf-8")
+
+        monkeypatch.setattr(sheet, "render_sheet", fake_render)
+        cache = SheetCache(str(tmp_path), max_files=2)
+        digests = [sheet_digest(text) for text in ("a", "b", "c")]
+        assert cache.get(digests[0]) is None
+        path = asyncio.run(cache.render(digests[0], "a"))
+        assert cache.get(digests[0]) == path and open(path, "rb").read() == b"%PDF-a"
+
+        os.utime(path, (1, 1))  # 最久未使用
+        asyncio.run(cache.render(digests[1], "b"))
+        asyncio.run(cache.render(digests[2], "c"))
+        assert cache.get(digests[0]) is None
+        assert cache.stats["evicted"] == 1 and len(calls) == 3
+
+    def test_items_scoped_and_ordered(self, db):
+        record_id = save_mistake_record(db, {"file_id": "f1", "filename": "f1.png", "user_id": 1},
+                                        MISTAKES, PRACTICES + [{"question": " 计算 1/4 +  1/6"}])
+        ids = [a.id for a in db.query(MistakeAnalysis).filter_by(mistake_record_id=record_id).order_by(MistakeAnalysis.id)]
+
+        mistakes, practices = get_learning_sheet_items(db, [ids[1], ids[0], 999], user_id=1)
+        assert [m["question"] for m in mistakes] == [MISTAKES[1]["question"], MISTAKES[0]["question"]]
+        assert [p["question"] for p in practices] == ["计算 1/4 + 1/6", "计算 2/3 - 1/2"]
+        assert get_learning_sheet_items(db, ids, user_id=2) == ([], [])
+        assert get_learning_sheet_items(db, ids, user_id=1, include_practices=False)[1] == []
@@ -0,0 +1,73 @@
+import io
+import os
+import sys
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.media.derivatives import (
+    DERIVATIVE_CACHE_CONTROL,
+    MediaStaticFiles,
+    derivative_urls,
+    generate_derivatives,
+)
+
+
+def make_upload(media_root, filename="abc-123.png", size=(2400, 1800)):
+    os.makedirs(os.path.join(media_root, "uploads"), exist_ok=True)
+    Image.new("RGB", size, (240, 240, 240)).save(os.path.join(media_root, "uploads", filename))
+    return filename
+
+
+class TestDerivatives:
+    """衍生图生成测试"""
+
+    def test_urls_for_image_and_pdf(self):
+        urls = derivative_urls("abc-123.png")
+        assert urls["thumb"] == "/media/derived/thumb/abc-123.jpg"
+        assert urls["webp"] == "/media/derived/webp/abc-123.webp"
+        assert derivative_urls("abc-123.pdf") == {}
+
+    def test_generate_all_variants(self, tmp_path):
+        filename = make_upload(str(tmp_path))
+        outputs = generate_derivatives(str(tmp_path), filename)
+        assert set(outputs) == {"thumb", "medium", "webp"}
+        with Image.open(outputs["thumb"]) as thumb:
+            assert max(thumb.size) == 320
+        with Image.open(outputs["webp"]) as webp:
+            assert webp.format == "WEBP"
+
+
+class TestMediaStaticFiles:
+    """media 挂载：惰性生成与缓存头"""
+
+    def make_client(self, media_root):
+        app = FastAPI()
+        app.mount("/media", MediaStaticFiles(directory=media_root), name="media")
+        return TestClient(app)
+
+    def test_lazy_generation_with_immutable_header(self, tmp_path):
+        make_upload(str(tmp_path))
+        client = self.make_client(str(tmp_path))
+
+        response = client.get("/media/derived/thumb/abc-123.jpg")
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == DERIVATIVE_CACHE_CONTROL
+        assert max(Image.open(io.BytesIO(response.content)).size) == 320
+        assert os.path.exists(tmp_path / "derived" / "thumb" / "abc-123.jpg")
+
+    def test_missing_source_and_originals(self, tmp_path):
+        make_upload(str(tmp_path))
+        client = self.make_client(str(tmp_path))
+
+        assert client.get("/media/derived/thumb/missing.jpg").status_code == 404
+        # 扩展名与变体不匹配时不生成
+        assert client.get("/media/derived/thumb/abc-123.webp").status_code == 404
+
+        original = client.get("/media/uploads/abc-123.png")
+        assert original.status_code == 200
+        assert "cache-control" not in original.headers
@@ -0,0 +1,206 @@
+import ast
+import json
+import os
+import sys
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.migrate import backfill, discover_migrations, migrate, migration_status, scan
+
+# 迁移框架引入前 sqlite_config.py 建出的表结构（缺 subject 列与 mistake_practices 表）
+LEGACY_SQLITE_SCHEMA = """
+CREATE TABLE mistake_records (
+    id INTEGER NOT NULL PRIMARY KEY, file_id VARCHAR(255) NOT NULL UNIQUE, filename VARCHAR(500) NOT NULL,
+    file_url VARCHAR(1000), file_size INTEGER, file_type VARCHAR(100),
+    upload_time DATETIME, created_at DATETIME, updated_at DATETIME
+);
+CREATE TABLE mistake_analysis (
+    id INTEGER NOT NULL PRIMARY KEY, mistake_record_id INTEGER REFERENCES mistake_records (id) ON DELETE CASCADE,
+    section VARCHAR(200), question TEXT, answer TEXT, is_question BOOLEAN, is_correct BOOLEAN,
+    correct_answer TEXT, comment TEXT, error_type VARCHAR(100), knowledge_point VARCHAR(200),
+    analysis_data JSON, created_at DATETIME
+);
+"""
+
+
+# 迁移框架引入前 01-init-tables.sql 建出的 PostgreSQL 表结构（节选）
+LEGACY_POSTGRES_SCHEMA = """
+CREATE TABLE mistake_records (
+    id SERIAL PRIMARY KEY, file_id VARCHAR(255) NOT NULL UNIQUE, filename VARCHAR(500) NOT NULL,
+    file_url VARCHAR(1000), file_size INTEGER, file_type VARCHAR(100),
+    upload_time TIMESTAMP, created_at TIMESTAMPTZ DEFAULT now(), updated_at TIMESTAMPTZ DEFAULT now()
+);
+CREATE TABLE mistake_analysis (
+    id SERIAL PRIMARY KEY, mistake_record_id INTEGER REFERENCES mistake_records (id) ON DELETE CASCADE,
+    section VARCHAR(200), question TEXT, answer TEXT, is_question BOOLEAN, is_correct BOOLEAN,
+    correct_answer TEXT, comment TEXT, error_type VARCHAR(100), knowledge_point VARCHAR(200),
+    analysis_data JSONB, created_at TIMESTAMPTZ DEFAULT now()
+);
+"""
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    yield engine
+    engine.dispose()
+
+
+def index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+class TestMigrate:
+    """迁移框架测试"""
+
+    def test_fresh_database_is_stamped(self, engine):
+        assert migrate(engine) == []
+        assert all(done for _, _, done in migration_status(engine))
+        assert "ix_mistake_analysis_user_incorrect_recent" in index_names(engine, "mistake_analysis")
+        # 再次执行无事可做
+        assert migrate(engine) == []
+
+    def test_legacy_sqlite_upgrade(self, engine):
+        with engine.begin() as conn:
+            conn.connection.executescript(LEGACY_SQLITE_SCHEMA)
+            conn.exec_driver_sql("INSERT INTO mistake_records (id, file_id, filename) VALUES (1, 'f1', 'f1.png')")
+            for i in range(1, 8):
+                conn.exec_driver_sql(
+                    "INSERT INTO mistake_analysis (id, mistake_record_id, is_correct, analysis_data) VALUES (?, 1, 0, ?)",
+                    (i, json.dumps({"subject": "数学" if i % 2 else "语文"}, ensure_ascii=False)),
+                )
+
+        executed = migrate(engine)
+        assert executed == [version for version, _, _ in discover_migrations()]
+
+        columns = {c["name"] for c in inspect(engine).get_columns("mistake_records")}
+        assert {"image_phash", "source_file_id", "page_index", "user_id"} <= columns
+        assert inspect(engine).has_table("mistake_practices")
+        assert "ix_mistake_analysis_user_subject_error_type_recent" in index_names(engine, "mistake_analysis")
+        with engine.connect() as conn:
+            subjects = dict(conn.execute(text("SELECT id, subject FROM mistake_analysis")).all())
+            rollup = conn.execute(text(
+                "SELECT total FROM mistake_stats_rollup WHERE dimension = 'subject' AND value = '数学'")).scalar()
+        assert subjects[1] == "数学" and subjects[2] == "语文"
+        assert rollup == 4
+
+        # 已执行的迁移不会重复执行
+        assert migrate(engine) == []
+
+    def test_rollup_upgraded_by_010_after_003_applied(self, engine, tmp_path):
+        with engine.begin() as conn:
+            conn.connection.executescript(LEGACY_SQLITE_SCHEMA)
+            conn.exec_driver_sql("INSERT INTO mistake_records (id, file_id, filename) VALUES (1, 'f1', 'f1.png')")
+            for i in range(1, 4):
+                conn.exec_driver_sql(
+                    "INSERT INTO mistake_analysis (id, mistake_record_id, is_correct, knowledge_point) "
+                    "VALUES (?, 1, ?, '分数加法，通分')", (i, i == 1))
+
+        # 先升级到 010 之前（即已上线 003 的库），汇总表还没有 user_id
+        shipped = tmp_path / "shipped"
+        shipped.mkdir()
+        for version, name, path in discover_migrations():
+            if version < "010":
+                (shipped / os.path.basename(path)).write_bytes(open(path, "rb").read())
+        migrate(engine, directory=str(shipped))
+        columns = {c["name"] for c in inspect(engine).get_columns("mistake_stats_rollup")}
+        assert "user_id" not in columns
+
+        assert migrate(engine) == [version for version, _, _ in discover_migrations() if version >= "010"]
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT user_id, dimension, value, total, incorrect FROM mistake_stats_rollup "
+                "WHERE dimension IN ('all', 'knowledge_point') ORDER BY dimension, value")).all()
+        assert [tuple(row) for row in rows] == [
+            (0, "all", "", 3, 2), (0, "knowledge_point", "分数加法", 3, 2), (0, "knowledge_point", "通分", 3, 2)]
+
+    def test_migrations_do_not_import_live_models(self):
+        # 迁移声明的是当时的表结构，模型之后的变化不能改变已发布迁移的行为
+        for _, _, path in discover_migrations():
+            tree = ast.parse(open(path, encoding="utf-8").read())
+            modules = {node.module for node in ast.walk(tree) if isinstance(node, ast.ImportFrom)}
+            modules |= {alias.name for node in ast.walk(tree) if isinstance(node, ast.Import) for alias in node.names}
+            assert not modules & {"db.models", "db.crud"}, path
+
+    def test_upgraded_schema_matches_fresh_schema(self, engine, tmp_path):
+        with engine.begin() as conn:
+            conn.connection.executescript(LEGACY_SQLITE_SCHEMA)
+        migrate(engine)
+        fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+        migrate(fresh)
+
+        def columns(e):
+            inspector = inspect(e)
+            return {table: {c["name"] for c in inspector.get_columns(table)}
+                    for table in inspector.get_table_names() if table != "schema_migrations"}
+
+        assert columns(engine) == columns(fresh)
+
+    def test_backfill_in_batches(self, engine):
+        with engine.begin() as conn:
+            conn.exec_driver_sql("CREATE TABLE t (id INTEGER PRIMARY KEY, a INTEGER, b INTEGER)")
+            conn.exec_driver_sql("INSERT INTO t (id, a) VALUES " + ", ".join(f"({i}, {i})" for i in range(1, 101)))
+
+        statements = []
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            conn.connection.set_trace_callback(statements.append)
+            updated = backfill(conn, "t", "b = a * 2", "b IS NULL", batch_size=30)
+            conn.connection.set_trace_callback(None)
+            assert updated == 100
+            assert conn.execute(text("SELECT COUNT(*) FROM t WHERE b = a * 2")).scalar() == 100
+            # 回填完成后条件不再成立，重跑不做任何更新
+            assert backfill(conn, "t", "b = a * 2", "b IS NULL", batch_size=30) == 0
+        assert sum(s.startswith("UPDATE t") for s in statements) == 4
+
+    def test_scan_in_batches(self, engine):
+        with engine.begin() as conn:
+            conn.exec_driver_sql("CREATE TABLE t (id INTEGER PRIMARY KEY, a INTEGER)")
+            conn.exec_driver_sql("INSERT INTO t (id, a) VALUES " + ", ".join(f"({i}, {i})" for i in range(1, 101)))
+
+        statements = []
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            conn.connection.set_trace_callback(statements.append)
+            assert sorted(row.a for row in scan(conn, "t", "a", batch_size=30)) == list(range(1, 101))
+            conn.connection.set_trace_callback(None)
+            conn.exec_driver_sql("DELETE FROM t")
+            assert list(scan(conn, "t", "a")) == []
+        assert sum(s.startswith("SELECT a FROM t") for s in statements) == 4
+
+    def test_backends_share_models(self):
+        import db.database_config as postgres_config
+        import db.sqlite_config as sqlite_config
+
+        assert sqlite_config.MistakeAnalysis is postgres_config.MistakeAnalysis
+        assert sqlite_config.save_mistake_record is postgres_config.save_mistake_record
+        assert "subject" in sqlite_config.MistakeAnalysis.__table__.columns
+
+    def test_legacy_postgres_upgrade_with_user_hash_partitions(self, postgres_engine, monkeypatch):
+        import db.partitions as partitions
+
+        monkeypatch.setattr(partitions, "MISTAKE_USER_HASH_PARTITIONS", 4)
+        with postgres_engine.begin() as conn:
+            conn.exec_driver_sql(LEGACY_POSTGRES_SCHEMA)
+            conn.exec_driver_sql("INSERT INTO mistake_records (id, file_id, filename) VALUES (1, 'f1', 'f1.png')")
+            conn.exec_driver_sql(
+                "INSERT INTO mistake_analysis (mistake_record_id, is_correct, analysis_data) "
+                "SELECT 1, false, '{\"subject\": \"数学\"}' FROM generate_series(1, 5)")
+
+        # 006 在 user_id 列加上之前执行：分区表主键只能是 (id, created_at)，010 再改主键并拆子分区
+        assert migrate(postgres_engine) == [version for version, _, _ in discover_migrations()]
+        with postgres_engine.connect() as conn:
+            assert partitions.is_partitioned(conn)
+            assert partitions.primary_key_columns(conn) == ["id", "created_at", "user_id"]
+            future = partitions.partition_name(partitions.add_months(partitions.month_start(date.today()), 1))
+            assert partitions.list_partitions(conn, future) == [f"{future}_h{i}" for i in range(4)]
+            assert conn.execute(text("SELECT COUNT(*) FROM mistake_analysis WHERE user_id = 0")).scalar() == 5
+            rollup = conn.execute(text(
+                "SELECT total FROM mistake_stats_rollup WHERE user_id = 0 AND dimension = 'all'")).scalar()
+        assert rollup == 5
+        assert migrate(postgres_engine) == []
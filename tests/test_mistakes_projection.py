@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_config import (
+    build_mistakes_query,
+    count_mistakes,
+    parse_mistake_list_fields,
+    save_mistake_record,
+    select_mistakes_page,
+)
+
+
+@pytest.fixture
+def db(db):
+    for i in range(3):
+        save_mistake_record(db, {"file_id": f"f{i}", "filename": f"f{i}.png", "file_url": f"/media/uploads/f{i}.png"}, [
+            {"subject": "数学", "question": "题" * 500, "comment": "短点评", "error_type": "计算错误",
+             "analysis_data": {"blob": "x" * 10000}},
+            {"subject": "语文", "question": f"语文题{i}", "is_correct": True},
+        ])
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    db.statements = statements
+    return db
+
+
+class TestMistakesProjection:
+    """错题本一览列投影查询测试"""
+
+    def test_parse_fields(self):
+        analysis, files = parse_mistake_list_fields("question, subject,file_info.file_url,file_info.derivatives",
+                                                    file_extras=("derivatives",))
+        assert analysis == ["id", "subject", "question"]
+        assert files == ["file_url", "derivatives"]
+        analysis, files = parse_mistake_list_fields("")
+        assert "comment" in analysis and "upload_time" in files
+        with pytest.raises(ValueError):
+            parse_mistake_list_fields("analysis_data")
+        with pytest.raises(ValueError):
+            parse_mistake_list_fields("file_info.derivatives")
+
+    def test_single_projected_statement(self, db):
+        query = build_mistakes_query(db, subject="数学")
+        analysis, files = parse_mistake_list_fields("question,file_info.file_url")
+        items = select_mistakes_page(query, analysis, files, limit=10, preview_chars=20)
+
+        assert len(items) == 3
+        # 一页只执行一条 SQL，且只查询所需列
+        assert len(db.statements) == 1
+        sql = db.statements[0]
+        assert "analysis_data" not in sql and "comment" not in sql and "file_size" not in sql
+        item = items[0]
+        assert set(item) == {"mistake_record_id", "file_info", "analysis"}
+        assert set(item["analysis"]) == {"id", "question"}
+        assert item["file_info"] == {"file_url": "/media/uploads/f2.png"}
+
+    def test_preview_truncation(self, db):
+        query = build_mistakes_query(db, subject="数学")
+        analysis, files = parse_mistake_list_fields("question,comment")
+        item = select_mistakes_page(query, analysis, files, limit=1, preview_chars=20)[0]
+        assert item["analysis"]["question"] == "题" * 20 + "…"
+        assert item["analysis"]["comment"] == "短点评"
+        full = select_mistakes_page(query, analysis, files, limit=1, preview_chars=0)[0]
+        assert full["analysis"]["question"] == "题" * 500
+
+    def test_default_shape_and_count(self, db):
+        query = build_mistakes_query(db)
+        analysis, files = parse_mistake_list_fields()
+        items = select_mistakes_page(query, analysis, files, skip=1, limit=2)
+        assert count_mistakes(query) == 6
+        assert len(items) == 2
+        assert isinstance(items[0]["analysis"]["created_at"], str)
+        assert items[0]["file_info"]["filename"].endswith(".png")
+
+    def test_payload_shrinks(self, db):
+        query = build_mistakes_query(db, subject="数学")
+        full = select_mistakes_page(query, *parse_mistake_list_fields(), preview_chars=0)
+        sparse = select_mistakes_page(query, *parse_mistake_list_fields("question,subject,file_info.file_url"),
+                                      preview_chars=30)
+        assert len(json.dumps(full, ensure_ascii=False)) > 5 * len(json.dumps(sparse, ensure_ascii=False))
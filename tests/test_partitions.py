@@ -0,0 +1,167 @@
+import gzip
+import os
+import sys
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_config import (
+    MistakeAnalysis,
+    MistakeRecord,
+    build_mistakes_query,
+    rebuild_stats_rollup,
+    save_mistake_record,
+)
+from db.migrate import migrate
+from db.partitions import (
+    add_months,
+    ensure_partitions,
+    month_start,
+    partition_month,
+    partition_name,
+    partitions_to_archive,
+    rewrite_index_def,
+    run_maintenance,
+    subtract_stats_rollup,
+)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    migrate(engine)
+    yield engine
+    engine.dispose()
+
+
+class TestPartitionHelpers:
+    """月份分区命名与保留期计算测试"""
+
+    def test_month_arithmetic(self):
+        assert add_months(date(2024, 11, 1), 2) == date(2025, 1, 1)
+        assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+        assert add_months(date(2024, 1, 1), -24) == date(2022, 1, 1)
+
+    def test_partition_name_roundtrip(self):
+        name = partition_name(date(2024, 3, 1))
+        assert name == "mistake_analysis_p202403"
+        assert partition_month(name) == date(2024, 3, 1)
+        assert partition_month("mistake_analysis_default") is None
+
+    def test_partitions_to_archive(self):
+        names = ["mistake_analysis_default", "mistake_analysis_p202403", "mistake_analysis_p202212",
+                 "mistake_analysis_p202404", "mistake_analysis_p202501"]
+        # 保留 12 个月：2025-04 起算，早于 2024-04 的整月分区过期
+        assert partitions_to_archive(names, today=date(2025, 4, 15), retention_months=12) == [
+            "mistake_analysis_p202212", "mistake_analysis_p202403"]
+        assert partitions_to_archive(names, today=date(2025, 4, 15), retention_months=0) == []
+
+    def test_rewrite_index_def(self):
+        indexdef = ("CREATE INDEX ix_mistake_analysis_incorrect_recent ON public.mistake_analysis "
+                    "USING btree (created_at DESC, id DESC) WHERE (is_correct = false)")
+        assert rewrite_index_def(indexdef, "mistake_analysis", "mistake_analysis_partitioned", "_part") == (
+            "CREATE INDEX ix_mistake_analysis_incorrect_recent_part ON mistake_analysis_partitioned "
+            "USING btree (created_at DESC, id DESC) WHERE (is_correct = false)")
+
+
+class TestDateRangeQuery:
+    """/mistakes 日期范围筛选测试"""
+
+    def test_date_range_inclusive(self, engine):
+        db = sessionmaker(bind=engine)()
+        try:
+            record = MistakeRecord(file_id="f1", filename="f1.png")
+            db.add(record)
+            db.flush()
+            for day in (datetime(2025, 1, 31, 23, 59), datetime(2025, 2, 1), datetime(2025, 2, 28, 12),
+                        datetime(2025, 3, 1)):
+                db.add(MistakeAnalysis(mistake_record_id=record.id, question=day.isoformat(), created_at=day))
+            db.commit()
+
+            rows = build_mistakes_query(db, date_from=date(2025, 2, 1), date_to=date(2025, 2, 28)).all()
+            assert [row.question for row in rows] == ["2025-02-28T12:00:00", "2025-02-01T00:00:00"]
+            assert build_mistakes_query(db, date_from=date(2025, 3, 1)).count() == 1
+            assert build_mistakes_query(db, date_to=date(2025, 1, 31)).count() == 1
+        finally:
+            db.close()
+
+    def test_maintenance_skips_sqlite(self, engine, tmp_path):
+        summary = run_maintenance(engine, retention_months=1, archive_dir=str(tmp_path / "archive"))
+        assert summary == {"created": [], "archived": [], "records_deleted": 0}
+        assert not (tmp_path / "archive").exists()
+
+
+class TestArchiveRollup:
+    """归档分区时扣减统计汇总测试"""
+
+    def test_subtract_matches_rebuild(self, engine):
+        db = sessionmaker(bind=engine)()
+        try:
+            old = []
+            for file_id, user_id, subject, correct in [("a1", 1, "数学", False), ("a2", 1, "语文", True),
+                                                       ("b1", 2, "数学", False), ("b2", 2, "数学", False)]:
+                file_data = {"file_id": file_id, "filename": f"{file_id}.png", "user_id": user_id}
+                analyses = [{"question": "q1", "subject": subject, "is_correct": correct,
+                             "knowledge_point": "分数加法，通分"}, {"question": "q2", "subject": subject}]
+                record_id = save_mistake_record(db, file_data, analyses)
+                if file_id in ("a1", "b2"):
+                    old.append(record_id)
+        finally:
+            db.close()
+
+        # 模拟 DETACH：旧数据移到独立的表中，再从汇总中扣减
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            where = f"mistake_record_id IN ({', '.join(map(str, old))})"
+            conn.exec_driver_sql(
+                f"CREATE TABLE mistake_analysis_p202401 AS SELECT * FROM mistake_analysis WHERE {where}")
+            conn.exec_driver_sql(f"DELETE FROM mistake_analysis WHERE {where}")
+            assert subtract_stats_rollup(conn, "mistake_analysis_p202401", batch_size=1) > 0
+
+        def rollup():
+            with engine.connect() as conn:
+                return sorted(tuple(row) for row in conn.execute(text(
+                    "SELECT user_id, dimension, value, total, incorrect FROM mistake_stats_rollup")))
+
+        subtracted = rollup()
+        db = sessionmaker(bind=engine)()
+        try:
+            rebuild_stats_rollup(db)
+        finally:
+            db.close()
+        assert subtracted == rollup()
+        assert (2, "subject", "数学", 2, 2) in subtracted
+        assert not any(row[0] == 1 and row[2] == "数学" for row in subtracted)  # 计数减到 0 的行已删除
+
+    def test_maintenance_finishes_detached_partition(self, postgres_engine, tmp_path):
+        """上次归档在 DETACH 之后失败：下次维护先补完归档（导出 + 扣减汇总），再删除孤立的错题记录"""
+        migrate(postgres_engine)
+        old = add_months(month_start(date.today()), -3)
+        name = partition_name(old)
+        with postgres_engine.connect() as conn:
+            ensure_partitions(conn.execution_options(isolation_level="AUTOCOMMIT"), start=old)
+        db = sessionmaker(bind=postgres_engine)()
+        try:
+            old_id = save_mistake_record(db, {"file_id": "old", "filename": "old.png"}, [{"question": "q"}])
+            save_mistake_record(db, {"file_id": "new", "filename": "new.png"}, [{"question": "q"}])
+        finally:
+            db.close()
+        with postgres_engine.begin() as conn:
+            for table, column in (("mistake_analysis", "mistake_record_id"), ("mistake_records", "id")):
+                conn.execute(text(f"UPDATE {table} SET created_at = :old WHERE {column} = :id"),
+                             {"old": datetime(old.year, old.month, 2), "id": old_id})
+            conn.exec_driver_sql(f"ALTER TABLE mistake_analysis DETACH PARTITION {name}")
+
+        summary = run_maintenance(postgres_engine, retention_months=2, archive_dir=str(tmp_path))
+        assert summary["archived"] == [name] and summary["records_deleted"] == 1
+        with gzip.open(tmp_path / f"{name}.csv.gz", "rt", encoding="utf-8") as f:
+            assert len(f.read().splitlines()) == 2  # 表头 + 旧分析记录
+        with postgres_engine.connect() as conn:
+            assert conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None
+            assert conn.execute(text(
+                "SELECT total FROM mistake_stats_rollup WHERE user_id = 0 AND dimension = 'all'")).scalar() == 1
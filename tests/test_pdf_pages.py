@@ -0,0 +1,159 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pymupdf = pytest.importorskip("pymupdf")
+
+import app.app as app_module  # noqa: E402
+from core.vision.pdf import InvalidPDFError, rasterize_pdf  # noqa: E402
+
+
+def pdf_bytes(pages=3):
+    document = pymupdf.open()
+    for i in range(pages):
+        page = document.new_page(width=595, height=842)
+        page.insert_text((72, 72), f"Page {i + 1}: 1/2 + 1/3 = ?", fontsize=18)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def encrypted_pdf_bytes():
+    document = pymupdf.open(stream=pdf_bytes(1), filetype="pdf")
+    data = document.tobytes(encryption=pymupdf.PDF_ENCRYPT_AES_256, owner_pw="owner", user_pw="user")
+    document.close()
+    return data
+
+
+class TestRasterize:
+    """PDF 栅格化测试"""
+
+    def test_pages_in_order(self):
+        images, total_pages = asyncio.run(rasterize_pdf(pdf_bytes(5), dpi=72))
+        assert len(images) == total_pages == 5
+        assert all(image[:2] == b"\xff\xd8" for image in images)
+
+    def test_max_pages(self):
+        images, total_pages = asyncio.run(rasterize_pdf(pdf_bytes(4), dpi=72, max_pages=2))
+        assert len(images) == 2
+        assert total_pages == 4
+
+    @pytest.mark.parametrize("content", [b"%PDF-1.4 truncated", encrypted_pdf_bytes()])
+    def test_corrupt_or_encrypted_pdf(self, content):
+        with pytest.raises(InvalidPDFError):
+            asyncio.run(rasterize_pdf(content, dpi=72))
+
+
+class TestPdfIngestion:
+    """多页 PDF 并发分析测试"""
+
+    def test_pages_analyzed_concurrently(self, tmp_path, monkeypatch):
+        os.makedirs(tmp_path / "uploads")
+        monkeypatch.setattr(app_module, "media_dir", str(tmp_path))
+        monkeypatch.setattr(app_module, "DATABASE_AVAILABLE", False)
+
+        page_latency = 0.5
+
+        async def fake_analyze(content, filename):
+            await asyncio.sleep(page_latency)
+            return {"analysis": [{"question": filename, "is_correct": False}], "practices": []}, {}
+
+        monkeypatch.setattr(app_module, "call_coze_with_preprocess", fake_analyze)
+        client = TestClient(app_module.app)
+
+        response = client.post("/analyze/image",
+                               files={"image": ("homework.pdf", pdf_bytes(6), "application/pdf")})
+
+        assert response.status_code == 200
+        data = response.json()
+        assert [p["page_index"] for p in data["pages"]] == list(range(6))
+        assert [a["page_index"] for a in data["analysis"]] == list(range(6))
+        assert data["pages"][0]["file_url"].endswith("-p001.jpg")
+        assert os.path.exists(tmp_path / "uploads" / data["pages"][0]["filename"])
+        # 6 页并发分析：渲染之后的耗时约为单页延迟，而不是 6 × 单页延迟
+        timing = data["pdf_timing"]
+        assert (timing["total_ms"] - timing["render_ms"]) / 1000 < page_latency * 3
+
+    def test_failed_page_does_not_abort_others(self, tmp_path, monkeypatch):
+        os.makedirs(tmp_path / "uploads")
+        monkeypatch.setattr(app_module, "media_dir", str(tmp_path))
+        monkeypatch.setattr(app_module, "DATABASE_AVAILABLE", False)
+
+        async def flaky_coze(image_data, filename=None, timings=None):
+            if filename.endswith("-p2.jpg"):
+                raise app_module.HTTPException(status_code=502, detail="Coze 调用失败")
+            return {"analysis": [{"question": filename}], "practices": []}
+
+        monkeypatch.setattr(app_module, "call_coze_workflow", flaky_coze)
+        client = TestClient(app_module.app)
+
+        data = client.post("/analyze/image",
+                           files={"image": ("homework.pdf", pdf_bytes(3), "application/pdf")}).json()
+        assert data["pages"][1]["error"] == "Coze 调用失败"
+        assert len(data["analysis"]) == 2
+
+    @pytest.mark.parametrize("endpoint", ["/upload/image", "/analyze/image"])
+    def test_corrupt_pdf_is_rejected(self, tmp_path, monkeypatch, endpoint):
+        os.makedirs(tmp_path / "media" / "uploads")
+        os.makedirs(tmp_path / "app")
+        monkeypatch.chdir(tmp_path / "app")
+        monkeypatch.setattr(app_module, "media_dir", str(tmp_path / "media"))
+        monkeypatch.setattr(app_module, "DATABASE_AVAILABLE", False)
+        client = TestClient(app_module.app)
+
+        for content in (b"%PDF-1.4 truncated", encrypted_pdf_bytes()):
+            response = client.post(endpoint, files={"image": ("homework.pdf", content, "application/pdf")})
+            assert response.status_code == 400
+        assert os.listdir(tmp_path / "media" / "uploads") == []
+
+    @pytest.mark.parametrize("process", ["_process_upload_image", "_process_analyze_image"])
+    def test_failed_page_not_saved_as_idempotent_result(self, tmp_path, monkeypatch, process):
+        os.makedirs(tmp_path / "media" / "uploads")
+        os.makedirs(tmp_path / "app")
+        monkeypatch.chdir(tmp_path / "app")  # /upload/image 按 ../media/uploads 保存原文件
+        monkeypatch.setattr(app_module, "media_dir", str(tmp_path / "media"))
+        monkeypatch.setattr(app_module, "DATABASE_AVAILABLE", False)
+        failing = {"page": "-p2.jpg"}
+
+        async def flaky_coze(image_data, filename=None, timings=None):
+            if failing["page"] and filename.endswith(failing["page"]):
+                raise app_module.CozeUnavailableError(30)
+            return {"analysis": [{"question": filename}], "practices": []}
+
+        monkeypatch.setattr(app_module, "call_coze_workflow", flaky_coze)
+        upload = SimpleNamespace(filename="homework.pdf", content_type="application/pdf")
+
+        _, cacheable = asyncio.run(getattr(app_module, process)(upload, pdf_bytes(3), ".pdf", "file-1"))
+        assert cacheable is False  # 部分页面失败：不保存，重试重新分析
+        failing["page"] = None
+        _, cacheable = asyncio.run(getattr(app_module, process)(upload, pdf_bytes(3), ".pdf", "file-2"))
+        assert cacheable is True
+
+    @pytest.mark.parametrize("process", ["_process_upload_image", "_process_analyze_image"])
+    def test_truncated_pdf_reported_and_not_cached(self, tmp_path, monkeypatch, process):
+        os.makedirs(tmp_path / "media" / "uploads")
+        os.makedirs(tmp_path / "app")
+        monkeypatch.chdir(tmp_path / "app")
+        monkeypatch.setattr(app_module, "media_dir", str(tmp_path / "media"))
+        monkeypatch.setattr(app_module, "DATABASE_AVAILABLE", False)
+        monkeypatch.setattr(app_module, "rasterize_pdf",
+                            lambda content: rasterize_pdf(content, dpi=72, max_pages=2))
+
+        async def fake_coze(image_data, filename=None, timings=None):
+            return {"analysis": [{"question": filename}], "practices": []}
+
+        monkeypatch.setattr(app_module, "call_coze_workflow", fake_coze)
+        upload = SimpleNamespace(filename="homework.pdf", content_type="application/pdf")
+
+        result, cacheable = asyncio.run(getattr(app_module, process)(upload, pdf_bytes(3), ".pdf", "file-1"))
+        assert cacheable is False  # 截断的结果不能当作完整结果保存
+        assert len(result["pages"]) == 2
+        assert result["pdf_timing"]["total_pages"] == 3
+        assert result["pdf_timing"]["truncated"] is True
@@ -0,0 +1,73 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_config import (
+    claim_pending_analysis,
+    complete_pending_analysis,
+    enqueue_pending_analysis,
+    get_pending_analysis,
+    retry_pending_analysis,
+)
+
+NOW = datetime(2025, 3, 1, 8, 0, tzinfo=timezone.utc)
+
+
+def enqueue(db, file_id="f1", now=NOW):
+    job_id = enqueue_pending_analysis(db, {"file_id": file_id, "filename": f"{file_id}.png",
+                                           "original_filename": "作业.png", "file_size": 10}, now=now)
+    db.commit()
+    return job_id
+
+
+class TestPendingAnalyses:
+    """待分析队列测试"""
+
+    def test_enqueue_once_per_file(self, db):
+        assert enqueue(db) == enqueue(db)
+        assert enqueue(db, "f2") != enqueue(db)
+
+    def test_claim_in_order_with_lease(self, db):
+        first = enqueue(db, "f1", now=NOW)
+        enqueue(db, "f2", now=NOW + timedelta(seconds=1))
+        job = claim_pending_analysis(db, now=NOW + timedelta(seconds=5), lease_seconds=60)
+        assert job["id"] == first
+        assert job["attempts"] == 1
+        assert job["original_filename"] == "作业.png"
+        assert claim_pending_analysis(db, now=NOW + timedelta(seconds=5))["file_id"] == "f2"
+        assert claim_pending_analysis(db, now=NOW + timedelta(seconds=5)) is None
+        # 处理中途崩溃：租约到期后重新领取
+        job = claim_pending_analysis(db, now=NOW + timedelta(seconds=66), lease_seconds=60)
+        assert job["id"] == first
+        assert job["attempts"] == 2
+
+    def test_complete(self, db):
+        job_id = enqueue(db)
+        claim_pending_analysis(db, now=NOW)
+        complete_pending_analysis(db, job_id, 42)
+        db.commit()
+        job = get_pending_analysis(db, job_id)
+        assert job["status"] == "done"
+        assert job["mistake_record_id"] == 42
+        assert claim_pending_analysis(db, now=NOW + timedelta(days=1)) is None
+
+    def test_retry_then_fail(self, db):
+        job_id = enqueue(db)
+        for attempt in range(1, 3):
+            now = NOW + timedelta(minutes=attempt * 10)
+            assert claim_pending_analysis(db, now=now)["attempts"] == attempt
+            status = retry_pending_analysis(db, job_id, "Coze 超时", 60, now=now, max_attempts=2)
+        assert status == "failed"
+        assert get_pending_analysis(db, job_id)["last_error"] == "Coze 超时"
+        assert claim_pending_analysis(db, now=NOW + timedelta(days=1)) is None
+
+    def test_retry_without_attempt(self, db):
+        job_id = enqueue(db)
+        claim_pending_analysis(db, now=NOW)
+        # 熔断器仍打开，未调用上游：不计入次数，延迟后重新领取
+        assert retry_pending_analysis(db, job_id, "熔断中", 30, count_attempt=False, now=NOW) == "pending"
+        assert claim_pending_analysis(db, now=NOW + timedelta(seconds=10)) is None
+        assert claim_pending_analysis(db, now=NOW + timedelta(seconds=30))["attempts"] == 1
@@ -0,0 +1,83 @@
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.vision.dedup import HammingIndex, compute_phash, to_signed, to_unsigned
+
+
+def worksheet_bytes(offset=0, size=(600, 800), fmt="PNG"):
+    image = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(image)
+    for row in range(12):
+        y = 40 + row * 60 + offset
+        draw.rectangle([40, y, 40 + (row * 37) % 400 + 100, y + 20], fill=0)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class TestPhash:
+    """感知哈希计算测试"""
+
+    def test_near_duplicate_has_small_distance(self):
+        """同一页轻微偏移、重新压缩后距离很小"""
+        a = compute_phash(worksheet_bytes())
+        b = compute_phash(worksheet_bytes(offset=2, fmt="JPEG"))
+        assert (a ^ b).bit_count() <= 6
+
+    def test_non_image_returns_none(self):
+        assert compute_phash(b"%PDF-1.4 not an image") is None
+
+    def test_signed_roundtrip(self):
+        value = (1 << 64) - 5
+        assert to_signed(value) < 0
+        assert to_unsigned(to_signed(value)) == value
+
+
+class TestHammingIndex:
+    """多索引汉明距离索引测试"""
+
+    def test_finds_within_distance_only(self):
+        index = HammingIndex(max_distance=4)
+        base = 0x0123456789ABCDEF
+        index.add(base, 1)
+        assert index.search(base ^ 0b1011) == (1, 3)
+        assert index.search(base ^ 0b11111) is None
+
+    def test_matches_brute_force(self):
+        """结果与暴力扫描一致（抽屉原理保证不漏召回）"""
+        rng = np.random.default_rng(0)
+        hashes = [int(h) for h in rng.integers(0, 2**63, size=5000, dtype=np.int64)]
+        index = HammingIndex(max_distance=6)
+        for record_id, value in enumerate(hashes):
+            index.add(value, record_id)
+        for value in hashes[:100]:
+            flipped = value
+            for bit in rng.choice(64, size=5, replace=False):
+                flipped ^= 1 << int(bit)
+            expected = min((((h ^ flipped).bit_count(), i) for i, h in enumerate(hashes)))
+            record_id, distance = index.search(flipped)
+            assert distance == expected[0]
+
+    def test_search_scans_few_candidates(self):
+        """20 万条数据下每次查询只比较少量候选（耗时见 scripts/bench_phash_index.py）"""
+        rng = np.random.default_rng(1)
+        size = 200000
+        index = HammingIndex(max_distance=6)
+        for record_id, value in enumerate(rng.integers(0, 2**63, size=size, dtype=np.int64)):
+            index.add(int(value), record_id)
+        queries = [int(v) for v in rng.integers(0, 2**63, size=500, dtype=np.int64)]
+
+        def candidates(value):
+            """查询要比较的哈希数：各段命中的桶大小之和"""
+            buckets = [table.get((value >> shift) & mask) for table, (shift, mask) in zip(index._tables, index._chunks)]
+            return sum(len(bucket[0]) for bucket in buckets if bucket is not None)
+
+        # 暴力扫描要比较全部 20 万条
+        assert sum(candidates(value) for value in queries) / len(queries) < size / 50
@@ -0,0 +1,92 @@
+import os
+import sys
+
+from sqlalchemy.orm import sessionmaker
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_config import Base, MistakeAnalysis, MistakePractice, MistakeRecord, PracticeText
+from core.practice_pool import get_recommendations, rebuild_practice_pools
+from db.sqlite_config import create_sqlite_engine
+from db.sqlite_writer import SQLiteWriter
+
+
+def add_record(db, file_id, knowledge_point, error_type, practices, is_correct=False, user_id=0):
+    record = MistakeRecord(file_id=file_id, filename=f"{file_id}.png", user_id=user_id)
+    db.add(record)
+    db.flush()
+    db.add(MistakeAnalysis(mistake_record_id=record.id, user_id=user_id, question="q", is_correct=is_correct,
+                           knowledge_point=knowledge_point, error_type=error_type))
+    for question in practices:
+        db.add(MistakePractice(mistake_record_id=record.id, user_id=user_id, question=question, correct_answer="a"))
+    db.commit()
+
+
+class TestPracticePool:
+    """类练习推荐池测试"""
+
+    def test_rebuild_dedup_and_rank(self, db):
+        """题干去重，出现次数多的练习排在前面"""
+        add_record(db, "r1", "分数运算", "计算错误", ["1/2+1/4=?", "2/3-1/3=?"])
+        add_record(db, "r2", "分数运算", "计算错误", ["1/2 + 1/4=?".replace(" ", ""), "3/4+1/8=?"])
+        add_record(db, "r3", "分数运算", "计算错误", ["  1/2+1/4=?  "])
+
+        rebuild_practice_pools(db)
+        assert db.query(PracticeText).count() == 3
+
+        result = get_recommendations(db, "分数运算", "计算错误", limit=10)
+        assert result[0]["question"] == "1/2+1/4=?"
+        assert len(result) == 3
+
+    def test_fallback_to_knowledge_point_only(self, db):
+        """精确键不存在时退化为仅按知识点"""
+        add_record(db, "r1", "三角形面积", "公式应用错误", ["底6高4求面积"])
+        rebuild_practice_pools(db)
+        result = get_recommendations(db, "三角形面积", "粗心", limit=5)
+        assert [p["question"] for p in result] == ["底6高4求面积"]
+
+    def test_multiple_knowledge_points_and_correct_rows_ignored(self, db):
+        """逗号分隔的知识点分别入池；判对的题不参与"""
+        add_record(db, "r1", "分数运算, 通分", None, ["通分练习"])
+        add_record(db, "r2", "通分", None, ["不应出现"], is_correct=True)
+        rebuild_practice_pools(db)
+        assert [p["question"] for p in get_recommendations(db, "通分")] == ["通分练习"]
+
+    def test_rebuild_is_repeatable(self, db):
+        """重复重建不会产生重复题干"""
+        add_record(db, "r1", "分数运算", "计算错误", ["1/2+1/4=?"])
+        rebuild_practice_pools(db)
+        rebuild_practice_pools(db)
+        assert db.query(PracticeText).count() == 1
+        assert len(get_recommendations(db, "分数运算", "计算错误")) == 1
+
+    def test_write_through_single_writer(self, tmp_path):
+        """传入 write 时新题干与练习池在单写线程中一次写入"""
+        engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'mistake_note.db'}")
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+        add_record(session, "r1", "分数运算", "计算错误", ["1/2+1/4=?", "2/3-1/3=?"])
+        writer = SQLiteWriter(sessionmaker(bind=engine.execution_options(sqlite_begin_immediate=True)))
+        try:
+            assert rebuild_practice_pools(session, write=lambda fn, *args: writer.submit(fn, *args).result()) == (3, 2)
+            assert writer.stats["jobs"] == 1 and writer.stats["failed"] == 0
+            assert len(get_recommendations(session, "分数运算", "计算错误")) == 2
+        finally:
+            writer.close()
+            session.close()
+            engine.dispose()
+
+    def test_pools_are_per_user(self, db):
+        """每个用户只拿到由自己的错题生成的练习，相同题干只存一份"""
+        add_record(db, "a1", "分数运算", "计算错误", ["1/2+1/4=?", "甲的练习"], user_id=1)
+        add_record(db, "b1", "分数运算", "计算错误", ["1/2+1/4=?", "乙的练习"], user_id=2)
+        rebuild_practice_pools(db)
+        assert db.query(PracticeText).count() == 3
+
+        def questions(user_id):
+            return sorted(p["question"] for p in get_recommendations(db, "分数运算", "计算错误", user_id=user_id))
+
+        assert questions(1) == ["1/2+1/4=?", "甲的练习"]
+        assert questions(2) == ["1/2+1/4=?", "乙的练习"]
+        assert questions(3) == []
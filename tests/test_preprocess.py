@@ -0,0 +1,90 @@
+import asyncio
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.vision.preprocess import PREPROCESS_CONFIG, _estimate_skew, preprocess_for_upload, preprocess_image
+
+cv2 = pytest.importorskip("cv2")
+
+
+def photo_bytes(size=(3000, 4000), angle=0):
+    """模拟手机拍摄的作业：带噪点的彩色背景 + 若干行文字块"""
+    rng = np.random.default_rng(0)
+    background = rng.integers(200, 240, size=(size[1], size[0], 3), dtype=np.uint8)
+    image = Image.fromarray(background, "RGB")
+    draw = ImageDraw.Draw(image)
+    for row in range(30):
+        y = 200 + row * 120
+        draw.rectangle([200, y, 200 + (row * 97) % 2000 + 600, y + 40], fill=(30, 30, 60))
+    if angle:
+        image = image.rotate(angle, expand=False, fillcolor=(220, 220, 220))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def make_config(tmp_path, **overrides):
+    config = dict(PREPROCESS_CONFIG, enabled=True, cache_dir=str(tmp_path), workers=1)
+    config.update(overrides)
+    return config
+
+
+class TestPreprocessImage:
+    """预处理流水线测试"""
+
+    def test_downscale_to_target_dpi(self, tmp_path):
+        output, info = preprocess_image(photo_bytes(), make_config(tmp_path, target_dpi=100))
+        decoded = cv2.imdecode(np.frombuffer(output, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        assert decoded.ndim == 2  # 灰度
+        assert max(decoded.shape) == int(100 * PREPROCESS_CONFIG["page_inches"])
+        assert info["original_size"] == [3000, 4000]
+
+    def test_deskew_estimates_rotation(self):
+        gray = cv2.imdecode(np.frombuffer(photo_bytes(size=(1200, 1600), angle=4), dtype=np.uint8),
+                            cv2.IMREAD_GRAYSCALE)
+        assert abs(abs(_estimate_skew(gray, 15)) - 4) < 1.5
+
+    def test_undecodable_returns_none(self, tmp_path):
+        output, info = preprocess_image(b"%PDF-1.4 not an image", make_config(tmp_path))
+        assert output is None
+        assert "reason" in info
+
+
+class TestPreprocessForUpload:
+    """上传前预处理入口测试"""
+
+    def test_shrinks_payload_and_uses_cache(self, tmp_path):
+        content = photo_bytes()
+        config = make_config(tmp_path)
+
+        data, filename, stats = asyncio.run(preprocess_for_upload(content, "photo.png", config))
+        assert stats["applied"] and not stats["cache_hit"]
+        assert stats["bytes_saved"] == len(content) - len(data) > 0
+        assert filename == "photo.jpg"
+
+        cached, _, stats = asyncio.run(preprocess_for_upload(content, "photo.png", config))
+        assert stats["cache_hit"]
+        assert cached == data
+
+    def test_webp_output(self, tmp_path):
+        data, filename, stats = asyncio.run(
+            preprocess_for_upload(photo_bytes(), "photo.png", make_config(tmp_path, format="webp")))
+        assert filename == "photo.webp"
+        assert data[8:12] == b"WEBP"
+
+    def test_pdf_and_disabled_pass_through(self, tmp_path):
+        content = photo_bytes(size=(400, 600))
+        data, filename, stats = asyncio.run(preprocess_for_upload(b"%PDF-1.4", "a.pdf", make_config(tmp_path)))
+        assert data == b"%PDF-1.4" and filename == "a.pdf" and not stats["applied"]
+
+        data, filename, stats = asyncio.run(
+            preprocess_for_upload(content, "a.png", make_config(tmp_path, enabled=False)))
+        assert data == content and stats["bytes_saved"] == 0
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.quantization import ProductQuantizer, ScalarQuantizer, recall_at_k
+from rag.vector_store import QuantizedVectorStore
+
+
+def make_vectors(n=2000, dim=64, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top(vectors, query, k):
+    return [str(i) for i in np.argsort(-(vectors @ query))[:k]]
+
+
+class TestQuantizers:
+    """量化器测试"""
+
+    def test_int8_roundtrip_error_small(self):
+        """int8 量化后的重建误差应足够小"""
+        vectors = make_vectors()
+        sq = ScalarQuantizer().fit(vectors)
+        codes = sq.encode(vectors)
+        assert codes.dtype == np.int8
+        assert np.abs(sq.decode(codes) - vectors).max() < 0.02
+
+    def test_int8_score_matches_decoded_dot(self):
+        """快速打分与先解码再点积的结果一致"""
+        vectors = make_vectors(500)
+        sq = ScalarQuantizer().fit(vectors)
+        codes = sq.encode(vectors)
+        query = vectors[0]
+        np.testing.assert_allclose(sq.score(query, codes), sq.decode(codes) @ query, atol=1e-4)
+
+    def test_pq_codes_are_compact(self):
+        """PQ 每条向量只占 m 字节"""
+        vectors = make_vectors(600, dim=32)
+        pq = ProductQuantizer(m=8, n_iter=5).fit(vectors)
+        codes = pq.encode(vectors)
+        assert codes.shape == (600, 8)
+        assert codes.dtype == np.uint8
+
+    def test_pq_rejects_indivisible_dim(self):
+        """维度不能被 m 整除时报错"""
+        with pytest.raises(ValueError):
+            ProductQuantizer(m=7).fit(make_vectors(300, dim=32))
+
+    def test_recall_at_k(self):
+        assert recall_at_k([["a", "b"]], [["a", "c"]], 2) == 0.5
+
+
+class TestQuantizedVectorStore:
+    """量化向量库测试"""
+
+    def _build(self, vectors, tmp_path, **params):
+        store = QuantizedVectorStore(vectors.shape[1], persist_directory=str(tmp_path), **params)
+        if params.get("quantization") != "none":
+            store.train(vectors)
+        ids = [str(i) for i in range(len(vectors))]
+        metadatas = [{"subject": "数学" if i % 2 == 0 else "语文"} for i in range(len(vectors))]
+        asyncio.run(store.add_documents([""] * len(vectors), vectors, metadatas, ids=ids))
+        return store
+
+    def test_int8_rescore_recall(self, tmp_path):
+        """int8 + 精排的 Recall@10 接近精确检索"""
+        vectors = make_vectors()
+        store = self._build(vectors, tmp_path, quantization="int8", rescore=True)
+        hits = 0
+        for row in range(50):
+            results = asyncio.run(store.search(vectors[row], n_results=10))
+            hits += len({r["id"] for r in results} & set(exact_top(vectors, vectors[row], 10)))
+        assert hits / 500 >= 0.95
+
+    def test_memory_smaller_than_float32(self, tmp_path):
+        """量化后常驻内存明显小于 float32"""
+        vectors = make_vectors()
+        baseline = self._build(vectors, tmp_path / "f32", quantization="none")
+        int8 = self._build(vectors, tmp_path / "int8", quantization="int8")
+        pq = self._build(vectors, tmp_path / "pq", quantization="pq", pq_m=8)
+        assert int8.memory_usage() < baseline.memory_usage() / 3
+        assert pq.memory_usage() < int8.memory_usage()
+
+    def test_filter_and_delete(self, tmp_path):
+        """元数据过滤与删除生效"""
+        vectors = make_vectors(200)
+        store = self._build(vectors, tmp_path, quantization="int8")
+        results = asyncio.run(store.search(vectors[0], n_results=5, where_filter={"subject": "语文"}))
+        assert all(r["metadata"]["subject"] == "语文" for r in results)
+
+        asyncio.run(store.delete_documents(["0"]))
+        results = asyncio.run(store.search(vectors[0], n_results=5))
+        assert "0" not in {r["id"] for r in results}
+        assert asyncio.run(store.get_collection_stats()) == 199
+
+    def test_incremental_adds_and_restart(self, tmp_path):
+        """逐条追加与一次性添加结果一致；重新打开目录时精排向量文件从头写起"""
+        vectors = make_vectors(300)
+        first = self._build(vectors, tmp_path / "batch", quantization="int8", rescore=True)
+        expected = {row: [r["id"] for r in asyncio.run(first.search(vectors[row], n_results=5))]
+                    for row in (0, 150, 299)}
+
+        self._build(vectors, tmp_path / "incremental", quantization="int8", rescore=True)
+        raw_path = tmp_path / "incremental" / "vectors.f32"
+        assert raw_path.stat().st_size == vectors.nbytes
+
+        store = QuantizedVectorStore(vectors.shape[1], quantization="int8", rescore=True,
+                                     persist_directory=str(tmp_path / "incremental"))
+        store.train(vectors)
+        for row in range(len(vectors)):
+            asyncio.run(store.add_documents([""], vectors[row:row + 1], ids=[str(row)]))
+        assert raw_path.stat().st_size == vectors.nbytes
+        assert len(vectors) <= len(store._codes) < 2 * len(vectors)  # 按容量倍增，预留不超过一倍
+        for row, ids in expected.items():
+            assert [r["id"] for r in asyncio.run(store.search(vectors[row], n_results=5))] == ids
+
+    def test_untrained_int8_rejected(self, tmp_path):
+        """int8 未训练时拒绝添加，避免单条首批数据拟合出饱和的量化参数"""
+        vectors = make_vectors(10)
+        store = QuantizedVectorStore(vectors.shape[1], quantization="int8", persist_directory=str(tmp_path))
+        with pytest.raises(RuntimeError):
+            asyncio.run(store.add_documents([""], vectors[:1], ids=["0"]))
+
+    def test_readd_same_id_replaces_row(self, tmp_path):
+        """同一 id 重复添加时只保留最新一行，检索不返回重复结果"""
+        vectors = make_vectors(50)
+        store = self._build(vectors, tmp_path, quantization="int8", rescore=True)
+        asyncio.run(store.add_documents(["new"], vectors[:1], ids=["0"]))
+        results = asyncio.run(store.search(vectors[0], n_results=5))
+        assert [r["id"] for r in results].count("0") == 1
+        assert results[0]["document"] == "new"
+        assert asyncio.run(store.get_collection_stats()) == 50
@@ -0,0 +1,103 @@
+"""/mistakes 查询计划回归测试
+
+在 SQLite 上按模型建表（含复合索引与部分索引），灌入 QUERY_PLAN_ROWS 行
+（默认 100 万）并 ANALYZE，逐个筛选组合检查 EXPLAIN QUERY PLAN：必须命中预期索引，
+且能由索引直接给出排序时不允许出现临时排序（USE TEMP B-TREE FOR ORDER BY）。
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_config import Base, build_mistakes_query
+
+QUERY_PLAN_ROWS = int(os.getenv("QUERY_PLAN_ROWS", "1000000"))
+
+SUBJECTS = ["数学", "语文", "英语", "物理", "化学", "生物"]
+ERROR_TYPES = ["计算错误", "概念不清", "审题不清", "方法错误", "粗心", "单位错误", "公式记错", "步骤缺失"]
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    path = tmp_path_factory.mktemp("plans") / "plans.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    record_count = max(1, QUERY_PLAN_ROWS // 4)
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.executemany(
+            "INSERT INTO mistake_records (id, file_id, filename) VALUES (?, ?, ?)",
+            ((i, f"f{i}", f"f{i}.png") for i in range(1, record_count + 1)),
+        )
+        cursor.executemany(
+            "INSERT INTO mistake_analysis (id, mistake_record_id, subject, error_type, knowledge_point, "
+            "is_question, is_correct, created_at) VALUES (?, ?, ?, ?, ?, 1, ?, ?)",
+            (
+                (i, rng.randint(1, record_count), rng.choice(SUBJECTS), rng.choice(ERROR_TYPES),
+                 f"知识点{rng.randint(1, 500)}", rng.random() < 0.6,
+                 (start + timedelta(seconds=rng.randint(0, 365 * 86400))).isoformat(sep=" "))
+                for i in range(1, QUERY_PLAN_ROWS + 1)
+            ),
+        )
+        cursor.execute("ANALYZE")
+        raw.commit()
+    finally:
+        raw.close()
+    yield engine
+    engine.dispose()
+
+
+def query_plan(engine, **filters):
+    session = sessionmaker(bind=engine)()
+    try:
+        query = build_mistakes_query(session, user_id=0, **filters).limit(20)
+        sql = str(query.statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    finally:
+        session.close()
+    with engine.connect() as conn:
+        return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+# (筛选条件, 预期索引, 是否要求索引直接有序)
+CASES = [
+    ({}, "ix_mistake_analysis_user_recent", True),
+    ({"subject": "数学"}, "ix_mistake_analysis_user_subject_recent", True),
+    ({"error_type": "粗心"}, "ix_mistake_analysis_user_error_type_recent", True),
+    ({"subject": "数学", "error_type": "粗心"}, "ix_mistake_analysis_user_subject_error_type_recent", True),
+    ({"incorrect_only": True}, "ix_mistake_analysis_user_incorrect_recent", True),
+    ({"subject": "数学", "error_type": "粗心", "incorrect_only": True},
+     "ix_mistake_analysis_user_incorrect_subject_error_type_recent", True),
+    ({"knowledge_point": "知识点1"}, "ix_mistake_analysis_user_recent", True),
+]
+
+
+class TestMistakesQueryPlans:
+    """/mistakes 筛选组合的索引命中"""
+
+    @pytest.mark.parametrize("filters,index_name,ordered", CASES,
+                             ids=["+".join(c[0]) or "none" for c in CASES])
+    def test_filter_uses_index(self, engine, filters, index_name, ordered):
+        plan = query_plan(engine, **filters)
+        details = "\n".join(plan)
+        analysis_steps = [step for step in plan if "mistake_analysis" in step]
+        assert analysis_steps and all(index_name in step for step in analysis_steps), details
+        # 关联 mistake_records 按主键查找，而不是扫描
+        assert any(step.startswith("SEARCH mistake_records") for step in plan), details
+        if ordered:
+            assert "TEMP B-TREE" not in details, details
+
+    def test_subject_with_incorrect_only_uses_index(self, engine):
+        """学科 + 只看错题：至少命中以学科开头的索引，不做全表扫描"""
+        plan = query_plan(engine, subject="数学", incorrect_only=True)
+        assert not any(step.startswith("SCAN") and "INDEX" not in step for step in plan), plan
@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_config import Base, MistakeRecord, save_mistake_record
+from db.routing import SessionRouter, reset_route_key, set_route_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def router(tmp_path):
+    """两个 SQLite 文件模拟主库与（尚未同步的）只读副本"""
+    engines = [create_engine(f"sqlite:///{tmp_path / name}") for name in ("primary.db", "replica.db")]
+    for engine in engines:
+        Base.metadata.create_all(engine)
+    primary, replica = (sessionmaker(bind=engine) for engine in engines)
+    router = SessionRouter(primary, [replica], sticky_seconds=5, clock=FakeClock())
+    yield router
+    for engine in engines:
+        engine.dispose()
+
+
+def count_records(session):
+    try:
+        return session.query(MistakeRecord).count()
+    finally:
+        session.close()
+
+
+def write(router, file_id):
+    db = router.writer()
+    try:
+        save_mistake_record(db, {"file_id": file_id, "filename": f"{file_id}.png"})
+    finally:
+        db.close()
+    router.mark_write()
+
+
+class TestReadRouting:
+    """读写路由与读己之写测试"""
+
+    def test_reads_go_to_replica(self, router):
+        write(router, "f1")
+        # 其他客户端读副本，看不到尚未复制的数据
+        assert count_records(router.reader("other")) == 0
+        assert router.stats["replica_reads"] == 1
+
+    def test_read_your_writes_within_window(self, router):
+        token = set_route_key("client-a")
+        try:
+            write(router, "f1")
+            assert count_records(router.reader()) == 1  # 写入方读主库
+            assert router.stats["sticky_reads"] == 1
+
+            router.clock.now += 6  # 超过粘滞窗口后回到副本
+            assert count_records(router.reader()) == 0
+            assert router.stats["replica_reads"] == 1
+        finally:
+            reset_route_key(token)
+
+    def test_replicas_round_robin(self):
+        calls = []
+        router = SessionRouter(lambda: "primary", [lambda: calls.append("r1") or "r1",
+                                                   lambda: calls.append("r2") or "r2"])
+        assert [router.reader() for _ in range(4)] == ["r1", "r2", "r1", "r2"]
+        assert router.writer() == "primary"
+
+    def test_without_replicas_uses_primary(self):
+        router = SessionRouter(lambda: "primary")
+        router.mark_write("a")
+        assert router.reader("b") == "primary"
+        assert router.stats["primary_reads"] == 1
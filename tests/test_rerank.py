@@ -0,0 +1,76 @@
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.rerank import Reranker
+
+
+def make_candidates(n):
+    # 向量得分递减，文档长度递增（假打分器按长度打分，顺序与向量排序相反）
+    return [{"document": "x" * (i + 1), "score": 1.0 - i * 0.01, "metadata": {"id": i}} for i in range(n)]
+
+
+class CountingScorer:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    def __call__(self, pairs):
+        self.batches.append(len(pairs))
+        time.sleep(self.delay)
+        return [float(len(doc)) for _, doc in pairs]
+
+
+class TestReranker:
+    """重排器测试"""
+
+    def test_batches_and_reorders(self):
+        """候选对按批次打分并按最终分数重排"""
+        scorer = CountingScorer()
+        reranker = Reranker(scorer=scorer, batch_size=4, deadline_ms=2000)
+        results = asyncio.run(reranker.rerank("q", make_candidates(10), top_k=3))
+        assert scorer.batches == [4, 4, 2]
+        assert [r["metadata"]["id"] for r in results] == [9, 8, 7]
+
+    def test_numpy_and_scalar_scores(self):
+        """打分器返回 numpy 数组或标量时同样可用"""
+        reranker = Reranker(scorer=lambda pairs: np.array([float(len(doc)) for _, doc in pairs]), deadline_ms=2000)
+        results = asyncio.run(reranker.rerank("q", make_candidates(3), top_k=3))
+        assert [r["metadata"]["id"] for r in results] == [2, 1, 0]
+        assert Reranker(scorer=lambda pairs: np.float32(0.5))._score_batch([("q", "d")]) == [0.5]
+
+    def test_cache_hits_skip_scoring(self):
+        """重复查询命中缓存，不再调用模型"""
+        scorer = CountingScorer()
+        reranker = Reranker(scorer=scorer, batch_size=8, deadline_ms=2000)
+
+        async def run_twice():
+            await reranker.rerank("q", make_candidates(5))
+            await reranker.rerank("q", make_candidates(5))
+
+        asyncio.run(run_twice())
+        assert sum(scorer.batches) == 5
+        assert reranker.stats["cache_hits"] == 5
+
+    def test_deadline_falls_back_to_vector_ranking(self):
+        """超出时间预算时回退为向量排序"""
+        reranker = Reranker(scorer=CountingScorer(delay=0.2), batch_size=2, deadline_ms=50)
+        results = asyncio.run(reranker.rerank("q", make_candidates(6), top_k=3))
+        assert [r["metadata"]["id"] for r in results] == [0, 1, 2]
+        assert reranker.stats["timeouts"] == 1
+        assert "rerank_score" not in results[0]
+
+    def test_scorer_error_falls_back(self):
+        """模型异常时回退为向量排序"""
+        def broken(pairs):
+            raise RuntimeError("boom")
+
+        reranker = Reranker(scorer=broken, deadline_ms=2000)
+        results = asyncio.run(reranker.rerank("q", make_candidates(3), top_k=2))
+        assert [r["metadata"]["id"] for r in results] == [0, 1]
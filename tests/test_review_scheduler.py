@@ -0,0 +1,119 @@
+import os
+import sys
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.review_scheduler import (
+    count_due_review_cards,
+    get_due_reviews,
+    grade_review_card,
+    schedule_reviews,
+    sm2,
+)
+from db.database_config import Base, MistakeAnalysis, ReviewCard, ReviewPlan, save_mistake_record
+from db.sqlite_config import create_sqlite_engine
+from db.sqlite_writer import SQLiteWriter
+
+TODAY = date(2025, 3, 1)
+
+
+@pytest.fixture
+def db(db):
+    save_mistake_record(db, {"file_id": "f1", "filename": "f1.png"}, [
+        {"subject": "数学", "question": "1+1", "is_correct": False},
+        {"subject": "数学", "question": "2+2", "is_correct": True},
+        {"subject": "语文", "question": "标题", "is_question": False},
+        {"subject": "语文", "question": "默写", "is_correct": False},
+    ])
+    return db
+
+
+class TestReviewScheduler:
+    """错题间隔复习调度测试"""
+
+    def test_sm2(self):
+        state = (0, 0, 2.5)
+        intervals = []
+        for _ in range(4):
+            repetitions, interval, ease, lapsed = sm2(*state, 5)
+            assert not lapsed
+            state = (repetitions, interval, ease)
+            intervals.append(interval)
+        assert intervals[:2] == [1, 6] and intervals[2] > 6 and intervals[3] > intervals[2]
+
+        repetitions, interval, ease, lapsed = sm2(*state, 1)
+        assert lapsed and repetitions == 0 and interval == 1 and ease < state[2]
+        assert sm2(0, 0, 1.3, 0)[2] == 1.3
+        with pytest.raises(ValueError):
+            sm2(0, 0, 2.5, 6)
+
+    def test_schedule_creates_cards_for_incorrect_only(self, db):
+        result = schedule_reviews(db, TODAY, batch_size=2)
+        assert result["new_cards"] == 2 and result["due"] == 0
+        cards = db.query(ReviewCard).all()
+        questions = {db.get(MistakeAnalysis, card.analysis_id).question for card in cards}
+        assert questions == {"1+1", "默写"}
+        assert {card.due_date for card in cards} == {TODAY + timedelta(days=1)}
+
+        # 重复执行不会重复建卡，每天只保留一行复习计划
+        assert schedule_reviews(db, TODAY)["new_cards"] == 0
+        plans = db.query(ReviewPlan).all()
+        assert len(plans) == 1 and plans[0].plan_data["new_cards"] == 0
+
+    def test_batches_written_through_single_writer(self, tmp_path):
+        """传入 write 时每批写入都交给单写线程执行，读会话不发起写事务"""
+        engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'mistake_note.db'}")
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+        save_mistake_record(session, {"file_id": "f1", "filename": "f1.png"}, [
+            {"subject": "数学", "question": f"q{i}", "is_correct": False} for i in range(4)])
+        writer = SQLiteWriter(sessionmaker(bind=engine.execution_options(sqlite_begin_immediate=True)))
+        try:
+            result = schedule_reviews(session, TODAY, batch_size=2,
+                                      write=lambda fn, *args: writer.submit(fn, *args).result())
+            assert result["new_cards"] == 4
+            assert session.query(ReviewCard).count() == 4
+            # 建卡 2 批 + 清理 2 批 + 当天复习计划 1 次
+            assert writer.stats["jobs"] == 5 and writer.stats["failed"] == 0
+        finally:
+            writer.close()
+            session.close()
+            engine.dispose()
+
+    def test_orphan_cards_removed(self, db):
+        schedule_reviews(db, TODAY)
+        db.execute(text("DELETE FROM mistake_analysis WHERE question = '默写'"))
+        db.commit()
+        assert schedule_reviews(db, TODAY)["removed_cards"] == 1
+        assert db.query(ReviewCard).count() == 1
+
+    def test_due_and_grade(self, db):
+        schedule_reviews(db, TODAY)
+        tomorrow = TODAY + timedelta(days=1)
+        assert get_due_reviews(db, TODAY) == []
+        due = get_due_reviews(db, tomorrow)
+        assert [item["question"] for item in due] == ["1+1", "默写"]
+        assert count_due_review_cards(db, tomorrow) == 2
+
+        card = grade_review_card(db, due[0]["analysis_id"], 5, today=tomorrow)
+        db.commit()
+        assert card["repetitions"] == 1 and card["due_date"] == (tomorrow + timedelta(days=1)).isoformat()
+        assert [item["question"] for item in get_due_reviews(db, tomorrow)] == ["默写"]
+
+        card = grade_review_card(db, due[1]["analysis_id"], 1, today=tomorrow)
+        assert card["lapses"] == 1 and card["interval_days"] == 1
+        assert grade_review_card(db, 999, 3) is None
+
+    def test_due_query_uses_index(self, db):
+        schedule_reviews(db, TODAY)
+        plan = db.execute(text(
+            "EXPLAIN QUERY PLAN SELECT analysis_id FROM review_cards WHERE user_id = 0 AND due_date <= :day "
+            "ORDER BY due_date, analysis_id"), {"day": TODAY.isoformat()}).fetchall()
+        detail = " ".join(row[-1] for row in plan)
+        assert "ix_review_cards_user_due" in detail and "TEMP B-TREE" not in detail
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from integration.singleflight import SingleFlight
+
+
+class _Upstream:
+    """模拟耗时的上游调用，记录实际执行次数"""
+
+    def __init__(self, delay=0.05, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return {"output": ["结果"], "calls": self.calls}
+
+
+class TestSingleFlight:
+    """请求合并测试"""
+
+    def test_concurrent_same_key_runs_once(self):
+        flight = SingleFlight("test")
+        upstream = _Upstream()
+
+        async def main():
+            return await asyncio.gather(*(flight.do("k", upstream) for _ in range(5)))
+
+        results = asyncio.run(main())
+        assert upstream.calls == 1
+        assert [shared for _, shared in results].count(False) == 1
+        assert all(result == {"output": ["结果"], "calls": 1} for result, _ in results)
+        assert flight.snapshot() == {"calls": 5, "executions": 1, "coalesced": 4, "errors": 0,
+                                     "cancelled": 0, "in_flight": 0}
+
+    def test_different_keys_run_separately(self):
+        flight = SingleFlight("test")
+        upstream = _Upstream()
+
+        async def main():
+            return await asyncio.gather(flight.do("a", upstream), flight.do("b", upstream))
+
+        asyncio.run(main())
+        assert upstream.calls == 2
+        assert flight.stats["coalesced"] == 0
+
+    def test_sequential_calls_not_coalesced(self):
+        flight = SingleFlight("test")
+        upstream = _Upstream(delay=0)
+
+        async def main():
+            await flight.do("k", upstream)
+            return await flight.do("k", upstream)
+
+        _, shared = asyncio.run(main())
+        assert upstream.calls == 2
+        assert shared is False
+
+    def test_error_shared_by_all_waiters(self):
+        flight = SingleFlight("test")
+        upstream = _Upstream(error=RuntimeError("Coze 超时"))
+
+        async def main():
+            return await asyncio.gather(*(flight.do("k", upstream) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(main())
+        assert upstream.calls == 1
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert flight.stats["errors"] == 1
+        assert flight.in_flight == 0
+
+    def test_results_are_independent_copies(self):
+        flight = SingleFlight("test")
+        upstream = _Upstream()
+
+        async def main():
+            return await asyncio.gather(flight.do("k", upstream), flight.do("k", upstream))
+
+        (first, _), (second, _) = asyncio.run(main())
+        first["output"].append("被修改")
+        assert second["output"] == ["结果"]
+
+    def test_leader_cancel_keeps_followers(self):
+        flight = SingleFlight("test")
+        upstream = _Upstream()
+
+        async def main():
+            leader = asyncio.create_task(flight.do("k", upstream))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(flight.do("k", upstream))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            result, shared = await follower
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+            return result, shared
+
+        result, shared = asyncio.run(main())
+        assert shared is True
+        assert result["calls"] == 1
+        assert upstream.cancelled is False
+
+    def test_all_waiters_cancelled_cancels_call(self):
+        flight = SingleFlight("test")
+        upstream = _Upstream(delay=1)
+
+        async def main():
+            waiters = [asyncio.create_task(flight.do("k", upstream)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            for waiter in waiters:
+                waiter.cancel()
+            await asyncio.gather(*waiters, return_exceptions=True)
+            await asyncio.sleep(0)
+
+        asyncio.run(main())
+        assert upstream.cancelled is True
+        assert flight.stats["cancelled"] == 1
+        assert flight.in_flight == 0
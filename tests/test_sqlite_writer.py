@@ -0,0 +1,122 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.sqlite_config import Base, MistakeAnalysis, MistakeRecord, MistakeStatsRollup, create_sqlite_engine
+from db.sqlite_writer import SQLiteWriter
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'mistake_note.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+def make_writer(engine, **kwargs):
+    writer_engine = engine.execution_options(sqlite_begin_immediate=True)
+    return SQLiteWriter(sessionmaker(autocommit=False, autoflush=False, bind=writer_engine), **kwargs)
+
+
+def file_data(file_id):
+    return {"file_id": file_id, "filename": f"{file_id}.png"}
+
+
+ANALYSIS = [{"subject": "数学", "question": "1+1", "error_type": "计算错误", "is_correct": False}]
+
+
+class TestSQLiteProductionMode:
+    """SQLite 生产模式（WAL + PRAGMA + 单写线程）测试"""
+
+    def test_pragmas_applied(self, engine):
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+            assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
+            assert conn.exec_driver_sql("PRAGMA cache_size").scalar() == -64 * 1024
+
+    def test_concurrent_saves_are_group_committed(self, engine):
+        writer = make_writer(engine, max_delay_ms=50)
+
+        async def main():
+            return await asyncio.gather(*(
+                writer.save_mistake_record(file_data(f"r{i}"), ANALYSIS) for i in range(30)))
+
+        try:
+            ids = asyncio.run(main())
+        finally:
+            writer.close()
+
+        assert len(set(ids)) == 30
+        assert writer.stats["jobs"] == 30
+        assert writer.stats["commits"] < 30
+        db = sessionmaker(bind=engine)()
+        try:
+            assert db.query(MistakeRecord).count() == 30
+            assert db.query(MistakeAnalysis).count() == 30
+            assert db.get(MistakeStatsRollup, (0, "all", "")).total == 30
+        finally:
+            db.close()
+
+    def test_failed_job_does_not_affect_batch(self, engine):
+        writer = make_writer(engine, max_delay_ms=50)
+
+        async def main():
+            return await asyncio.gather(
+                writer.save_mistake_record(file_data("a"), ANALYSIS),
+                writer.save_mistake_record(file_data("a"), ANALYSIS),  # file_id 唯一约束冲突
+                writer.save_mistake_record(file_data("b"), ANALYSIS),
+                return_exceptions=True,
+            )
+
+        try:
+            first, duplicate, last = asyncio.run(main())
+        finally:
+            writer.close()
+
+        assert isinstance(first, int) and isinstance(last, int)
+        assert isinstance(duplicate, IntegrityError)
+        assert writer.stats["failed"] == 1
+        db = sessionmaker(bind=engine)()
+        try:
+            assert {r.file_id for r in db.query(MistakeRecord)} == {"a", "b"}
+            # 失败任务的统计增量随 SAVEPOINT 一起回滚
+            assert db.get(MistakeStatsRollup, (0, "all", "")).total == 2
+        finally:
+            db.close()
+
+    def test_reads_not_blocked_by_open_write(self, engine):
+        Session = sessionmaker(bind=engine)
+        writing = sessionmaker(bind=engine.execution_options(sqlite_begin_immediate=True))()
+        reader = Session()
+        try:
+            writing.add(MistakeRecord(**file_data("pending")))
+            writing.flush()  # 持有写锁、未提交
+            assert reader.query(MistakeRecord).count() == 0
+        finally:
+            reader.close()
+            writing.rollback()
+            writing.close()
+
+    def test_close_flushes_queued_jobs(self, engine):
+        writer = make_writer(engine, max_delay_ms=0)
+        futures = [writer.submit(lambda db, i=i: db.add(MistakeRecord(**file_data(f"q{i}")))) for i in range(5)]
+        writer.close()
+
+        assert all(future.done() and future.exception() is None for future in futures)
+        with pytest.raises(RuntimeError):
+            writer.submit(lambda db: None)
+        db = sessionmaker(bind=engine)()
+        try:
+            assert db.query(MistakeRecord).count() == 5
+        finally:
+            db.close()
@@ -0,0 +1,78 @@
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_config import (
+    MistakeStatsRollup,
+    add_mistake_analyses,
+    get_mistake_stats,
+    rebuild_stats_rollup,
+    replace_mistake_analyses,
+    save_mistake_record,
+)
+
+
+def save(db, file_id, analyses):
+    analyses = [{"question": "q", **analysis} for analysis in analyses]
+    return save_mistake_record(db, {"file_id": file_id, "filename": f"{file_id}.png"}, analyses)
+
+
+def by_value(items):
+    return {item["value"]: (item["total"], item["incorrect"]) for item in items}
+
+
+class TestStatsRollup:
+    """统计汇总表增量维护测试"""
+
+    def test_incremental_on_save(self, db):
+        save(db, "r1", [
+            {"subject": "数学", "error_type": "计算错误", "knowledge_point": "分数运算, 通分", "is_correct": False},
+            {"subject": "数学", "error_type": None, "knowledge_point": "分数运算", "is_correct": True},
+            {"subject": "数学", "is_question": False},
+        ])
+        save(db, "r2", [{"subject": "语文", "error_type": "计算错误", "is_correct": False}])
+
+        stats = get_mistake_stats(db)
+        assert (stats["total"], stats["incorrect"]) == (3, 2)
+        assert by_value(stats["by_subject"]) == {"数学": (2, 1), "语文": (1, 1)}
+        assert by_value(stats["by_error_type"]) == {"计算错误": (2, 2), None: (1, 0)}
+        assert by_value(stats["by_knowledge_point"]) == {"分数运算": (2, 1), "通分": (1, 1), None: (1, 1)}
+        # 按错题数降序
+        assert stats["by_error_type"][0]["value"] == "计算错误"
+
+    def test_rebuild_matches_incremental(self, db):
+        save(db, "r1", [{"subject": "数学", "error_type": "审题不清", "knowledge_point": "应用题"}])
+        save(db, "r2", [{"subject": "数学", "error_type": "审题不清", "knowledge_point": "应用题",
+                         "is_correct": True}])
+        incremental = get_mistake_stats(db)
+
+        db.query(MistakeStatsRollup).delete()
+        db.commit()
+        assert get_mistake_stats(db)["total"] == 0
+
+        rebuild_stats_rollup(db)
+        assert get_mistake_stats(db) == incremental
+
+    def test_limit_per_dimension(self, db):
+        save(db, "r1", [{"subject": f"学科{i}", "is_correct": False} for i in range(5)])
+        assert len(get_mistake_stats(db, limit=3)["by_subject"]) == 3
+
+    def test_append_and_replace(self, db):
+        record_id = save(db, "r1", [{"subject": "数学", "error_type": "计算错误"}])
+        add_mistake_analyses(db, record_id, [{"question": "q", "subject": "数学", "is_correct": True}])
+        db.commit()
+        assert (get_mistake_stats(db)["total"], get_mistake_stats(db)["incorrect"]) == (2, 1)
+
+        # 替换后汇总扣减旧结果、累加新结果，与全量重建一致
+        replace_mistake_analyses(db, record_id, [{"question": "q", "subject": "语文", "error_type": "审题不清"}])
+        db.commit()
+        stats = get_mistake_stats(db)
+        assert (stats["total"], stats["incorrect"]) == (1, 1)
+        assert by_value(stats["by_subject"]) == {"语文": (1, 1)}
+        incremental = {(r.dimension, r.value): (r.total, r.incorrect)
+                       for r in db.query(MistakeStatsRollup).all() if r.total}
+        rebuild_stats_rollup(db)
+        rebuilt = {(r.dimension, r.value): (r.total, r.incorrect) for r in db.query(MistakeStatsRollup).all()}
+        assert incremental == rebuilt
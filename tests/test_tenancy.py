@@ -0,0 +1,109 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.review_scheduler import get_due_reviews, grade_review_card, schedule_reviews
+from core.vision import dedup
+from db.database_config import (
+    MistakeAnalysis,
+    MistakePractice,
+    build_mistakes_query,
+    get_mistake_stats,
+    rebuild_stats_rollup,
+    save_mistake_record,
+)
+from db.tenancy import (
+    DEFAULT_USER_ID,
+    current_user_id,
+    parse_trusted_proxies,
+    parse_user_id,
+    reset_current_user_id,
+    resolve_user_id,
+    set_current_user_id,
+)
+
+
+def save(db, file_id, user_id, subject, image_phash=None):
+    file_data = {"file_id": file_id, "filename": f"{file_id}.png", "user_id": user_id, "image_phash": image_phash}
+    return save_mistake_record(db, file_data, [{"question": f"{file_id}-q", "subject": subject, "is_correct": False}],
+                               [{"question": "类练习"}])
+
+
+class TestTenancy:
+    """按用户隔离数据测试"""
+
+    def test_parse_user_id(self):
+        assert parse_user_id(None) == DEFAULT_USER_ID
+        assert parse_user_id(" ") == DEFAULT_USER_ID
+        assert parse_user_id("42") == 42
+        for value in ("abc", "-1", str(2 ** 31)):
+            with pytest.raises(ValueError):
+                parse_user_id(value)
+
+    def test_header_only_trusted_from_proxies(self):
+        proxies = parse_trusted_proxies("10.0.0.0/8, 127.0.0.1")
+        assert resolve_user_id("42", "10.1.2.3", proxies) == 42
+        assert resolve_user_id("42", "127.0.0.1", proxies) == 42
+        for host in ("192.168.1.5", "testclient", None):
+            with pytest.raises(PermissionError):
+                resolve_user_id("42", host, proxies)
+        # 没有请求头时不需要可信代理
+        assert resolve_user_id(None, "192.168.1.5", proxies) == DEFAULT_USER_ID
+        # 默认不信任任何来源；"*" 信任所有来源
+        with pytest.raises(PermissionError):
+            resolve_user_id("42", "127.0.0.1", parse_trusted_proxies(""))
+        assert resolve_user_id("42", "testclient", parse_trusted_proxies("*")) == 42
+
+    def test_current_user_context(self):
+        assert current_user_id() == DEFAULT_USER_ID
+        token = set_current_user_id(7)
+        assert current_user_id() == 7
+        reset_current_user_id(token)
+        assert current_user_id() == DEFAULT_USER_ID
+
+    def test_records_inherit_owner(self, db):
+        record_id = save(db, "a1", 1, "数学")
+        assert {a.user_id for a in db.query(MistakeAnalysis).filter_by(mistake_record_id=record_id)} == {1}
+        assert {p.user_id for p in db.query(MistakePractice).filter_by(mistake_record_id=record_id)} == {1}
+
+    def test_list_and_stats_scoped(self, db):
+        save(db, "a1", 1, "数学")
+        save(db, "a2", 1, "语文")
+        save(db, "b1", 2, "数学")
+
+        assert {a.question for a in build_mistakes_query(db, user_id=1)} == {"a1-q", "a2-q"}
+        assert [a.question for a in build_mistakes_query(db, subject="数学", user_id=2)] == ["b1-q"]
+        assert build_mistakes_query(db).count() == 3
+
+        stats = get_mistake_stats(db, user_id=1)
+        assert (stats["total"], stats["incorrect"]) == (2, 2)
+        assert get_mistake_stats(db, user_id=2)["total"] == 1
+        assert get_mistake_stats(db, user_id=3)["total"] == 0
+
+        incremental = {user_id: get_mistake_stats(db, user_id=user_id) for user_id in (1, 2)}
+        rebuild_stats_rollup(db)
+        assert {user_id: get_mistake_stats(db, user_id=user_id) for user_id in (1, 2)} == incremental
+
+    def test_review_cards_scoped(self, db):
+        save(db, "a1", 1, "数学")
+        save(db, "b1", 2, "数学")
+        schedule_reviews(db, date(2025, 3, 1))
+
+        later = date(2025, 3, 10)
+        due = get_due_reviews(db, later, user_id=1)
+        assert [item["question"] for item in due] == ["a1-q"]
+        assert grade_review_card(db, due[0]["analysis_id"], 5, today=later, user_id=2) is None
+        assert grade_review_card(db, due[0]["analysis_id"], 5, today=later, user_id=1)["repetitions"] == 1
+
+    def test_phash_index_per_user(self, db, monkeypatch):
+        monkeypatch.setattr(dedup, "_indexes", {})
+        a1 = save(db, "a1", 1, "数学", image_phash=0x1234)
+        save(db, "b1", 2, "数学", image_phash=0x7FFF_FFFF_0000_0000)
+
+        assert dedup.get_phash_index(db, 1).search(0x1234) == (a1, 0)
+        assert dedup.get_phash_index(db, 2).search(0x1234) is None
@@ -10,6 +10,15 @@ export interface MistakeRecord {
     file_url: string;
     file_size: number;
     file_type: string;
+    // 衍生图（缩略图 / 中图 / WebP），PDF 等非图片为空对象
+    derivatives?: {
+      thumb?: string;
+      medium?: string;
+      webp?: string;
+    };
+    // 多页 PDF 拆页时的原 PDF file_id 与页码（从 0 开始）
+    source_file_id?: string | null;
+    page_index?: number | null;
     upload_time: string;
     created_at: string;
   };
@@ -29,6 +38,17 @@ export interface MistakeRecord {
   };
 }
 
+// 错题本一览页用到的字段（fields 参数），其余字段不返回；长文本为截断后的预览
+export const ERROR_BOOK_LIST_FIELDS = [
+  'question',
+  'subject',
+  'knowledge_point',
+  'error_type',
+  'file_info.file_url',
+  'file_info.derivatives',
+  'file_info.upload_time',
+].join(',');
+
 export interface MistakesListResponse {
   total_count: number;
   skip: number;
@@ -46,13 +66,21 @@ export const getMistakesList = async (
   error_type?: string,
   knowledge_point?: string,
   skip: number = 0,
-  limit: number = 100
+  limit: number = 100,
+  incorrect_only: boolean = false,
+  date_from?: string,
+  date_to?: string,
+  fields?: string
 ): Promise<MistakesListResponse> => {
   const params = new URLSearchParams();
   
   if (subject) params.append('subject', subject);
   if (error_type) params.append('error_type', error_type);
   if (knowledge_point) params.append('knowledge_point', knowledge_point);
+  if (incorrect_only) params.append('incorrect_only', 'true');
+  if (date_from) params.append('date_from', date_from);
+  if (date_to) params.append('date_to', date_to);
+  if (fields) params.append('fields', fields);
   params.append('skip', skip.toString());
   params.append('limit', limit.toString());
 
@@ -78,6 +106,65 @@ export const getMistakeDetail = async (mistakeId: number): Promise<any> => {
   return response.json();
 };
 
+export interface PracticeRecommendation {
+  id: number;
+  question: string;
+  correct_answer: string;
+  comment: string;
+}
+
+// 获取推荐的类练习（后台按知识点 + 错因预计算）
+export const getPracticeRecommendations = async (
+  knowledge_point?: string,
+  error_type?: string,
+  limit: number = 10
+): Promise<PracticeRecommendation[]> => {
+  const params = new URLSearchParams();
+
+  if (knowledge_point) params.append('knowledge_point', knowledge_point);
+  if (error_type) params.append('error_type', error_type);
+  params.append('limit', limit.toString());
+
+  const response = await fetch(`${API_BASE_URL}/practices/recommendations?${params}`);
+
+  if (!response.ok) {
+    const error: ApiError = await response.json();
+    throw new Error(error.detail || '获取推荐练习失败');
+  }
+
+  const data = await response.json();
+  return data.practices;
+};
+
+export interface StatsItem {
+  value: string | null;
+  total: number;
+  incorrect: number;
+}
+
+export interface MistakeStats {
+  total: number;
+  incorrect: number;
+  by_subject: StatsItem[];
+  by_error_type: StatsItem[];
+  by_knowledge_point: StatsItem[];
+}
+
+// 获取错题统计（按学科 / 错因 / 知识点，后端读取预聚合汇总表）
+export const getMistakeStats = async (limit?: number): Promise<MistakeStats> => {
+  const params = new URLSearchParams();
+  if (limit) params.append('limit', limit.toString());
+
+  const response = await fetch(`${API_BASE_URL}/stats?${params}`);
+
+  if (!response.ok) {
+    const error: ApiError = await response.json();
+    throw new Error(error.detail || '获取统计数据失败');
+  }
+
+  return response.json();
+};
+
 // 删除错题
 export const deleteMistake = async (mistakeId: number): Promise<void> => {
   // 注意：后端目前没有删除API，这里只是占位符
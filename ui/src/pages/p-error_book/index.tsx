@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import styles from './styles.module.css';
-import { getMistakesList, MistakeRecord } from '../../lib/apiClient';
+import { getMistakesList, MistakeRecord, ERROR_BOOK_LIST_FIELDS } from '../../lib/apiClient';
 
 const ErrorBookPage: React.FC = () => {
   const navigate = useNavigate();
@@ -44,7 +44,11 @@ const ErrorBookPage: React.FC = () => {
         selectedReason || undefined,
         searchTerm || undefined,
         skip,
-        pageSize
+        pageSize,
+        false,
+        undefined,
+        undefined,
+        ERROR_BOOK_LIST_FIELDS
       );
       
       setMistakes(response.mistakes);
@@ -326,8 +330,9 @@ const ErrorBookPage: React.FC = () => {
                   <div className="flex-1 grid grid-cols-12 gap-4 items-center">
                     <div className="col-span-1">
                       <img 
-                        src={mistake.file_info.file_url} 
+                        src={mistake.file_info.derivatives?.thumb || mistake.file_info.file_url} 
                         alt="题目图片" 
+                        loading="lazy" 
                         className="w-12 h-12 rounded-lg object-cover"
                       />
                     </div>